@@ -1,8 +1,14 @@
 import os
 import json
+import signal
+import functools
+import threading
+import pika
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from libraries.utils import log_message, connect_to_rabbitmq, start_rabbitmq_consumer, prompt_llm_provider  # Import prompt_llm_provider
 from libraries.backend import BackendAPI
+from libraries.notifications import PartialResultPublisher
 
 # Load environment variables from .env file
 load_dotenv()
@@ -10,23 +16,59 @@ load_dotenv()
 # Setup connection parameters from environment variables
 QUEUE_NAME = os.getenv('QUEUE_NAME')
 
-def callback(ch, method, properties, body):
+# Number of tasks (and LLM calls) each agent process works on at the same time
+AGENT_CONCURRENCY = max(1, int(os.getenv('AGENT_CONCURRENCY', 4)))
+
+# Queues to consume with their weights, e.g. "agent_task_queue.openai.interactive:3,agent_task_queue.openai.batch:1",
+# QUEUE_NAME alone when not set
+AGENT_QUEUES = os.getenv('AGENT_QUEUES', '')
+
+# Send status updates and results back on the agent_results queue instead of through GraphQL
+AGENT_RESULTS_VIA_QUEUE = os.getenv('AGENT_RESULTS_VIA_QUEUE') == '1'
+AGENT_RESULTS_QUEUE = os.getenv('AGENT_RESULTS_QUEUE', 'agent_results')
+
+def process_task(body, publish_result=None):
+    """
+    Run an agent task from the queue.
+
+    :param body: The queue message, the task ID and possibly the task data itself.
+    :param publish_result: Sends the results on the agent_results queue, if given,
+                           instead of through the backend API. The task is claimed
+                           through the backend API either way.
+    """
     task_data = json.loads(body)
     task_id = task_data.get('task_id')
     log_message(f"Received task ID: {task_id}")
 
-    # Load task data from backend API
-    agent_task = BackendAPI.load_agent_task(task_id)
+    # Set the task to processing, unless it is not pending anymore: a task published
+    # again may reach several agents, and only the first one runs it
+    claimed_task = BackendAPI.claim_agent_task(task_id)
+    if not claimed_task:
+        log_message(f"Task ID {task_id} is not pending, skipped")
+        return
+
+    # Use the task data sent along with the message, or the data of the claimed task
+    agent_task = task_data.get('task') or claimed_task
 
-    if agent_task:
-        # Update the task status to "processing"
-        BackendAPI.update_agent_task_status(task_id, "processing", "Processing generation request...")
-        log_message(f"Processing task ID: {task_id}")
+    log_message(f"Processing task ID: {task_id}")
 
-        # Process the task using LLM
-        llm_response = prompt_llm_provider(agent_task)
+    # Process the task using LLM, streaming partial results to the project's clients
+    publisher = PartialResultPublisher(agent_task) if PartialResultPublisher.enabled(agent_task) else None
+    llm_response = prompt_llm_provider(agent_task, on_text=publisher.on_text if publisher else None)
 
-        # Update the task with the results of the processing
+    # Update the task with the results of the processing
+    if publish_result:
+        publish_result({
+            'task_id': task_id,
+            'status': 'completed',
+            'status_message': 'Completed request',
+            'input_tokens_used': llm_response['input_tokens_used'],
+            'output_tokens_used': llm_response['output_tokens_used'],
+            'process_time': llm_response['process_time'],
+            'agent_results': llm_response['results'],
+            'agent_id': os.getenv('AGENT_ID')
+        })
+    else:
         BackendAPI.finalize_agent_task(
             task_id,
             input_tokens_used=llm_response['input_tokens_used'],
@@ -35,24 +77,162 @@ def callback(ch, method, properties, body):
             results=llm_response['results']
         )
 
-        # Log the LLM response
-        log_message(f"LLM Response: Input tokens used {llm_response['input_tokens_used']}, Output tokens used {llm_response['output_tokens_used']}, Process time {llm_response['process_time']}ms")
-        #log_message(f"LLM Result: {llm_response['results']}")
+    # Log the LLM response
+    log_message(f"LLM Response: Input tokens used {llm_response['input_tokens_used']}, Output tokens used {llm_response['output_tokens_used']}, Process time {llm_response['process_time']}ms")
+    #log_message(f"LLM Result: {llm_response['results']}")
 
-        # TODO: Handle the response further if needed (e.g. store in database, send back to frontend, etc.)
-    else:
-        log_message(f"No data found for task ID: {task_id}")
+def parse_queues(queues, default_queue):
+    """
+    Parse AGENT_QUEUES into (queue name, weight) pairs, a weight defaults to 1.
+
+    :param queues: Comma separated queue names, each optionally followed by :weight.
+    :param default_queue: The queue to consume when none are given.
+    """
+    parsed = []
+    for entry in queues.split(','):
+        if not entry.strip():
+            continue
+        name, _, weight = entry.strip().partition(':')
+        parsed.append((name.strip(), max(1, int(weight or 1))))
+    return parsed or [(default_queue, 1)]
+
+class AgentWorker:
+    """
+    Consumes agent task queues with a pool of worker threads, so one agent process
+    keeps up to AGENT_CONCURRENCY LLM calls in flight instead of one.
+
+    Each queue gets a share of the AGENT_CONCURRENCY worker slots by its weight (at
+    least one), as the number of unacknowledged tasks RabbitMQ delivers from it
+    (basic_qos on a channel of its own). So interactive tasks keep their slots while
+    a batch queue is backed up, and queues of one provider or model can be consumed
+    apart from the others. Each task is acknowledged when it completes, and on
+    SIGTERM/SIGINT the worker stops taking new tasks and finishes the ones in
+    flight before closing the connection.
+
+    A task that fails is set to the error status before it is acknowledged. When
+    that report fails too, the task goes back to the queue once.
+    """
+
+    def __init__(self, queues, concurrency):
+        self.concurrency = concurrency
+        total_weight = sum(weight for _, weight in queues)
+        self.queues = [(name, max(1, round(concurrency * weight / total_weight))) for name, weight in queues]
+        self.executor = ThreadPoolExecutor(max_workers=sum(slots for _, slots in self.queues), thread_name_prefix='agent-task')
+        self.in_flight = 0
+        self.in_flight_lock = threading.Lock()
+        self.connection = None
+        self.channel = None
+        self.channels = []
+        self.stopping = False
+
+    def on_message(self, channel, method, properties, body):
+        if self.stopping:
+            # Delivered while stopping, leave it to another agent
+            channel.basic_reject(delivery_tag=method.delivery_tag, requeue=True)
+            return
+        with self.in_flight_lock:
+            self.in_flight += 1
+        self.executor.submit(self.run_task, channel, method.delivery_tag, body, method.redelivered)
+
+    def run_task(self, channel, delivery_tag, body, redelivered=False):
+        requeue = False
+        try:
+            process_task(body, self.publish_result if AGENT_RESULTS_VIA_QUEUE else None)
+        except Exception as e:
+            log_message(f"Error processing task: {e}")
+            # A task whose failure could not be reported either, e.g. while the backend is down, gets one more try
+            requeue = not self.report_error(body, e) and not redelivered
+        finally:
+            # pika channels are not thread safe, ack from the connection's thread
+            self.connection.add_callback_threadsafe(functools.partial(self.ack, channel, delivery_tag, requeue))
+
+    def report_error(self, body, error):
+        """
+        Set a task that failed to the error status, so it does not stay processing.
+
+        :return: Whether the failure was reported, or there was no task to report it for.
+        """
+        try:
+            task_id = json.loads(body).get('task_id')
+        except ValueError:
+            return True
+        if not task_id:
+            return True
+
+        try:
+            if AGENT_RESULTS_VIA_QUEUE:
+                self.publish_result({'task_id': task_id, 'status': 'error', 'status_message': 'Error processing request', 'errors': str(error), 'agent_id': os.getenv('AGENT_ID')})
+                return True
+            return BackendAPI.fail_agent_task(task_id, str(error))
+        except Exception as e:
+            log_message(f"Error reporting the failure of task ID {task_id}: {e}")
+            return False
+
+    def publish_result(self, message):
+        # Published from the connection's thread like acks, so a result always goes out before its task is acknowledged
+        self.connection.add_callback_threadsafe(functools.partial(
+            self.channel.basic_publish,
+            exchange='',
+            routing_key=AGENT_RESULTS_QUEUE,
+            body=json.dumps(message),
+            properties=pika.BasicProperties(delivery_mode=2)  # Make message persistent
+        ))
+
+    def ack(self, channel, delivery_tag, requeue=False):
+        try:
+            if channel.is_open and requeue:
+                channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+            elif channel.is_open:
+                channel.basic_ack(delivery_tag=delivery_tag)
+        finally:
+            with self.in_flight_lock:
+                self.in_flight -= 1
+
+    def stop(self, signum=None, frame=None):
+        if self.stopping:
+            return
+        self.stopping = True
+        log_message(f"Stopping agent, waiting for {self.in_flight} task(s) in flight...")
+        for channel in self.channels:
+            self.connection.add_callback_threadsafe(channel.stop_consuming)
+
+    def run(self):
+        first_queue, first_slots = self.queues[0]
+        self.connection, self.channel = connect_to_rabbitmq(first_queue)
+        self.channels = [self.channel]
+        if AGENT_RESULTS_VIA_QUEUE:
+            self.channel.queue_declare(queue=AGENT_RESULTS_QUEUE, durable=True)
+
+        # Every other queue gets a channel of its own, so its prefetch limit is its own
+        for queue_name, slots in self.queues[1:]:
+            channel = self.connection.channel()
+            channel.queue_declare(queue=queue_name, durable=True)
+            channel.basic_qos(prefetch_count=slots)
+            channel.basic_consume(queue=queue_name, on_message_callback=self.on_message, auto_ack=False)
+            self.channels.append(channel)
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        queue_slots = ', '.join(f"{queue_name} ({slots})" for queue_name, slots in self.queues)
+        log_message(f"Agent started with a concurrency of {self.concurrency}, consuming {queue_slots}")
+        try:
+            # Consuming on the first channel serves the consumers of all channels of the connection
+            start_rabbitmq_consumer(self.channel, self.on_message, first_queue, prefetch_count=first_slots)
+        finally:
+            self.drain()
 
-    ch.basic_ack(delivery_tag=method.delivery_tag)
+    def drain(self):
+        # Keep the connection serving acks until every task in flight has finished
+        while self.in_flight > 0 and self.connection.is_open:
+            self.connection.process_data_events(time_limit=1)
+        self.executor.shutdown(wait=True)
+        if self.connection.is_open:
+            self.connection.close()
+        log_message("Agent stopped.")
 
 def main():
-    connection, channel = connect_to_rabbitmq(QUEUE_NAME)
-    start_rabbitmq_consumer(channel, callback, QUEUE_NAME)
-    # It's important to close the connection inside a try-finally block or after the start_rabbitmq_consumer loop to ensure it's always closed properly
-    try:
-        start_rabbitmq_consumer(channel, callback, QUEUE_NAME)
-    finally:
-        connection.close()
+    AgentWorker(parse_queues(AGENT_QUEUES, QUEUE_NAME), AGENT_CONCURRENCY).run()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,82 @@
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from libraries.backend import BackendAPI
+from libraries.utils import get_provider
+
+# Time the backend calls an agent makes per task (claim, finalize) against
+# a local stub GraphQL server, with a new connection per call as before and with the
+# shared keep-alive session. Optionally also times creating an LLM provider per task
+# against the shared provider instance.
+#
+# Usage: python src/benchmark_backend_api.py [task_count] [provider_class_name]
+
+class StubGraphQLHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so the stub keeps connections open like the backend behind nginx
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, do not hold the body back for an ACK
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = json.dumps({'data': {
+            'claimAgentTask': {'agentTask': {'id': '1', 'status': 'processing'}},
+            'updateAgentTask': {'agentTask': {'id': '1', 'status': 'completed'}},
+        }}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def legacy_task_calls(task_id):
+    # One requests.post per call, as BackendAPI did before it kept a session
+    headers = {'Content-Type': 'application/json', 'X-API-Key': BackendAPI.AGENT_SECRET_KEY}
+    for variables in ({'id': task_id}, {'id': task_id, 'status': 'processing'}, {'id': task_id, 'status': 'completed'}):
+        requests.post(BackendAPI.GRAPHQL_ENDPOINT, json={'query': 'query', 'variables': variables}, headers=headers)
+
+def session_task_calls(task_id):
+    BackendAPI.claim_agent_task(task_id)
+    BackendAPI.finalize_agent_task(task_id, 10, 10, 100, 'results')
+
+def time_per_task(task_count, run):
+    start = time.perf_counter()
+    for index in range(task_count):
+        run(str(index))
+    return (time.perf_counter() - start) * 1000 / task_count
+
+def benchmark_backend(task_count):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubGraphQLHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    BackendAPI.GRAPHQL_ENDPOINT = f"http://127.0.0.1:{server.server_address[1]}/graphql"
+
+    # BackendAPI logs every call, keep the timings about the HTTP calls
+    import libraries.backend
+    libraries.backend.log_message = lambda message: None
+
+    try:
+        for label, run in (('new connection per call (legacy)', legacy_task_calls), ('shared session', session_task_calls)):
+            print(f"{label}: {time_per_task(task_count, run):.2f}ms of backend calls per task")
+    finally:
+        server.shutdown()
+
+def benchmark_provider(task_count, provider_class_name):
+    import importlib
+    ProviderClass = getattr(importlib.import_module(f"llms.{provider_class_name}"), provider_class_name)
+
+    per_task = time_per_task(task_count, lambda task_id: ProviderClass())
+    print(f"{provider_class_name} created per task (legacy): {per_task:.2f}ms per task")
+    per_task = time_per_task(task_count, lambda task_id: get_provider(provider_class_name))
+    print(f"{provider_class_name} shared: {per_task:.4f}ms per task")
+
+if __name__ == '__main__':
+    task_count = int(sys.argv[1]) if len(sys.argv) >= 2 else 500
+    benchmark_backend(task_count)
+    if len(sys.argv) >= 3:
+        benchmark_provider(task_count, sys.argv[2])
@@ -1,15 +1,25 @@
-# Define the configuration for LLM providers and their models
+import os
+import json
+
+# Define the configuration for LLM providers and their models.
+# rate_limits are the default requests/tokens per minute budget of every model of a
+# provider, a model can override them with its own requests_per_minute/tokens_per_minute.
+# encoding is the tiktoken encoding used to count and truncate tokens of the models of a
+# provider, a model can override it too. Anthropic has no tiktoken encoding, cl100k_base
+# is close enough to its tokenizer for budgeting.
 LLMS_CONFIG = {
     'openai': {
         'provider_class_name': 'OpenAIProvider',
+        'rate_limits': {'requests_per_minute': 500, 'tokens_per_minute': 200000},
+        'encoding': 'cl100k_base',
         'models': {
             'gpt-3.5-turbo': {'max_input_tokens': 2048, 'max_output_tokens': 2048},
             'gpt-3.5-turbo-16k-0613': {'max_input_tokens': 2048, 'max_output_tokens': 2048},
             'gpt-4': {'max_input_tokens': 4096, 'max_output_tokens': 4096},
             'gpt-4-0613': {'max_input_tokens': 4096, 'max_output_tokens': 4096},
             'gpt-4-turbo-preview': {'max_input_tokens': 123904, 'max_output_tokens': 4096},
-            'gpt-4o': {'max_input_tokens': 123904, 'max_output_tokens': 4096},            
-            'gpt-3.5-instruct': {'max_input_tokens': 4096, 'max_output_tokens': 4096},
+            'gpt-4o': {'max_input_tokens': 123904, 'max_output_tokens': 4096, 'encoding': 'o200k_base'},
+            'gpt-3.5-instruct': {'max_input_tokens': 4096, 'max_output_tokens': 4096, 'encoding': 'p50k_base'},
             "gpt-3.5-turbo-0125": {'max_input_tokens': 12288, 'max_output_tokens': 4096},
         }
     },
@@ -17,6 +27,8 @@ LLMS_CONFIG = {
 
     'anthropic': {
         'provider_class_name': 'AnthropicProvider',
+        'rate_limits': {'requests_per_minute': 50, 'tokens_per_minute': 80000},
+        'encoding': 'cl100k_base',
         'models': {
             'claude-2': {'max_input_tokens': 95904, 'max_output_tokens': 4096},
             'claude-2.1': {'max_input_tokens': 195906, 'max_output_tokens': 4096},
@@ -34,6 +46,27 @@ def get_model_config(model_name):
         if model_name in config['models']:
             return {
                 'provider': config['provider_class_name'],
+                'provider_name': provider,
                 'config': config['models'][model_name],
+                'rate_limits': get_rate_limits(provider, model_name),
+                'encoding': config['models'][model_name].get('encoding', config.get('encoding', 'cl100k_base')),
             }
     raise ValueError(f"No configuration found for model: '{model_name}'")
+
+def get_rate_limits(provider, model_name):
+    """
+    Requests and tokens per minute budget of a model. LLM_RATE_LIMITS can override
+    them with JSON keyed by provider or 'provider:model', e.g.
+    {"openai": {"tokens_per_minute": 800000}, "anthropic:claude-3-opus": {"requests_per_minute": 20}}.
+    A limit of 0 means unlimited.
+    """
+    config = LLMS_CONFIG[provider]
+    model_config = config['models'].get(model_name, {})
+    overrides = json.loads(os.getenv('LLM_RATE_LIMITS') or '{}')
+
+    rate_limits = {}
+    for limit in ('requests_per_minute', 'tokens_per_minute'):
+        rate_limits[limit] = model_config.get(limit, config.get('rate_limits', {}).get(limit, 0))
+        for key in (provider, f"{provider}:{model_name}"):
+            rate_limits[limit] = overrides.get(key, {}).get(limit, rate_limits[limit])
+    return rate_limits
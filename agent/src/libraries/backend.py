@@ -1,6 +1,8 @@
 import requests
+from requests.adapters import HTTPAdapter
 from .utils import log_message
 import os
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -8,6 +10,54 @@ load_dotenv()
 class BackendAPI:
     GRAPHQL_ENDPOINT = os.getenv('GRAPHQL_ENDPOINT')
     AGENT_SECRET_KEY = os.getenv('AGENT_SECRET_KEY')
+    # Seconds to wait for a connection and for a response of the backend
+    TIMEOUT = (float(os.getenv('BACKEND_CONNECT_TIMEOUT', 5)), float(os.getenv('BACKEND_READ_TIMEOUT', 30)))
+
+    _session = None
+    _session_lock = threading.Lock()
+
+    @staticmethod
+    def session():
+        """
+        The HTTP session shared by all worker threads, which keeps connections to the
+        backend alive between requests instead of doing a TCP and TLS handshake for each.
+        """
+        with BackendAPI._session_lock:
+            if BackendAPI._session is None:
+                session = requests.Session()
+                pool_size = max(1, int(os.getenv('AGENT_CONCURRENCY', 4)))
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers.update({
+                    'Content-Type': 'application/json',
+                    'X-API-Key': BackendAPI.AGENT_SECRET_KEY
+                })
+                BackendAPI._session = session
+            return BackendAPI._session
+
+    @staticmethod
+    def post(query, variables):
+        return BackendAPI.session().post(
+            BackendAPI.GRAPHQL_ENDPOINT,
+            json={'query': query, 'variables': variables},
+            timeout=BackendAPI.TIMEOUT
+        )
+
+    @staticmethod
+    def check_response(response, action):
+        """
+        Read the result of a request to the backend.
+
+        :param action: What the request did, for the error message.
+        :return: The data of the result.
+        :raises requests.HTTPError: When the backend did not answer the request or reported errors.
+        """
+        response.raise_for_status()
+        result = response.json()
+        if result.get('errors'):
+            raise requests.HTTPError(f"{action} failed: {result['errors']}", response=response)
+        return result['data']
 
     @staticmethod
     def load_agent_task(task_id):
@@ -15,6 +65,7 @@ class BackendAPI:
         query ($id: ID!) {
             agentTaskById(id: $id) {
                 id
+                projectId
                 status
                 documentType
                 documentId
@@ -28,14 +79,7 @@ class BackendAPI:
             }
         }
         """
-        response = requests.post(
-            BackendAPI.GRAPHQL_ENDPOINT,
-            json={'query': query, 'variables': {'id': task_id}},
-            headers={
-                'Content-Type': 'application/json',
-                'X-API-Key': BackendAPI.AGENT_SECRET_KEY
-            }
-        )
+        response = BackendAPI.post(query, {'id': task_id})
 
         if response.status_code == 200:
             log_message(f"Agent task data loaded successfully for task ID: {task_id}")
@@ -44,6 +88,41 @@ class BackendAPI:
             log_message(f"Failed to load agent task data for task ID: {task_id}")
             return None
 
+    @staticmethod
+    def claim_agent_task(task_id):
+        """
+        Set a pending task to processing for this agent, loading its data.
+
+        :return: The task, or None if it is not pending (another agent has it, or it finished).
+        :raises requests.HTTPError: When the backend did not answer the request.
+        """
+        mutation = """
+        mutation ($id: ID!, $agent_id: String, $status_message: String) {
+            claimAgentTask(id: $id, agentId: $agent_id, statusMessage: $status_message) {
+                agentTask {
+                    id
+                    projectId
+                    status
+                    documentType
+                    documentId
+                    llmModel
+                    maxInputTokens
+                    maxOutputTokens
+                    temperature
+                    systemRole
+                    promptText
+                    metadata
+                }
+            }
+        }
+        """
+        response = BackendAPI.post(mutation, {
+            'id': task_id,
+            'agent_id': os.getenv('AGENT_ID'),
+            'status_message': 'Processing generation request...'
+        })
+        return BackendAPI.check_response(response, f"Claiming task ID {task_id}")['claimAgentTask']['agentTask']
+
     @staticmethod
     def update_agent_task_status(task_id, status, status_message):
         mutation = """
@@ -57,24 +136,22 @@ class BackendAPI:
             }
         }
         """
-        response = requests.post(
-            BackendAPI.GRAPHQL_ENDPOINT,
-            json={'query': mutation, 'variables': {
-                'id': task_id,
-                'status': status,
-                'status_message': status_message,
-                'agent_id': os.getenv('AGENT_ID')
-            }},
-            headers={
-                'Content-Type': 'application/json',
-                'X-API-Key': BackendAPI.AGENT_SECRET_KEY
-            }
-        )
+        response = BackendAPI.post(mutation, {
+            'id': task_id,
+            'status': status,
+            'status_message': status_message,
+            'agent_id': os.getenv('AGENT_ID')
+        })
         log_message(f"Update status response: {response.text}")
         return response.ok
 
     @staticmethod
     def finalize_agent_task(task_id, input_tokens_used, output_tokens_used, process_time, results):
+        """
+        Save the results of a task and set it to completed.
+
+        :raises requests.HTTPError: When the results were not saved, so the task is not acknowledged as done.
+        """
         mutation = """
         mutation ($id: ID!, $input_tokens_used: Int!, $output_tokens_used: Int!, $process_time: Int!, $agent_results: String!, $agent_id: String!) {
             updateAgentTask(
@@ -95,20 +172,34 @@ class BackendAPI:
             }
         }
         """
-        response = requests.post(
-            BackendAPI.GRAPHQL_ENDPOINT,
-            json={'query': mutation, 'variables': {
-                'id': task_id,
-                'input_tokens_used': input_tokens_used,
-                'output_tokens_used': output_tokens_used,
-                'process_time': process_time,
-                'agent_results': results,
-                'agent_id': os.getenv('AGENT_ID')
-            }},
-            headers={
-                'Content-Type': 'application/json',
-                'X-API-Key': BackendAPI.AGENT_SECRET_KEY
-            }
-        )
+        response = BackendAPI.post(mutation, {
+            'id': task_id,
+            'input_tokens_used': input_tokens_used,
+            'output_tokens_used': output_tokens_used,
+            'process_time': process_time,
+            'agent_results': results,
+            'agent_id': os.getenv('AGENT_ID')
+        })
         log_message(f"Finalize task response: {response.text}")
-        return response.ok
+        return BackendAPI.check_response(response, f"Finalizing task ID {task_id}")['updateAgentTask']['agentTask']
+
+    @staticmethod
+    def fail_agent_task(task_id, errors):
+        mutation = """
+        mutation ($id: ID!, $errors: String!, $agent_id: String!) {
+            updateAgentTask(id: $id, status: "error", statusMessage: "Error processing request", errors: $errors, agentId: $agent_id) {
+                agentTask {
+                    id
+                    status
+                    statusMessage
+                }
+            }
+        }
+        """
+        response = BackendAPI.post(mutation, {
+            'id': task_id,
+            'errors': errors,
+            'agent_id': os.getenv('AGENT_ID')
+        })
+        log_message(f"Fail task response: {response.text}")
+        return response.ok and not response.json().get('errors')
@@ -0,0 +1,80 @@
+import os
+import json
+import time
+import zlib
+from dotenv import load_dotenv
+from .utils import log_message
+from .redis_connection import get_redis_client
+
+load_dotenv()
+
+class PartialResultPublisher:
+    """
+    Pushes the text an LLM has generated so far for an agent task to the project's
+    websocket channel, through the same Redis channel the backend broadcasts it on:
+    'notifications', or with WEBSOCKET_RELAY_SHARDS above 1 the 'notifications.<shard>'
+    of the relay shard the channel belongs to (see the backend's Websocket.shard_of).
+    Updates are coalesced to at most one every AGENT_STREAM_INTERVAL_MS.
+
+    Each update only carries the text generated since the previous one
+    ('partial_results'), with its 'offset' in the whole text and a 'sequence' number.
+    Clients append it when the offset matches the text they have. After a gap they
+    wait for the final result, which still reaches them through updateAgentTask.
+    """
+
+    def __init__(self, agent_task):
+        self.agent_task = agent_task
+        self.redis_client = get_redis_client()
+        self.interval = int(os.getenv('AGENT_STREAM_INTERVAL_MS', 250)) / 1000
+        self.text = ''
+        self.sequence = 0
+        self.last_published = 0
+        self.published_length = 0
+
+    @staticmethod
+    def enabled(agent_task):
+        return os.getenv('AGENT_STREAM_PARTIAL_RESULTS', '1') == '1' \
+            and bool(os.getenv('REDIS_HOST')) \
+            and bool(agent_task.get('projectId'))
+
+    @staticmethod
+    def notifications_channel(channel):
+        """The Redis channel the websocket relay relaying a websocket channel listens on."""
+        shards = int(os.getenv('WEBSOCKET_RELAY_SHARDS', 1))
+        if shards <= 1:
+            return 'notifications'
+        return f"notifications.{zlib.crc32(channel.encode('utf-8')) % shards}"
+
+    def on_text(self, text):
+        """Called by providers with every piece of streamed text."""
+        self.text += text
+        if time.monotonic() - self.last_published >= self.interval:
+            self.publish()
+
+    def publish(self):
+        if len(self.text) == self.published_length:
+            return
+        offset = self.published_length
+        self.sequence += 1
+        self.last_published = time.monotonic()
+        self.published_length = len(self.text)
+
+        channel = f"project-{self.agent_task['projectId']}"
+        notification = {
+            'channel': channel,
+            'notification': {
+                'type': 'agent_task_partial',
+                'agent_task_id': str(self.agent_task['id']),
+                'status': 'processing',
+                'document_id': str(self.agent_task.get('documentId')),
+                'document_type': self.agent_task.get('documentType'),
+                'sequence': self.sequence,
+                'offset': offset,
+                'partial_results': self.text[offset:]
+            },
+            'sent_at': time.time()
+        }
+        try:
+            self.redis_client.publish(PartialResultPublisher.notifications_channel(channel), json.dumps(notification))
+        except Exception as e:
+            log_message(f"Error publishing partial results: {e}")
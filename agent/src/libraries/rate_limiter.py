@@ -0,0 +1,212 @@
+import os
+import time
+import random
+import threading
+from dotenv import load_dotenv
+from .utils import log_message
+from .redis_connection import get_redis_client
+
+load_dotenv()
+
+# Refills and takes from the request and token buckets of one model atomically, so every
+# agent process shares the same budget. Returns the seconds to wait before trying again,
+# 0 when the request was admitted. A rate of 0 means unlimited.
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rates = {tonumber(ARGV[2]), tonumber(ARGV[3])}
+local costs = {1, tonumber(ARGV[4])}
+local state = redis.call('HMGET', KEYS[1], 'requests', 'tokens', 'updated_at', 'blocked_until')
+local elapsed = math.max(0, now - (tonumber(state[3]) or now))
+local wait = math.max(0, (tonumber(state[4]) or 0) - now)
+local levels = {}
+for i = 1, 2 do
+    levels[i] = math.min(rates[i], (tonumber(state[i]) or rates[i]) + elapsed * rates[i] / 60)
+    local cost = math.min(costs[i], rates[i])
+    if rates[i] > 0 and levels[i] < cost then
+        wait = math.max(wait, (cost - levels[i]) * 60 / rates[i])
+    end
+end
+if wait == 0 then
+    for i = 1, 2 do
+        levels[i] = levels[i] - math.min(costs[i], rates[i])
+    end
+end
+redis.call('HSET', KEYS[1], 'requests', levels[1], 'tokens', levels[2], 'updated_at', now)
+redis.call('EXPIRE', KEYS[1], 300)
+return tostring(wait)
+"""
+
+class ProviderError(Exception):
+    """Raised when an LLM provider fails to answer a prompt, so the task is marked as failed rather than completed empty."""
+
+class RateLimitError(ProviderError):
+    """
+    Raised by providers when the LLM API reports a rate limit or overload (429, 503, 529).
+
+    :param retry_after: The seconds the provider asked to wait, if it said.
+    """
+
+    # Too many requests, service unavailable and Anthropic's overloaded
+    STATUS_CODES = (429, 503, 529)
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @staticmethod
+    def retry_after_from(error):
+        """Read the Retry-After header of an SDK error, if it has one."""
+        headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+        try:
+            return float(headers.get('retry-after'))
+        except (TypeError, ValueError):
+            return None
+
+class LocalBuckets:
+    """In-process fallback of the Redis buckets, used when REDIS_HOST is not set."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def acquire(self, key, requests_per_minute, tokens_per_minute, tokens, now):
+        with self.lock:
+            bucket = self.buckets.setdefault(key, {
+                'levels': [requests_per_minute, tokens_per_minute], 'updated_at': now, 'blocked_until': 0
+            })
+            rates = (requests_per_minute, tokens_per_minute)
+            costs = (min(1, rates[0]), min(tokens, rates[1]))
+            elapsed = max(0, now - bucket['updated_at'])
+            wait = max(0, bucket['blocked_until'] - now)
+            levels = [min(rate, level + elapsed * rate / 60) for rate, level in zip(rates, bucket['levels'])]
+            for rate, level, cost in zip(rates, levels, costs):
+                if rate > 0 and level < cost:
+                    wait = max(wait, (cost - level) * 60 / rate)
+            if wait == 0:
+                levels = [level - cost for level, cost in zip(levels, costs)]
+            bucket.update({'levels': levels, 'updated_at': now})
+            return wait
+
+    def refund(self, key, tokens):
+        with self.lock:
+            if key in self.buckets:
+                self.buckets[key]['levels'][1] += tokens
+
+    def block(self, key, until):
+        with self.lock:
+            if key in self.buckets:
+                self.buckets[key]['blocked_until'] = max(self.buckets[key]['blocked_until'], until)
+
+class RateLimiter:
+    """
+    Token bucket rate limiter keyed by provider and model, budgeting requests and tokens
+    per minute. Buckets live in Redis when REDIS_HOST is set, so all agent processes
+    share one budget, and in process otherwise.
+    """
+
+    _local = LocalBuckets()
+
+    def __init__(self):
+        self.redis_client = get_redis_client()
+        if self.redis_client:
+            self.acquire_script = self.redis_client.register_script(ACQUIRE_SCRIPT)
+
+    @staticmethod
+    def bucket_key(provider, model):
+        return f"{os.getenv('APP_ID', '')}llm_rate:{provider}:{model}"
+
+    def acquire(self, provider, model, rate_limits, tokens):
+        """
+        Wait until the budget of a model allows one more request of the given size.
+
+        :param provider: The provider name, e.g. 'openai'.
+        :param model: The model name.
+        :param rate_limits: The requests_per_minute and tokens_per_minute of the model.
+        :param tokens: The tokens the request is expected to use, input plus maximum output.
+        """
+        key = self.bucket_key(provider, model)
+        requests_per_minute = rate_limits.get('requests_per_minute', 0)
+        tokens_per_minute = rate_limits.get('tokens_per_minute', 0)
+        if not requests_per_minute and not tokens_per_minute:
+            return
+
+        while True:
+            wait = self._acquire(key, requests_per_minute, tokens_per_minute, tokens)
+            if wait <= 0:
+                return
+            # Spread waiting workers out so they do not all retry at the same moment
+            time.sleep(wait + random.uniform(0, min(1.0, wait / 2)))
+
+    def _acquire(self, key, requests_per_minute, tokens_per_minute, tokens):
+        now = time.time()
+        if self.redis_client:
+            try:
+                return float(self.acquire_script(keys=[key], args=[now, requests_per_minute, tokens_per_minute, tokens]))
+            except Exception as e:
+                log_message(f"Rate limiter could not reach Redis, limiting in process: {e}")
+        return self._local.acquire(key, requests_per_minute, tokens_per_minute, tokens, now)
+
+    def refund(self, provider, model, tokens):
+        """
+        Give back tokens reserved by acquire() that the request did not use.
+
+        :param provider: The provider name.
+        :param model: The model name.
+        :param tokens: The number of unused tokens.
+        """
+        if tokens <= 0:
+            return
+        key = self.bucket_key(provider, model)
+        if self.redis_client:
+            try:
+                self.redis_client.hincrbyfloat(key, 'tokens', tokens)
+                return
+            except Exception as e:
+                log_message(f"Rate limiter could not reach Redis: {e}")
+        self._local.refund(key, tokens)
+
+    def block(self, provider, model, seconds):
+        """
+        Hold back every request to a model for a while, after the provider reported
+        a rate limit, so all workers back off together instead of piling on retries.
+
+        :param provider: The provider name.
+        :param model: The model name.
+        :param seconds: How long to hold requests back.
+        """
+        key = self.bucket_key(provider, model)
+        until = time.time() + seconds
+        if self.redis_client:
+            try:
+                blocked_until = float(self.redis_client.hget(key, 'blocked_until') or 0)
+                if until > blocked_until:
+                    self.redis_client.hset(key, 'blocked_until', until)
+                    self.redis_client.expire(key, 300)
+                return
+            except Exception as e:
+                log_message(f"Rate limiter could not reach Redis: {e}")
+        self._local.block(key, until)
+
+shared_rate_limiter = None
+shared_rate_limiter_lock = threading.Lock()
+
+def get_rate_limiter():
+    """The RateLimiter shared by all worker threads of this process."""
+    global shared_rate_limiter
+    with shared_rate_limiter_lock:
+        if shared_rate_limiter is None:
+            shared_rate_limiter = RateLimiter()
+        return shared_rate_limiter
+
+def backoff_delay(attempt, retry_after=None, base=None, maximum=None):
+    """
+    Jittered exponential backoff: a random delay up to base * 2^attempt seconds,
+    capped at maximum, and never shorter than what the provider asked for.
+
+    :param attempt: The number of the retry, starting at 0.
+    :param retry_after: The seconds the provider asked to wait (optional).
+    """
+    base = base if base is not None else float(os.getenv('LLM_RETRY_BASE_DELAY', 2))
+    maximum = maximum if maximum is not None else float(os.getenv('LLM_RETRY_MAX_DELAY', 60))
+    delay = random.uniform(0, min(maximum, base * 2 ** attempt))
+    return max(delay, retry_after or 0)
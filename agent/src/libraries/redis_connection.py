@@ -0,0 +1,26 @@
+import os
+import threading
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+redis_client = None
+redis_client_lock = threading.Lock()
+
+def get_redis_client():
+    """
+    The Redis client shared by all worker threads of this process, backed by one
+    connection pool, or None when REDIS_HOST is not set.
+    """
+    global redis_client
+    if not os.getenv('REDIS_HOST'):
+        return None
+    with redis_client_lock:
+        if redis_client is None:
+            redis_client = redis.Redis(
+                host=os.getenv('REDIS_HOST'),
+                port=int(os.getenv('REDIS_PORT', 6379)),
+                socket_timeout=5
+            )
+        return redis_client
@@ -1,5 +1,6 @@
 import pika
 import time
+import threading
 import importlib
 from datetime import datetime
 import os
@@ -9,12 +10,16 @@ from config.llms import get_model_config
 
 load_dotenv()
 
+# Tasks run on several threads, keep their log lines whole
+log_lock = threading.Lock()
+
 def log_message(message):
     timestamp = datetime.now().isoformat()
     log_entry = f"{timestamp} - {message}\n"
-    print(log_entry, end='')
-    with open('logs/agent.log', 'a') as log_file:
-        log_file.write(log_entry)
+    with log_lock:
+        print(log_entry, end='')
+        with open('logs/agent.log', 'a') as log_file:
+            log_file.write(log_entry)
 
 def connect_to_rabbitmq(queue_name):
     connection_params = pika.ConnectionParameters(host=os.getenv('RABBITMQ_HOST', 'localhost'))
@@ -23,7 +28,9 @@ def connect_to_rabbitmq(queue_name):
     channel.queue_declare(queue=queue_name, durable=True)
     return connection, channel
 
-def start_rabbitmq_consumer(channel, callback, queue_name):
+def start_rabbitmq_consumer(channel, callback, queue_name, prefetch_count=1):
+    # Never hold more unacknowledged messages than can be worked on at once
+    channel.basic_qos(prefetch_count=prefetch_count)
     channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=False)
     try:
         log_message("Starting RabbitMQ consumer...")
@@ -33,15 +40,49 @@ def start_rabbitmq_consumer(channel, callback, queue_name):
     except Exception as e:
         log_message(f"Error: {e}")
         time.sleep(5)  # Sleep before restarting consumer
-        start_rabbitmq_consumer(channel, callback, queue_name)
+        start_rabbitmq_consumer(channel, callback, queue_name, prefetch_count)
 
-def count_tokens(string: str, encoding_name: str = "gpt2") -> int:
-    """Returns the number of tokens in a text string."""
-    encoding = tiktoken.get_encoding(encoding_name)
-    num_tokens = len(encoding.encode(string))
-    return num_tokens
+# tiktoken encodings by name, loading one reads and parses its whole vocabulary
+encodings = {}
+encodings_lock = threading.Lock()
+
+def get_encoding(encoding_name):
+    """The shared tiktoken encoding of a name, e.g. 'cl100k_base', see LLMS_CONFIG."""
+    with encodings_lock:
+        if encoding_name not in encodings:
+            encodings[encoding_name] = tiktoken.get_encoding(encoding_name)
+        return encodings[encoding_name]
 
-def prompt_llm_provider(task):
+def count_tokens(string: str, encoding_name: str = "cl100k_base") -> int:
+    """Returns the number of tokens in a text string."""
+    # Special token markers in prompts are counted as text, not rejected
+    return len(get_encoding(encoding_name).encode(string, disallowed_special=()))
+
+# Provider instances by class name, each created once per process so their clients
+# (and the connection pools of those) are reused across tasks
+providers = {}
+providers_lock = threading.Lock()
+
+def get_provider(provider_class_name):
+    """
+    The shared instance of a provider class in the llms package, e.g. 'OpenAIProvider'.
+    The SDK clients of the providers are safe to use from several threads.
+    """
+    with providers_lock:
+        if provider_class_name not in providers:
+            # Import the provider class dynamically
+            provider_module = importlib.import_module(f"llms.{provider_class_name}")
+            ProviderClass = getattr(provider_module, provider_class_name)
+            providers[provider_class_name] = ProviderClass()
+        return providers[provider_class_name]
+
+def prompt_llm_provider(task, on_text=None):
+    """
+    Send the prompt of an agent task to its LLM.
+
+    :param task: The agent task, as loaded from the backend.
+    :param on_text: Called with every piece of text as the LLM streams it (optional).
+    """
     start_time = time.time()
 
     # Extract task details
@@ -55,41 +96,59 @@ def prompt_llm_provider(task):
     # Load model configuration based on the llm_model
     model_config = get_model_config(llm_model)
     provider_class_name = model_config['provider']
+    provider_name = model_config['provider_name']
+    rate_limits = model_config['rate_limits']
+    encoding_name = model_config['encoding']
     model_config = model_config['config']
 
     # Override max input/output tokens if necessary
     max_input_tokens = min(max_input_tokens, model_config['max_input_tokens']) if max_input_tokens else model_config['max_input_tokens']
     max_output_tokens = min(max_output_tokens, model_config['max_output_tokens']) if max_output_tokens else model_config['max_output_tokens']
 
-    # Count input tokens
-    system_role_tokens = count_tokens(system_role)
-    prompt_text_tokens = count_tokens(prompt_text)
-    total_input_tokens = system_role_tokens + prompt_text_tokens
+    # Count input tokens, encoding the prompt once for counting and truncating it
+    system_role_tokens = count_tokens(system_role, encoding_name)
+    prompt_tokens = get_encoding(encoding_name).encode(prompt_text, disallowed_special=())
+    total_input_tokens = system_role_tokens + len(prompt_tokens)
 
     # Truncate prompt_text if the total tokens exceed max_input_tokens
     if total_input_tokens > max_input_tokens:
         # Calculate how many tokens we can use for prompt_text
         available_tokens_for_prompt = max_input_tokens - system_role_tokens
         # Truncate prompt_text to fit the available token count
-        truncated_prompt_text, tokens_truncated = truncate_text_to_tokens(prompt_text, available_tokens_for_prompt)
+        truncated_prompt_text, tokens_truncated = truncate_text_to_tokens(
+            prompt_text, available_tokens_for_prompt, encoding_name, prompt_tokens
+        )
         log_message(f"Input too big ({total_input_tokens}), truncated {tokens_truncated} tokens")
         input_tokens_used = max_input_tokens
     else:
         truncated_prompt_text = prompt_text
         input_tokens_used = total_input_tokens
 
-    # Import the provider class dynamically
-    provider_module = importlib.import_module(f"llms.{provider_class_name}")
-    ProviderClass = getattr(provider_module, provider_class_name)
+    # The provider instance is shared by all tasks of this process
+    provider = get_provider(provider_class_name)
+
+    # Token usage reported by the provider, when it does
+    usage = {}
+
+    def send():
+        usage.clear()
+        return provider.send_prompt(system_role, truncated_prompt_text, max_output_tokens, temperature, llm_model, on_text=on_text, usage=usage)
 
-    # Instantiate the provider
-    provider = ProviderClass()
+    def count_output_tokens(results):
+        if 'output_tokens' not in usage:
+            usage['output_tokens'] = count_tokens(results, encoding_name)
+        return usage['output_tokens']
 
-    # Send the prompt to the provider
-    results = provider.send_prompt(system_role, truncated_prompt_text, max_output_tokens, temperature, llm_model)
+    # Send the prompt to the provider, within the rate limits of the model
+    results = send_prompt_with_rate_limit(
+        provider_name, llm_model, rate_limits,
+        input_tokens_used, max_output_tokens,
+        send, count_output_tokens
+    )
 
     # Count the tokens of the output result
-    output_tokens_used = count_tokens(results)
+    output_tokens_used = count_output_tokens(results)
+    input_tokens_used = usage.get('input_tokens', input_tokens_used)
 
     # Calculate the processing time in milliseconds
     process_time = int((time.time() - start_time) * 1000)
@@ -101,9 +160,57 @@ def prompt_llm_provider(task):
         'results': results
     }
 
-def truncate_text_to_tokens(text, max_tokens, encoding_name="gpt2"):
-    encoding = tiktoken.get_encoding(encoding_name)
-    tokens = encoding.encode(text)
+def send_prompt_with_rate_limit(provider_name, llm_model, rate_limits, input_tokens, max_output_tokens, send, count_output_tokens=None):
+    """
+    Call send() once the rate limiter admits the request, retrying with jittered
+    exponential backoff while the provider reports rate limits or overload.
+
+    :param count_output_tokens: Returns the number of tokens of the results (optional).
+
+    :return: The results of send().
+    :raises RateLimitError: When all retries were rate limited.
+    :raises ProviderError: When the provider failed or returned no text.
+    """
+    # Imported here, rate_limiter itself depends on log_message
+    from libraries.rate_limiter import get_rate_limiter, RateLimitError, ProviderError, backoff_delay
+
+    rate_limiter = get_rate_limiter()
+    max_retries = int(os.getenv('LLM_MAX_RETRIES', 5))
+    reserved_tokens = input_tokens + max_output_tokens
+
+    for attempt in range(max_retries + 1):
+        rate_limiter.acquire(provider_name, llm_model, rate_limits, reserved_tokens)
+        try:
+            results = send()
+        except RateLimitError as e:
+            if attempt >= max_retries:
+                log_message(f"Giving up on {llm_model} after {attempt + 1} rate limited attempts: {e}")
+                raise
+            delay = backoff_delay(attempt, e.retry_after)
+            log_message(f"{llm_model} is rate limited, retrying in {delay:.1f}s: {e}")
+            rate_limiter.block(provider_name, llm_model, delay)
+            continue
+
+        # An empty answer would be saved as a new, empty version of the document
+        if not results:
+            rate_limiter.refund(provider_name, llm_model, max_output_tokens)
+            raise ProviderError(f"{llm_model} returned no text")
+
+        # Give back the part of the output budget the response did not use
+        output_tokens = count_output_tokens(results) if count_output_tokens else count_tokens(results)
+        rate_limiter.refund(provider_name, llm_model, max_output_tokens - output_tokens)
+        return results
+
+def truncate_text_to_tokens(text, max_tokens, encoding_name="cl100k_base", tokens=None):
+    """
+    Cut a text down to max_tokens tokens.
+
+    :param tokens: The tokens of the text, if they were already encoded (optional).
+    :return: The text and the number of tokens cut off.
+    """
+    encoding = get_encoding(encoding_name)
+    if tokens is None:
+        tokens = encoding.encode(text, disallowed_special=())
     if len(tokens) > max_tokens:
         truncated_tokens = tokens[:max_tokens]
         truncated_text = encoding.decode(truncated_tokens)
@@ -1,6 +1,7 @@
 from anthropic import Anthropic, HUMAN_PROMPT, AI_PROMPT
 import os
 from libraries.utils import log_message
+from libraries.rate_limiter import RateLimitError, ProviderError
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,9 +11,11 @@ class AnthropicProvider:
         self.api_key = os.getenv('SH_ANTHROPIC_API_KEY')
         if not self.api_key:
             raise ValueError("No Anthropic API key found in environment variables.")
-        self.anthropic = Anthropic(api_key=self.api_key)
-    def send_prompt(self, system_role, user_prompt,  max_tokens=4095, temperature=0.7, model="claude-2",):
-     
+        # Retries are left to the agent's rate limiter, see send_prompt_with_rate_limit
+        self.anthropic = Anthropic(api_key=self.api_key, max_retries=0)
+    def send_prompt(self, system_role, user_prompt,  max_tokens=4095, temperature=0.7, model="claude-2", on_text=None, usage=None):
+        # The text completions API reports no token usage, usage is left for the caller to count
+
         prompt = f"{HUMAN_PROMPT} {system_role} {user_prompt}{AI_PROMPT}"
         try:
             
@@ -21,11 +24,23 @@ class AnthropicProvider:
                 max_tokens_to_sample=max_tokens,
                 prompt=prompt,
                 temperature=temperature,
+                stream=on_text is not None,
             )
-            return completion.completion
+            if on_text is None:
+                return completion.completion
+
+            # Pass every piece of text on as it arrives and return the whole text
+            parts = []
+            for event in completion:
+                if event.completion:
+                    parts.append(event.completion)
+                    on_text(event.completion)
+            return ''.join(parts)
         except Exception as e:
+            if getattr(e, 'status_code', None) in RateLimitError.STATUS_CODES:
+                raise RateLimitError(str(e), RateLimitError.retry_after_from(e)) from e
             log_message(f"An error occurred while sending prompt to Anthropic: {e}")
-            return ""
+            raise ProviderError(str(e)) from e
 
 if __name__ == '__main__':
     provider = AnthropicProvider()
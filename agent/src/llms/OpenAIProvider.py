@@ -1,6 +1,7 @@
 import os
 from openai import OpenAI
 from libraries.utils import log_message
+from libraries.rate_limiter import RateLimitError, ProviderError
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -11,7 +12,8 @@ class OpenAIProvider:
         if not self.api_key:
             raise ValueError("No OpenAI API key found in the environment variables.")
 
-        self.client = OpenAI(api_key=self.api_key)
+        # Retries are left to the agent's rate limiter, see send_prompt_with_rate_limit
+        self.client = OpenAI(api_key=self.api_key, max_retries=0)
 
     def handle_chat_completion(self, response):
         try:
@@ -27,7 +29,31 @@ class OpenAIProvider:
             log_message(f"An error occurred in handling instruct completion response: {e}")
             return ""
 
-    def send_prompt(self, system_role, user_prompt, max_tokens, temperature, model="gpt-4", stream=False, json_mode=False):
+    def handle_usage(self, response_usage, usage):
+        # Report the tokens counted by OpenAI, when asked for and included
+        if usage is not None and response_usage:
+            usage['input_tokens'] = response_usage.prompt_tokens
+            usage['output_tokens'] = response_usage.completion_tokens
+
+    def handle_stream(self, completion, on_text, chat=True, usage=None):
+        # Pass every piece of text on as it arrives and return the whole text
+        parts = []
+        for chunk in completion:
+            # The last chunk carries the usage of the whole request, and no choices
+            self.handle_usage(getattr(chunk, 'usage', None), usage)
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].delta.content if chat else chunk.choices[0].text
+            if text:
+                parts.append(text)
+                on_text(text)
+        return ''.join(parts)
+
+    def send_prompt(self, system_role, user_prompt, max_tokens, temperature, model="gpt-4", stream=False, json_mode=False, on_text=None, usage=None):
+        # Streaming is used whenever someone listens for partial text
+        stream = stream or on_text is not None
+        # Only streamed requests take stream_options
+        stream_options = {"stream_options": {"include_usage": True}} if stream else {}
         try:
             if "instruct" not in model and "davinci" not in model:
                 response_format = {"type": "json_object"} if json_mode else None
@@ -40,20 +66,31 @@ class OpenAIProvider:
                     max_tokens=max_tokens,
                     temperature=temperature,
                     stream=stream,
-                    response_format=response_format
+                    response_format=response_format,
+                    **stream_options
                 )
+                if stream:
+                    return self.handle_stream(completion, on_text or (lambda text: None), usage=usage)
+                self.handle_usage(completion.usage, usage)
                 return self.handle_chat_completion(completion)
             else:
                 completion = self.client.completions.create(
                     model=model,
                     prompt=user_prompt,
                     max_tokens=max_tokens,
-                    temperature=temperature
+                    temperature=temperature,
+                    stream=stream,
+                    **stream_options
                 )
+                if stream:
+                    return self.handle_stream(completion, on_text or (lambda text: None), chat=False, usage=usage).strip()
+                self.handle_usage(completion.usage, usage)
                 return self.handle_instruct_completion(completion)
         except Exception as e:
+            if getattr(e, 'status_code', None) in RateLimitError.STATUS_CODES:
+                raise RateLimitError(str(e), RateLimitError.retry_after_from(e)) from e
             log_message(f"An error occurred in Completion: {e}")
-            return ""
+            raise ProviderError(str(e)) from e
 
 
 if __name__ == '__main__':
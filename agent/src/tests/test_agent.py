@@ -0,0 +1,187 @@
+import json
+import unittest
+import requests
+from unittest.mock import patch, MagicMock
+import agent
+from agent import AgentWorker, parse_queues, process_task
+from libraries.backend import BackendAPI
+
+
+class TestParseQueues(unittest.TestCase):
+
+    def test_weights(self):
+        self.assertEqual(parse_queues('interactive:3, batch', 'agent_task_queue'), [('interactive', 3), ('batch', 1)])
+        # A weight below 1 still gets the queue consumed
+        self.assertEqual(parse_queues('interactive:0,', 'agent_task_queue'), [('interactive', 1)])
+
+    def test_default_queue(self):
+        self.assertEqual(parse_queues('', 'agent_task_queue'), [('agent_task_queue', 1)])
+        self.assertEqual(parse_queues(' , ', 'agent_task_queue'), [('agent_task_queue', 1)])
+
+
+class TestAgentWorker(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch('agent.log_message')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def worker(self, queues=(('agent_task_queue', 1),), concurrency=1):
+        worker = AgentWorker(list(queues), concurrency)
+        self.addCleanup(worker.executor.shutdown)
+        # Run the callbacks meant for the connection's thread right away
+        worker.connection = MagicMock()
+        worker.connection.add_callback_threadsafe.side_effect = lambda callback: callback()
+        worker.in_flight = 1
+        return worker
+
+    def test_slots_by_weight(self):
+        self.assertEqual(self.worker([('interactive', 3), ('batch', 1)], 8).queues, [('interactive', 6), ('batch', 2)])
+        # Every queue keeps a slot, even past the concurrency
+        self.assertEqual(self.worker([('interactive', 3), ('batch', 1)], 2).queues, [('interactive', 2), ('batch', 1)])
+        self.assertEqual(self.worker([('agent_task_queue', 1)], 4).queues, [('agent_task_queue', 4)])
+
+    @patch('agent.process_task')
+    def test_completed_task_is_acknowledged(self, mock_process_task):
+        worker = self.worker()
+        channel = MagicMock(is_open=True)
+
+        worker.run_task(channel, 1, b'{"task_id": "task"}')
+
+        mock_process_task.assert_called_once()
+        channel.basic_ack.assert_called_once_with(delivery_tag=1)
+        channel.basic_nack.assert_not_called()
+        self.assertEqual(worker.in_flight, 0)
+
+    @patch('agent.BackendAPI')
+    @patch('agent.process_task', side_effect=Exception('LLM unavailable'))
+    def test_failed_task_is_reported(self, mock_process_task, mock_backend_api):
+        worker = self.worker()
+        channel = MagicMock(is_open=True)
+        mock_backend_api.fail_agent_task.return_value = True
+
+        worker.run_task(channel, 1, b'{"task_id": "task"}')
+
+        mock_backend_api.fail_agent_task.assert_called_once_with('task', 'LLM unavailable')
+        channel.basic_ack.assert_called_once_with(delivery_tag=1)
+        channel.basic_nack.assert_not_called()
+
+    @patch('agent.BackendAPI')
+    @patch('agent.process_task', side_effect=Exception('Backend unavailable'))
+    def test_unreported_failure_is_requeued_once(self, mock_process_task, mock_backend_api):
+        worker = self.worker()
+        channel = MagicMock(is_open=True)
+        mock_backend_api.fail_agent_task.side_effect = Exception('Backend unavailable')
+
+        worker.run_task(channel, 1, b'{"task_id": "task"}')
+        channel.basic_nack.assert_called_once_with(delivery_tag=1, requeue=True)
+        channel.basic_ack.assert_not_called()
+
+        # Delivered again and failing again, it is dropped
+        worker.in_flight = 1
+        worker.run_task(channel, 2, b'{"task_id": "task"}', redelivered=True)
+        channel.basic_ack.assert_called_once_with(delivery_tag=2)
+        self.assertEqual(worker.in_flight, 0)
+
+    @patch('agent.BackendAPI')
+    @patch('agent.process_task', side_effect=Exception('LLM unavailable'))
+    def test_failure_reported_on_results_queue(self, mock_process_task, mock_backend_api):
+        worker = self.worker()
+        worker.channel = MagicMock()
+        channel = MagicMock(is_open=True)
+
+        with patch('agent.AGENT_RESULTS_VIA_QUEUE', True):
+            worker.run_task(channel, 1, b'{"task_id": "task"}')
+
+        mock_backend_api.fail_agent_task.assert_not_called()
+        result = json.loads(worker.channel.basic_publish.call_args.kwargs['body'])
+        self.assertEqual((result['task_id'], result['status'], result['errors']), ('task', 'error', 'LLM unavailable'))
+        channel.basic_ack.assert_called_once_with(delivery_tag=1)
+
+    def test_message_while_stopping_is_rejected(self):
+        worker = self.worker()
+        worker.in_flight = 0
+        worker.stopping = True
+        channel = MagicMock()
+
+        worker.on_message(channel, MagicMock(delivery_tag=1), None, b'{"task_id": "task"}')
+
+        channel.basic_reject.assert_called_once_with(delivery_tag=1, requeue=True)
+        self.assertEqual(worker.in_flight, 0)
+
+
+@patch('agent.log_message')
+@patch('agent.PartialResultPublisher.enabled', return_value=False)
+@patch('agent.prompt_llm_provider', return_value={'input_tokens_used': 5, 'output_tokens_used': 7, 'process_time': 100, 'results': 'Generated'})
+@patch('agent.BackendAPI')
+class TestProcessTask(unittest.TestCase):
+
+    def test_claimed_task_is_processed(self, mock_backend_api, mock_prompt_llm_provider, mock_enabled, mock_log_message):
+        mock_backend_api.claim_agent_task.return_value = {'id': 'task', 'promptText': 'Write a story'}
+
+        process_task(b'{"task_id": "task"}')
+
+        mock_backend_api.claim_agent_task.assert_called_once_with('task')
+        self.assertEqual(mock_prompt_llm_provider.call_args[0][0], {'id': 'task', 'promptText': 'Write a story'})
+        mock_backend_api.finalize_agent_task.assert_called_once_with(
+            'task', input_tokens_used=5, output_tokens_used=7, process_time=100, results='Generated'
+        )
+
+    def test_task_not_pending_is_skipped(self, mock_backend_api, mock_prompt_llm_provider, mock_enabled, mock_log_message):
+        mock_backend_api.claim_agent_task.return_value = None
+
+        process_task(b'{"task_id": "task", "task": {"id": "task"}}')
+
+        mock_prompt_llm_provider.assert_not_called()
+        mock_backend_api.finalize_agent_task.assert_not_called()
+
+    def test_results_on_queue(self, mock_backend_api, mock_prompt_llm_provider, mock_enabled, mock_log_message):
+        mock_backend_api.claim_agent_task.return_value = {'id': 'task'}
+        publish_result = MagicMock()
+
+        # The task data sent with the message is used, the task is still claimed first
+        process_task(b'{"task_id": "task", "task": {"id": "task", "promptText": "Write a story"}}', publish_result)
+
+        mock_backend_api.claim_agent_task.assert_called_once_with('task')
+        self.assertEqual(mock_prompt_llm_provider.call_args[0][0]['promptText'], 'Write a story')
+        result = publish_result.call_args[0][0]
+        self.assertEqual((result['status'], result['agent_results']), ('completed', 'Generated'))
+        mock_backend_api.finalize_agent_task.assert_not_called()
+
+    def test_unsaved_results_are_not_acknowledged(self, mock_backend_api, mock_prompt_llm_provider, mock_enabled, mock_log_message):
+        mock_backend_api.claim_agent_task.return_value = {'id': 'task'}
+        mock_backend_api.finalize_agent_task.side_effect = requests.HTTPError('Finalizing task ID task failed')
+
+        # Raised for run_task to report the failure or requeue the task
+        with self.assertRaises(requests.HTTPError):
+            process_task(b'{"task_id": "task"}')
+
+
+@patch('libraries.backend.log_message')
+@patch.object(BackendAPI, 'post')
+class TestBackendAPI(unittest.TestCase):
+
+    def response(self, result, status_code=200):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = json.dumps(result).encode('utf-8')
+        return response
+
+    def test_finalize_agent_task(self, mock_post, mock_log_message):
+        mock_post.return_value = self.response({'data': {'updateAgentTask': {'agentTask': {'id': 'task', 'status': 'completed'}}}})
+        self.assertEqual(BackendAPI.finalize_agent_task('task', 5, 7, 100, 'Generated')['status'], 'completed')
+
+    def test_finalize_agent_task_failures(self, mock_post, mock_log_message):
+        mock_post.return_value = self.response({'errors': [{'message': 'Not authorized'}]}, 500)
+        with self.assertRaises(requests.HTTPError):
+            BackendAPI.finalize_agent_task('task', 5, 7, 100, 'Generated')
+
+        # GraphQL reports errors with a 200 response
+        mock_post.return_value = self.response({'data': {'updateAgentTask': None}, 'errors': [{'message': 'Agent task not found'}]})
+        with self.assertRaises(requests.HTTPError):
+            BackendAPI.finalize_agent_task('task', 5, 7, 100, 'Generated')
+        self.assertFalse(BackendAPI.fail_agent_task('task', 'LLM unavailable'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import redis
+from libraries.rate_limiter import RateLimiter, LocalBuckets, ACQUIRE_SCRIPT, backoff_delay, RateLimitError, ProviderError
+from libraries.utils import send_prompt_with_rate_limit
+
+LIMITS = {'requests_per_minute': 60, 'tokens_per_minute': 1000}
+
+
+class TestLocalBuckets(unittest.TestCase):
+
+    def test_waits_for_the_bucket_to_refill(self):
+        buckets = LocalBuckets()
+        self.assertEqual(buckets.acquire('key', 60, 1000, 600, now=100), 0)
+
+        # 400 tokens left, the next 600 are there after 200 * 60 / 1000 seconds
+        self.assertAlmostEqual(buckets.acquire('key', 60, 1000, 600, now=100), 12)
+        self.assertEqual(buckets.acquire('key', 60, 1000, 600, now=112), 0)
+
+    def test_refund_and_block(self):
+        buckets = LocalBuckets()
+        buckets.acquire('key', 60, 1000, 1000, now=100)
+        buckets.refund('key', 600)
+        self.assertEqual(buckets.acquire('key', 60, 1000, 600, now=100), 0)
+
+        buckets.block('key', until=130)
+        self.assertEqual(buckets.acquire('key', 60, 1000, 1, now=110), 20)
+
+    def test_unlimited_rate(self):
+        buckets = LocalBuckets()
+        for _ in range(3):
+            self.assertEqual(buckets.acquire('key', 0, 0, 10 ** 6, now=100), 0)
+
+
+@patch('libraries.rate_limiter.log_message')
+class TestRateLimiter(unittest.TestCase):
+
+    def limiter(self, redis_client=None):
+        with patch('libraries.rate_limiter.get_redis_client', return_value=redis_client):
+            limiter = RateLimiter()
+        # Keep the process-wide fallback buckets of other tests out
+        patcher = patch.object(RateLimiter, '_local', LocalBuckets())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return limiter
+
+    def test_buckets_in_redis(self, mock_log_message):
+        redis_client = MagicMock()
+        acquire_script = redis_client.register_script.return_value
+        acquire_script.return_value = b'0'
+        limiter = self.limiter(redis_client)
+
+        limiter.acquire('openai', 'gpt-4o', LIMITS, 600)
+
+        redis_client.register_script.assert_called_once_with(ACQUIRE_SCRIPT)
+        keys, args = acquire_script.call_args.kwargs['keys'], acquire_script.call_args.kwargs['args']
+        self.assertEqual(keys, [RateLimiter.bucket_key('openai', 'gpt-4o')])
+        self.assertEqual(args[1:], [60, 1000, 600])
+
+    @patch('libraries.rate_limiter.time.sleep')
+    def test_waits_as_told_by_redis(self, mock_sleep, mock_log_message):
+        redis_client = MagicMock()
+        redis_client.register_script.return_value.side_effect = [b'1.5', b'0']
+        limiter = self.limiter(redis_client)
+
+        limiter.acquire('openai', 'gpt-4o', LIMITS, 600)
+
+        mock_sleep.assert_called_once()
+        self.assertGreaterEqual(mock_sleep.call_args[0][0], 1.5)
+
+    @patch('libraries.rate_limiter.time.sleep')
+    def test_falls_back_to_local_buckets(self, mock_sleep, mock_log_message):
+        redis_client = MagicMock()
+        redis_client.register_script.return_value.side_effect = redis.ConnectionError('Connection refused')
+        limiter = self.limiter(redis_client)
+
+        # Limited in process while Redis cannot be reached
+        limiter.acquire('openai', 'gpt-4o', LIMITS, 600)
+        mock_sleep.assert_not_called()
+        self.assertIn(RateLimiter.bucket_key('openai', 'gpt-4o'), RateLimiter._local.buckets)
+
+        redis_client.hincrbyfloat.side_effect = redis.ConnectionError('Connection refused')
+        limiter.refund('openai', 'gpt-4o', 400)
+        levels = RateLimiter._local.buckets[RateLimiter.bucket_key('openai', 'gpt-4o')]['levels']
+        self.assertEqual(levels[1], 800)
+
+    def test_without_redis(self, mock_log_message):
+        limiter = self.limiter()
+        self.assertIsNone(limiter.redis_client)
+
+        limiter.acquire('openai', 'gpt-4o', LIMITS, 600)
+        limiter.block('openai', 'gpt-4o', 30)
+        self.assertGreater(RateLimiter._local.buckets[RateLimiter.bucket_key('openai', 'gpt-4o')]['blocked_until'], 0)
+
+    def test_block_in_redis(self, mock_log_message):
+        redis_client = MagicMock()
+        redis_client.hget.return_value = None
+        limiter = self.limiter(redis_client)
+
+        limiter.block('openai', 'gpt-4o', 30)
+
+        key, field, until = redis_client.hset.call_args[0]
+        self.assertEqual((key, field), (RateLimiter.bucket_key('openai', 'gpt-4o'), 'blocked_until'))
+        redis_client.expire.assert_called_once_with(key, 300)
+
+
+class TestBackoffDelay(unittest.TestCase):
+
+    def test_bounds(self):
+        for attempt in range(10):
+            self.assertLessEqual(backoff_delay(attempt, base=2, maximum=60), 60)
+        # Never shorter than the provider asked for
+        self.assertGreaterEqual(backoff_delay(0, retry_after=30, base=2, maximum=60), 30)
+
+
+@patch('libraries.utils.log_message')
+@patch('libraries.rate_limiter.get_rate_limiter')
+class TestSendPromptWithRateLimit(unittest.TestCase):
+
+    def send(self, send):
+        return send_prompt_with_rate_limit('openai', 'gpt-4o', LIMITS, 100, 500, send, lambda results: 50)
+
+    def test_results_and_refund(self, mock_get_rate_limiter, mock_log_message):
+        self.assertEqual(self.send(lambda: 'Generated'), 'Generated')
+        mock_get_rate_limiter.return_value.refund.assert_called_once_with('openai', 'gpt-4o', 450)
+
+    @patch.dict('os.environ', {'LLM_MAX_RETRIES': '2'})
+    def test_gives_up_when_rate_limited(self, mock_get_rate_limiter, mock_log_message):
+        send = MagicMock(side_effect=RateLimitError('Too many requests', retry_after=1))
+
+        # Raised for the task to be marked as failed, not completed without results
+        with self.assertRaises(RateLimitError):
+            self.send(send)
+        self.assertEqual(send.call_count, 3)
+        self.assertEqual(mock_get_rate_limiter.return_value.block.call_count, 2)
+
+    def test_empty_results(self, mock_get_rate_limiter, mock_log_message):
+        with self.assertRaises(ProviderError):
+            self.send(lambda: '')
+        mock_get_rate_limiter.return_value.refund.assert_called_once_with('openai', 'gpt-4o', 500)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import os
+import time
+import uuid
+import dill
+from datetime import datetime
+from bson import ObjectId
+from dotenv import load_dotenv
+from main.libraries.Cache import Cache
+from main.libraries.CacheCodec import CacheCodec
+
+load_dotenv()
+
+class BenchmarkCache:
+    command_name = 'benchmarkCache'
+
+    def run(self, args):
+        mode = args[0] if len(args) >= 1 else 'invalidate'
+
+        if mode == 'invalidate':
+            key_count = int(args[1]) if len(args) >= 2 else 1000
+            tag_count = int(args[2]) if len(args) >= 3 else 10
+            self.benchmark_invalidate(key_count, tag_count)
+        elif mode == 'codec':
+            scene_count = int(args[1]) if len(args) >= 2 else 100
+            self.benchmark_codec(scene_count)
+        else:
+            print('Usage: python3 src/cmd.py benchmarkCache invalidate [key_count] [tag_count]')
+            print('       python3 src/cmd.py benchmarkCache codec [scene_count]')
+
+    def benchmark_invalidate(self, key_count, tag_count):
+        """
+        Time tag invalidation of key_count cache entries spread across tag_count tags,
+        comparing the pipelined forget_by_tags against the previous per-key approach.
+        """
+        if os.getenv('CACHE_DISABLED') == '1':
+            print('Cache is disabled, unset CACHE_DISABLED to run this benchmark.')
+            return
+
+        cache = Cache()
+        tags = [f"benchmark_tag_{index}" for index in range(tag_count)]
+
+        for label, invalidate in (('per-key (legacy)', self.legacy_forget_by_tags), ('pipelined', cache.forget_by_tags)):
+            start = time.perf_counter()
+            for index in range(key_count):
+                cache.set(f"benchmark_key_{index}", {'index': index}, tags=[tags[index % tag_count], 'benchmark_all'])
+            populate_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            invalidate(tags)
+            invalidate_ms = (time.perf_counter() - start) * 1000
+
+            remaining = sum(1 for index in range(key_count) if cache.get(f"benchmark_key_{index}") is not None)
+            cache.forget_by_tags(['benchmark_all'])
+
+            print(f"{label}: set {key_count} keys in {populate_ms:.1f}ms, "
+                  f"invalidated {tag_count} tags in {invalidate_ms:.1f}ms, {remaining} keys left")
+
+    def legacy_forget_by_tags(self, tags):
+        """Replays the round trips of the previous SMEMBERS + per-key forget implementation."""
+        cache = Cache()
+        client = cache.redis_client
+        for tag in tags:
+            for hash_key in client.smembers(f"tag:{tag}"):
+                tags_key = cache.tags_key(hash_key.decode('utf-8'))
+                for member_tag in client.smembers(tags_key):
+                    client.srem(f"tag:{member_tag.decode('utf-8')}", hash_key)
+                    client.scard(f"tag:{member_tag.decode('utf-8')}")
+                client.delete(tags_key)
+                client.delete(hash_key)
+            if client.scard(f"tag:{tag}") == 0:
+                client.delete(f"tag:{tag}")
+
+    def benchmark_codec(self, scene_count, rounds=200):
+        """
+        Compare encode/decode time and size of cache codecs for a list_project_scenes
+        payload with scene_count scenes.
+        """
+        payload = [self.sample_scene(index) for index in range(scene_count)]
+
+        codecs = (
+            ('dill (legacy)', None),
+            ('msgpack', CacheCodec(codec='msgpack', compress_threshold=0)),
+            ('msgpack + zstd', CacheCodec(codec='msgpack', compress_threshold=1)),
+        )
+        for label, codec in codecs:
+            encode = codec.encode if codec else dill.dumps
+            decode = codec.decode if codec else dill.loads
+
+            start = time.perf_counter()
+            for _ in range(rounds):
+                encoded = encode(payload)
+            encode_us = (time.perf_counter() - start) / rounds * 1000000
+
+            start = time.perf_counter()
+            for _ in range(rounds):
+                decoded = decode(encoded)
+            decode_us = (time.perf_counter() - start) / rounds * 1000000
+
+            assert decoded == payload, f"{label} did not round trip"
+            print(f"{label}: {len(encoded)} bytes, encode {encode_us:.0f}us, decode {decode_us:.0f}us")
+
+    def sample_scene(self, index):
+        """A dictionary shaped like SceneTextModel._to_dict() with realistic text sizes."""
+        # Build distinct strings per scene, pickle would otherwise memoize shared ones
+        return {
+            'id': str(ObjectId()),
+            'project_id': str(ObjectId()),
+            'scene_key': str(uuid.uuid4()),
+            'title': f"Scene {index}: The confrontation on the pier",
+            'scene_order': index + 1,
+            'version_type': 'edit',
+            'source_version_number': 3,
+            'version_number': 4,
+            'version_label': None,
+            'text_seed': f"Our hero finally confronts smuggler #{index} at the end of the pier. " * 3,
+            'text_notes': f"Make the dialogue in scene {index} sharper and add more tension. " * 2,
+            'text_content': f"The fog rolls in over the water as footsteps echo on pier {index}. " * 30,
+            'character_count': 1950,
+            'llm_model': 'gpt-4o',
+            'created_at': datetime.utcnow(),
+            'created_by': str(ObjectId()),
+            'latest_beat_sheet_id': str(ObjectId()),
+            'latest_script_text_id': str(ObjectId()),
+        }
@@ -0,0 +1,149 @@
+import os
+import time
+import json
+import pika
+from types import SimpleNamespace
+from bson import ObjectId
+from dotenv import load_dotenv
+from main.libraries import QueueHelper as queue_helper_module
+from main.libraries.QueueHelper import QueueHelper
+
+load_dotenv()
+
+class BenchmarkQueue:
+    command_name = 'benchmarkQueue'
+
+    def run(self, args):
+        task_count = int(args[0]) if len(args) >= 1 else 1000
+        target = args[1] if len(args) >= 2 else 'memory'
+        round_trip_ms = float(args[2]) if len(args) >= 3 else 0.5
+
+        if target not in ('rabbitmq', 'memory'):
+            print('Usage: python3 src/cmd.py benchmarkQueue [task_count] [rabbitmq|memory] [round_trip_ms]')
+            return
+        if os.getenv('MOCK_QUEUE') == '1':
+            print('Queue is mocked, unset MOCK_QUEUE to run this benchmark.')
+            return
+
+        if target == 'memory':
+            # Stand in for the server, every round trip of the protocol costs round_trip_ms
+            print(f"In-memory RabbitMQ stand-in with {round_trip_ms}ms round trips")
+            memory_pika = MemoryPika(round_trip_ms)
+            queue_helper_module.pika = memory_pika
+            try:
+                self.benchmark_publish(task_count, memory_pika)
+            finally:
+                queue_helper_module.pika = pika
+        else:
+            print(f"RabbitMQ at {os.environ.get('RABBITMQ_HOST')}")
+            self.benchmark_publish(task_count, pika)
+
+    def benchmark_publish(self, task_count, pika_module):
+        """
+        Time publishing task_count tasks with a connection per task (the previous
+        publish_task), one by one over the persistent channel, and with publish_many.
+        The tasks go to a benchmark queue, which is deleted afterwards.
+        """
+        queue_name = 'benchmark_agent_task_queue'
+        tasks = [(ObjectId(), queue_name, None) for _ in range(task_count)]
+
+        def publish_each():
+            for task in tasks:
+                QueueHelper.publish_task(*task)
+
+        runs = (
+            ('connection per task (legacy)', lambda: [self.legacy_publish_task(pika_module, *task) for task in tasks]),
+            ('persistent publish_task', publish_each),
+            ('persistent publish_many', lambda: QueueHelper.publish_many(tasks)),
+        )
+        for label, publish in runs:
+            start = time.perf_counter()
+            publish()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            print(f"{label}: {task_count} tasks in {elapsed_ms:.1f}ms, {elapsed_ms * 1000 / task_count:.0f}us per task")
+
+        channel = QueueHelper._get_channel()
+        queued = channel.queue_declare(queue=queue_name, durable=True, passive=True).method.message_count
+        print(f"{queued} of {task_count * len(runs)} tasks queued")
+        channel.queue_delete(queue=queue_name)
+        QueueHelper._disconnect()
+
+    def legacy_publish_task(self, pika_module, task_id, queue_name, payload=None):
+        """Replays the previous QueueHelper.publish_task, connecting to the server for each task."""
+        connection = pika_module.BlockingConnection(pika_module.ConnectionParameters(host=os.environ.get('RABBITMQ_HOST')))
+        channel = connection.channel()
+        channel.queue_declare(queue=queue_name, durable=True)
+        channel.basic_publish(
+            exchange='',
+            routing_key=queue_name,
+            body=json.dumps({'task_id': str(task_id), 'task': payload} if payload else {'task_id': str(task_id)}),
+            properties=pika_module.BasicProperties(delivery_mode=2)
+        )
+        connection.close()
+
+
+class MemoryPika:
+    """
+    The parts of pika QueueHelper uses, keeping messages in memory. Calls waiting on
+    the server sleep for their round trips: connecting takes four (protocol header,
+    tune, connection open, channel open), closing one, and publishing one per message
+    with publisher confirms (none without).
+    """
+
+    exceptions = pika.exceptions
+    BasicProperties = pika.BasicProperties
+    ConnectionParameters = staticmethod(lambda **kwargs: kwargs)
+
+    def __init__(self, round_trip_ms):
+        self.round_trip = round_trip_ms / 1000
+        self.queues = {}
+
+    def wait(self, round_trips=1):
+        time.sleep(self.round_trip * round_trips)
+
+    def BlockingConnection(self, parameters):
+        self.wait(3)
+        return MemoryConnection(self)
+
+
+class MemoryConnection:
+    def __init__(self, server):
+        self.server = server
+        self.is_open = True
+
+    def channel(self):
+        self.server.wait()
+        return MemoryChannel(self.server)
+
+    def process_data_events(self, time_limit=0):
+        pass
+
+    def close(self):
+        self.server.wait()
+        self.is_open = False
+
+
+class MemoryChannel:
+    def __init__(self, server):
+        self.server = server
+        self.is_open = True
+        self.confirming = False
+
+    def queue_declare(self, queue, durable=False, passive=False):
+        self.server.wait()
+        messages = self.server.queues.setdefault(queue, [])
+        return SimpleNamespace(method=SimpleNamespace(message_count=len(messages)))
+
+    def queue_delete(self, queue):
+        self.server.wait()
+        self.server.queues.pop(queue, None)
+
+    def confirm_delivery(self):
+        self.server.wait()
+        self.confirming = True
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        if self.confirming:
+            # Waits for the server's confirm of the message
+            self.server.wait()
+        self.server.queues[routing_key].append(body)
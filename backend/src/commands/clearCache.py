@@ -1,5 +1,5 @@
 from main.libraries.Cache import Cache
-import redis
+from main.libraries.RedisConnection import RedisConnection
 import os
 from dotenv import load_dotenv
 
@@ -14,12 +14,12 @@ class ClearCache:
             return
 
         try:
-            redis_client = redis.Redis(
-                host=os.getenv("REDIS_HOST"),
-                port=os.getenv("REDIS_PORT"),
-                db=0
-            )
+            redis_client = RedisConnection.get_client()
             cache_prefix = f"{os.getenv('APP_ID', '')}cache_*"
+
+            # Drop the global tag index used by older releases, tags now live with each key
+            redis_client.delete("key_tags")
+
             keys = redis_client.keys(cache_prefix)
             if not keys:
                 print("No cache keys to clear.")
@@ -0,0 +1,76 @@
+import os
+from dotenv import load_dotenv
+from main.modules.SceneText.SceneTextModel import SceneTextModel
+from main.modules.BeatSheet.BeatSheetModel import BeatSheetModel
+from main.modules.ScriptText.ScriptTextModel import ScriptTextModel
+from main.modules.StoryText.StoryTextModel import StoryTextModel
+from main.modules.CharacterProfile.CharacterProfileModel import CharacterProfileModel
+from main.modules.LocationProfile.LocationProfileModel import LocationProfileModel
+
+load_dotenv()
+
+# Versioned models and the field shared by all versions of a document
+VERSIONED_MODELS = {
+    'scene_texts': (SceneTextModel, 'scene_key'),
+    'beat_sheets': (BeatSheetModel, 'scene_key'),
+    'script_texts': (ScriptTextModel, 'scene_key'),
+    'story_texts': (StoryTextModel, 'project_id'),
+    'character_profiles': (CharacterProfileModel, 'character_key'),
+    'location_profiles': (LocationProfileModel, 'location_key'),
+}
+
+class CompressVersions:
+    command_name = 'compressVersions'
+
+    def run(self, args):
+        expand = len(args) >= 1 and args[0] == 'expand'
+        collections = args[1:] if expand else args
+        collections = collections or list(VERSIONED_MODELS)
+
+        unknown = [collection for collection in collections if collection not in VERSIONED_MODELS]
+        if unknown:
+            print(f"Unknown collections: {', '.join(unknown)}")
+            print('Usage: python3 src/cmd.py compressVersions [expand] [collection ...]')
+            print(f"Collections: {', '.join(VERSIONED_MODELS)}")
+            return
+
+        if not expand and os.getenv('VERSION_DELTA_STORAGE') != '1':
+            print('Delta storage is disabled, set VERSION_DELTA_STORAGE=1 to compress versions.')
+            return
+
+        for collection in collections:
+            model, key_field = VERSIONED_MODELS[collection]
+            size_before = self.stored_size(model)
+            converted = self.expand(model) if expand else self.compress(model, key_field)
+            size_after = self.stored_size(model)
+            print(f"{collection}: {'expanded' if expand else 'compressed'} {converted} versions, "
+                  f"stored text {size_before} -> {size_after} bytes")
+
+    def compress(self, model, key_field):
+        """Store every version as a delta of the previous one, with periodic full snapshots."""
+        converted = 0
+        for key in model.objects.distinct(key_field):
+            previous = None
+            for version in model.objects(**{key_field: key}).order_by('version_number'):
+                if previous is not None and not version.text_delta:
+                    version.set_delta_base(previous.id)
+                    version.save()
+                    converted += 1 if version.text_delta else 0
+                previous = version
+        return converted
+
+    def expand(self, model):
+        """Store every delta version in full again, e.g. before turning delta storage off."""
+        converted = 0
+        for version in model.objects(text_delta__ne=None):
+            version.save()
+            converted += 1
+        return converted
+
+    def stored_size(self, model):
+        """Size of the stored (encrypted) text and delta fields of a collection."""
+        fields = model._meta.get('delta_fields', []) + ['text_delta']
+        total = 0
+        for document in model._get_collection().find({}, {field: 1 for field in fields}):
+            total += sum(len(document.get(field) or '') for field in fields)
+        return total
@@ -0,0 +1,46 @@
+import os
+import json
+import signal
+import pika
+from dotenv import load_dotenv
+from main.modules.AgentTask.AgentTaskService import AgentTaskService
+from main.libraries.functions import log_message
+
+load_dotenv()
+
+class ConsumeAgentResults:
+    command_name = 'consumeAgentResults'
+
+    def run(self, args):
+        """
+        Apply the status updates and results agents send on the agent_results queue
+        (with AGENT_RESULTS_VIA_QUEUE=1 on the agents), outside of the web workers.
+        Runs until stopped with SIGTERM or SIGINT.
+        """
+        queue_name = os.getenv('AGENT_RESULTS_QUEUE', 'agent_results')
+
+        connection = pika.BlockingConnection(pika.ConnectionParameters(host=os.environ.get('RABBITMQ_HOST')))
+        channel = connection.channel()
+        channel.queue_declare(queue=queue_name, durable=True)
+        channel.basic_qos(prefetch_count=int(os.getenv('AGENT_RESULTS_PREFETCH', 10)))
+
+        def on_message(channel, method, properties, body):
+            try:
+                AgentTaskService.apply_agent_result(json.loads(body))
+                channel.basic_ack(delivery_tag=method.delivery_tag)
+            except Exception as e:
+                # Retry once, in case the failure was passing, then drop the message
+                log_message('error', f'Error applying agent result (redelivered: {method.redelivered}): {e}')
+                channel.basic_nack(delivery_tag=method.delivery_tag, requeue=not method.redelivered)
+
+        def stop(signum, frame):
+            connection.add_callback_threadsafe(channel.stop_consuming)
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        channel.basic_consume(queue=queue_name, on_message_callback=on_message)
+        print(f'Consuming agent results from {queue_name}...')
+        channel.start_consuming()
+        connection.close()
+        print('Stopped consuming agent results.')
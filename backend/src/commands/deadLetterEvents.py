@@ -0,0 +1,57 @@
+import json
+from dotenv import load_dotenv
+from main.libraries.Event import Event
+from main.libraries.Observable import Observable
+from main.libraries.RedisConnection import RedisConnection
+from main.modules.AgentTask.AgentTaskModel import AgentTaskModel
+from main.modules.AgentTask.AgentTaskService import AgentTaskService
+
+load_dotenv()
+
+class DeadLetterEvents:
+    command_name = 'deadLetterEvents'
+
+    def run(self, args):
+        """List, replay or clear the events asynchronous listeners kept failing on (EVENTS_ASYNC=1)."""
+        mode = args[0] if len(args) >= 1 else 'list'
+        redis_client = RedisConnection.get_client()
+
+        if mode == 'list':
+            count = int(args[1]) if len(args) >= 2 else 20
+            entries = redis_client.lrange(Observable.dead_letter_key(), 0, count - 1)
+            if not entries:
+                print('No dead-letter events.')
+            for entry in entries:
+                print(json.dumps(json.loads(entry), indent=2))
+        elif mode == 'replay':
+            self.replay(redis_client)
+        elif mode == 'clear':
+            redis_client.delete(Observable.dead_letter_key())
+            print('Cleared dead-letter events.')
+        else:
+            print('Usage: python3 src/cmd.py deadLetterEvents list [count]')
+            print('       python3 src/cmd.py deadLetterEvents replay')
+            print('       python3 src/cmd.py deadLetterEvents clear')
+
+    def replay(self, redis_client):
+        """
+        Notify the agent task updates of the dead-letter list again, so the results of
+        completed tasks get applied. Replayed entries are removed from the list, entries
+        of other events are left for listing.
+        """
+        replayed = 0
+        for entry in redis_client.lrange(Observable.dead_letter_key(), 0, -1):
+            event = json.loads(entry)
+            if event['event_type'] != 'agent_task_updated':
+                continue
+
+            task = AgentTaskModel.objects(id=event['data'].get('task')).first()
+            if task:
+                AgentTaskService.task_events.notify(Event('agent_task_updated', {'task': task}))
+                print(f'Replayed agent_task_updated of task ID {task.id} ({task.status})')
+            else:
+                print(f"Task ID {event['data'].get('task')} not found, dropped")
+            redis_client.lrem(Observable.dead_letter_key(), 1, entry)
+            replayed += 1
+
+        print(f'Replayed {replayed} dead-letter event(s).')
@@ -0,0 +1,72 @@
+import os
+import time
+import threading
+import socketio
+from dotenv import load_dotenv
+from main.libraries.Websocket import Websocket
+from main.libraries.WebsocketRelay import WebsocketRelay
+
+load_dotenv()
+
+class LoadTestWebsocketServer:
+    command_name = 'loadTestWebsocketServer'
+
+    def run(self, args):
+        """
+        Broadcast message_count notifications over channel_count channels through Redis
+        and the websocket server, the way testWebsocketServer sends one, and report how
+        many a socket.io client received, the throughput and the latency.
+        """
+        message_count = int(args[0]) if len(args) >= 1 else 1000
+        channel_count = int(args[1]) if len(args) >= 2 else 10
+        url = args[2] if len(args) >= 3 else f"http://localhost:{os.getenv('WEBSOCKET_SERVER_PORT', 2053)}"
+
+        if os.getenv('MOCK_WEBSOCKETS') == '1':
+            print('Websockets are mocked, unset MOCK_WEBSOCKETS to run this load test.')
+            return
+
+        channels = [f"load-test-{index}" for index in range(channel_count)]
+        latencies = []
+        received = threading.Event()
+        lock = threading.Lock()
+
+        client = socketio.Client()
+
+        @client.on('message')
+        def on_message(notification):
+            # Coalesced broadcasts arrive as batches
+            notifications = notification.get('notifications', []) if notification.get('type') == 'batch' else [notification]
+            now = time.time()
+            with lock:
+                for load_test_notification in notifications:
+                    if load_test_notification.get('type') == 'load_test':
+                        latencies.append((now - load_test_notification['sent_at']) * 1000)
+                if len(latencies) >= message_count:
+                    received.set()
+
+        client.connect(url)
+        for channel in channels:
+            # One at a time, waiting for the server to handle each join
+            client.call('join', {'room': channel}, timeout=10)
+
+        websocket_util = Websocket()
+        start = time.perf_counter()
+        for index in range(message_count):
+            websocket_util.broadcast_message(channels[index % channel_count], {
+                'type': 'load_test', 'sequence': index, 'sent_at': time.time()
+            })
+        sent_seconds = time.perf_counter() - start
+
+        received.wait(timeout=max(10, message_count / 100))
+        elapsed = time.perf_counter() - start
+        client.disconnect()
+
+        with lock:
+            latencies = sorted(latencies)
+        print(f"Sent {message_count} notifications over {channel_count} channels in {sent_seconds * 1000:.0f}ms")
+        print(f"Received {len(latencies)} in {elapsed * 1000:.0f}ms, {len(latencies) / elapsed:.0f} notifications/s")
+        if latencies:
+            percentile = lambda fraction: latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+            print(f"Latency: p50 {percentile(0.5):.1f}ms, p95 {percentile(0.95):.1f}ms, max {latencies[-1]:.1f}ms")
+        for statistics in WebsocketRelay.get_statistics():
+            print(f"Relay statistics of the last interval: {statistics}")
@@ -0,0 +1,22 @@
+from dotenv import load_dotenv
+from main.modules.Project.ProjectModel import ProjectModel
+from main.modules.SceneText.SceneTextService import SceneTextService
+from main.modules.CharacterProfile.CharacterProfileService import CharacterProfileService
+from main.modules.LocationProfile.LocationProfileService import LocationProfileService
+
+load_dotenv()
+
+class RebalanceOrderKeys:
+    command_name = 'rebalanceOrderKeys'
+
+    def run(self, args):
+        """
+        Give every scene, character and location an order key, taken from the integer
+        order of its latest version if it has none yet, and respace the keys.
+        """
+        project_ids = args or [str(project.id) for project in ProjectModel.objects.only('id')]
+
+        for project_id in project_ids:
+            for heads in (SceneTextService.heads, CharacterProfileService.heads, LocationProfileService.heads):
+                heads.rebalance(project_id)
+            print(f"Rebalanced order keys of project {project_id}")
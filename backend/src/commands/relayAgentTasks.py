@@ -0,0 +1,47 @@
+import os
+import signal
+import time
+from dotenv import load_dotenv
+from main.modules.AgentTask.AgentTaskOutbox import AgentTaskOutbox
+from main.libraries.functions import log_message
+
+load_dotenv()
+
+class RelayAgentTasks:
+    command_name = 'relayAgentTasks'
+
+    def run(self, args):
+        """
+        Publish agent tasks from the outbox to the queue server, and re-queue stuck
+        tasks every AGENT_TASK_SWEEP_INTERVAL seconds. Runs until stopped with SIGTERM
+        or SIGINT, or once with: python3 src/cmd.py relayAgentTasks once
+        """
+        once = len(args) >= 1 and args[0] == 'once'
+        poll_interval = float(os.getenv('AGENT_TASK_OUTBOX_POLL_INTERVAL', 0.5))
+        sweep_interval = float(os.getenv('AGENT_TASK_SWEEP_INTERVAL', 60))
+        batch_size = int(os.getenv('AGENT_TASK_OUTBOX_BATCH', 100))
+
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+
+        if not once:
+            print('Relaying agent tasks from the outbox...')
+        last_sweep = 0
+        while not stopping:
+            try:
+                if time.monotonic() - last_sweep >= sweep_interval or once:
+                    last_sweep = time.monotonic()
+                    AgentTaskOutbox.sweep()
+
+                # Keep going while full batches come out of the outbox
+                while AgentTaskOutbox.relay(batch_size) >= batch_size and not stopping:
+                    pass
+            except Exception as e:
+                log_message('error', f'Error relaying agent tasks: {e}')
+
+            if once:
+                break
+            time.sleep(poll_interval)
+
+        print('Stopped relaying agent tasks.')
@@ -1,4 +1,5 @@
 from main.modules.AgentTask.AgentTaskService import AgentTaskService
+from main.libraries.QueueHelper import QueueHelper
 
 class ResetAgentTask:
     command_name = 'resetAgentTask'
@@ -8,11 +9,13 @@ class ResetAgentTask:
             print('No ID provided')
             return
 
-        task_id = args[0]
-        reset = AgentTaskService.reset_agent_task(task_id)
-        if reset:
-            print(f'Task ID {task_id} reset to queue!')
-        else:
-            print(f'Failed resetting task')
+        # Re-queue all given tasks together
+        with QueueHelper.batch():
+            for task_id in args:
+                reset = AgentTaskService.reset_agent_task(task_id)
+                if reset:
+                    print(f'Task ID {task_id} reset to queue!')
+                else:
+                    print(f'Failed resetting task {task_id}')
 
         return
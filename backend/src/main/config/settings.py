@@ -53,6 +53,12 @@ class settings():
         'auto': {'max_input_tokens': None, 'max_output_tokens': None},  # Auto settings can be decided at runtime
     }
 
+    # Provider serving the models of each name prefix, used to route agent tasks
+    llm_model_providers = {
+        'gpt-': 'openai',
+        'claude-': 'anthropic',
+    }
+
     # Default LLM model for each module
     default_llm_for_module = {
         StoryTextModel: llm_options['GPT-4o'][0],
@@ -1,20 +1,39 @@
-import dill as pickle  # Using dill as a drop-in replacement for pickle
-import redis
 import os
+import json
+import uuid
 import hashlib
 from dotenv import load_dotenv
 from main.libraries.functions import log_message
+from main.libraries.RedisConnection import RedisConnection
+from main.libraries.LocalCache import LocalCache
+from main.libraries.CacheCodec import CacheCodec
 
 load_dotenv()
 
+# Deletes a lock only if it is still held by the caller's token.
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
 class Cache:
+    # Suffix of the per-key set listing the tags of a cache entry
+    tags_suffix = ':tags'
+
+    # Process-wide lookup counters for the Redis tier (the L1 tier keeps its own)
+    redis_hits = 0
+    redis_misses = 0
+
     def __init__(self):
         if os.getenv('CACHE_DISABLED') != '1':
-            self.redis_client = redis.Redis(
-                host=os.getenv("REDIS_HOST"),
-                port=os.getenv("REDIS_PORT"),
-                db=0
-            )
+            # Share the process-wide pool instead of opening a new connection per instance
+            self.redis_client = RedisConnection.get_client()
+            self.release_lock_script = self.redis_client.register_script(RELEASE_LOCK_SCRIPT)
+            # Optional in-process tier in front of Redis, None unless CACHE_L1_ENABLED=1
+            self.local_cache = LocalCache.instance()
+            self.codec = CacheCodec()
         self.cache_prefix = f"{os.getenv('APP_ID', '')}cache_"
 
     def hashed_key(self, key):
@@ -22,26 +41,80 @@ class Cache:
         hash_object = hashlib.sha256(key.encode())
         return f"{self.cache_prefix}{hash_object.hexdigest()}"
 
+    def tags_key(self, hash_key):
+        """Name of the set holding the tags of a cache entry; it expires with the entry."""
+        return f"{hash_key}{self.tags_suffix}"
+
+    def lock_key(self, key):
+        """Name of the lock guarding the recomputation of a cache entry."""
+        return f"{self.hashed_key(key)}:lock"
+
+    def acquire_lock(self, key, timeout, strict=False):
+        """
+        Try to take a short lived lock on a cache key, so that a single process recomputes it.
+        The lock expires after timeout seconds in case its holder dies.
+
+        :param strict: Raise when Redis fails, for locks guarding writes which must not
+                       run unlocked. Strict locks need the cache to be enabled.
+        :return: A token to pass to release_lock(), or None if the lock is held elsewhere.
+                 If the cache is disabled or Redis fails a token is returned as well,
+                 so callers go ahead and compute the value themselves.
+        """
+        token = uuid.uuid4().hex
+        if os.getenv('CACHE_DISABLED') == '1':
+            return token #skip cache if disabled
+        try:
+            if self.redis_client.set(self.lock_key(key), token, nx=True, ex=timeout):
+                return token
+            return None
+        except Exception as e:
+            log_message('error', f"Error acquiring cache lock for {key}: {e}")
+            if strict:
+                raise
+            return token
+
+    def release_lock(self, key, token):
+        """Release a lock taken with acquire_lock(), unless it already expired and was taken over."""
+        if os.getenv('CACHE_DISABLED') == '1':
+            return True #skip cache if disabled
+        try:
+            self.release_lock_script(keys=[self.lock_key(key)], args=[token])
+            return True
+        except Exception as e:
+            log_message('error', f"Error releasing cache lock for {key}: {e}")
+            return False
+
     def set(self, key, value, timeout=None, tags=[]):
         """
-        Serialize a value with dill and set it in the cache.
+        Serialize a value with the cache codec and set it in the cache.
         Optionally, associate the cache entry with tags and set an expiration timeout.
+        The value and its tag bookkeeping are written in a single transaction.
         """
         if os.getenv('CACHE_DISABLED') == '1':
             return True #skip cache if disabled
         try:
             hash_key = self.hashed_key(key)
-            # Serialize the value with dill
-            value_serialized = pickle.dumps(value)
+            tags_key = self.tags_key(hash_key)
+            epoch = self.local_cache.epoch if self.local_cache else None
+            value_serialized = self.codec.encode(value)
+
+            pipe = self.redis_client.pipeline()
             if timeout:
-                self.redis_client.setex(hash_key, timeout, value_serialized)
+                pipe.setex(hash_key, timeout, value_serialized)
             else:
-                self.redis_client.set(hash_key, value_serialized)
+                pipe.set(hash_key, value_serialized)
 
+            pipe.delete(tags_key)
             if tags:
-               self.redis_client.hset("key_tags", hash_key, ",".join(tags))
-               for tag in tags:
-                   self.redis_client.sadd(f"tag:{tag}", hash_key)
+                pipe.sadd(tags_key, *tags)
+                if timeout:
+                    pipe.expire(tags_key, timeout)
+                for tag in tags:
+                    pipe.sadd(f"tag:{tag}", hash_key)
+            pipe.execute()
+
+            if self.local_cache:
+                self.local_cache.set(hash_key, value, len(value_serialized), tags, timeout, epoch)
 
             return True
         except Exception as e:
@@ -51,7 +124,9 @@ class Cache:
 
     def get(self, key, direct_key=False):
         """
-        Get a value from the cache and deserialize it using dill.
+        Get a value from the cache and deserialize it with the cache codec.
+        When the L1 tier is enabled it is checked first, and values read from
+        Redis are copied into it along with their tags and remaining TTL.
         """
         if os.getenv('CACHE_DISABLED') == '1':
             return None #skip cache if disabled
@@ -59,11 +134,34 @@ class Cache:
             hash_key = key
             if not direct_key:
                 hash_key = self.hashed_key(key)
-            value_serialized = self.redis_client.get(hash_key)
+
+            if self.local_cache:
+                found, value = self.local_cache.get(hash_key)
+                if found:
+                    return value
+
+                # Capture the epoch first, so an invalidation racing with this read is not undone
+                epoch = self.local_cache.epoch
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.get(hash_key)
+                pipe.smembers(self.tags_key(hash_key))
+                pipe.ttl(hash_key)
+                value_serialized, tags, ttl = pipe.execute()
+            else:
+                value_serialized = self.redis_client.get(hash_key)
+
             if value_serialized is None:
+                Cache.redis_misses += 1
                 return None
-            # Deserialize the value with dill
-            return pickle.loads(value_serialized)
+            Cache.redis_hits += 1
+
+            value = self.codec.decode(value_serialized)
+
+            if self.local_cache:
+                tags = [tag.decode('utf-8') for tag in tags]
+                self.local_cache.set(hash_key, value, len(value_serialized), tags, ttl if ttl > 0 else None, epoch)
+
+            return value
         except Exception as e:
             log_message('error', f"Error getting cache for {key}: {e}")
             return None
@@ -71,7 +169,7 @@ class Cache:
     def forget(self, key, direct_key=False):
         """
         Remove a key from the cache and disassociate it from any tags.
-        Includes cleanup step to delete tags with no keys associated.
+        Redis drops tag sets automatically once their last member is removed.
         """
         if os.getenv('CACHE_DISABLED') == '1':
             return True #skip cache if disabled
@@ -80,20 +178,11 @@ class Cache:
             if not direct_key:
                 hash_key = self.hashed_key(key)
 
-            # Retrieve the tags associated with this key
-            tags = self.redis_client.hget("key_tags", hash_key)
-            if tags:
-                tags = tags.decode('utf-8').split(",")
-                for tag in tags:
-                    self.redis_client.srem(f"tag:{tag}", hash_key)
-                    # Check if the tag set is now empty and delete it if so
-                    if self.redis_client.scard(f"tag:{tag}") == 0:
-                        self.redis_client.delete(f"tag:{tag}")
-                # Remove the key's tag associations from the hash
-                self.redis_client.hdel("key_tags", hash_key)
-
-            # Finally, delete the key itself
-            self.redis_client.delete(hash_key)
+            if self.local_cache:
+                self.local_cache.forget([hash_key])
+
+            # Other workers drop their L1 copy when the invalidation is published
+            self._delete_entries([hash_key], {}, json.dumps({'keys': [hash_key]}))
             return True
         except Exception as e:
             log_message('error', f"Error deleting cache for {key}: {e}")
@@ -114,20 +203,84 @@ class Cache:
     def forget_by_tags(self, tags=[]):
         """
         Clear all cache entries associated with any of the specified tags.
-        Enhanced logging for debugging.
+        Costs three round trips however many entries are tagged, see _delete_entries().
         """
         if os.getenv('CACHE_DISABLED') == '1':
             return True #skip cache if disabled
+        if not tags:
+            return True
         try:
-            for tag in tags:
-                keys_to_clear = self.redis_client.smembers(f"tag:{tag}")
-                for key in keys_to_clear:
-                    self.forget(key, direct_key=True)
-
-                # Check if the tag has any remaining members before attempting to delete
-                if self.redis_client.scard(f"tag:{tag}") == 0:
-                    self.redis_client.delete(f"tag:{tag}")
+            if self.local_cache:
+                self.local_cache.forget_by_tags(tags)
+
+            tag_keys = [f"tag:{tag}" for tag in tags]
+            pipe = self.redis_client.pipeline(transaction=False)
+            for tag_key in tag_keys:
+                pipe.smembers(tag_key)
+            memberships = {
+                tag_key: {member.decode('utf-8') for member in members}
+                for tag_key, members in zip(tag_keys, pipe.execute())
+            }
+
+            # Other workers drop their L1 copies when the invalidation is published
+            hash_keys = set().union(*memberships.values())
+            self._delete_entries(hash_keys, memberships, json.dumps({'tags': list(tags)}))
             return True
         except Exception as e:
             log_message('error', f"Error clearing cache by tags {tags}: {e}")
             return False
+
+    def _delete_entries(self, hash_keys, memberships, message):
+        """
+        Delete cache entries with their tag bookkeeping and publish the invalidation.
+
+        Only keys read beforehand are written, so this works with Redis Cluster and
+        replicates as plain commands: the tags of the entries are read first, then the
+        entries are deleted and removed from exactly those tag sets in one pipeline.
+        Tag sets lose only the members read, so an entry tagged in the meantime stays
+        reachable by the next invalidation, and Redis drops the sets left empty.
+
+        :param hash_keys: The hashed keys of the entries to delete.
+        :param memberships: Tag set keys ('tag:<name>') mapped to the hashed keys to remove from them.
+        :param message: The invalidation message for the L1 tier of other workers.
+        """
+        hash_keys = sorted(hash_keys)
+        memberships = {tag_key: set(members) for tag_key, members in memberships.items()}
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        for hash_key in hash_keys:
+            pipe.smembers(self.tags_key(hash_key))
+        for hash_key, member_tags in zip(hash_keys, pipe.execute()):
+            for member_tag in member_tags:
+                memberships.setdefault(f"tag:{member_tag.decode('utf-8')}", set()).add(hash_key)
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        for hash_key in hash_keys:
+            pipe.delete(hash_key)
+            pipe.delete(self.tags_key(hash_key))
+        for tag_key, members in memberships.items():
+            if members:
+                pipe.srem(tag_key, *members)
+        pipe.publish(LocalCache.invalidation_channel(), message)
+        pipe.execute()
+
+    @staticmethod
+    def get_statistics():
+        """
+        Report hit and miss counts for each cache tier of this process.
+        The Redis tier only sees lookups that missed the L1 tier.
+        """
+        redis_lookups = Cache.redis_hits + Cache.redis_misses
+        statistics = {
+            'redis': {
+                'hits': Cache.redis_hits,
+                'misses': Cache.redis_misses,
+                'hit_rate': round(Cache.redis_hits / redis_lookups, 4) if redis_lookups else None,
+            }
+        }
+
+        local_cache = LocalCache.instance()
+        if local_cache:
+            statistics['l1'] = local_cache.stats()
+
+        return statistics
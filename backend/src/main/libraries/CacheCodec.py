@@ -0,0 +1,126 @@
+import os
+import uuid
+import importlib
+from datetime import datetime, date
+import dill as pickle  # Only used for entries written by older releases or CACHE_CODEC=dill
+import msgpack
+import zstandard
+from bson import ObjectId
+from graphene import ObjectType
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# msgpack extension type codes
+EXT_DATETIME = 1
+EXT_DATE = 2
+EXT_OBJECT_ID = 3
+EXT_UUID = 4
+EXT_OBJECT_TYPE = 5
+
+class CacheCodec:
+    """
+    Serializes cache values to bytes and back.
+
+    Every encoded value starts with a version byte naming the format, so the
+    format can change without flushing the cache. Entries written before the
+    version byte existed are dill pickles (first byte 0x80). Loading pickles can
+    run arbitrary code, so they are only read with CACHE_CODEC=dill or while
+    CACHE_CODEC_LEGACY_READ=1 is set for a rollout, otherwise such entries are
+    misses and get recomputed.
+
+    The default msgpack format handles the plain data produced by _to_dict()
+    plus datetimes, ObjectIds, UUIDs and graphene ObjectType instances, and
+    refuses anything else rather than pickling arbitrary objects.
+    """
+
+    VERSION_DILL = 0x01
+    VERSION_MSGPACK = 0x02
+    VERSION_MSGPACK_ZSTD = 0x03
+
+    LEGACY_PICKLE_PREFIX = 0x80
+
+    def __init__(self, codec=None, compress_threshold=None, legacy_read=None):
+        """
+        :param codec: 'msgpack' (default) or 'dill', defaults to CACHE_CODEC.
+        :param compress_threshold: Payloads of at least this many bytes are zstd
+                                   compressed, 0 disables compression. Defaults to
+                                   CACHE_COMPRESS_THRESHOLD.
+        :param legacy_read: Whether dill entries may be loaded with the msgpack codec,
+                            defaults to CACHE_CODEC_LEGACY_READ (off).
+        """
+        self.codec = codec or os.getenv('CACHE_CODEC', 'msgpack')
+        if compress_threshold is None:
+            compress_threshold = int(os.getenv('CACHE_COMPRESS_THRESHOLD', 4096))
+        self.compress_threshold = compress_threshold
+        if legacy_read is None:
+            legacy_read = os.getenv('CACHE_CODEC_LEGACY_READ', '0') == '1'
+        self.legacy_read = legacy_read or self.codec == 'dill'
+
+    def encode(self, value):
+        if self.codec == 'dill':
+            return bytes([self.VERSION_DILL]) + pickle.dumps(value)
+
+        payload = msgpack.packb(value, default=self._default, use_bin_type=True)
+        if self.compress_threshold and len(payload) >= self.compress_threshold:
+            return bytes([self.VERSION_MSGPACK_ZSTD]) + zstandard.ZstdCompressor().compress(payload)
+        return bytes([self.VERSION_MSGPACK]) + payload
+
+    def decode(self, data):
+        version = data[0]
+        if version == self.VERSION_MSGPACK:
+            return self._unpack(data[1:])
+        if version == self.VERSION_MSGPACK_ZSTD:
+            return self._unpack(zstandard.ZstdDecompressor().decompress(data[1:]))
+        if version == self.VERSION_DILL and self.legacy_read:
+            return pickle.loads(data[1:])
+        if version == self.LEGACY_PICKLE_PREFIX and self.legacy_read:
+            return pickle.loads(data)
+        raise ValueError(f"Unsupported cache entry format: {version}")
+
+    def _unpack(self, payload):
+        return msgpack.unpackb(payload, ext_hook=self._ext_hook, raw=False, strict_map_key=False)
+
+    def _default(self, obj):
+        if isinstance(obj, datetime):
+            return msgpack.ExtType(EXT_DATETIME, obj.isoformat().encode())
+        if isinstance(obj, date):
+            return msgpack.ExtType(EXT_DATE, obj.isoformat().encode())
+        if isinstance(obj, ObjectId):
+            return msgpack.ExtType(EXT_OBJECT_ID, obj.binary)
+        if isinstance(obj, uuid.UUID):
+            return msgpack.ExtType(EXT_UUID, obj.bytes)
+        if isinstance(obj, ObjectType):
+            object_type = type(obj)
+            fields = {name: getattr(obj, name, None) for name in object_type._meta.fields}
+            packed = [object_type.__module__, object_type.__qualname__, fields]
+            return msgpack.ExtType(EXT_OBJECT_TYPE, msgpack.packb(packed, default=self._default, use_bin_type=True))
+        if isinstance(obj, (set, frozenset, tuple)):
+            return list(obj)
+        raise TypeError(f"Cannot cache value of type {type(obj).__name__}")
+
+    def _ext_hook(self, code, data):
+        if code == EXT_DATETIME:
+            return datetime.fromisoformat(data.decode())
+        if code == EXT_DATE:
+            return date.fromisoformat(data.decode())
+        if code == EXT_OBJECT_ID:
+            return ObjectId(data)
+        if code == EXT_UUID:
+            return uuid.UUID(bytes=data)
+        if code == EXT_OBJECT_TYPE:
+            module_name, qualname, fields = self._unpack(data)
+            return self._load_object_type(module_name, qualname)(**fields)
+        return msgpack.ExtType(code, data)
+
+    @staticmethod
+    def _load_object_type(module_name, qualname):
+        """Resolve a GraphQL ObjectType class, refusing anything outside our own modules."""
+        if not module_name.startswith('main.modules.'):
+            raise ValueError(f"Refusing to load type from module {module_name}")
+        object_type = importlib.import_module(module_name)
+        for name in qualname.split('.'):
+            object_type = getattr(object_type, name)
+        if not (isinstance(object_type, type) and issubclass(object_type, ObjectType)):
+            raise ValueError(f"{module_name}.{qualname} is not a GraphQL ObjectType")
+        return object_type
@@ -0,0 +1,190 @@
+import os
+import json
+import zlib
+import base64
+import difflib
+from mongoengine import ObjectIdField, IntField, StringField
+from dotenv import load_dotenv
+from main.libraries.EncryptedDocument import EncryptedDocument
+from main.libraries.LocalCache import LocalCache
+from main.libraries.functions import encrypt_text, decrypt_text
+
+load_dotenv()
+
+# Recently reconstructed versions, keyed by '<collection>:<id>'. Versions never change
+# text once stored, and saving a version evicts it, so entries do not go stale.
+reconstructed_versions = LocalCache(
+    max_bytes=int(os.getenv('VERSION_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+    max_entry_bytes=int(os.getenv('VERSION_CACHE_MAX_BYTES', 32 * 1024 * 1024)) // 8,
+    ttl=3600
+)
+
+
+def encode_delta(base_texts, texts):
+    """
+    Encode the changes from base_texts to texts as a compressed, line based delta.
+
+    Fields that did not change are left out, fields without a usable base are stored
+    as is, and the others as a list of [start, end] line ranges copied from the base
+    and strings of inserted text.
+    """
+    delta = {}
+    for field, text in texts.items():
+        base = base_texts.get(field)
+        if text == base:
+            continue
+        if text is None or not base:
+            delta[field] = text
+            continue
+
+        base_lines = base.splitlines(keepends=True)
+        lines = text.splitlines(keepends=True)
+        operations = []
+        matcher = difflib.SequenceMatcher(None, base_lines, lines, autojunk=False)
+        for tag, base_start, base_end, start, end in matcher.get_opcodes():
+            if tag == 'equal':
+                operations.append([base_start, base_end])
+            elif end > start:
+                operations.append(''.join(lines[start:end]))
+        delta[field] = operations
+
+    return base64.b64encode(zlib.compress(json.dumps(delta).encode('utf-8'))).decode('utf-8')
+
+
+def apply_delta(base_texts, encoded_delta):
+    """Rebuild the texts of a version from the texts of its base and encode_delta() output."""
+    delta = json.loads(zlib.decompress(base64.b64decode(encoded_delta)))
+    texts = dict(base_texts)
+    for field, operations in delta.items():
+        if not isinstance(operations, list):
+            texts[field] = operations
+            continue
+
+        base_lines = (base_texts.get(field) or '').splitlines(keepends=True)
+        texts[field] = ''.join(
+            ''.join(base_lines[operation[0]:operation[1]]) if isinstance(operation, list) else operation
+            for operation in operations
+        )
+    return texts
+
+
+class DeltaVersionedDocument(EncryptedDocument):
+    """
+    EncryptedDocument for versioned texts that can store a version as a compressed
+    forward delta of the version it was created from, instead of a full copy.
+
+    The text fields listed in meta['delta_fields'] are rebuilt when a document is
+    loaded, so callers always see full texts. With VERSION_DELTA_STORAGE=1 new versions
+    are stored as deltas, with a full snapshot at least every VERSION_SNAPSHOT_INTERVAL
+    versions; any other save stores the document in full.
+
+    Attributes:
+        delta_base (ObjectIdField): The version the delta applies to, None for full snapshots.
+        delta_depth (IntField): The number of deltas between this version and a full snapshot.
+        text_delta (StringField): The encrypted delta.
+    """
+
+    meta = {'abstract': True}
+
+    delta_base = ObjectIdField()
+    delta_depth = IntField(default=0)
+    text_delta = StringField()
+
+    @staticmethod
+    def delta_storage_enabled():
+        return os.getenv('VERSION_DELTA_STORAGE') == '1'
+
+    def set_delta_base(self, base_id):
+        """
+        Store this new version as a delta of another version when it is saved,
+        if delta storage is enabled.
+
+        :param base_id: The ID of the version this one was created from.
+        """
+        self._pending_delta_base = base_id
+
+    @classmethod
+    def _cache_key(cls, document_id):
+        return f"{cls._get_collection_name()}:{document_id}"
+
+    @classmethod
+    def _remember(cls, document):
+        texts = {field: getattr(document, field, None) for field in cls._meta.get('delta_fields', [])}
+        value = (texts, document.delta_depth or 0)
+        reconstructed_versions.set(cls._cache_key(document.id), value, size=sum(len(text or '') for text in texts.values()))
+        return value
+
+    @classmethod
+    def load_texts(cls, document_id):
+        """
+        Load the full texts of a stored version.
+
+        :param document_id: The ID of the version.
+        :return: A ({field: text}, delta_depth) tuple.
+        """
+        found, value = reconstructed_versions.get(cls._cache_key(document_id))
+        if found:
+            return value
+
+        document = cls.objects(id=document_id).first()
+        if document is None:
+            raise ValueError(f"{cls.__name__} version {document_id} does not exist")
+        return cls._remember(document)
+
+    @classmethod
+    def pre_save(cls, sender, document, **kwargs):
+        delta_fields = document._meta.get('delta_fields', [])
+        texts = {field: getattr(document, field, None) for field in delta_fields}
+
+        if document.id:
+            # The texts as loaded, or as stored when this instance was not loaded from the database
+            stored_texts = getattr(document, '_stored_texts', None)
+            document._stored_texts = None
+            if stored_texts is None:
+                stored = cls.objects(id=document.id).first()
+                stored_texts = {field: getattr(stored, field, None) for field in delta_fields} if stored else texts
+            if stored_texts != texts:
+                # Versions stored as deltas of this one need the old texts, store them in full first.
+                # Deltas stay readable after VERSION_DELTA_STORAGE is turned off, so this runs either way.
+                for dependent in cls.objects(delta_base=document.id):
+                    dependent.save()
+            reconstructed_versions.forget([cls._cache_key(document.id)])
+
+        base_id = getattr(document, '_pending_delta_base', None)
+        document._pending_delta_base = None
+
+        delta = None
+        if base_id and cls.delta_storage_enabled():
+            base_texts, base_depth = cls.load_texts(base_id)
+            if base_depth + 1 < int(os.getenv('VERSION_SNAPSHOT_INTERVAL', 10)):
+                delta = encode_delta(base_texts, texts)
+                # Not worth it when most of the text changed
+                if len(delta) >= sum(len(text or '') for text in texts.values()):
+                    delta = None
+
+        if delta:
+            document.delta_base = base_id
+            document.delta_depth = base_depth + 1
+            document.text_delta = encrypt_text(delta)
+            for field in delta_fields:
+                setattr(document, field, None)
+        else:
+            document.delta_base = None
+            document.delta_depth = 0
+            document.text_delta = None
+
+        super().pre_save(sender, document, **kwargs)
+
+    @classmethod
+    def post_init(cls, sender, document, **kwargs):
+        super().post_init(sender, document, **kwargs)
+
+        if document.text_delta and document.delta_base:
+            base_texts, base_depth = cls.load_texts(document.delta_base)
+            texts = apply_delta(base_texts, decrypt_text(document.text_delta))
+            for field, text in texts.items():
+                setattr(document, field, text)
+            cls._remember(document)
+
+        if document.id:
+            document._stored_texts = {field: getattr(document, field, None) for field in document._meta.get('delta_fields', [])}
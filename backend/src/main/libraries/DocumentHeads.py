@@ -0,0 +1,497 @@
+import os
+import time
+import uuid
+import functools
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from bson import ObjectId
+from mongoengine import Document, StringField, ObjectIdField, IntField, DateTimeField, NotUniqueError, Q
+from mongoengine.errors import BulkWriteError
+from main.libraries.OrderKeys import key_between, spread_keys
+from main.libraries.Cache import Cache
+from main.libraries.functions import log_message
+
+
+class DocumentHeadModel(Document):
+    """
+    DocumentHeadModel points at the current version of a versioned document.
+
+    Attributes:
+        document_type (StringField): The collection of the versioned documents, e.g. 'scene_texts'.
+        key (StringField): The key shared by all versions, e.g. a scene key or project ID.
+        head_id (ObjectIdField): The ID of the current version.
+        head_version (IntField): The version number of the current version.
+        version_counter (IntField): The highest version number handed out so far.
+        parent_key (StringField): The parent the document is ordered within, e.g. a project ID.
+        order_key (StringField): The fractional order key of the document within its parent.
+        updated_at (DateTimeField): The timestamp of the last head change.
+    """
+
+    meta = {
+        'collection': 'document_heads',
+        'indexes': [
+            {'fields': ['document_type', 'key'], 'unique': True},
+            ('document_type', 'parent_key', 'order_key'),
+        ],
+    }
+
+    document_type = StringField(required=True)
+    key = StringField(required=True)
+    head_id = ObjectIdField()
+    head_version = IntField(default=0)
+    version_counter = IntField(default=0)
+    parent_key = StringField()
+    order_key = StringField()
+    updated_at = DateTimeField(default=datetime.utcnow)
+
+
+class DocumentLockModel(Document):
+    """
+    DocumentLockModel is a lock held in MongoDB, for the order locks of DocumentHeads
+    while the cache is disabled, see DocumentHeads.ordering().
+
+    Attributes:
+        key (StringField): The name of the lock.
+        token (StringField): The token of the holder, which releases it.
+        expires_at (DateTimeField): When the lock may be taken over, in case its holder died.
+    """
+
+    meta = {
+        'collection': 'document_locks',
+        'indexes': [
+            {'fields': ['key'], 'unique': True},
+            {'fields': ['expires_at'], 'expireAfterSeconds': 0},
+        ],
+    }
+
+    key = StringField(required=True)
+    token = StringField(required=True)
+    expires_at = DateTimeField(required=True)
+
+
+class DocumentHeads:
+    """
+    Tracks the head (latest version) of the documents of one versioned model,
+    so services can load it by ID instead of sorting all versions, and hands out
+    version numbers atomically so concurrent new versions never share a number.
+
+    Keys written before heads existed are picked up from the versions on first use.
+
+    Documents ordered within a parent, such as the scenes of a project, also keep their
+    position here as a fractional order key, so moving a document writes only its head
+    instead of renumbering every version of every other document. Keys that grow too
+    long are respaced in the background.
+
+    Reads of the order only look at the heads. Documents written before order keys
+    get theirs from the first write placing a document within their parent, or from
+    the rebalanceOrderKeys command. Writes of order keys within a parent hold its
+    order lock, see ordering().
+    """
+
+    def __init__(self, model, key_field, parent_field=None, order_field=None):
+        """
+        :param model: The versioned document class, e.g. SceneTextModel.
+        :param key_field: The field shared by all versions of a document, e.g. 'scene_key'.
+        :param parent_field: The field documents are ordered within, e.g. 'project_id' (optional).
+        :param order_field: The integer order field of documents written before order keys, e.g. 'scene_order' (optional).
+        """
+        self.model = model
+        self.key_field = key_field
+        self.parent_field = parent_field
+        self.order_field = order_field
+
+    @property
+    def document_type(self):
+        return self.model._get_collection_name()
+
+    @staticmethod
+    def _key(key):
+        # Accept UUIDs, ObjectIds and referenced documents alike
+        if not isinstance(key, (str, uuid.UUID)):
+            key = getattr(key, 'id', key)
+        return str(key)
+
+    def _heads(self, key):
+        return DocumentHeadModel.objects(document_type=self.document_type, key=self._key(key))
+
+    def _latest_version(self, key):
+        return self.model.objects(**{self.key_field: key}).order_by('-version_number').first()
+
+    def get(self, key):
+        """
+        Load the current version of a document.
+
+        :param key: The key shared by all versions.
+        :return: The latest version, or None if the document has no versions.
+        """
+        head = self._heads(key).first()
+        if head and head.head_id:
+            document = self.model.objects(id=head.head_id).first()
+            if document:
+                return document
+
+        # No head yet, or it points at a deleted version
+        document = self._latest_version(key)
+        if document:
+            self.advance(key, document)
+        return document
+
+    def next_version_number(self, key):
+        """
+        Atomically allocate the next version number of a document.
+
+        :param key: The key shared by all versions.
+        :return: A version number no other caller will receive.
+        """
+        head = self._heads(key).modify(new=True, inc__version_counter=1, set__updated_at=datetime.utcnow())
+        if head:
+            return head.version_counter
+
+        # Seed the counter from the existing versions, then allocate from it
+        latest = self._latest_version(key)
+        try:
+            DocumentHeadModel(
+                document_type=self.document_type,
+                key=self._key(key),
+                head_id=latest.id if latest else None,
+                head_version=latest.version_number if latest else 0,
+                version_counter=latest.version_number if latest else 0,
+            ).save(force_insert=True)
+        except NotUniqueError:
+            pass  # Another request seeded it first
+        return self.next_version_number(key)
+
+    def advance(self, key, document):
+        """
+        Point the head at a newly saved version, unless a newer version got there first.
+
+        :param key: The key shared by all versions.
+        :param document: The saved version.
+        """
+        try:
+            DocumentHeadModel.objects(
+                document_type=self.document_type,
+                key=self._key(key),
+                head_version__lt=document.version_number
+            ).update_one(
+                upsert=True,
+                set__head_id=document.id,
+                set__head_version=document.version_number,
+                max__version_counter=document.version_number,
+                set__updated_at=datetime.utcnow()
+            )
+        except NotUniqueError:
+            pass  # The head already points at a newer version
+
+    def reset(self, key, document, parent=None, order_key=None):
+        """
+        Make a document the head and restart the counter at its version number,
+        for new documents and for rebases, which delete every other version.
+
+        :param key: The key shared by all versions.
+        :param document: The saved version.
+        :param parent: The parent of a new ordered document (optional).
+        :param order_key: The order key of a new ordered document, see new_order_key() (optional).
+        """
+        order = {'set__parent_key': self._key(parent), 'set__order_key': order_key} if order_key else {}
+        self._heads(key).update_one(
+            upsert=True,
+            set__head_id=document.id,
+            set__head_version=document.version_number,
+            set__version_counter=document.version_number,
+            set__updated_at=datetime.utcnow(),
+            **order
+        )
+        if order_key:
+            self._check_order_key(parent, order_key)
+
+    def reset_many(self, documents, parent=None, order_keys=None):
+        """
+        reset() for many new documents, with a single bulk insert.
+
+        :param documents: The saved versions of new documents, one per key.
+        :param parent: The parent of new ordered documents (optional).
+        :param order_keys: The order keys of new ordered documents, in the order of documents (optional).
+        """
+        if not documents:
+            return
+
+        order_keys = order_keys or [None] * len(documents)
+        heads = [
+            DocumentHeadModel(
+                document_type=self.document_type,
+                key=self._key(getattr(document, self.key_field)),
+                head_id=document.id,
+                head_version=document.version_number,
+                version_counter=document.version_number,
+                parent_key=self._key(parent) if order_key else None,
+                order_key=order_key
+            ) for document, order_key in zip(documents, order_keys)
+        ]
+        try:
+            DocumentHeadModel.objects.insert(heads, load_bulk=False)
+        except (NotUniqueError, BulkWriteError):
+            # Some keys already had a head, reset them one by one instead
+            for document, order_key in zip(documents, order_keys):
+                self._heads(getattr(document, self.key_field)).update_one(
+                    upsert=True,
+                    set__head_id=document.id,
+                    set__head_version=document.version_number,
+                    set__version_counter=document.version_number,
+                    set__updated_at=datetime.utcnow(),
+                    **({'set__parent_key': self._key(parent), 'set__order_key': order_key} if order_key else {})
+                )
+
+    def forget(self, keys):
+        """
+        Remove the heads of deleted documents.
+
+        :param keys: The keys of the deleted documents.
+        """
+        DocumentHeadModel.objects(document_type=self.document_type, key__in=[self._key(key) for key in keys]).delete()
+
+    def _parent_documents(self, parent):
+        return self.model.objects(**{self.parent_field: ObjectId(self._key(parent))})
+
+    def _ordered_heads(self, parent):
+        # Deleting a document drops its head (see forget()), so these are the live documents
+        return DocumentHeadModel.objects(document_type=self.document_type, parent_key=self._key(parent), order_key__ne=None)
+
+    def ordered_keys(self, parent):
+        """
+        List the keys of the documents within a parent in order, from their heads only.
+        Documents without an order key yet are left out, see seed_order_keys().
+
+        :param parent: The parent, e.g. a project ID.
+        :return: A list of (key, order_key) tuples, sorted by order key.
+        """
+        heads = self._ordered_heads(parent).order_by('order_key', 'key').only('key', 'order_key')
+        return [(head.key, head.order_key) for head in heads]
+
+    @contextmanager
+    def ordering(self, parent):
+        """
+        Hold the order lock of a parent, so order keys are generated and written without
+        a move or rebalance of the same parent in between. Callers placing new documents
+        hold it from new_order_key() until reset(), move() and rebalance() take it themselves.
+        Waits up to ORDER_KEY_LOCK_WAIT seconds for the lock.
+
+        The lock is held in Redis, and in MongoDB while the cache is disabled. Writes of
+        the order fail rather than run unlocked when Redis cannot be reached.
+
+        :param parent: The parent, e.g. a project ID.
+        """
+        lock_key = f"order_keys:{self.document_type}:{self._key(parent)}"
+        deadline = time.monotonic() + float(os.getenv('ORDER_KEY_LOCK_WAIT', 5))
+        release = self._acquire_order_lock(lock_key, 30)
+        while not release:
+            if time.monotonic() >= deadline:
+                raise ValueError(f"The order of {self.document_type} in {self._key(parent)} is being changed, please try again")
+            time.sleep(0.05)
+            release = self._acquire_order_lock(lock_key, 30)
+        try:
+            yield
+        finally:
+            release()
+
+    def _acquire_order_lock(self, lock_key, timeout):
+        # Returns the function releasing the lock, or None while it is held elsewhere
+        if os.getenv('CACHE_DISABLED') == '1':
+            log_message('info', f"Cache disabled, taking the order lock {lock_key} in MongoDB")
+            return self._acquire_database_lock(lock_key, timeout)
+
+        cache = Cache()
+        try:
+            token = cache.acquire_lock(lock_key, timeout, strict=True)
+        except Exception as e:
+            raise ValueError(f"The order of {self.document_type} cannot be changed right now, please try again") from e
+        return functools.partial(cache.release_lock, lock_key, token) if token else None
+
+    @staticmethod
+    def _acquire_database_lock(lock_key, timeout):
+        token = uuid.uuid4().hex
+        now = datetime.utcnow()
+        try:
+            # Inserts the lock, or takes over an expired one; a held lock fails the unique key
+            DocumentLockModel.objects(key=lock_key, expires_at__lte=now).update_one(
+                upsert=True,
+                set__token=token,
+                set__expires_at=now + timedelta(seconds=timeout)
+            )
+        except NotUniqueError:
+            return None
+        return lambda: DocumentLockModel.objects(key=lock_key, token=token).delete()
+
+    def seed_order_keys(self, parent):
+        """
+        Give the documents within a parent that have no order key yet one, after the others,
+        by their integer order, and take the order keys of heads without documents back.
+        Only for writes holding the order lock, reads never write order keys.
+
+        :param parent: The parent, e.g. a project ID.
+        :return: The ordered keys within the parent, see ordered_keys().
+        """
+        ordered = self.ordered_keys(parent)
+        keys = {self._key(key) for key in self._parent_documents(parent).distinct(self.key_field)}
+
+        stale = [key for key, _ in ordered if key not in keys]
+        if stale:
+            DocumentHeadModel.objects(document_type=self.document_type, key__in=stale).update(unset__parent_key=True, unset__order_key=True)
+            ordered = [(key, order_key) for key, order_key in ordered if key in keys]
+
+        missing = keys - {key for key, _ in ordered}
+        if missing:
+            ordered += self._seed_order_keys(parent, missing, ordered[-1][1] if ordered else None)
+        return ordered
+
+    def _seed_order_keys(self, parent, keys, last_order_key):
+        # Order by the integer order of the latest versions, as before order keys existed
+        order_field = self.model._fields[self.order_field].db_field if self.order_field else None
+        latest_versions = self._parent_documents(parent).aggregate([
+            {'$sort': {self.key_field: 1, 'version_number': -1}},
+            {'$group': {
+                '_id': f"${self.key_field}",
+                'order': {'$first': f"${order_field}" if order_field else None},
+                'created_at': {'$first': '$created_at'},
+            }},
+        ])
+        legacy_order = {
+            self._key(version['_id']): (version['order'] is None, version['order'] or 0, version['created_at'] or datetime.min)
+            for version in latest_versions
+        }
+        keys = sorted(keys, key=lambda key: legacy_order.get(key, (True, 0, datetime.min)))
+
+        order_keys = self._append_order_keys(last_order_key, len(keys))
+        for key, order_key in zip(keys, order_keys):
+            self._heads(key).update_one(upsert=True, set__parent_key=self._key(parent), set__order_key=order_key)
+        return list(zip(keys, order_keys))
+
+    @staticmethod
+    def _append_order_keys(last_order_key, count):
+        if last_order_key is None:
+            return spread_keys(count)
+
+        order_keys = []
+        for _ in range(count):
+            last_order_key = key_between(last_order_key, None)
+            order_keys.append(last_order_key)
+        return order_keys
+
+    def positions(self, parent):
+        """
+        :param parent: The parent, e.g. a project ID.
+        :return: A dictionary of the 1-based position of every document key within the parent.
+        """
+        return {key: index + 1 for index, (key, _) in enumerate(self.ordered_keys(parent))}
+
+    def position(self, parent, key):
+        """
+        :param parent: The parent, e.g. a project ID.
+        :param key: The key of a document within the parent.
+        :return: The 1-based position of the document within the parent, None if it has no order key yet.
+        """
+        head = self._heads(key).only('key', 'parent_key', 'order_key').first()
+        if not head or not head.order_key or head.parent_key != self._key(parent):
+            return None
+
+        # Counted the way ordered_keys() sorts, by order key and then key
+        return self._ordered_heads(parent).filter(
+            Q(order_key__lt=head.order_key) | Q(order_key=head.order_key, key__lt=head.key)
+        ).count() + 1
+
+    def new_order_key(self, parent, after=None):
+        """
+        Generate the order key of a new document, to be stored with reset()
+        while holding the order lock of the parent, see ordering().
+
+        :param parent: The parent, e.g. a project ID.
+        :param after: The position of the document to place it after, 0 for the start and None for the end.
+        :return: A (order_key, position) tuple.
+        """
+        ordered = self.seed_order_keys(parent)
+        index = len(ordered) if after is None else max(0, min(after, len(ordered)))
+        order_key = key_between(
+            ordered[index - 1][1] if index > 0 else None,
+            ordered[index][1] if index < len(ordered) else None
+        )
+        return order_key, index + 1
+
+    def new_order_keys(self, parent, count):
+        """
+        Generate the order keys of new documents placed at the end, in order, to be
+        stored with reset_many() while holding the order lock of the parent.
+
+        :param parent: The parent, e.g. a project ID.
+        :param count: The number of new documents.
+        :return: A (order_keys, first_position) tuple.
+        """
+        ordered = self.seed_order_keys(parent)
+        return self._append_order_keys(ordered[-1][1] if ordered else None, count), len(ordered) + 1
+
+    def move(self, parent, key, position):
+        """
+        Move a document to a new position within its parent, writing only its head.
+
+        :param parent: The parent, e.g. a project ID.
+        :param key: The key of the document to move.
+        :param position: The new 1-based position, limited to the number of documents.
+        :return: The new position.
+        """
+        key = self._key(key)
+        with self.ordering(parent):
+            ordered = self.seed_order_keys(parent)
+            others = [(other, order_key) for other, order_key in ordered if other != key]
+            position = max(1, min(position, len(others) + 1))
+            if position - 1 < len(ordered) and ordered[position - 1][0] == key:
+                return position  # Already there
+
+            order_key = key_between(
+                others[position - 2][1] if position > 1 else None,
+                others[position - 1][1] if position <= len(others) else None
+            )
+            self._heads(key).update_one(
+                upsert=True,
+                set__parent_key=self._key(parent),
+                set__order_key=order_key,
+                set__updated_at=datetime.utcnow()
+            )
+        self._check_order_key(parent, order_key)
+        return position
+
+    def rebalance(self, parent):
+        """
+        Replace the order keys within a parent by short, evenly spaced keys,
+        keeping the order, under the order lock of the parent.
+
+        :param parent: The parent, e.g. a project ID.
+        """
+        with self.ordering(parent):
+            ordered = self.seed_order_keys(parent)
+            for (key, _), order_key in zip(ordered, spread_keys(len(ordered))):
+                self._heads(key).update_one(set__order_key=order_key)
+
+    def _check_order_key(self, parent, order_key):
+        # Keys grow when documents are inserted at the same spot over and over
+        if len(order_key) <= int(os.getenv('ORDER_KEY_REBALANCE_LENGTH', 16)):
+            return
+        threading.Thread(
+            target=self._rebalance_in_background,
+            args=(self._key(parent),),
+            name='order-key-rebalancer',
+            daemon=True
+        ).start()
+
+    def _rebalance_in_background(self, parent):
+        cache = Cache()
+        lock_key = f"order_key_rebalance:{self.document_type}:{parent}"
+        token = cache.acquire_lock(lock_key, 60)
+        if not token:
+            return  # Another process is rebalancing this parent
+        try:
+            self.rebalance(parent)
+            log_message('info', f"Rebalanced the {self.document_type} order keys of {parent}")
+        except Exception as e:
+            log_message('error', f"Failed to rebalance the {self.document_type} order keys of {parent}: {str(e)}")
+        finally:
+            cache.release_lock(lock_key, token)
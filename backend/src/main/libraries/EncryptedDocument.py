@@ -4,8 +4,9 @@ from main.libraries.functions import encrypt_text, decrypt_text
 class EncryptedDocumentMeta(type(Document)):
     def __new__(cls, name, bases, attrs):
         new_class = super(EncryptedDocumentMeta, cls).__new__(cls, name, bases, attrs)
-        if name != 'EncryptedDocument':  # Prevent connecting signals to the abstract base class
+        if not new_class._meta.get('abstract'):  # Prevent connecting signals to the abstract base classes
             signals.pre_save.connect(new_class.pre_save, sender=new_class)
+            signals.pre_bulk_insert.connect(new_class.pre_bulk_insert, sender=new_class)
             signals.post_init.connect(new_class.post_init, sender=new_class)
         return new_class
 
@@ -21,6 +22,12 @@ class EncryptedDocument(Document, metaclass=EncryptedDocumentMeta):
                 encrypted_value = encrypt_text(original_value)
                 setattr(document, field, encrypted_value)
 
+    @classmethod
+    def pre_bulk_insert(cls, sender, documents, **kwargs):
+        # QuerySet.insert() does not send pre_save, encrypt every document the same way
+        for document in documents:
+            cls.pre_save(sender, document, **kwargs)
+
     @classmethod
     def post_init(cls, sender, document, **kwargs):
         encrypted_fields = document._meta.get('encrypted_fields', [])
@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+from main.libraries.functions import log_message
+from main.libraries.RedisConnection import RedisConnection
+
+load_dotenv()
+
+class LocalCache:
+    """
+    Bounded in-process LRU/TTL cache used as the first tier in front of Redis.
+
+    Entries are indexed by tag so they can be dropped when Cache.forget_by_tags
+    runs in any worker; invalidations are received over Redis pub/sub.
+
+    Values are shared between requests of the same worker and must be treated
+    as read-only by callers.
+    """
+
+    _instance = None
+    _pid = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, max_bytes, max_entry_bytes, ttl):
+        """
+        :param max_bytes: Upper bound for the summed size of all entries.
+        :param max_entry_bytes: Entries larger than this are never stored.
+        :param ttl: Default time to live of an entry in seconds.
+        """
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (value, size, tags, expires_at)
+        self.tag_index = {}  # tag -> set of keys
+        self.current_bytes = 0
+        self.epoch = 0  # bumped on every invalidation, see set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def enabled():
+        return os.getenv('CACHE_L1_ENABLED') == '1' and os.getenv('CACHE_DISABLED') != '1'
+
+    @staticmethod
+    def invalidation_channel():
+        return f"{os.getenv('APP_ID', '')}cache_invalidations"
+
+    @staticmethod
+    def instance():
+        """
+        Return the LocalCache of this process, or None if the tier is disabled.
+        The first call in each process starts the invalidation listener.
+        """
+        if not LocalCache.enabled():
+            return None
+
+        pid = os.getpid()
+        if LocalCache._pid != pid:
+            with LocalCache._instance_lock:
+                if LocalCache._pid != pid:
+                    local_cache = LocalCache(
+                        max_bytes=int(os.getenv('CACHE_L1_MAX_BYTES', 64 * 1024 * 1024)),
+                        max_entry_bytes=int(os.getenv('CACHE_L1_MAX_ENTRY_BYTES', 1024 * 1024)),
+                        ttl=int(os.getenv('CACHE_L1_TTL', 30))
+                    )
+                    local_cache.start_listener()
+                    LocalCache._instance = local_cache
+                    LocalCache._pid = pid
+        return LocalCache._instance
+
+    def get(self, key):
+        """
+        Look up a key.
+
+        :return: A (found, value) tuple.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            value, size, tags, expires_at = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def set(self, key, value, size, tags=None, timeout=None, epoch=None):
+        """
+        Store a value.
+
+        :param size: Serialized size of the value in bytes, used for the memory cap.
+        :param tags: Tags used to invalidate the entry.
+        :param timeout: Remaining lifetime in Redis, the entry never outlives it.
+        :param epoch: The epoch read before the value was fetched; if an invalidation
+                      happened since then the value may be stale and is not stored.
+        """
+        if size > self.max_entry_bytes:
+            return False
+
+        ttl = min(self.ttl, timeout) if timeout else self.ttl
+        with self.lock:
+            if epoch is not None and epoch != self.epoch:
+                return False
+            if key in self.entries:
+                self._remove(key)
+
+            tags = tuple(tags or ())
+            self.entries[key] = (value, size, tags, time.monotonic() + ttl)
+            self.current_bytes += size
+            for tag in tags:
+                self.tag_index.setdefault(tag, set()).add(key)
+
+            # Evict least recently used entries until we are back under the cap
+            while self.current_bytes > self.max_bytes and self.entries:
+                oldest_key = next(iter(self.entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+        return True
+
+    def forget(self, keys):
+        with self.lock:
+            self.epoch += 1
+            for key in keys:
+                if key in self.entries:
+                    self._remove(key)
+
+    def forget_by_tags(self, tags):
+        with self.lock:
+            self.epoch += 1
+            for tag in tags:
+                for key in list(self.tag_index.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.epoch += 1
+            self.entries.clear()
+            self.tag_index.clear()
+            self.current_bytes = 0
+
+    def _remove(self, key):
+        value, size, tags, expires_at = self.entries.pop(key)
+        self.current_bytes -= size
+        for tag in tags:
+            keys = self.tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tag_index[tag]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'entries': len(self.entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+            }
+
+    def start_listener(self):
+        """Subscribe to invalidation broadcasts in a background daemon thread."""
+        listener = threading.Thread(target=self._listen, name='cache-invalidation-listener', daemon=True)
+        listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = RedisConnection.get_pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(LocalCache.invalidation_channel())
+                for message in pubsub.listen():
+                    if message['type'] != 'message':
+                        continue
+                    payload = json.loads(message['data'])
+                    if payload.get('tags'):
+                        self.forget_by_tags(payload['tags'])
+                    if payload.get('keys'):
+                        self.forget(payload['keys'])
+            except Exception as e:
+                log_message('error', f"Cache invalidation listener error: {e}")
+                # We may have missed invalidations while disconnected
+                self.clear()
+                time.sleep(1)
@@ -1,5 +1,12 @@
 from opentelemetry import trace
 import os
+import json
+import time
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from main.libraries.RedisConnection import RedisConnection
+from main.libraries.functions import log_message
 
 class Observable:
     """
@@ -8,24 +15,50 @@ class Observable:
     This class represents a core component of the
     Observer pattern. It maintains a list of listeners for different event types and
     provides methods to register, unregister, and notify these listeners.
+
+    Listeners registered with run_async=True run on a shared worker pool when
+    EVENTS_ASYNC=1, so their latency and failures stay out of the code that notified
+    the event. Failed runs are retried EVENTS_MAX_ATTEMPTS times with exponential
+    backoff, and then recorded in a dead-letter list in Redis. A retry runs the whole
+    listener again, so listeners whose side effects are not safe to repeat register
+    with max_attempts=1.
+
+    A run with an idempotency key claims the key in Redis before the listener runs,
+    so it runs once per key even when the event is notified by several workers at
+    the same time. A claim expires after EVENTS_CLAIM_TTL seconds, in case its worker
+    dies, and is released when the listener fails for good.
     """
 
+    # Worker pool shared by all observables, created on first use
+    executor = None
+    executor_lock = threading.Lock()
+
     def __init__(self):
         """
         Initialize an instance of Observable.
 
         :attribute listeners: A dictionary to hold lists of listener functions
                               for each event type.
+        :attribute async_listeners: The idempotency key function (or None) and the
+                                    most attempts (or None) of each listener
+                                    registered to run asynchronously, by event type
+                                    and listener.
         """
 
         self.listeners = {}  # The listeners dictionary
+        self.async_listeners = {}
 
-    def register(self, event_type, listener):
+    def register(self, event_type, listener, run_async=False, idempotency_key=None, max_attempts=None):
         """
         Register a listener for a specified event type.
 
         :param event_type: A string representing the type of the event.
         :param listener: The listener function to be called when the event occurs.
+        :param run_async: Run the listener on the worker pool when EVENTS_ASYNC=1.
+        :param idempotency_key: A function returning the key of an event (or None), an
+                                asynchronous listener runs once per key.
+        :param max_attempts: How often an asynchronous listener runs before its event is
+                             dead-lettered, EVENTS_MAX_ATTEMPTS by default.
         """
 
         # If the event type is not already in the listeners dictionary, add it
@@ -35,6 +68,9 @@ class Observable:
         # Add the listener to the list of listeners for this event type
         self.listeners[event_type].add(listener)
 
+        if run_async:
+            self.async_listeners[(event_type, listener)] = (idempotency_key, max_attempts)
+
     def unregister(self, event_type, listener):
         """
         Unregister a listener for a specified event type.
@@ -47,6 +83,7 @@ class Observable:
         # list for that event type, remove the listener
         if event_type in self.listeners and listener in self.listeners[event_type]:
             self.listeners[event_type].remove(listener)
+            self.async_listeners.pop((event_type, listener), None)
 
     def notify(self, event):
         """
@@ -64,9 +101,110 @@ class Observable:
 
                 if event.type in self.listeners:
                     for listener in self.listeners[event.type]:
-                        listener(event)  # Call the listener function with the event
+                        self.call(listener, event)  # Call the listener function with the event
         else:
             # If OpenTelemetry is not enabled, just trigger the event normally without tracing
             if event.type in self.listeners:
                 for listener in self.listeners[event.type]:
-                    listener(event)
+                    self.call(listener, event)
+
+    def call(self, listener, event):
+        """Call a listener right away, or hand it to the worker pool if it runs asynchronously."""
+        if (event.type, listener) not in self.async_listeners or os.getenv('EVENTS_ASYNC') != '1':
+            listener(event)
+            return
+
+        key_function, max_attempts = self.async_listeners[(event.type, listener)]
+        key = key_function(event) if key_function else None
+        if key is not None:
+            key = self.idempotency_key(event.type, listener, key)
+        Observable.get_executor().submit(self.run_async, listener, event, key, max_attempts)
+
+    @staticmethod
+    def get_executor():
+        with Observable.executor_lock:
+            if Observable.executor is None:
+                workers = int(os.getenv('EVENTS_ASYNC_WORKERS', 4))
+                Observable.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='events')
+            return Observable.executor
+
+    @staticmethod
+    def idempotency_key(event_type, listener, key):
+        return f"{os.getenv('APP_ID', '')}event_done:{event_type}:{listener.__qualname__}:{key}"
+
+    @staticmethod
+    def dead_letter_key():
+        return f"{os.getenv('APP_ID', '')}event_dead_letters"
+
+    def run_async(self, listener, event, key=None, max_attempts=None):
+        """Run a listener on the worker pool, with retries, idempotency and dead-lettering."""
+        redis_client = RedisConnection.get_client()
+        if key is not None:
+            try:
+                # Claimed until the listener is done, or by the run that already did it
+                if not redis_client.set(key, 'running', nx=True, ex=int(os.getenv('EVENTS_CLAIM_TTL', 600))):
+                    log_message('info', f"Skipped {listener.__qualname__} for {event.type}, already done or running: {key}")
+                    return
+            except Exception as e:
+                log_message('error', f"Error claiming event idempotency key {key}: {e}")
+
+        max_attempts = max_attempts or int(os.getenv('EVENTS_MAX_ATTEMPTS', 3))
+        retry_delay = float(os.getenv('EVENTS_RETRY_DELAY', 1))
+        for attempt in range(1, max_attempts + 1):
+            try:
+                listener(event)
+                break
+            except Exception as e:
+                if attempt < max_attempts:
+                    log_message('warning', f"{listener.__qualname__} failed on {event.type} (attempt {attempt}), retrying: {e}")
+                    time.sleep(retry_delay * 2 ** (attempt - 1))
+                    continue
+                log_message('error', f"{listener.__qualname__} failed on {event.type} after {attempt} attempts: {e}")
+                self.dead_letter(listener, event, key, e)
+                if key is not None:
+                    # Let the event run again when it is notified again
+                    try:
+                        redis_client.delete(key)
+                    except Exception as e:
+                        log_message('error', f"Error releasing event idempotency key {key}: {e}")
+                return
+
+        if key is not None:
+            try:
+                redis_client.set(key, 'done', ex=int(os.getenv('EVENTS_IDEMPOTENCY_TTL', 86400)))
+            except Exception as e:
+                log_message('error', f"Error setting event idempotency key {key}: {e}")
+
+    def dead_letter(self, listener, event, key, error):
+        """Record an event a listener kept failing on, the list keeps the latest EVENTS_DEAD_LETTER_MAX entries."""
+        entry = {
+            'event_type': event.type,
+            'listener': listener.__qualname__,
+            'idempotency_key': key,
+            'error': str(error),
+            'data': {name: str(getattr(value, 'id', value)) for name, value in event.data.items()},
+            'failed_at': datetime.utcnow().isoformat(),
+        }
+        try:
+            redis_client = RedisConnection.get_client()
+            pipe = redis_client.pipeline()
+            pipe.lpush(Observable.dead_letter_key(), json.dumps(entry))
+            pipe.ltrim(Observable.dead_letter_key(), 0, int(os.getenv('EVENTS_DEAD_LETTER_MAX', 1000)) - 1)
+            pipe.execute()
+        except Exception as e:
+            log_message('error', f"Error recording dead-letter event {entry}: {e}")
+
+    def forget_idempotency_key(self, event_type, key):
+        """Let the asynchronous listeners of an event type run again for a key, e.g. when a task is reset."""
+        if os.getenv('EVENTS_ASYNC') != '1':
+            return
+        keys = [
+            self.idempotency_key(event_type, listener, key)
+            for (listener_event_type, listener), (key_function, max_attempts) in self.async_listeners.items()
+            if listener_event_type == event_type and key_function
+        ]
+        if keys:
+            try:
+                RedisConnection.get_client().delete(*keys)
+            except Exception as e:
+                log_message('error', f"Error forgetting event idempotency keys {keys}: {e}")
@@ -0,0 +1,81 @@
+"""
+Lexicographic fractional order keys.
+
+An order key is a string of base 62 digits read as the fraction after a radix point,
+so keys sort as plain strings and there is always a key between any two keys. Moving
+an item only gives that item a new key, no other item has to change. Keys never end
+in the lowest digit, so there is also always room in front of the first key.
+"""
+
+DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+
+def _midpoint(before, after):
+    # before < after, before may be '' and after None for no upper bound
+    if after is not None:
+        # Keep the common prefix, padding before with the lowest digit
+        prefix = 0
+        while prefix < len(after) and (before[prefix] if prefix < len(before) else DIGITS[0]) == after[prefix]:
+            prefix += 1
+        if prefix > 0:
+            return after[:prefix] + _midpoint(before[prefix:], after[prefix:])
+
+    digit_before = DIGITS.index(before[0]) if before else 0
+    digit_after = DIGITS.index(after[0]) if after is not None else len(DIGITS)
+    if digit_after - digit_before > 1:
+        return DIGITS[(digit_before + digit_after + 1) // 2]
+
+    # Adjacent digits
+    if after is not None and len(after) > 1:
+        return after[:1]
+    return DIGITS[digit_before] + _midpoint(before[1:], None)
+
+
+def _validate(key):
+    if key is not None and (not key or key[-1] == DIGITS[0] or any(digit not in DIGITS for digit in key)):
+        raise ValueError(f"Invalid order key: {key!r}")
+
+
+def key_between(before=None, after=None):
+    """
+    Generate an order key that sorts between two keys.
+
+    :param before: The key to sort after, None for the start.
+    :param after: The key to sort before, None for the end.
+    :return: A new order key.
+    """
+    _validate(before)
+    _validate(after)
+    if before is not None and after is not None and before >= after:
+        raise ValueError(f"Order key {before!r} does not sort before {after!r}")
+
+    if before is not None and after is None:
+        # Appending is the common case, so step the first digit that can be stepped
+        # instead of halving the remaining range, which would lengthen keys quickly
+        for index, digit in enumerate(before):
+            if digit != DIGITS[-1]:
+                return before[:index] + DIGITS[DIGITS.index(digit) + 1]
+
+    return _midpoint(before or '', after)
+
+
+def spread_keys(count):
+    """
+    Generate count short, evenly spaced order keys, for new or rebalanced lists.
+
+    :param count: The number of keys.
+    :return: A sorted list of order keys.
+    """
+    width = 1
+    while len(DIGITS) ** width <= count + 1:
+        width += 1
+
+    keys = []
+    for index in range(1, count + 1):
+        value = index * len(DIGITS) ** width // (count + 1)
+        digits = []
+        for _ in range(width):
+            value, digit = divmod(value, len(DIGITS))
+            digits.append(DIGITS[digit])
+        keys.append(''.join(reversed(digits)).rstrip(DIGITS[0]))
+    return keys
@@ -1,36 +1,164 @@
 import os
 import pika
 import json
+import threading
+from contextlib import contextmanager
+from main.libraries.functions import log_message
 
 class QueueHelper:
+    """
+    Publishes tasks to RabbitMQ over one long-lived connection and channel per process,
+    instead of a connection per task.
+
+    The connection is opened lazily, rebuilt whenever the current PID changes (so
+    gunicorn workers never share the master's socket), and reopened once when a
+    publish fails on a connection the server or network dropped. Publishing is
+    serialized with a lock, as pika connections are not thread safe.
+
+    With QUEUE_PUBLISH_CONFIRM=1 (the default) the channel is in publisher confirm
+    mode: each publish waits for the server to confirm it took the message, and
+    raises when it was refused (NackError) or could not be routed to a queue
+    (UnroutableError). Inside a batch() block tasks are collected and published
+    together, and the on_published callbacks of their calls run once the batch went out.
+    """
+
+    _connection = None
+    _channel = None
+    _pid = None
+    _declared_queues = set()
+    _lock = threading.Lock()
+    _batches = threading.local()
+
+    @staticmethod
+    def publish_task(task_id, queue_name, payload=None, on_published=None):
+        """
+        Publish a new task ID to the RabbitMQ server, optionally along with the data
+        of the task, so consumers do not need to load it.
+        """
+        QueueHelper.publish_many([(task_id, queue_name, payload)], on_published)
+
+    @staticmethod
+    def publish_many(tasks, on_published=None):
+        """
+        Publish several tasks over the shared channel, on one connection check.
+
+        :param tasks: A list of (task_id, queue_name, payload) tuples, payload may be None.
+        :param on_published: Called once the server accepted the tasks, which inside a
+                             batch() block is at the end of the block, and not at all
+                             when publishing fails.
+        """
+        batch = getattr(QueueHelper._batches, 'tasks', None)
+        if batch is not None:
+            batch.extend(tasks)
+            if on_published:
+                QueueHelper._batches.callbacks.append(on_published)
+            return
+
+        if os.getenv('MOCK_QUEUE') != '1' and tasks:
+            with QueueHelper._lock:
+                try:
+                    QueueHelper._publish(tasks)
+                except pika.exceptions.AMQPError as e:
+                    # The connection went away while idle, publish again on a new one
+                    log_message('warning', f'Reconnecting to RabbitMQ after publish error: {e!r}')
+                    QueueHelper._disconnect()
+                    QueueHelper._publish(tasks)
+
+        if on_published:
+            on_published()
+
     @staticmethod
-    def publish_task(task_id, queue_name):
-        """ Publish a new task ID to the RabbitMQ server"""
+    @contextmanager
+    def batch():
+        """
+        Collect the tasks published in this thread inside the block and publish them
+        together at the end of it. Nested blocks publish with the outermost one.
 
-        if os.getenv('MOCK_QUEUE') == '1':
+        When the block raises, the tasks collected before are still published, and a
+        failure to publish them is logged so the error of the block is the one raised.
+        """
+        if getattr(QueueHelper._batches, 'tasks', None) is not None:
+            yield
             return
 
-        # Load the RabbitMQ connection parameters from environment variables
-        rabbitmq_host = os.environ.get('RABBITMQ_HOST')
-        rabbitmq_user = os.environ.get('RABBITMQ_USER')
-        rabbitmq_pass = os.environ.get('RABBITMQ_PASS')
-
-        # Set up RabbitMQ connection and channel
-        connection = pika.BlockingConnection(pika.ConnectionParameters(host=rabbitmq_host))
-        channel = connection.channel()
-
-        # Declare the queue
-        channel.queue_declare(queue=queue_name, durable=True)
-
-        # Publish the message
-        channel.basic_publish(
-            exchange='',
-            routing_key=queue_name,
-            body=json.dumps({'task_id': str(task_id)}),
-            properties=pika.BasicProperties(
-                delivery_mode=2,  # Make message persistent
+        QueueHelper._batches.tasks = []
+        QueueHelper._batches.callbacks = []
+        completed = False
+        try:
+            yield
+            completed = True
+        finally:
+            # Tasks created before an error are saved already, queue them either way
+            tasks, callbacks = QueueHelper._batches.tasks, QueueHelper._batches.callbacks
+            QueueHelper._batches.tasks = None
+            QueueHelper._batches.callbacks = None
+            try:
+                QueueHelper.publish_many(tasks)
+            except Exception as e:
+                if completed:
+                    raise
+                log_message('error', f'Error publishing {len(tasks)} batched task(s): {e!r}')
+            else:
+                for callback in callbacks:
+                    callback()
+
+    @staticmethod
+    def _publish(tasks):
+        channel = QueueHelper._get_channel()
+        for task_id, queue_name, payload in tasks:
+            if queue_name not in QueueHelper._declared_queues:
+                channel.queue_declare(queue=queue_name, durable=True)
+                QueueHelper._declared_queues.add(queue_name)
+
+            channel.basic_publish(
+                exchange='',
+                routing_key=queue_name,
+                body=json.dumps({'task_id': str(task_id), 'task': payload} if payload else {'task_id': str(task_id)}),
+                properties=pika.BasicProperties(
+                    delivery_mode=2,  # Make message persistent
+                ),
+                mandatory=QueueHelper._confirm()
             )
-        )
 
-        # Close the connection
-        connection.close()
+    @staticmethod
+    def _confirm():
+        return os.getenv('QUEUE_PUBLISH_CONFIRM', '1') == '1'
+
+    @staticmethod
+    def _get_channel():
+        """Return the channel of this process, connecting to the RabbitMQ server if needed."""
+        pid = os.getpid()
+        if QueueHelper._pid != pid:
+            # Forked from a process with a connection, leave its socket to the parent
+            QueueHelper._connection = None
+            QueueHelper._channel = None
+            QueueHelper._declared_queues = set()
+            QueueHelper._pid = pid
+
+        if QueueHelper._connection is not None and QueueHelper._connection.is_open \
+                and QueueHelper._channel is not None and QueueHelper._channel.is_open:
+            # Answer heartbeats, and find out about a dropped connection before publishing
+            QueueHelper._connection.process_data_events(time_limit=0)
+            return QueueHelper._channel
+
+        QueueHelper._disconnect()
+        QueueHelper._connection = pika.BlockingConnection(pika.ConnectionParameters(
+            host=os.environ.get('RABBITMQ_HOST'),
+            heartbeat=int(os.getenv('QUEUE_HEARTBEAT', 60)),
+        ))
+        QueueHelper._channel = QueueHelper._connection.channel()
+        if QueueHelper._confirm():
+            QueueHelper._channel.confirm_delivery()
+        return QueueHelper._channel
+
+    @staticmethod
+    def _disconnect():
+        connection = QueueHelper._connection
+        QueueHelper._connection = None
+        QueueHelper._channel = None
+        QueueHelper._declared_queues = set()
+        if connection is not None and connection.is_open:
+            try:
+                connection.close()
+            except pika.exceptions.AMQPError:
+                pass
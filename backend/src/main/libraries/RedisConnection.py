@@ -0,0 +1,110 @@
+import os
+import threading
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class RedisConnection:
+    """
+    Process-wide Redis connection pools shared by Cache, Websocket, commands and
+    the websocket relay.
+
+    Pools are created lazily on first use and rebuilt whenever the current PID
+    changes, so gunicorn workers never reuse sockets inherited from the master.
+
+    Two pools are kept: 'default' for short request/response commands, and
+    'pubsub' for long-lived subscriptions which must not be subject to the
+    socket read timeout.
+    """
+
+    _pools = {}
+    _pid = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _pool_settings(name):
+        """
+        Build the connection pool keyword arguments from environment variables.
+
+        :param name: The pool name ('default' or 'pubsub').
+        :return: A dictionary of arguments for redis.BlockingConnectionPool.
+        """
+        socket_timeout = float(os.getenv('REDIS_SOCKET_TIMEOUT', 5))
+        return {
+            'host': os.getenv('REDIS_HOST'),
+            'port': int(os.getenv('REDIS_PORT', 6379)),
+            'db': 0,
+            'max_connections': int(os.getenv('REDIS_MAX_CONNECTIONS', 50)),
+            'timeout': float(os.getenv('REDIS_POOL_TIMEOUT', 5)),
+            'health_check_interval': int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', 30)),
+            'socket_connect_timeout': float(os.getenv('REDIS_SOCKET_CONNECT_TIMEOUT', 2)),
+            'socket_keepalive': True,
+            # subscriptions block on read indefinitely, so only bound command sockets
+            'socket_timeout': None if name == 'pubsub' else socket_timeout,
+        }
+
+    @staticmethod
+    def get_pool(name='default'):
+        """
+        Return the shared connection pool for this process, creating it if needed.
+
+        :param name: The pool name ('default' or 'pubsub').
+        :return: A redis.BlockingConnectionPool instance.
+        """
+        pid = os.getpid()
+        if RedisConnection._pid != pid:
+            with RedisConnection._lock:
+                if RedisConnection._pid != pid:
+                    # We are in a freshly forked child (or first use), drop inherited pools
+                    RedisConnection._pools = {}
+                    RedisConnection._pid = pid
+
+        pool = RedisConnection._pools.get(name)
+        if pool is None:
+            with RedisConnection._lock:
+                pool = RedisConnection._pools.get(name)
+                if pool is None:
+                    pool = redis.BlockingConnectionPool(**RedisConnection._pool_settings(name))
+                    RedisConnection._pools[name] = pool
+        return pool
+
+    @staticmethod
+    def get_client():
+        """Return a Redis client backed by the shared command pool."""
+        return redis.Redis(connection_pool=RedisConnection.get_pool('default'))
+
+    @staticmethod
+    def get_pubsub(**kwargs):
+        """Return a PubSub object backed by the shared subscription pool."""
+        client = redis.Redis(connection_pool=RedisConnection.get_pool('pubsub'))
+        return client.pubsub(**kwargs)
+
+    @staticmethod
+    def get_pool_stats():
+        """
+        Report connection usage for each pool created in this process.
+
+        :return: A dictionary keyed by pool name with connection counts.
+        """
+        stats = {}
+        for name, pool in list(RedisConnection._pools.items()):
+            created = len(getattr(pool, '_connections', []))
+            # Idle connections sit in the queue; empty slots are represented by None
+            available = len([conn for conn in list(pool.pool.queue) if conn is not None])
+            stats[name] = {
+                'pid': RedisConnection._pid,
+                'max_connections': pool.max_connections,
+                'created_connections': created,
+                'in_use_connections': created - available,
+                'available_connections': available,
+            }
+        return stats
+
+    @staticmethod
+    def reset():
+        """Disconnect and discard all pools for this process."""
+        with RedisConnection._lock:
+            for pool in RedisConnection._pools.values():
+                pool.disconnect()
+            RedisConnection._pools = {}
@@ -1,8 +1,113 @@
-import redis
 import json
 import os
+import time
+import zlib
+import atexit
+import threading
 from dotenv import load_dotenv
 from main.libraries.functions import log_message
+from main.libraries.RedisConnection import RedisConnection
+
+class BroadcastCoalescer:
+    """
+    Buffers websocket notifications per channel for WEBSOCKET_COALESCE_MS and sends
+    them as one message, so a burst of changes (e.g. a MakeScenes completion) reaches
+    clients once instead of N times. The buffer of a channel is flushed by a timer
+    thread at the end of its window, or right away at WEBSOCKET_COALESCE_MAX messages.
+
+    A window with a single notification sends it as is. Otherwise clients get:
+
+        {'type': 'batch', 'changed': [...], 'notifications': [...]}
+
+    where 'notifications' holds the notifications in order, dropping duplicates and
+    all but the last update of each agent task, and 'changed' lists the documents
+    they are about once each, as {'type', 'document_type', 'document_id'}.
+    """
+
+    buffers = {}
+    lock = threading.Lock()
+
+    @staticmethod
+    def window():
+        """The time notifications are buffered for in seconds, 0 when coalescing is off."""
+        return max(0.0, float(os.getenv('WEBSOCKET_COALESCE_MS', 0))) / 1000
+
+    @staticmethod
+    def add(redis_client, channel, message):
+        """Buffer a notification for a channel, starting the channel's window if it is the first."""
+        with BroadcastCoalescer.lock:
+            buffer = BroadcastCoalescer.buffers.get(channel)
+            if buffer is None:
+                buffer = BroadcastCoalescer.buffers[channel] = {'redis_client': redis_client, 'messages': []}
+                timer = threading.Timer(BroadcastCoalescer.window(), BroadcastCoalescer.flush, args=(channel,))
+                timer.daemon = True
+                timer.start()
+            buffer['messages'].append(message)
+            full = len(buffer['messages']) >= int(os.getenv('WEBSOCKET_COALESCE_MAX', 100))
+
+        if full:
+            BroadcastCoalescer.flush(channel)
+
+    @staticmethod
+    def flush(channel):
+        """Send the notifications buffered for a channel, if any are left."""
+        with BroadcastCoalescer.lock:
+            buffer = BroadcastCoalescer.buffers.pop(channel, None)
+        if not buffer:
+            return
+
+        try:
+            Websocket.publish(buffer['redis_client'], channel, BroadcastCoalescer.merge(buffer['messages']))
+        except Exception as e:
+            log_message('error', f"Error broadcasting message: {e}")
+
+    @staticmethod
+    def flush_all():
+        """Send everything buffered, e.g. before the process exits."""
+        for channel in list(BroadcastCoalescer.buffers):
+            BroadcastCoalescer.flush(channel)
+
+    @staticmethod
+    def merge(messages):
+        """Merge the notifications of one window into a single message."""
+        if len(messages) == 1:
+            return messages[0]
+
+        # Batches coalesced before (by the broadcasting process, merged again by the relay) are taken apart
+        flattened = []
+        for message in messages:
+            if message.get('type') == 'batch':
+                flattened.extend(message.get('notifications', []))
+            else:
+                flattened.append(message)
+        messages = flattened
+
+        # Keep the last of each agent task's updates, and the first of other duplicates
+        latest = {}
+        for index, message in enumerate(messages):
+            if message.get('type') == 'agent_task' and message.get('agent_task_id'):
+                key = ('agent_task', message['agent_task_id'])
+            else:
+                key = json.dumps(message, sort_keys=True, default=str)
+            if key not in latest or key[0] == 'agent_task':
+                latest[key] = index
+        notifications = [messages[index] for index in sorted(latest.values())]
+        if len(notifications) == 1:
+            return notifications[0]
+
+        changed = []
+        for message in notifications:
+            document = {
+                'type': message.get('type'),
+                'document_type': message.get('document_type'),
+                'document_id': message.get('document_id'),
+            }
+            if document not in changed:
+                changed.append(document)
+
+        return {'type': 'batch', 'changed': changed, 'notifications': notifications}
+
+atexit.register(BroadcastCoalescer.flush_all)
 
 class Websocket:
     def __init__(self):
@@ -13,42 +118,63 @@ class Websocket:
         self.mock_websockets = os.getenv('MOCK_WEBSOCKETS') == '1'
 
         if not self.mock_websockets:
-            # Initialize Redis client if not mocking
-            self.redis_client = redis.Redis(
-                host=os.getenv("REDIS_HOST"),
-                port=os.getenv("REDIS_PORT"),
-                db=0
-            )
+            # Use a client backed by the shared connection pool if not mocking
+            self.redis_client = RedisConnection.get_client()
 
     def broadcast_message(self, channel, message):
-        """Broadcast a message to a WebSocket channel via Redis"""
+        """
+        Broadcast a message to a WebSocket channel via Redis, coalesced with the other
+        messages of the channel if WEBSOCKET_COALESCE_MS is set, see BroadcastCoalescer.
+        """
         if self.mock_websockets:
             # Mocking is enabled, so skip the actual broadcast
             return True
 
+        if BroadcastCoalescer.window() > 0:
+            BroadcastCoalescer.add(self.redis_client, channel, message)
+            return True
+
         try:
-            # Construct message in the expected format
-            notification = {
-                'channel': channel,
-                'notification': message
-            }
-            # Convert to JSON string
-            notification_json = json.dumps(notification)
-            # Publish the message to the "notifications" Redis channel
-            self.redis_client.publish('notifications', notification_json)
+            Websocket.publish(self.redis_client, channel, message)
             return True
         except Exception as e:
             # Handle any exceptions that may occur
             log_message('error', f"Error broadcasting message: {e}")
             return False
 
+    @staticmethod
+    def publish(redis_client, channel, message):
+        """Publish a notification for a WebSocket channel to the websocket relay on Redis"""
+        # Construct message in the expected format, sent_at lets the relay measure latency
+        notification = {
+            'channel': channel,
+            'notification': message,
+            'sent_at': time.time()
+        }
+        redis_client.publish(Websocket.notifications_channel(Websocket.shard_of(channel)), json.dumps(notification))
+
+    @staticmethod
+    def shard_of(channel):
+        """The websocket relay shard relaying a channel, out of WEBSOCKET_RELAY_SHARDS."""
+        shards = int(os.getenv('WEBSOCKET_RELAY_SHARDS', 1))
+        if shards <= 1:
+            return 0
+        return zlib.crc32(channel.encode('utf-8')) % shards
+
+    @staticmethod
+    def notifications_channel(shard=0):
+        """The Redis channel of the notifications a websocket relay shard relays."""
+        if int(os.getenv('WEBSOCKET_RELAY_SHARDS', 1)) <= 1:
+            return 'notifications'
+        return f"notifications.{shard}"
+
     def listen_to_channel(self, channel):
         """Listen to messages on a WebSocket channel via Redis"""
         if self.mock_websockets:
             # Mocking is enabled, throw an exception
             raise Exception("Cannot listen to channel while websockets are mocked")
 
-        pubsub = self.redis_client.pubsub()
+        pubsub = RedisConnection.get_pubsub()
         pubsub.subscribe(channel)
         log_message('debug', f"Subscribed to {channel}, listening for messages...")
         for message in pubsub.listen():
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+from main.libraries.functions import log_message
+from main.libraries.RedisConnection import RedisConnection
+from main.libraries.Websocket import Websocket, BroadcastCoalescer
+
+class WebsocketRelay:
+    """
+    Relays the notifications published on Redis by Websocket.broadcast_message to the
+    socket.io rooms of the websocket server (websockets.py).
+
+    The relay drains every notification waiting on its subscription before emitting,
+    up to WEBSOCKET_RELAY_BATCH at a time, and only yields to the server in between.
+    When broadcasts are coalesced (WEBSOCKET_COALESCE_MS) the notifications of a room
+    in one drained batch go out as one emit, see BroadcastCoalescer.merge.
+
+    With WEBSOCKET_RELAY_SHARDS above 1, channels are spread over that many relay
+    processes, each relaying the shard given by WEBSOCKET_RELAY_SHARD. Their
+    socket.io servers then share WEBSOCKET_MESSAGE_QUEUE, so clients connected to
+    any of them receive every emit.
+
+    Counters of relayed notifications and their latency (from Websocket.publish to
+    the emit) are logged and stored in Redis every WEBSOCKET_RELAY_STATS_INTERVAL
+    seconds, see get_statistics().
+    """
+
+    def __init__(self, emit, sleep=time.sleep, shard=None, log=None):
+        """
+        :param emit: Function emitting an event to a room, e.g. socketio.emit.
+        :param sleep: Function yielding to the server between batches, e.g. socketio.sleep.
+        :param shard: The shard to relay, WEBSOCKET_RELAY_SHARD by default.
+        :param log: Function logging each notification, only given for debugging.
+        """
+        self.emit = emit
+        self.sleep = sleep
+        self.shard = shard if shard is not None else int(os.getenv('WEBSOCKET_RELAY_SHARD', 0))
+        self.batch_size = int(os.getenv('WEBSOCKET_RELAY_BATCH', 100))
+        self.stats_interval = float(os.getenv('WEBSOCKET_RELAY_STATS_INTERVAL', 60))
+        self.log = log
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.counters = {'notifications': 0, 'emits': 0, 'batches': 0, 'errors': 0, 'max_batch': 0,
+                         'total_latency_ms': 0.0, 'max_latency_ms': 0.0}
+        self.counting_since = time.time()
+
+    def run(self):
+        """Relay notifications until the process stops."""
+        pubsub = RedisConnection.get_pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(Websocket.notifications_channel(self.shard))
+        log_message('info', f"Websocket relay listening on {Websocket.notifications_channel(self.shard)}")
+
+        while True:
+            try:
+                self.drain(pubsub)
+            except Exception as e:
+                # The subscription is restored on the next read once Redis is back
+                log_message('error', f"Websocket relay error: {e}")
+                self.sleep(1)
+
+            if time.time() - self.counting_since >= self.stats_interval:
+                self.report_statistics()
+
+    def drain(self, pubsub):
+        """Wait up to a second for notifications, then relay all of them that are waiting."""
+        messages = []
+        message = pubsub.get_message(timeout=1.0)
+        while message is not None:
+            if message['type'] == 'message':
+                messages.append(message)
+                if len(messages) >= self.batch_size:
+                    break
+            message = pubsub.get_message(timeout=0)
+
+        if messages:
+            self.relay(messages)
+        # Let the server send what was emitted and serve its clients
+        self.sleep(0)
+        return len(messages)
+
+    def relay(self, messages):
+        """Emit a batch of notifications from Redis to their rooms."""
+        now = time.time()
+        rooms = {}
+        for message in messages:
+            try:
+                data = json.loads(message['data'])
+                rooms.setdefault(data['channel'], []).append(data['notification'])
+            except (ValueError, KeyError, TypeError) as e:
+                self.counters['errors'] += 1
+                log_message('error', f"Websocket relay received an invalid notification: {e}")
+                continue
+
+            if self.log:
+                self.log(f"Received data: {data}")
+            if data.get('sent_at'):
+                latency_ms = max(0.0, (now - data['sent_at']) * 1000)
+                self.counters['total_latency_ms'] += latency_ms
+                self.counters['max_latency_ms'] = max(self.counters['max_latency_ms'], latency_ms)
+            self.counters['notifications'] += 1
+
+        coalesce = BroadcastCoalescer.window() > 0
+        for room, notifications in rooms.items():
+            for notification in ([BroadcastCoalescer.merge(notifications)] if coalesce else notifications):
+                self.emit('message', notification, room=room)
+                self.counters['emits'] += 1
+
+        self.counters['batches'] += 1
+        self.counters['max_batch'] = max(self.counters['max_batch'], len(messages))
+
+    def statistics(self):
+        """The counters since the last report, with rates and average latency."""
+        elapsed = max(time.time() - self.counting_since, 0.001)
+        counters = self.counters
+        return {
+            'shard': self.shard,
+            'seconds': round(elapsed, 1),
+            'notifications': counters['notifications'],
+            'emits': counters['emits'],
+            'batches': counters['batches'],
+            'errors': counters['errors'],
+            'max_batch': counters['max_batch'],
+            'notifications_per_second': round(counters['notifications'] / elapsed, 1),
+            'average_latency_ms': round(counters['total_latency_ms'] / counters['notifications'], 1) if counters['notifications'] else None,
+            'max_latency_ms': round(counters['max_latency_ms'], 1),
+        }
+
+    def report_statistics(self):
+        statistics = self.statistics()
+        self.reset_counters()
+        if statistics['notifications']:
+            log_message('info', f"Websocket relay: {json.dumps(statistics)}")
+        try:
+            RedisConnection.get_client().set(
+                WebsocketRelay.statistics_key(self.shard), json.dumps(statistics), ex=int(self.stats_interval * 5)
+            )
+        except Exception as e:
+            log_message('error', f"Error storing websocket relay statistics: {e}")
+
+    @staticmethod
+    def statistics_key(shard):
+        return f"websocket_relay:statistics:{shard}"
+
+    @staticmethod
+    def get_statistics():
+        """The last statistics reported by each shard of the websocket relay."""
+        client = RedisConnection.get_client()
+        statistics = []
+        for shard in range(max(1, int(os.getenv('WEBSOCKET_RELAY_SHARDS', 1)))):
+            reported = client.get(WebsocketRelay.statistics_key(shard))
+            if reported:
+                statistics.append(json.loads(reported))
+        return statistics
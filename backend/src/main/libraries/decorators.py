@@ -1,4 +1,5 @@
 import functools
+import time
 from types import SimpleNamespace
 from graphql import GraphQLError
 from main.modules.Project.ProjectModel import ProjectModel
@@ -102,31 +103,44 @@ def project_role(roles=None):
         return wrapper
     return decorator
 
-def cache_response(cache_prefix, *identifier_keys):
+def cache_response(cache_prefix, *identifier_keys, soft_ttl=None, hard_ttl=None):
     """
     Decorator to cache the response of a method based on a constructed cache key,
     with support for tagging cache entries for easy invalidation.
     Tags will include the cache prefix followed by each identifier key and its value.
+
+    Misses are recomputed by a single request at a time: the others wait up to
+    CACHE_LOCK_WAIT seconds for its result instead of all running the query.
+    Responses keyed by a project_id are the same for every member of the project
+    (project_role checks the membership before the cache), so collaborators share
+    one entry and one recomputation. Other responses are cached per user.
+
+    Passing soft_ttl and hard_ttl (seconds) enables stale-while-revalidate: a response
+    older than soft_ttl is still served while one request refreshes it, and it expires
+    after hard_ttl. An untagged copy is kept for hard_ttl as well, and is served to
+    waiters when recomputing an invalidated entry takes longer than CACHE_LOCK_WAIT.
     """
+    if soft_ttl and not hard_ttl:
+        raise ValueError('cache_response: hard_ttl is required when soft_ttl is set')
+
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
+            if os.getenv('CACHE_DISABLED') == '1':
+                return func(*args, **kwargs)
+
             # Extract the user from the `info` context, which is assumed to be the second argument
             user = args[1].context.get('user') if len(args) > 1 and hasattr(args[1], 'context') else None
             if not user:
                 #try second arg index (sometimes it is different)
                 user = args[2].context.get('user') if len(args) > 1 and hasattr(args[2], 'context') else None
-            user_part = f"{user.id}_" if user else ""
+            project_scoped = 'project_id' in identifier_keys and kwargs.get('project_id')
+            user_part = f"{user.id}_" if user and not project_scoped else ""
 
             # Construct the cache key with named identifier variables
             identifiers = "_".join(f"{key}:{kwargs.get(key)}" for key in identifier_keys if key in kwargs)
             cache_key = f"{cache_prefix}{user_part}{identifiers}"
 
-            # Attempt to retrieve the cached response
-            cached_response = Cache().get(cache_key)
-            if cached_response:
-                return cached_response
-
             # Define tags based on cache_prefix, user_part and individual identifier keys with their values
             tags = [cache_prefix]
             if user_part:
@@ -136,10 +150,92 @@ def cache_response(cache_prefix, *identifier_keys):
                     # Include both the identifier key and its value in the tag
                     tags.append(f"{cache_prefix}{key}:{kwargs.get(key)}")
 
-            # Call the original function and cache its response with tags
-            response = func(*args, **kwargs)
-            Cache().set(cache_key, response, tags=tags)
-            return response
+            cache = Cache()
+            if soft_ttl:
+                return _stale_while_revalidate(cache, cache_key, tags, lambda: func(*args, **kwargs), soft_ttl, hard_ttl)
+
+            # Attempt to retrieve the cached response
+            cached_response = cache.get(cache_key)
+            if cached_response is not None:
+                return cached_response
+
+            def compute():
+                # Call the original function and cache its response with tags
+                response = func(*args, **kwargs)
+                cache.set(cache_key, response, tags=tags)
+                return response
+
+            return _single_flight(cache, cache_key, compute, lambda: cache.get(cache_key))
 
         return wrapper
     return decorator
+
+
+def _single_flight(cache, cache_key, compute, lookup, fallback=None):
+    """
+    Recompute a missing cache entry in at most one request at a time.
+
+    The request that takes the lock runs compute(). The others poll lookup() for
+    its result, and once CACHE_LOCK_WAIT runs out return fallback() if that has a
+    value, or else compute the response themselves.
+    """
+    token = cache.acquire_lock(cache_key, int(os.getenv('CACHE_LOCK_TIMEOUT', 10)))
+    if token:
+        try:
+            # The previous lock holder may have stored the response just before we got the lock
+            response = lookup()
+            if response is not None:
+                return response
+            return compute()
+        finally:
+            cache.release_lock(cache_key, token)
+
+    deadline = time.monotonic() + float(os.getenv('CACHE_LOCK_WAIT', 2))
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        response = lookup()
+        if response is not None:
+            return response
+
+    if fallback:
+        response = fallback()
+        if response is not None:
+            return response
+    return compute()
+
+
+def _stale_while_revalidate(cache, cache_key, tags, func, soft_ttl, hard_ttl):
+    """Serve a cache_response entry that is refreshed after soft_ttl and dropped after hard_ttl."""
+    stale_key = f"{cache_key}:stale"
+
+    def compute():
+        response = func()
+        entry = {'response': response, 'fresh_until': time.time() + soft_ttl}
+        cache.set(cache_key, entry, timeout=hard_ttl, tags=tags)
+        # Untagged, so it outlives invalidation and can be served while the entry is recomputed
+        cache.set(stale_key, entry, timeout=hard_ttl)
+        return response
+
+    entry = cache.get(cache_key)
+    if entry is not None:
+        if entry['fresh_until'] > time.time():
+            return entry['response']
+
+        # Soft expired: one request refreshes it, everyone else keeps getting the stale response
+        token = cache.acquire_lock(cache_key, int(os.getenv('CACHE_LOCK_TIMEOUT', 10)))
+        if not token:
+            return entry['response']
+        try:
+            return compute()
+        finally:
+            cache.release_lock(cache_key, token)
+
+    def lookup():
+        entry = cache.get(cache_key)
+        return entry['response'] if entry is not None else None
+
+    def fallback():
+        entry = cache.get(stale_key)
+        return entry['response'] if entry is not None else None
+
+    return _single_flight(cache, cache_key, compute, lookup, fallback)
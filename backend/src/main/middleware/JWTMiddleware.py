@@ -3,8 +3,8 @@ import hashlib
 import json
 from flask import request, g, Response
 from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
-from main.modules.User.UserModel import UserModel
-from main.modules.Auth.RevokedTokenModel import RevokedTokenModel
+from main.modules.User.UserService import UserService
+from main.modules.Auth.TokenRevocation import TokenRevocation
 
 def JWTMiddleware():
     if request.method != 'POST' or request.method == 'OPTIONS':
@@ -38,13 +38,13 @@ def JWTMiddleware():
 
             # Check if the token has been revoked
             token_hash = hashlib.sha256(token.encode()).hexdigest()
-            if RevokedTokenModel.objects(token_hash=token_hash):
+            if TokenRevocation.is_revoked(token_hash):
                 error_response = json.dumps({'error': 'Token has been revoked'})
                 return Response(error_response, status=403, mimetype='application/json')
 
             # Fetch user from token identity
             user_id = get_jwt_identity()
-            user = UserModel.objects(id=user_id).first()
+            user = UserService.get_cached_user(user_id)
             if user:
                 # Store user and auth status in global object if
                 g.user = user
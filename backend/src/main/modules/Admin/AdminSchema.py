@@ -3,6 +3,7 @@ from graphene import ObjectType, Mutation, Field, Int, String, Boolean, List
 from graphql import GraphQLError
 from main.libraries.decorators import admin_required
 from graphene.types import Scalar
+from graphene.types.generic import GenericScalar
 from graphql.language import ast
 from .AdminService import AdminService
 import json
@@ -75,6 +76,27 @@ class PlatformStats(ObjectType):
         except Exception as e:
             raise GraphQLError(str(e))
 
+class CacheStats(ObjectType):
+    """
+    CacheStats GraphQL Object Type
+
+    Exposes runtime statistics of the caching layer for the worker that serves
+    the request, such as Redis connection pool usage and hit rates per cache tier.
+    """
+    redis_pools = GenericScalar()
+    tiers = GenericScalar()
+
+    @classmethod
+    @admin_required(required_level=1)
+    def resolve_cache_statistics(cls, root, info):
+        """
+        Resolver method for fetching cache statistics.
+        """
+        try:
+            return CacheStats(**AdminService.get_cache_statistics())
+        except Exception as e:
+            raise GraphQLError(str(e))
+
 class PlatformSetting(ObjectType):
     """
     PlatformSetting GraphQL Object Type for querying platform settings.
@@ -146,6 +168,7 @@ class UpdatePlatformSetting(Mutation):
 def get_query_fields():
     return {
         'platform_statistics': Field(PlatformStats, start_date=String(), end_date=String(), resolver=PlatformStats.resolve_statistics),
+        'cache_statistics': Field(CacheStats, resolver=CacheStats.resolve_cache_statistics),
         'platform_setting': Field(PlatformSetting, key=String(required=True), resolver=PlatformSetting.resolve_platform_setting),
         'list_platform_settings': Field(List(PlatformSetting), resolver=PlatformSetting.resolve_list_platform_settings)
     }
@@ -13,6 +13,9 @@ from main.modules.CharacterProfile.CharacterProfileModel import CharacterProfile
 from main.modules.LocationProfile.LocationProfileModel import LocationProfileModel
 from main.modules.SuggestedStoryTitle.SuggestedStoryTitleModel import SuggestedStoryTitleModel
 
+from main.libraries.RedisConnection import RedisConnection
+from main.libraries.Cache import Cache
+
 from .PlatformSettingModel import PlatformSettingModel
 
 class AdminService:
@@ -51,6 +54,14 @@ class AdminService:
 
         return statistics
 
+    @staticmethod
+    def get_cache_statistics():
+        """Returns runtime statistics for the caching layer of this worker process."""
+        return {
+            'redis_pools': RedisConnection.get_pool_stats(),
+            'tiers': Cache.get_statistics(),
+        }
+
     @staticmethod
     def register_platform_setting(key, value):
         """Registers a new platform setting with a unique key."""
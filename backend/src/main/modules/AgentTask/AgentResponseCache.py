@@ -0,0 +1,111 @@
+import os
+import json
+import time
+import hashlib
+from dotenv import load_dotenv
+from main.libraries.RedisConnection import RedisConnection
+from main.libraries.functions import log_message
+
+load_dotenv()
+
+class AgentResponseCache:
+    """
+    Content addressed cache of LLM results, keyed by a hash of the normalized request
+    (model, temperature, system role, prompt and token limits) of an agent task.
+
+    Opt-in per model through AGENT_RESPONSE_CACHE_MODELS (a comma separated list, or *).
+    Entries expire after AGENT_RESPONSE_CACHE_TTL seconds, results larger than
+    AGENT_RESPONSE_CACHE_MAX_ENTRY_BYTES are not cached, and once there are more than
+    AGENT_RESPONSE_CACHE_MAX_ENTRIES entries the oldest ones are dropped.
+    """
+
+    @staticmethod
+    def key_prefix():
+        return f"{os.getenv('APP_ID', '')}agent_response_"
+
+    @staticmethod
+    def index_key():
+        # Sorted set of the cached request hashes, scored by the time they were cached
+        return f"{AgentResponseCache.key_prefix()}index"
+
+    @staticmethod
+    def enabled_for(llm_model):
+        """Whether results of a model are cached."""
+        if os.getenv('CACHE_DISABLED') == '1':
+            return False
+        models = [model.strip() for model in os.getenv('AGENT_RESPONSE_CACHE_MODELS', '').split(',') if model.strip()]
+        return '*' in models or llm_model in models
+
+    @staticmethod
+    def should_reuse(temperature, reuse_cached_results=False):
+        """
+        Whether a request may be answered from the cache: when its output is meant to
+        be deterministic (a temperature of 0), or when reuse was asked for explicitly.
+        """
+        return bool(reuse_cached_results) or temperature == 0
+
+    @staticmethod
+    def request_hash(llm_model, temperature, system_role, prompt_text, max_input_tokens, max_output_tokens):
+        """Hash of the normalized request, requests differing only in line endings or outer whitespace match."""
+        def normalize(text):
+            return (text or '').replace('\r\n', '\n').strip()
+
+        request = json.dumps([
+            llm_model,
+            float(temperature or 0),
+            normalize(system_role),
+            normalize(prompt_text),
+            max_input_tokens,
+            max_output_tokens,
+        ])
+        return hashlib.sha256(request.encode()).hexdigest()
+
+    @staticmethod
+    def get(request_hash):
+        """
+        Look up the cached result of a request.
+
+        :return: A dictionary with the agent_results, output_tokens_used and task_id of
+                 the task that produced them, or None.
+        """
+        try:
+            cached = RedisConnection.get_client().get(f"{AgentResponseCache.key_prefix()}{request_hash}")
+            return json.loads(cached) if cached else None
+        except Exception as e:
+            log_message('error', f"Error reading agent response cache: {e}")
+            return None
+
+    @staticmethod
+    def set(request_hash, task_id, agent_results, output_tokens_used=None):
+        """Cache the result of a completed request, dropping the oldest entries beyond the cap."""
+        entry = json.dumps({
+            'agent_results': agent_results,
+            'output_tokens_used': output_tokens_used,
+            'task_id': str(task_id),
+        })
+        if len(entry) > int(os.getenv('AGENT_RESPONSE_CACHE_MAX_ENTRY_BYTES', 262144)):
+            return False
+
+        ttl = int(os.getenv('AGENT_RESPONSE_CACHE_TTL', 86400))
+        max_entries = int(os.getenv('AGENT_RESPONSE_CACHE_MAX_ENTRIES', 10000))
+        prefix = AgentResponseCache.key_prefix()
+        index_key = AgentResponseCache.index_key()
+        now = time.time()
+        try:
+            redis_client = RedisConnection.get_client()
+            pipe = redis_client.pipeline()
+            pipe.setex(f"{prefix}{request_hash}", ttl, entry)
+            pipe.zadd(index_key, {request_hash: now})
+            # Entries that expired by themselves leave the index too
+            pipe.zremrangebyscore(index_key, '-inf', now - ttl)
+            pipe.zcard(index_key)
+            entry_count = pipe.execute()[-1]
+
+            if entry_count > max_entries:
+                oldest = redis_client.zpopmin(index_key, entry_count - max_entries)
+                if oldest:
+                    redis_client.delete(*[f"{prefix}{member.decode('utf-8')}" for member, score in oldest])
+            return True
+        except Exception as e:
+            log_message('error', f"Error writing agent response cache: {e}")
+            return False
@@ -0,0 +1,158 @@
+import time
+import threading
+from main.modules.User.UserService import UserService
+from main.libraries.functions import replace_text_segment, log_message
+
+class AgentTaskHandlers:
+    """
+    Registry of the handlers applying the results of completed agent tasks, keyed by
+    document type. Modules register a handler for each document type they generate,
+    see AgentTaskListener.register_listeners, and handle() runs the one of a task.
+
+    Handler runs are timed per document type, see get_statistics().
+
+    Handlers record what they created in the task metadata (RESULT_FIELDS) and skip a
+    step already recorded, so a run retried after a failure, or replayed, does not
+    apply the results twice. Resetting a task clears them for its next run.
+    """
+
+    # The task metadata recording the documents and tasks created from its results
+    RESULT_FIELDS = ('generated_document', 'created_scenes', 'generated_suggestion', 'generated_script_task')
+
+    handlers = {}
+
+    # Runs, errors and time spent per document type in this process
+    statistics = {}
+    statistics_lock = threading.Lock()
+
+    @staticmethod
+    def register(document_type, handler):
+        """
+        Register the handler of completed tasks of a document type.
+
+        :param document_type: The document_type of agent tasks, e.g. 'SceneText'.
+        :param handler: A function taking the completed AgentTaskModel.
+        """
+        AgentTaskHandlers.handlers[document_type] = handler
+
+    @staticmethod
+    def handle(task):
+        """Run the handler registered for the document type of a completed task, if there is one."""
+        handler = AgentTaskHandlers.handlers.get(task.document_type)
+        if not handler:
+            return
+
+        start = time.perf_counter()
+        failed = False
+        try:
+            handler(task)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            AgentTaskHandlers.record_timing(task.document_type, elapsed_ms, failed)
+            log_message('info', f"Applied {task.document_type} results of agent task {task.id} in {elapsed_ms:.0f}ms")
+
+    @staticmethod
+    def record_timing(document_type, elapsed_ms, failed=False):
+        with AgentTaskHandlers.statistics_lock:
+            statistics = AgentTaskHandlers.statistics.setdefault(document_type, {'runs': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            statistics['runs'] += 1
+            statistics['errors'] += 1 if failed else 0
+            statistics['total_ms'] += elapsed_ms
+            statistics['max_ms'] = max(statistics['max_ms'], elapsed_ms)
+
+    @staticmethod
+    def get_statistics():
+        """Report runs, errors, and average and maximum time of the handlers of each document type in this process."""
+        with AgentTaskHandlers.statistics_lock:
+            return {
+                document_type: {
+                    'runs': statistics['runs'],
+                    'errors': statistics['errors'],
+                    'average_ms': round(statistics['total_ms'] / statistics['runs'], 1),
+                    'max_ms': round(statistics['max_ms'], 1),
+                }
+                for document_type, statistics in AgentTaskHandlers.statistics.items()
+            }
+
+    @staticmethod
+    def load_user(user_id):
+        """
+        Load the user who requested a task from the user cache of this worker, as one
+        user's tasks tend to complete in bursts.
+        """
+        if not user_id:
+            return None
+        return UserService.get_cached_user(user_id)
+
+    @staticmethod
+    def apply_generated_text(task, source_text, user, create_new_version, metadata_fields, **arguments):
+        """
+        Create a new version of a versioned document from the results of a task.
+
+        The field named by the update_field metadata (text_content by default) gets the
+        results, or only the selected part of it for selective tasks. The metadata_fields
+        take their value from the task metadata when it has one, the rest come from the
+        source document.
+
+        :param source_text: The document the task was generated for.
+        :param user: The user who requested the task.
+        :param create_new_version: The create_new_version method of the document's service.
+        :param metadata_fields: The fields the task metadata may set, e.g. ('text_seed', 'text_notes').
+        :param arguments: Further arguments for create_new_version.
+        :return: The new version, or None if the task already created it.
+        """
+        metadata = task.metadata
+        if metadata.get('generated_document'):
+            log_message('info', f"Agent task {task.id} already created version {metadata['generated_document']}, skipped")
+            return None
+
+        values = {field: metadata.get(field, getattr(source_text, field)) for field in metadata_fields}
+        values['text_content'] = source_text.text_content  # default initially to existing value
+
+        field_to_update = metadata.get('update_field', 'text_content')
+        if field_to_update in values:
+            select_text_start = metadata.get('select_text_start', None)
+            select_text_end = metadata.get('select_text_end', None)
+            if metadata.get('selective', False) and (select_text_start or select_text_end):
+                # replace a portion of the text with the agent results
+                values[field_to_update] = replace_text_segment(values[field_to_update], select_text_start, select_text_end, task.agent_results)
+            else:
+                # replace the entire text with agent results
+                values[field_to_update] = task.agent_results
+        else:
+            log_message('error', f"Agent task {task.id} cannot update field {field_to_update} of {task.document_type}")
+
+        new_version = create_new_version(
+            source_text=source_text,
+            user=user,
+            version_type=metadata.get('new_version_type', 'generation'),
+            llm_model=task.llm_model,
+            **values,
+            **arguments
+        )
+
+        # Once new version is created, update the agent task metadata with new document ID
+        task.metadata['generated_document'] = str(new_version.id)
+        task.save()
+
+        return new_version
+
+    @staticmethod
+    def versioned_document_handler(model, create_new_version, metadata_fields, **arguments):
+        """
+        Build a handler creating a new version of a document from the results of a task,
+        for document types needing nothing more than apply_generated_text().
+        """
+        def handler(task):
+            source_text = model.objects(id=task.document_id).first()
+            if not source_text:
+                return
+            user = AgentTaskHandlers.load_user(task.metadata.get('created_by'))
+            if not user:
+                return #must be a user ID related
+            AgentTaskHandlers.apply_generated_text(task, source_text, user, create_new_version, metadata_fields, **arguments)
+
+        return handler
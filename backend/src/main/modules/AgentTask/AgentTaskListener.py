@@ -1,5 +1,5 @@
 from .AgentTaskService import AgentTaskService
-from main.modules.User.UserModel import UserModel
+from .AgentTaskHandlers import AgentTaskHandlers
 from main.modules.Project.ProjectModel import ProjectModel
 from main.modules.StoryText.StoryTextService import StoryTextService
 from main.modules.StoryText.StoryTextModel import StoryTextModel
@@ -12,7 +12,9 @@ from main.modules.ScriptText.ScriptTextModel import ScriptTextModel
 from main.modules.SuggestedStoryTitle.SuggestedStoryTitleService import SuggestedStoryTitleService
 from main.modules.CharacterProfile.CharacterProfileService import CharacterProfileService
 from main.modules.CharacterProfile.CharacterProfileModel import CharacterProfileModel
-from main.libraries.functions import extract_and_parse_json, replace_text_segment
+from main.modules.LocationProfile.LocationProfileService import LocationProfileService
+from main.modules.LocationProfile.LocationProfileModel import LocationProfileModel
+from main.libraries.functions import extract_and_parse_json
 from main.libraries.Websocket import Websocket
 from main.libraries.functions import log_message
 
@@ -49,422 +51,8 @@ class AgentTaskListener:
         task = event.data['task']
 
         if task.status == 'completed':
-            document_id = task.document_id
-            document_type = task.document_type
-
-            # Determine the service class and model class to use based on document_type
-            if document_type == 'StoryText':
-                # Load the source text document
-                source_text = StoryTextModel.objects(id=document_id).first()
-                if not source_text:
-                    return
-
-                # Load the user who initiated the request
-                user_id = task.metadata.get('created_by')
-                user = UserModel.objects(id=user_id).first()
-                if not user:
-                    return #must be a user ID related
-
-                version_type = task.metadata.get('new_version_type', 'generation')
-                is_selective = task.metadata.get('selective', False)
-                select_text_start = task.metadata.get('select_text_start', None)
-                select_text_end = task.metadata.get('select_text_end', None)
-
-                text_seed = task.metadata.get('text_seed', source_text.text_seed)
-                text_notes = task.metadata.get('text_notes', source_text.text_notes)
-                text_content = source_text.text_content #default initially to existing value
-
-                #update relevant field
-                field_to_update = task.metadata.get('update_field', 'text_content')
-                if field_to_update == 'text_content':
-                    if is_selective and (select_text_start or select_text_end):
-                        #replace a portion of the text with the agent results
-                        text_content = replace_text_segment(text_content, select_text_start, select_text_end, task.agent_results)
-                    else:
-                        #replace the entire text with agent results
-                        text_content = task.agent_results
-                if field_to_update == 'text_notes':
-                    if is_selective and (select_text_start or select_text_end):
-                        #replace a portion of the text with the agent results
-                        text_notes = replace_text_segment(text_notes, select_text_start, select_text_end, task.agent_results)
-                    else:
-                        #replace the entire text with agent results
-                        text_notes = task.agent_results
-                if field_to_update == 'text_seed':
-                    if is_selective and (select_text_start or select_text_end):
-                        #replace a portion of the text with the agent results
-                        text_seed = replace_text_segment(text_seed, select_text_start, select_text_end, task.agent_results)
-                    else:
-                        #replace the entire text with agent results
-                        text_seed = task.agent_results
-
-                # Create new version using the agent results
-                new_story_text = StoryTextService.create_new_version(
-                    source_text=source_text,
-                    user=user,
-                    version_type=version_type,
-                    text_content=text_content,
-                    llm_model=task.llm_model,
-                    text_seed=text_seed,
-                    text_notes=text_notes
-                )
-
-                # Once new version is created, update the agent task metadata with new document ID
-                task.metadata['generated_document'] = str(new_story_text.id)
-                task.save()
-
-            if document_type == 'SceneText':
-                # Load the source text document
-                source_text = SceneTextModel.objects(id=document_id).first()
-                if not source_text:
-                    return
-
-                # Load the user who initiated the request
-                user_id = task.metadata.get('created_by')
-                user = UserModel.objects(id=user_id).first()
-                if not user:
-                    return #must be a user ID related
-
-                version_type = task.metadata.get('new_version_type', 'generation')
-                is_selective = task.metadata.get('selective', False)
-                select_text_start = task.metadata.get('select_text_start', None)
-                select_text_end = task.metadata.get('select_text_end', None)
-
-                text_seed = task.metadata.get('text_seed', source_text.text_seed)
-                text_notes = task.metadata.get('text_notes', source_text.text_notes)
-                text_content = source_text.text_content #default initially to existing value
-
-                #update relevant field
-                field_to_update = task.metadata.get('update_field', 'text_content')
-                if field_to_update == 'text_content':
-                    if is_selective and (select_text_start or select_text_end):
-                        #replace a portion of the text with the agent results
-                        text_content = replace_text_segment(text_content, select_text_start, select_text_end, task.agent_results)
-                    else:
-                        #replace the entire text with agent results
-                        text_content = task.agent_results
-                if field_to_update == 'text_notes':
-                    if is_selective and (select_text_start or select_text_end):
-                        #replace a portion of the text with the agent results
-                        text_notes = replace_text_segment(text_notes, select_text_start, select_text_end, task.agent_results)
-                    else:
-                        #replace the entire text with agent results
-                        text_notes = task.agent_results
-                if field_to_update == 'text_seed':
-                    if is_selective and (select_text_start or select_text_end):
-                        #replace a portion of the text with the agent results
-                        text_seed = replace_text_segment(text_seed, select_text_start, select_text_end, task.agent_results)
-                    else:
-                        #replace the entire text with agent results
-                        text_seed = task.agent_results
-
-                # Create new version using the agent results
-                new_scene_text = SceneTextService.create_new_version(
-                    source_text=source_text,
-                    user=user,
-                    version_type=version_type,
-                    title=None, #defaults to existing scene title
-                    text_seed=text_seed,
-                    text_notes=text_notes,
-                    text_content=text_content,
-                    llm_model=task.llm_model
-                )
-
-                # Once new version is created, update the agent task metadata with new document ID
-                task.metadata['generated_document'] = str(new_scene_text.id)
-                task.save()
-
-            if document_type == 'MakeScenes':
-                #Load the source project
-                source_project = ProjectModel.objects(id=document_id).first()
-                if not source_project:
-                    return
-
-                # Load the user who initiated the request
-                user_id = task.metadata.get('created_by')
-                user = UserModel.objects(id=user_id).first()
-                if not user:
-                    return
-
-                try:
-                    # Parse the agent results using the JSON extraction and parsing function
-                    scenes_data = extract_and_parse_json(task.agent_results)
-                except ValueError as e:
-                    # Log error if parsing fails and return
-                    log_message('error', f"Error parsing JSON from agent results: {e}")
-                    return
-
-                if not isinstance(scenes_data, list):
-                    # Log error if parsed data is not a list as expected
-                    log_message('error', "Parsed data is not in the expected list format")
-                    return
-
-                # Call the 'delete all scenes' method to clear existing scenes
-                SceneTextService.delete_all_scenes(project_id=document_id)
-
-                # Loop through parsed scenes and create new scenes
-                created_scene_ids = []
-                for scene in scenes_data:
-                    if not isinstance(scene, list) or len(scene) != 2:
-                        # Log error if scene format is not as expected
-                        log_message('error', "Scene data is not in the expected format (title, description)")
-                        continue
-
-                    title, text_seed = scene
-                    new_scene_text = SceneTextService.create_scene_text(
-                        project_id=document_id,
-                        user=user,
-                        title=title,
-                        text_seed=text_seed
-                    )
-                    created_scene_ids.append(str(new_scene_text.id))
-
-                # Once all new scenes are created, update the task metadata with the new scene IDs
-                task.metadata['created_scenes'] = created_scene_ids
-                task.save()
-
-            if document_type == 'SuggestedStoryTitle':
-                # Load the project associated with the suggestion
-                project = ProjectModel.objects(id=document_id).first()
-                if not project:
-                    # Log the error and return
-                    log_message('error', f"Project with id {document_id} not found.")
-                    return
-
-                # Load the user who initiated the request
-                user_id = task.metadata.get('created_by')
-                user = UserModel.objects(id=user_id).first()
-                if not user:
-                    # Log the error and return
-                    log_message('error', f"User with id {user_id} not found.")
-                    return
-
-                # Take the agent results and use them as the title for the new suggestion
-                title = task.agent_results
-
-                # Create a new SuggestedStoryTitleModel object using the service method
-                new_suggestion = SuggestedStoryTitleService.create_suggestion(
-                    project_id=document_id,
-                    user=user,
-                    title=title
-                )
-
-                # Update the agent task metadata with new suggestion ID
-                task.metadata['generated_suggestion'] = str(new_suggestion.id)
-                task.save()
-
-            if document_type == 'BeatSheet':
-                # Load the source text document
-                source_text = BeatSheetModel.objects(id=document_id).first()
-                if not source_text:
-                    return
-
-                # Load the user who initiated the request
-                user_id = task.metadata.get('created_by')
-                user = UserModel.objects(id=user_id).first()
-                if not user:
-                    return #must be a user ID related
-
-                version_type = task.metadata.get('new_version_type', 'generation')
-                is_selective = task.metadata.get('selective', False)
-                select_text_start = task.metadata.get('select_text_start', None)
-                select_text_end = task.metadata.get('select_text_end', None)
-
-                scene_text_id = task.metadata.get('scene_text_id', source_text.scene_text_id)
-                text_notes = task.metadata.get('text_notes', source_text.text_notes)
-                text_content = source_text.text_content #default initially to existing value
-
-                #update relevant field
-                field_to_update = task.metadata.get('update_field', 'text_content')
-                if field_to_update == 'text_content':
-                    if is_selective and (select_text_start or select_text_end):
-                        #replace a portion of the text with the agent results
-                        text_content = replace_text_segment(text_content, select_text_start, select_text_end, task.agent_results)
-                    else:
-                        #replace the entire text with agent results
-                        text_content = task.agent_results
-                if field_to_update == 'text_notes':
-                    if is_selective and (select_text_start or select_text_end):
-                        #replace a portion of the text with the agent results
-                        text_notes = replace_text_segment(text_notes, select_text_start, select_text_end, task.agent_results)
-                    else:
-                        #replace the entire text with agent results
-                        text_notes = task.agent_results
-                if field_to_update == 'text_seed':
-                    if is_selective and (select_text_start or select_text_end):
-                        #replace a portion of the text with the agent results
-                        text_seed = replace_text_segment(text_seed, select_text_start, select_text_end, task.agent_results)
-                    else:
-                        #replace the entire text with agent results
-                        text_seed = task.agent_results
-
-
-                author_style_id = task.metadata.get('author_style_id', None)
-                style_guideline_id = task.metadata.get('style_guideline_id', None)
-                script_dialog_flavor_id = task.metadata.get('script_dialog_flavor_id', None)
-                screenplay_format = task.metadata.get('screenplay_format', False)
-
-                make_script_text = task.metadata.get('make_script_text', False)
-
-                # Create new version using the agent results
-                new_beat_sheet = BeatSheetService.create_new_version(
-                    source_text=source_text,
-                    user=user,
-                    version_type=version_type,
-                    scene_text_id=scene_text_id,
-                    text_notes=text_notes,
-                    text_content=text_content,
-                    llm_model=task.llm_model,
-                )
-
-                # Once new version is created, update the agent task metadata with new document ID
-                task.metadata['generated_document'] = str(new_beat_sheet.id)
-                task.save()
-
-                if make_script_text:
-                    scene_text = source_text.scene_text_id
-                    latest_script_text_id = scene_text.getLatestScriptTextId()
-
-                    #trigger the generation of some script text
-                    ScriptTextService.generate_from_scene(
-                        scene_key=str(source_text.scene_key),
-                        text_id=latest_script_text_id,
-                        scene_text_id=str(scene_text.id),
-                        user_id=user_id,
-                        include_beat_sheet=True,
-                        author_style_id=author_style_id,
-                        style_guideline_id=style_guideline_id,
-                        script_dialog_flavor_id=script_dialog_flavor_id,
-                        screenplay_format=screenplay_format
-                    )
-
-
-            if document_type == 'ScriptText':
-                # Load the source text document
-                source_text = ScriptTextModel.objects(id=document_id).first()
-                if not source_text:
-                    return
-
-                # Load the user who initiated the request
-                user_id = task.metadata.get('created_by')
-                user = UserModel.objects(id=user_id).first()
-                if not user:
-                    return #must be a user ID related
-
-                version_type = task.metadata.get('new_version_type', 'generation')
-                is_selective = task.metadata.get('selective', False)
-                select_text_start = task.metadata.get('select_text_start', None)
-                select_text_end = task.metadata.get('select_text_end', None)
-
-                scene_text_id = task.metadata.get('scene_text_id', source_text.scene_text_id)
-                text_notes = task.metadata.get('text_notes', source_text.text_notes)
-                text_content = source_text.text_content #default initially to existing value
-
-                #update relevant field
-                field_to_update = task.metadata.get('update_field', 'text_content')
-                if field_to_update == 'text_content':
-                    if is_selective and (select_text_start or select_text_end):
-                        #replace a portion of the text with the agent results
-                        text_content = replace_text_segment(text_content, select_text_start, select_text_end, task.agent_results)
-                    else:
-                        #replace the entire text with agent results
-                        text_content = task.agent_results
-                if field_to_update == 'text_notes':
-                    if is_selective and (select_text_start or select_text_end):
-                        #replace a portion of the text with the agent results
-                        text_notes = replace_text_segment(text_notes, select_text_start, select_text_end, task.agent_results)
-                    else:
-                        #replace the entire text with agent results
-                        text_notes = task.agent_results
-                if field_to_update == 'text_seed':
-                    if is_selective and (select_text_start or select_text_end):
-                        #replace a portion of the text with the agent results
-                        text_seed = replace_text_segment(text_seed, select_text_start, select_text_end, task.agent_results)
-                    else:
-                        #replace the entire text with agent results
-                        text_seed = task.agent_results
-
-
-                author_style_id = task.metadata.get('author_style_id', None)
-                style_guideline_id = task.metadata.get('style_guideline_id', None)
-                script_dialog_flavor_id = task.metadata.get('script_dialog_flavor_id', None)
-                screenplay_format = task.metadata.get('screenplay_format', False)
-
-                # Create new version using the agent results
-                new_script_text = ScriptTextService.create_new_version(
-                    source_text=source_text,
-                    user=user,
-                    version_type=version_type,
-                    scene_text_id=scene_text_id,
-                    text_notes=text_notes,
-                    text_content=text_content,
-                    llm_model=task.llm_model,
-                )
-
-                # Once new version is created, update the agent task metadata with new document ID
-                task.metadata['generated_document'] = str(new_script_text.id)
-                task.save()
-
-            if document_type == 'CharacterProfile':
-                # Load the source text document
-                source_text = CharacterProfileModel.objects(id=document_id).first()
-                if not source_text:
-                    return
-
-                # Load the user who initiated the request
-                user_id = task.metadata.get('created_by')
-                user = UserModel.objects(id=user_id).first()
-                if not user:
-                    return #must be a user ID related
-
-                version_type = task.metadata.get('new_version_type', 'generation')
-                is_selective = task.metadata.get('selective', False)
-                select_text_start = task.metadata.get('select_text_start', None)
-                select_text_end = task.metadata.get('select_text_end', None)
-
-                text_seed = task.metadata.get('text_seed', source_text.text_seed)
-                text_notes = task.metadata.get('text_notes', source_text.text_notes)
-                text_content = source_text.text_content #default initially to existing value
-
-                #update relevant field
-                field_to_update = task.metadata.get('update_field', 'text_content')
-                if field_to_update == 'text_content':
-                    if is_selective and (select_text_start or select_text_end):
-                        #replace a portion of the text with the agent results
-                        text_content = replace_text_segment(text_content, select_text_start, select_text_end, task.agent_results)
-                    else:
-                        #replace the entire text with agent results
-                        text_content = task.agent_results
-                if field_to_update == 'text_notes':
-                    if is_selective and (select_text_start or select_text_end):
-                        #replace a portion of the text with the agent results
-                        text_notes = replace_text_segment(text_notes, select_text_start, select_text_end, task.agent_results)
-                    else:
-                        #replace the entire text with agent results
-                        text_notes = task.agent_results
-                if field_to_update == 'text_seed':
-                    if is_selective and (select_text_start or select_text_end):
-                        #replace a portion of the text with the agent results
-                        text_seed = replace_text_segment(text_seed, select_text_start, select_text_end, task.agent_results)
-                    else:
-                        #replace the entire text with agent results
-                        text_seed = task.agent_results
-
-                # Create new version using the agent results
-                new_character_profile = CharacterProfileService.create_new_version(
-                    source_text=source_text,
-                    user=user,
-                    version_type=version_type,
-                    name=None, #defaults to existing character name
-                    text_seed=text_seed,
-                    text_notes=text_notes,
-                    text_content=text_content,
-                    llm_model=task.llm_model
-                )
-
-                # Once new version is created, update the agent task metadata with new document ID
-                task.metadata['generated_document'] = str(new_character_profile.id)
-                task.save()
+            # Apply the results with the handler of the task's document type
+            AgentTaskHandlers.handle(task)
 
         #send the websocket notification
         AgentTaskListener.broadcast(task)
@@ -472,6 +60,124 @@ class AgentTaskListener:
 
         return
 
+    @staticmethod
+    def make_scenes_completed(task):
+        if task.metadata.get('created_scenes') is not None:
+            return  # Already applied, by an earlier attempt
+
+        #Load the source project
+        source_project = ProjectModel.objects(id=task.document_id).first()
+        if not source_project:
+            return
+
+        # Load the user who initiated the request
+        user = AgentTaskHandlers.load_user(task.metadata.get('created_by'))
+        if not user:
+            return
+
+        try:
+            # Parse the agent results using the JSON extraction and parsing function
+            scenes_data = extract_and_parse_json(task.agent_results)
+        except ValueError as e:
+            # Log error if parsing fails and return
+            log_message('error', f"Error parsing JSON from agent results: {e}")
+            return
+
+        if not isinstance(scenes_data, list):
+            # Log error if parsed data is not in the expected list format
+            log_message('error', "Parsed data is not in the expected list format")
+            return
+
+        # Validate the parsed scenes before replacing anything
+        new_scenes = []
+        for scene in scenes_data:
+            if not isinstance(scene, list) or len(scene) != 2:
+                # Log error if scene format is not as expected
+                log_message('error', "Scene data is not in the expected format (title, description)")
+                continue
+            new_scenes.append((scene[0], scene[1]))
+
+        # Replace the existing scenes with the new ones in bulk
+        created_scenes = SceneTextService.bulk_create_scenes(
+            project_id=task.document_id,
+            user=user,
+            scenes=new_scenes,
+            replace_existing=True
+        )
+        created_scene_ids = [str(scene_text.id) for scene_text in created_scenes]
+
+        # Once all new scenes are created, update the task metadata with the new scene IDs
+        task.metadata['created_scenes'] = created_scene_ids
+        task.save()
+
+    @staticmethod
+    def suggested_story_title_completed(task):
+        if task.metadata.get('generated_suggestion'):
+            return  # Already applied, by an earlier attempt
+
+        # Load the project associated with the suggestion
+        project = ProjectModel.objects(id=task.document_id).first()
+        if not project:
+            # Log the error and return
+            log_message('error', f"Project with id {task.document_id} not found.")
+            return
+
+        # Load the user who initiated the request
+        user_id = task.metadata.get('created_by')
+        user = AgentTaskHandlers.load_user(user_id)
+        if not user:
+            # Log the error and return
+            log_message('error', f"User with id {user_id} not found.")
+            return
+
+        # Take the agent results and use them as the title for the new suggestion
+        new_suggestion = SuggestedStoryTitleService.create_suggestion(
+            project_id=task.document_id,
+            user=user,
+            title=task.agent_results
+        )
+
+        # Update the agent task metadata with new suggestion ID
+        task.metadata['generated_suggestion'] = str(new_suggestion.id)
+        task.save()
+
+    @staticmethod
+    def beat_sheet_completed(task):
+        # Load the source text document
+        source_text = BeatSheetModel.objects(id=task.document_id).first()
+        if not source_text:
+            return
+
+        # Load the user who initiated the request
+        user_id = task.metadata.get('created_by')
+        user = AgentTaskHandlers.load_user(user_id)
+        if not user:
+            return #must be a user ID related
+
+        # Create new version using the agent results
+        AgentTaskHandlers.apply_generated_text(
+            task, source_text, user, BeatSheetService.create_new_version, ('scene_text_id', 'text_notes')
+        )
+
+        if task.metadata.get('make_script_text', False) and not task.metadata.get('generated_script_task'):
+            scene_text = source_text.scene_text_id
+            latest_script_text_id = scene_text.getLatestScriptTextId()
+
+            #trigger the generation of some script text
+            script_task_id = ScriptTextService.generate_from_scene(
+                scene_key=str(source_text.scene_key),
+                text_id=latest_script_text_id,
+                scene_text_id=str(scene_text.id),
+                user_id=user_id,
+                include_beat_sheet=True,
+                author_style_id=task.metadata.get('author_style_id', None),
+                style_guideline_id=task.metadata.get('style_guideline_id', None),
+                script_dialog_flavor_id=task.metadata.get('script_dialog_flavor_id', None),
+                screenplay_format=task.metadata.get('screenplay_format', False)
+            )
+            task.metadata['generated_script_task'] = str(script_task_id)
+            task.save()
+
     @staticmethod
     def agent_task_deleted_listener(event):
         # Placeholder for logic when an agent task is deleted
@@ -479,13 +185,46 @@ class AgentTaskListener:
 
     @staticmethod
     def agent_task_reset_listener(event):
-        # Placeholder for logic when an agent task is reset
-        pass
+        # The results of the next run get applied again
+        task = event.data['task']
+        AgentTaskService.task_events.forget_idempotency_key('agent_task_updated', f"{task.id}:completed")
+
+    @staticmethod
+    def agent_task_updated_key(event):
+        # Results are applied once per task (until it is reset), other updates only broadcast
+        task = event.data['task']
+        return f"{task.id}:completed" if task.status == 'completed' else None
 
     def register_listeners(self):
         #AGENT TASKS
         agent_event_service = AgentTaskService.task_events
         agent_event_service.register('agent_task_created', self.agent_task_created_listener)
-        agent_event_service.register('agent_task_updated', self.agent_task_updated_listener)
+        # Applying results creates versions and may chain more tasks, keep it off the agent's request.
+        # Retried, the handlers skip what an earlier attempt already created
+        agent_event_service.register('agent_task_updated', self.agent_task_updated_listener,
+                                     run_async=True, idempotency_key=self.agent_task_updated_key)
         agent_event_service.register('agent_task_deleted', self.agent_task_deleted_listener)
         agent_event_service.register('agent_task_reset', self.agent_task_reset_listener)
+
+        #COMPLETION HANDLERS, by document type
+        AgentTaskHandlers.register('StoryText', AgentTaskHandlers.versioned_document_handler(
+            StoryTextModel, StoryTextService.create_new_version, ('text_seed', 'text_notes')
+        ))
+        AgentTaskHandlers.register('SceneText', AgentTaskHandlers.versioned_document_handler(
+            SceneTextModel, SceneTextService.create_new_version, ('text_seed', 'text_notes'),
+            title=None  #defaults to existing scene title
+        ))
+        AgentTaskHandlers.register('ScriptText', AgentTaskHandlers.versioned_document_handler(
+            ScriptTextModel, ScriptTextService.create_new_version, ('scene_text_id', 'text_notes')
+        ))
+        AgentTaskHandlers.register('CharacterProfile', AgentTaskHandlers.versioned_document_handler(
+            CharacterProfileModel, CharacterProfileService.create_new_version, ('text_seed', 'text_notes'),
+            name=None  #defaults to existing character name
+        ))
+        AgentTaskHandlers.register('LocationProfile', AgentTaskHandlers.versioned_document_handler(
+            LocationProfileModel, LocationProfileService.create_new_version, ('text_seed', 'text_notes'),
+            name=None  #defaults to existing location name
+        ))
+        AgentTaskHandlers.register('BeatSheet', self.beat_sheet_completed)
+        AgentTaskHandlers.register('MakeScenes', self.make_scenes_completed)
+        AgentTaskHandlers.register('SuggestedStoryTitle', self.suggested_story_title_completed)
@@ -19,6 +19,10 @@ class AgentTaskModel(EncryptedDocument):
     # Define the collection name
     meta = {
         'collection': 'agent_tasks',
+        'indexes': [
+            ('status', 'enqueued', 'created_at'),  # outbox relay
+            ('status', 'processing_at'),  # stuck task sweep
+        ],
         'encrypted_fields': ['prompt_text', 'system_role', 'agent_results']
     }
 
@@ -40,6 +44,11 @@ class AgentTaskModel(EncryptedDocument):
     agent_results = StringField()
     agent_id = StringField(default=None)
     errors = StringField()
+    request_hash = StringField()  # key of the request in the AgentResponseCache, if enabled for the model
+    cache_hit = BooleanField(default=False)  # completed from the AgentResponseCache instead of an LLM
+    enqueued = BooleanField(default=True)  # False while in the outbox, until published to the agents' queue
+    enqueued_at = DateTimeField()
+    requeue_count = IntField(default=0)  # times the outbox sweep re-queued the task after it got stuck
     created_at = DateTimeField(default=datetime.utcnow)
     processing_at = DateTimeField()
     updated_at = DateTimeField(default=datetime.utcnow)
@@ -69,6 +78,7 @@ class AgentTaskModel(EncryptedDocument):
                 'input_tokens_used': self.input_tokens_used,
                 'output_tokens_used': self.output_tokens_used,
                 'process_time': self.process_time,
+                'cache_hit': self.cache_hit,
                 'created_at': self.created_at,
                 'processing_at': self.processing_at,
                 'updated_at': self.updated_at,
@@ -95,7 +105,25 @@ class AgentTaskModel(EncryptedDocument):
                 'agent_results': self.agent_results,
                 'agent_id': self.agent_id,
                 'errors': self.errors,
+                'cache_hit': self.cache_hit,
                 'created_at': self.created_at,
                 'processing_at': self.processing_at,
                 'updated_at': self.updated_at,
             }
+
+    def _to_agent_message(self):
+        """Format an AgentTaskModel instance the way agents load it, for sending along with its queue message"""
+        return {
+            'id': str(self.id),
+            'projectId': str(self.project_id.id) if self.project_id else None,
+            'status': self.status,
+            'documentType': self.document_type,
+            'documentId': str(self.document_id),
+            'llmModel': self.llm_model,
+            'maxInputTokens': self.max_input_tokens,
+            'maxOutputTokens': self.max_output_tokens,
+            'temperature': self.temperature,
+            'systemRole': self.system_role,
+            'promptText': self.prompt_text,
+            'metadata': serialize_complex_obj(self.metadata),
+        }
@@ -0,0 +1,102 @@
+import os
+from datetime import datetime, timedelta
+from .AgentTaskModel import AgentTaskModel
+from .AgentTaskService import AgentTaskService
+from main.libraries.QueueHelper import QueueHelper
+from main.libraries.functions import log_message
+
+class AgentTaskOutbox:
+    """
+    Relays agent tasks from the outbox to the agents' queues. New and reset tasks are
+    saved with enqueued=False, and stay in the outbox until they are published, by
+    the request itself or, with AGENT_TASK_OUTBOX=1 or when that failed, by relay().
+
+    relay() claims each task (enqueued=True) before publishing it, so several relays
+    never publish the same task. Unless AGENT_TASK_OUTBOX=1, it leaves tasks alone
+    for AGENT_TASK_OUTBOX_GRACE seconds after they were saved, while the request
+    publishes them itself.
+
+    sweep() puts tasks back in the outbox when they are stuck: still pending
+    AGENT_TASK_PENDING_TIMEOUT seconds after they were queued, or still processing
+    AGENT_TASK_PROCESSING_TIMEOUT seconds after an agent took them. A task stuck
+    more than AGENT_TASK_MAX_REQUEUES times fails instead. A pending task
+    published again may still have its first message in a queue, the agent getting
+    the second of them finds it claimed (AgentTaskService.claim_agent_task) and
+    drops it. Once a task stuck processing is reset, the agent which had it can no
+    longer complete it (see AgentTaskService.update_agent_task).
+
+    The relayAgentTasks command runs both in a loop.
+    """
+
+    @staticmethod
+    def relay(limit=None):
+        """
+        Publish the tasks waiting in the outbox, oldest first, in one batch.
+
+        :param limit: The most tasks to publish, AGENT_TASK_OUTBOX_BATCH by default.
+        :return: The number of tasks published.
+        """
+        limit = limit or int(os.getenv('AGENT_TASK_OUTBOX_BATCH', 100))
+        now = datetime.utcnow()
+        waiting = {'status': 'pending', 'enqueued': False}
+        if os.getenv('AGENT_TASK_OUTBOX') != '1':
+            waiting['updated_at__lt'] = now - timedelta(seconds=int(os.getenv('AGENT_TASK_OUTBOX_GRACE', 60)))
+
+        # Claimed one at a time, a task claimed by another relay is not found again
+        tasks = []
+        while len(tasks) < limit:
+            task = AgentTaskModel.objects(**waiting).order_by('created_at').modify(
+                set__enqueued=True, set__enqueued_at=now, new=True
+            )
+            if not task:
+                break
+            tasks.append(task)
+        if not tasks:
+            return 0
+
+        try:
+            QueueHelper.publish_many([AgentTaskService.queue_message(task) for task in tasks])
+        except Exception:
+            # Back in the outbox for the next run
+            AgentTaskModel.objects(id__in=[task.id for task in tasks], enqueued_at=now).update(
+                set__enqueued=False, unset__enqueued_at=True
+            )
+            raise
+        log_message('info', f'Relayed {len(tasks)} agent task(s) from the outbox to the queue server')
+        return len(tasks)
+
+    @staticmethod
+    def sweep():
+        """
+        Put tasks stuck pending or processing back in the outbox.
+
+        :return: The number of tasks re-queued.
+        """
+        now = datetime.utcnow()
+        pending_timeout = timedelta(seconds=int(os.getenv('AGENT_TASK_PENDING_TIMEOUT', 1800)))
+        processing_timeout = timedelta(seconds=int(os.getenv('AGENT_TASK_PROCESSING_TIMEOUT', 900)))
+        max_requeues = int(os.getenv('AGENT_TASK_MAX_REQUEUES', 3))
+
+        # Queued but never picked up, e.g. lost with a queue, publish them again
+        stuck_pending = {'status': 'pending', 'enqueued': True, 'enqueued_at__lt': now - pending_timeout}
+        requeued = AgentTaskModel.objects(requeue_count__lt=max_requeues, **stuck_pending).update(
+            set__enqueued=False, inc__requeue_count=1
+        )
+        for task in AgentTaskModel.objects(requeue_count__gte=max_requeues, **stuck_pending):
+            log_message('error', f'Agent task {task.id} was not picked up after {task.requeue_count + 1} tries, giving up')
+            AgentTaskService.update_agent_task(str(task.id), status='error', errors='Not picked up by an agent')
+
+        # Picked up by an agent which never finished them
+        for task in AgentTaskModel.objects(status='processing', processing_at__lt=now - processing_timeout):
+            if (task.requeue_count or 0) >= max_requeues:
+                log_message('error', f'Agent task {task.id} timed out processing {task.requeue_count + 1} times, giving up')
+                AgentTaskService.update_agent_task(str(task.id), status='error', errors='Timed out processing the task')
+                continue
+
+            AgentTaskModel.objects(id=task.id).update(inc__requeue_count=1)
+            AgentTaskService.reset_agent_task(str(task.id))
+            requeued += 1
+
+        if requeued:
+            log_message('warning', f'Re-queued {requeued} stuck agent task(s)')
+        return requeued
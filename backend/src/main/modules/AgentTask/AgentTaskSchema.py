@@ -35,6 +35,7 @@ class AgentTask(ObjectType):
     agent_results = String()
     agent_id = String()
     errors = String()
+    cache_hit = Boolean()
     created_at = DateTime()
     processing_at = DateTime()
     updated_at = DateTime()
@@ -111,6 +112,20 @@ class UpdateAgentTask(Mutation):
 
         return UpdateAgentTask(agent_task=task)
 
+class ClaimAgentTask(Mutation):
+    class Arguments:
+        id = graphene.ID(required=True)
+        agent_id = graphene.String()
+        status_message = graphene.String()
+
+    # None when the task is not pending anymore, the agent leaves it alone then
+    agent_task = graphene.Field(AgentTask)
+
+    @agent_key_required
+    def mutate(self, info, id, agent_id=None, status_message=None):
+        task = AgentTaskService.claim_agent_task(task_id=id, agent_id=agent_id, status_message=status_message)
+        return ClaimAgentTask(agent_task=task._to_dict() if task else None)
+
 class DeleteAgentTask(Mutation):
     class Arguments:
         id = ID(required=True)
@@ -173,6 +188,7 @@ def get_query_fields():
 def get_mutation_fields():
     return {
         'update_agent_task': UpdateAgentTask.Field(),
+        'claim_agent_task': ClaimAgentTask.Field(),
         'delete_agent_task': DeleteAgentTask.Field(),
         'reset_agent_task': ResetAgentTask.Field()
     }
@@ -1,6 +1,8 @@
 import os
 from datetime import datetime
 from .AgentTaskModel import AgentTaskModel
+from .AgentResponseCache import AgentResponseCache
+from .AgentTaskHandlers import AgentTaskHandlers
 from main.libraries.QueueHelper import QueueHelper
 from main.libraries.Event import Event
 from main.libraries.Observable import Observable
@@ -18,11 +20,30 @@ class AgentTaskService:
     # Create an observable instance for the service
     task_events = Observable()
 
+    # Tasks going to the batch lane unless their metadata says otherwise
+    batch_document_types = ('MakeScenes',)
+    batch_version_types = ('magic-note',)
+
     @staticmethod
     def new_agent_task(project_id, document_type, document_id, llm_model, max_input_tokens,
-                       max_output_tokens, temperature, prompt_text, system_role, metadata=None):
-        """Register a new AgentTaskModel object with a status of 'pending'"""
+                       max_output_tokens, temperature, prompt_text, system_role, metadata=None,
+                       reuse_cached_results=False):
+        """
+        Register a new AgentTaskModel object with a status of 'pending'.
+        If the AgentResponseCache has the result of the same request and the request
+        may reuse it, the task is completed right away instead of being queued.
+        """
         try:
+            metadata = metadata or {}
+            if reuse_cached_results:
+                metadata['reuse_cached_results'] = True
+
+            request_hash = None
+            if AgentResponseCache.enabled_for(llm_model):
+                request_hash = AgentResponseCache.request_hash(
+                    llm_model, temperature, system_role, prompt_text, max_input_tokens, max_output_tokens
+                )
+
             task = AgentTaskModel(
                 project_id=project_id,
                 status='pending',
@@ -34,16 +55,21 @@ class AgentTaskService:
                 temperature=temperature,
                 prompt_text=prompt_text,
                 system_role=system_role,
-                metadata=metadata or {}
+                metadata=metadata,
+                request_hash=request_hash
             )
+
+            # A task completed from the cache is never queued, keep it out of the outbox from the start
+            cached = AgentTaskService.cached_response(task, reuse_cached_results)
+            task.enqueued = bool(cached)
             task.save()
 
             #refresh data
             task = AgentTaskModel.objects(id=task.id).first()
 
-            # Push the task ID to the RabbitMQ server
-            QueueHelper.publish_task(task.id, 'agent_task_queue')
-            log_message('info', f'Sent task ID {task.id} to queue server')
+            if not cached:
+                # Push the task ID to the RabbitMQ server, or leave it to the outbox relay
+                AgentTaskService.enqueue_task(task)
 
             #trigger additional event listeners
             AgentTaskService.task_events.notify(Event('agent_task_created', {'task': task}))
@@ -51,6 +77,9 @@ class AgentTaskService:
 
             log_message('info', f'Created new agent task with ID: {task.id}')
 
+            if cached:
+                task = AgentTaskService.complete_from_cache(task, cached)
+
             # Return the created task object
             return task
         except Exception as e:
@@ -58,7 +87,7 @@ class AgentTaskService:
             return None
 
     @staticmethod
-    def new_agent_task_with_prompt(project_id, document_type, document_id, prompt_data, metadata=None):
+    def new_agent_task_with_prompt(project_id, document_type, document_id, prompt_data, metadata=None, reuse_cached_results=False):
         return AgentTaskService.new_agent_task(
             project_id = project_id,
             document_type = document_type,
@@ -69,7 +98,155 @@ class AgentTaskService:
             temperature = prompt_data['temperature'],
             prompt_text = prompt_data['prompt_text'],
             system_role = prompt_data['system_role'],
-            metadata = metadata)
+            metadata = metadata,
+            reuse_cached_results = reuse_cached_results or prompt_data.get('reuse_cached_results', False))
+
+    @staticmethod
+    def enqueue_task(task):
+        """
+        Queue a task saved with enqueued=False for the agents. With AGENT_TASK_OUTBOX=1
+        the task stays in the outbox for the relayAgentTasks command to publish, so
+        requests do not wait on RabbitMQ. Otherwise it is published right away, and
+        left to the relay if that fails.
+        """
+        if os.getenv('AGENT_TASK_OUTBOX') == '1':
+            return
+
+        def mark_enqueued():
+            task.enqueued = True
+            task.enqueued_at = datetime.utcnow()
+            AgentTaskModel.objects(id=task.id).update(set__enqueued=True, set__enqueued_at=task.enqueued_at)
+            log_message('info', f'Sent task ID {task.id} to queue server')
+
+        try:
+            # Inside a QueueHelper.batch() block the task is marked once the batch is published
+            AgentTaskService.publish_task(task, on_published=mark_enqueued)
+        except Exception as e:
+            log_message('error', f'Error sending task ID {task.id} to queue server, left in the outbox: {e}')
+
+    @staticmethod
+    def publish_task(task, on_published=None):
+        """
+        Queue a task for the agents. With AGENT_TASK_PAYLOAD_IN_MESSAGE=1 the task data
+        travels in the message, saving agents the agentTaskById request.
+        """
+        QueueHelper.publish_task(*AgentTaskService.queue_message(task), on_published=on_published)
+
+    @staticmethod
+    def queue_message(task):
+        """The (task_id, queue_name, payload) of a task for QueueHelper."""
+        payload = task._to_agent_message() if os.getenv('AGENT_TASK_PAYLOAD_IN_MESSAGE') == '1' else None
+        return task.id, AgentTaskService.queue_name(task), payload
+
+    @staticmethod
+    def queue_lane(task):
+        """
+        The lane of a task: 'batch' for bulk generation (making all scenes, magic notes)
+        and 'interactive' for the rest, unless the task metadata sets a lane.
+        """
+        lane = task.metadata.get('lane')
+        if lane in ('interactive', 'batch'):
+            return lane
+        if task.document_type in AgentTaskService.batch_document_types \
+                or task.metadata.get('new_version_type') in AgentTaskService.batch_version_types:
+            return 'batch'
+        return 'interactive'
+
+    @staticmethod
+    def queue_name(task):
+        """
+        The queue of a task. With AGENT_TASK_ROUTING=1 tasks are split by lane and by
+        provider (or by model with AGENT_TASK_ROUTE_BY=model), e.g.
+        'agent_task_queue.openai.interactive', so agents can weigh lanes and a backlog
+        of one provider does not hold up the others.
+        """
+        if os.getenv('AGENT_TASK_ROUTING') != '1':
+            return 'agent_task_queue'
+
+        if os.getenv('AGENT_TASK_ROUTE_BY', 'provider') == 'model':
+            route = task.llm_model
+        else:
+            route = next((
+                provider for prefix, provider in settings.llm_model_providers.items()
+                if task.llm_model.startswith(prefix)
+            ), 'openai')
+        return f"agent_task_queue.{route}.{AgentTaskService.queue_lane(task)}"
+
+    @staticmethod
+    def apply_agent_result(message):
+        """
+        Apply a status update or the results of a task, sent by an agent on the
+        agent_results queue instead of through updateAgentTask.
+        Updates arriving after the task already finished are ignored, as messages
+        of one task may be handled out of order by several consumers.
+
+        :return: The updated task, or None if the update was not applied.
+        """
+        task_id = message.get('task_id')
+        fields = {
+            field: message[field] for field in (
+                'status', 'status_message', 'input_tokens_used', 'output_tokens_used',
+                'process_time', 'agent_results', 'agent_id', 'errors'
+            ) if message.get(field) is not None
+        }
+
+        if fields.get('status') == 'processing':
+            # Only a pending task is taken, a late or duplicate update is ignored
+            return AgentTaskService.claim_agent_task(task_id, fields.get('agent_id'), fields.get('status_message'))
+
+        return AgentTaskService.update_agent_task(task_id, **fields)
+
+    @staticmethod
+    def claim_agent_task(task_id, agent_id=None, status_message=None):
+        """
+        Set a pending task to processing for the agent which picked it up, in one
+        atomic update. A task which is not pending is not claimed, e.g. when another
+        agent got a second message of it first, or it finished already.
+
+        :return: The claimed task, or None if the task was not pending.
+        """
+        now = datetime.utcnow()
+        task = AgentTaskModel.objects(id=task_id, status='pending').modify(
+            set__status='processing',
+            set__status_message=status_message or 'Processing generation request...',
+            set__agent_id=agent_id,
+            set__processing_at=now,
+            set__updated_at=now,
+            new=True
+        )
+        if not task:
+            log_message('info', f'Agent task {task_id} is not pending, not claimed by agent {agent_id}')
+            return None
+
+        AgentTaskService.task_events.notify(Event('agent_task_updated', {'task': task}))
+        AgentTaskService.clear_agent_task_cache(task.id)
+        log_message('info', f'Agent task {task_id} claimed by agent {agent_id}')
+        return task
+
+    @staticmethod
+    def cached_response(task, reuse_cached_results=False):
+        """The AgentResponseCache entry a task may be completed with, if there is one."""
+        if not task.request_hash or not AgentResponseCache.should_reuse(task.temperature, reuse_cached_results):
+            return None
+        return AgentResponseCache.get(task.request_hash)
+
+    @staticmethod
+    def complete_from_cache(task, cached):
+        """Complete a task with a cached result, no LLM tokens are used for it."""
+        log_message('info', f"Completing agent task {task.id} with the cached result of task {cached.get('task_id')}")
+        # Held by the cache like an agent holds a claimed task, see update_agent_task()
+        AgentTaskModel.objects(id=task.id, status='pending').update_one(set__status='processing', set__agent_id='response_cache')
+        return AgentTaskService.update_agent_task(
+            task.id,
+            status='completed',
+            status_message='Completed request from cache',
+            input_tokens_used=0,
+            output_tokens_used=0,
+            process_time=0,
+            agent_results=cached['agent_results'],
+            agent_id='response_cache',
+            cache_hit=True
+        )
 
     @staticmethod
     def load_agent_task_by_id(task_id):
@@ -109,7 +286,7 @@ class AgentTaskService:
 
         # Query the database with filters, sort order, and pagination
         tasks = tasks.filter(query).only(
-            'id', 'status', 'status_message', 'document_type', 'document_id', 'llm_model', 'project_id', 'process_time', 'input_tokens_used', 'output_tokens_used', 'created_at', 'updated_at'
+            'id', 'status', 'status_message', 'document_type', 'document_id', 'llm_model', 'project_id', 'process_time', 'input_tokens_used', 'output_tokens_used', 'cache_hit', 'created_at', 'updated_at'
         ).order_by(sort_order)
 
         # caclulate the number of pages based on total number of records
@@ -130,6 +307,7 @@ class AgentTaskService:
             'process_time': task.process_time,
             'input_tokens_used': task.input_tokens_used,
             'output_tokens_used': task.output_tokens_used,
+            'cache_hit': task.cache_hit,
             'created_at': task.created_at,
             'updated_at': task.updated_at
         } for task in tasks]
@@ -154,15 +332,28 @@ class AgentTaskService:
     @staticmethod
     def update_agent_task(task_id, status=None, status_message=None, input_tokens_used=None,
                           output_tokens_used=None, process_time=None, agent_results=None,
-                          agent_id=None, errors=None):
+                          agent_id=None, errors=None, cache_hit=None):
         """
         Updates fields of an agent task for the given ID.
+        Results of completed tasks are added to the AgentResponseCache if it is enabled for their model.
+
+        An agent (agent_id given) finishes only a task it still holds, processing and
+        claimed by it. A task reset after it got stuck may be pending or claimed by
+        another agent by the time the first one reports back.
+
+        :return: The updated task, or None if it was not found or not held by the agent.
         """
         task = AgentTaskModel.objects(id=task_id).first()
 
         if not task:
             return None  # Or raise an exception if you prefer
 
+        if agent_id is not None and status is not None and status != 'processing':
+            held = AgentTaskModel.objects(id=task_id, status='processing', agent_id=agent_id).update_one(set__status=status)
+            if not held:
+                log_message('warning', f"Agent task {task_id} is not held by agent {agent_id} anymore, its {status} update was rejected")
+                return None
+
         # Update fields if provided
         if status is not None:
             if task.status != 'processing' and status == 'processing':
@@ -182,10 +373,15 @@ class AgentTaskService:
             task.agent_id = agent_id
         if errors is not None:
             task.errors = errors
+        if cache_hit is not None:
+            task.cache_hit = cache_hit
 
         task.updated_at = datetime.utcnow()  # Always update the 'updated_at' field
         task.save()  # Save the changes to the database
 
+        if task.status == 'completed' and agent_results and task.request_hash and not task.cache_hit:
+            AgentResponseCache.set(task.request_hash, task.id, agent_results, task.output_tokens_used)
+
         #refresh data
         task = AgentTaskModel.objects(id=task.id).first()
 
@@ -242,17 +438,26 @@ class AgentTaskService:
             task.agent_id = None
             task.errors = None
             task.processing_at = None
+            task.cache_hit = False
+            task.enqueued_at = None
+            # The results of the next run are applied again, see AgentTaskHandlers
+            for field in AgentTaskHandlers.RESULT_FIELDS:
+                task.metadata.pop(field, None)
 
             # Set the status to 'pending'
             task.status = 'pending'
             task.updated_at = datetime.utcnow()
 
+            # Left out of the outbox when it is completed from the cache below
+            cached = AgentTaskService.cached_response(task, task.metadata.get('reuse_cached_results', False))
+            task.enqueued = bool(cached)
+
             # Save the changes to the database
             task.save()
 
-            # code is causing exception
-            # Push the task ID back to the message queue
-            QueueHelper.publish_task(task.id, 'agent_task_queue')
+            if not cached:
+                # Push the task ID back to the message queue
+                AgentTaskService.enqueue_task(task)
 
             #trigger additional event listeners
             AgentTaskService.task_events.notify(Event('agent_task_reset', {'task': task}))
@@ -261,6 +466,9 @@ class AgentTaskService:
             log_message('info', log_message_text)
             AgentTaskService.clear_agent_task_cache(task.id)
 
+            if cached:
+                AgentTaskService.complete_from_cache(task, cached)
+
             return True
         except Exception as e:
             # Log the error or handle it as you see fit
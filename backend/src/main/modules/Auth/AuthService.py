@@ -1,7 +1,8 @@
-from flask_jwt_extended import create_access_token
+from flask_jwt_extended import create_access_token, get_jwt
 from werkzeug.security import check_password_hash, generate_password_hash
 from main.modules.User.UserModel import UserModel
 from .RevokedTokenModel import RevokedTokenModel
+from .TokenRevocation import TokenRevocation
 from .LoginHistoryModel import LoginHistoryModel
 from .PasswordResetRequestModel import PasswordResetRequestModel
 from datetime import timedelta, datetime
@@ -56,6 +57,7 @@ class AuthService:
         token = request.headers.get("Authorization").split()[1]
         token_hash = hashlib.sha256(token.encode()).hexdigest()
         RevokedTokenModel(user=user, token_hash=token_hash).save()
+        TokenRevocation.revoke(token_hash, get_jwt().get('exp'))
 
         # Trigger 'user_logged_out' event and pass the user id
         AuthService.auth_events.notify(Event('user_logged_out', str(user.id)))
@@ -0,0 +1,143 @@
+import os
+import time
+import threading
+import redis
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from main.libraries.RedisConnection import RedisConnection
+from main.libraries.functions import log_message
+from .RevokedTokenModel import RevokedTokenModel
+
+load_dotenv()
+
+class TokenRevocation:
+    """
+    Revoked access tokens, checked by JWTMiddleware on every authenticated request
+    without a database query.
+
+    Revoked token hashes are kept in one Redis hash along with the expiry of their
+    token, so entries are pruned once the token could not be used anyway, and a
+    version field bumped on every revocation. Both live in the same key so Redis
+    cannot evict one without the other. Each worker keeps a copy of the revoked
+    hashes and checks the version at most every AUTH_REVOCATION_REFRESH seconds,
+    loading them again when it changed. A revocation takes effect right away in the
+    worker handling it, and within AUTH_REVOCATION_REFRESH seconds in the others.
+
+    RevokedTokenModel stays the record of revocations: the hash is filled from it
+    whenever Redis does not have it, before a revocation is added as well as on a
+    check, and checks go to it while the cache is disabled (CACHE_DISABLED) or Redis
+    cannot be reached.
+    """
+
+    # Tokens are issued for 30 days (see AuthService.authenticate_user)
+    token_lifetime = timedelta(days=30)
+
+    # Token hashes are hex digests, so they never collide with this field
+    version_field = '_version'
+
+    revoked = set()
+    version = None
+    checked_at = 0
+    lock = threading.Lock()
+
+    @staticmethod
+    def key():
+        return f"{os.getenv('APP_ID', '')}revoked_token_hashes"
+
+    @staticmethod
+    def enabled():
+        return os.getenv('CACHE_DISABLED') != '1'
+
+    @staticmethod
+    def revoke(token_hash, expires_at=None):
+        """
+        Add a revoked token to the Redis hash, loading the hash from the database first
+        if Redis does not have it, so the version is never bumped on a partial hash.
+
+        :param token_hash: The SHA-256 hash of the token, as saved in RevokedTokenModel.
+        :param expires_at: The expiry of the token as a UNIX timestamp, the longest token lifetime if unknown.
+        """
+        with TokenRevocation.lock:
+            TokenRevocation.revoked.add(token_hash)
+        if not TokenRevocation.enabled():
+            return
+
+        expires_at = expires_at or time.time() + TokenRevocation.token_lifetime.total_seconds()
+        try:
+            client = RedisConnection.get_client()
+            with client.pipeline() as pipe:
+                while True:
+                    try:
+                        # Fails the transaction if the hash is evicted or loaded in the meantime
+                        pipe.watch(TokenRevocation.key())
+                        if not pipe.exists(TokenRevocation.key()):
+                            pipe.unwatch()
+                            TokenRevocation.load_from_database(client)
+                            continue
+                        pipe.multi()
+                        pipe.hset(TokenRevocation.key(), token_hash, expires_at)
+                        pipe.hincrby(TokenRevocation.key(), TokenRevocation.version_field, 1)
+                        pipe.execute()
+                        return
+                    except redis.WatchError:
+                        continue
+        except Exception as e:
+            log_message('error', f'Error adding revoked token to Redis: {e}')
+
+    @staticmethod
+    def is_revoked(token_hash):
+        """Whether a token has been revoked, by the hash of the token."""
+        if not TokenRevocation.enabled():
+            return bool(RevokedTokenModel.objects(token_hash=token_hash).first())
+
+        try:
+            TokenRevocation.refresh()
+        except Exception as e:
+            log_message('error', f'Error loading revoked tokens from Redis, checking the database: {e}')
+            return bool(RevokedTokenModel.objects(token_hash=token_hash).first())
+
+        return token_hash in TokenRevocation.revoked
+
+    @staticmethod
+    def refresh():
+        """Load the revoked tokens from Redis if the hash changed since the last check of this worker."""
+        now = time.monotonic()
+        if now - TokenRevocation.checked_at < float(os.getenv('AUTH_REVOCATION_REFRESH', 1)):
+            return
+
+        with TokenRevocation.lock:
+            if now - TokenRevocation.checked_at < float(os.getenv('AUTH_REVOCATION_REFRESH', 1)):
+                return
+
+            client = RedisConnection.get_client()
+            version = client.hget(TokenRevocation.key(), TokenRevocation.version_field)
+            if version is None:
+                version = TokenRevocation.load_from_database(client)
+            if version != TokenRevocation.version:
+                entries = client.hgetall(TokenRevocation.key())
+                entries.pop(TokenRevocation.version_field.encode('utf-8'), None)
+                expired = [member for member, expires_at in entries.items() if float(expires_at) <= time.time()]
+                if expired:
+                    client.hdel(TokenRevocation.key(), *expired)
+                TokenRevocation.revoked = {member.decode('utf-8') for member in entries if member not in expired}
+                TokenRevocation.version = version
+            TokenRevocation.checked_at = now
+
+    @staticmethod
+    def load_from_database(client):
+        """Fill the Redis hash with the revocations of tokens which may not have expired yet."""
+        since = datetime.utcnow() - TokenRevocation.token_lifetime
+        revoked = {
+            revoked_token.token_hash: (revoked_token.revoked_at + TokenRevocation.token_lifetime).replace(tzinfo=timezone.utc).timestamp()
+            for revoked_token in RevokedTokenModel.objects(revoked_at__gt=since).only('token_hash', 'revoked_at')
+        }
+
+        pipe = client.pipeline()
+        if revoked:
+            pipe.hset(TokenRevocation.key(), mapping=revoked)
+        # Only the first worker to get here sets the version, the others load what it added
+        pipe.hsetnx(TokenRevocation.key(), TokenRevocation.version_field, 1)
+        pipe.hget(TokenRevocation.key(), TokenRevocation.version_field)
+        version = pipe.execute()[-1]
+        log_message('info', f'Loaded {len(revoked)} revoked token(s) into Redis')
+        return version
@@ -1,11 +1,11 @@
-from main.libraries.EncryptedDocument import EncryptedDocument
+from main.libraries.DeltaVersionedDocument import DeltaVersionedDocument
 from mongoengine import Document, StringField, ReferenceField, IntField, DateTimeField, UUIDField
 from datetime import datetime
 from main.modules.SceneText.SceneTextModel import SceneTextModel
 from main.modules.User.UserModel import UserModel
 import uuid
 
-class BeatSheetModel(EncryptedDocument):
+class BeatSheetModel(DeltaVersionedDocument):
     """
     BeatSheetModel represents a beat sheet document in MongoDB.
 
@@ -28,11 +28,13 @@ class BeatSheetModel(EncryptedDocument):
         'collection': 'beat_sheets',
         'indexes': [
             'scene_key',
+            ('scene_key', '-version_number'),
             'version_number',
             'created_at',
         ],
         'ordering': ['-created_at'],  # Documents will be ordered by 'created_at' in descending order by default.
         'encrypted_fields': ['text_notes', 'text_content', 'version_label'], 
+        'delta_fields': ['text_notes', 'text_content'],
     }
 
     scene_key = UUIDField(binary=False, default=uuid.uuid4, unique=False)
@@ -9,6 +9,7 @@ from uuid import UUID
 from main.modules.UserPreference.UserPreferenceService import UserPreferenceService
 from main.libraries.Event import Event
 from main.libraries.Observable import Observable
+from main.libraries.DocumentHeads import DocumentHeads
 from main.libraries.Cache import Cache
 
 class BeatSheetService:
@@ -16,6 +17,9 @@ class BeatSheetService:
     # Create an observable instance for the service
     events = Observable()
 
+    # Current version and version counter of every beat sheet
+    heads = DocumentHeads(BeatSheetModel, 'scene_key')
+
     @staticmethod
     def init_beat_sheet(scene_key, user, scene_text_id):
         """
@@ -33,7 +37,7 @@ class BeatSheetService:
         except InvalidId as e:
             raise ValueError(f"Invalid ObjectId: {e}")
 
-        latest_beat_sheet = BeatSheetModel.objects(scene_key=scene_key_oid).order_by('-version_number').first()
+        latest_beat_sheet = BeatSheetService.heads.get(scene_key_oid)
 
         if latest_beat_sheet:
             return str(latest_beat_sheet.id)
@@ -47,6 +51,7 @@ class BeatSheetService:
             )
 
             new_beat_sheet.save()
+            BeatSheetService.heads.reset(new_beat_sheet.scene_key, new_beat_sheet)
 
             #refresh data
             new_beat_sheet = BeatSheetModel.objects(id=new_beat_sheet.id).first()
@@ -77,12 +82,30 @@ class BeatSheetService:
                 if version_number:
                     return BeatSheetModel.objects(scene_key=oid, version_number=version_number).first()
                 else:
-                    return BeatSheetModel.objects(scene_key=oid).order_by('-version_number').first()
+                    return BeatSheetService.heads.get(oid)
             else:
                 raise ValueError("Either text_id or scene_key must be provided.")
         except InvalidId as e:
             raise ValueError(f"Invalid ObjectId: {e}")
 
+    @staticmethod
+    def get_latest_beat_sheet_ids(scene_keys):
+        """
+        Look up the latest beat sheet version of several scenes with a single query.
+        Unlike init_beat_sheet, this never creates missing beat sheets.
+
+        :param scene_keys: The keys of the scenes.
+        :return: A dictionary mapping each scene key (as a string) to the ID of its latest beat sheet.
+        """
+        if not scene_keys:
+            return {}
+
+        latest_versions = BeatSheetModel.objects(scene_key__in=scene_keys).aggregate([
+            {'$sort': {'scene_key': 1, 'version_number': -1}},
+            {'$group': {'_id': '$scene_key', 'latest_id': {'$first': '$_id'}}},
+        ])
+        return {str(version['_id']): str(version['latest_id']) for version in latest_versions}
+
     @staticmethod
     def list_beat_sheet_versions(scene_key):
         """
@@ -123,9 +146,8 @@ class BeatSheetService:
         :param llm_model: Optional LLM model used for the new version.
         :return: The newly created BeatSheetModel object.
         """
-        # Determine the latest version number for the scene and increment it
-        latest_version = BeatSheetModel.objects(scene_key=source_text.scene_key).order_by('-version_number').first()
-        next_version_number = latest_version.version_number + 1 if latest_version else 1
+        # Allocate the version number atomically, so concurrent new versions never share one
+        next_version_number = BeatSheetService.heads.next_version_number(source_text.scene_key)
 
         # Create the new version
         new_beat_sheet = BeatSheetModel(
@@ -140,7 +162,9 @@ class BeatSheetService:
             llm_model=llm_model if llm_model is not None else source_text.llm_model,
             created_by=user
         )
+        new_beat_sheet.set_delta_base(source_text.id)
         new_beat_sheet.save()
+        BeatSheetService.heads.advance(new_beat_sheet.scene_key, new_beat_sheet)
 
         #refresh data
         new_beat_sheet = BeatSheetModel.objects(id=new_beat_sheet.id).first()
@@ -182,6 +206,7 @@ class BeatSheetService:
 
         # Save the new base as the only version
         new_base.save()
+        BeatSheetService.heads.reset(new_base.scene_key, new_base)
 
         #trigger events
         BeatSheetService.events.notify(Event('beat_sheet_rebased', {'beat_sheet': new_base}))
@@ -254,7 +279,8 @@ class BeatSheetService:
         style_guideline_id=None,
         script_dialog_flavor_id=None,
         screenplay_format=False,
-        make_script_text=False
+        make_script_text=False,
+        reuse_cached_results=False
     ):
         # Load the beat sheet object
         beat_sheet = BeatSheetModel.objects(id=text_id).first()
@@ -318,7 +344,8 @@ class BeatSheetService:
 
         # Create the agent task
         agent_task = AgentTaskService.new_agent_task_with_prompt(
-            project_id, 'BeatSheet', beat_sheet.id, prompt_data, task_metadata
+            project_id, 'BeatSheet', beat_sheet.id, prompt_data, task_metadata,
+            reuse_cached_results=reuse_cached_results
         )
 
         return agent_task.id
@@ -331,6 +358,7 @@ class BeatSheetService:
         screenplay_format=False,
         select_text_start=None,
         select_text_end=None,
+        reuse_cached_results=False
     ):
         # Load the beat sheet object
         beat_sheet = BeatSheetModel.objects(id=text_id).first()
@@ -404,7 +432,8 @@ class BeatSheetService:
 
         # Create the agent task
         agent_task = AgentTaskService.new_agent_task_with_prompt(
-            project_id, 'BeatSheet', beat_sheet.id, prompt_data, task_metadata
+            project_id, 'BeatSheet', beat_sheet.id, prompt_data, task_metadata,
+            reuse_cached_results=reuse_cached_results
         )
 
         return agent_task.id
@@ -51,7 +51,9 @@ class CharacterProfile(ObjectType):
                 raise GraphQLError('Character text not found')
 
             # Convert the character_profile to a dictionary using the method from the ObjectType
-            return character_profile._to_dict()
+            character_dict = character_profile._to_dict()
+            character_dict['character_order'] = CharacterProfileService.get_character_order(character_profile)
+            return character_dict
         except Exception as e:
             raise GraphQLError(f'Error retrieving character text: {str(e)}')
 
@@ -181,16 +183,18 @@ class GenerateCharacterFromSeed(Mutation):
         project_id = ID(required=True)
         text_id = ID(required=True)
         text_seed = String()
+        reuse_cached_results = Boolean()
 
     agent_task_id = ID()
 
     @project_role(roles="owner")
-    def mutate(self, info, project_id, text_id, text_seed=None):
+    def mutate(self, info, project_id, text_id, text_seed=None, reuse_cached_results=False):
         user = info.context.get('user')
         try:
             # Call the generate_from_seed method and pass the user ID
             agent_task_id = CharacterProfileService.generate_from_seed(
-                project_id, text_id, text_seed, user.id
+                project_id, text_id, text_seed, user.id,
+                reuse_cached_results=reuse_cached_results
             )
             return GenerateCharacterFromSeed(agent_task_id=agent_task_id)
         except Exception as e:
@@ -204,16 +208,18 @@ class GenerateCharacterWithNotes(Mutation):
         text_notes = String()
         select_text_start = Int()
         select_text_end = Int()
+        reuse_cached_results = Boolean()
 
     agent_task_id = ID()
 
     @project_role(roles="owner")
-    def mutate(self, info, project_id, text_id, text_notes=None, select_text_start=None, select_text_end=None):
+    def mutate(self, info, project_id, text_id, text_notes=None, select_text_start=None, select_text_end=None, reuse_cached_results=False):
         user = info.context.get('user')
         try:
             # Call the generate_from_seed method and pass the user ID
             agent_task_id = CharacterProfileService.generate_with_notes(
-                project_id, text_id, text_notes, user.id, select_text_start, select_text_end
+                project_id, text_id, text_notes, user.id, select_text_start, select_text_end,
+                reuse_cached_results=reuse_cached_results
             )
 
             return GenerateCharacterWithNotes(agent_task_id=agent_task_id)
@@ -12,6 +12,7 @@ from mongoengine import NotUniqueError
 from main.modules.UserPreference.UserPreferenceService import UserPreferenceService
 from main.libraries.Event import Event
 from main.libraries.Observable import Observable
+from main.libraries.DocumentHeads import DocumentHeads
 from main.libraries.Cache import Cache
 from main.libraries.functions import log_message
 
@@ -20,6 +21,9 @@ class CharacterProfileService:
     # Create an observable instance for the service
     events = Observable()
 
+    # Current version, version counter and order key of every character profile
+    heads = DocumentHeads(CharacterProfileModel, 'character_key', 'project_id', 'character_order')
+
     @staticmethod
     def create_character_profile(project_id, user, name, text_seed=None, character_order_after=None):
         """
@@ -44,31 +48,12 @@ class CharacterProfileService:
             created_at=datetime.utcnow()
         )
 
-        if character_order_after is not None:
-            # Place the new character after the specified character order
-            preceding_character = CharacterProfileModel.objects(
-                project_id=ObjectId(project_id),
-                character_order__lte=character_order_after
-            ).order_by('-character_order').first()
-            if preceding_character:
-                character_order = preceding_character.character_order + 1
-            else:
-                character_order = character_order_after
-            character_profile.character_order = character_order
-
-            # Increment character_order for subsequent characters
-            subsequent_characters = CharacterProfileModel.objects(
-                project_id=ObjectId(project_id),
-                character_order__gte=character_order
-            ).update(inc__character_order=1)
-        else:
-            # Place the new character at the end
-            highest_order_character = CharacterProfileModel.objects(
-                project_id=ObjectId(project_id)
-            ).order_by('-character_order').first()
-            character_profile.character_order = (highest_order_character.character_order + 1) if highest_order_character else 1
+        # Place the new character after the specified character order, or at the end
+        with CharacterProfileService.heads.ordering(project_id):
+            order_key, character_profile.character_order = CharacterProfileService.heads.new_order_key(project_id, character_order_after)
 
-        character_profile.save()
+            character_profile.save()
+            CharacterProfileService.heads.reset(character_profile.character_key, character_profile, project_id, order_key)
 
         #refresh data
         character_profile = CharacterProfileModel.objects(id=character_profile.id).first()
@@ -127,8 +112,13 @@ class CharacterProfileService:
                     'character_count': character.character_count
                 })
 
+        # The position of a character is kept with its head, not on its versions
+        character_positions = CharacterProfileService.heads.positions(project_id)
+        for character in unique_characters.values():
+            character['character_order'] = character_positions.get(character['character_key'], character['character_order'])
+
         #Sort characters by their character_order
-        sorted_characters = sorted(unique_characters.values(), key=lambda x: x['character_order'])
+        sorted_characters = sorted(unique_characters.values(), key=lambda x: x['character_order'] or 0)
         return sorted_characters
 
     @staticmethod
@@ -149,6 +139,7 @@ class CharacterProfileService:
 
                 # Delete all character text versions that match the character_key
                 CharacterProfileModel.objects(character_key=character_key).delete()
+                CharacterProfileService.heads.forget([character_key])
 
                 #trigger events -- since the character is deleted the only data we can pass really is the character_key
                 CharacterProfileService.events.notify(Event('character_deleted', {'character_key': character_key, 'project_id': project_id}))
@@ -196,7 +187,7 @@ class CharacterProfileService:
                 if version_number is not None:
                     return CharacterProfileModel.objects(character_key=character_key, version_number=version_number).first()
                 else:
-                    return CharacterProfileModel.objects(character_key=character_key).order_by('-version_number').first()
+                    return CharacterProfileService.heads.get(character_key)
             else:
                 raise ValueError("Either text_id or character_key must be provided.")
         except (ValueError) as e:
@@ -215,7 +206,10 @@ class CharacterProfileService:
                 character_key = uuid.UUID(character_key)
             versions = CharacterProfileModel.objects(character_key=character_key).order_by('version_number')
             version_list = []
+            character_order = None
             for version in versions:
+                if character_order is None:
+                    character_order = CharacterProfileService.get_character_order(version)
                 try:
                     created_by_id = str(version.created_by.id) if version.created_by else None
                 except Exception:
@@ -230,7 +224,7 @@ class CharacterProfileService:
                     'version_label': version.version_label,
                     'character_count': version.character_count,
                     'character_key': version.character_key,
-                    'character_order': version.character_order,
+                    'character_order': character_order,
                     'name': version.name,
                     'text_seed': version.text_seed,
                     'llm_model': version.llm_model,
@@ -254,9 +248,8 @@ class CharacterProfileService:
         :param text_content: Optional content text for the new version.
         :return: The newly created CharacterProfileModel object.
         """
-        # Determine the latest version number for the character and increment it
-        latest_version = CharacterProfileModel.objects(character_key=source_text.character_key).order_by('-version_number').first()
-        next_version_number = latest_version.version_number + 1 if latest_version else 1
+        # Allocate the version number atomically, so concurrent new versions never share one
+        next_version_number = CharacterProfileService.heads.next_version_number(source_text.character_key)
 
         # Create the new version
         new_character_profile = CharacterProfileModel(
@@ -274,7 +267,9 @@ class CharacterProfileService:
             llm_model=llm_model if llm_model is not None else source_text.llm_model,
             created_by=user
         )
+        new_character_profile.set_delta_base(source_text.id)
         new_character_profile.save()
+        CharacterProfileService.heads.advance(new_character_profile.character_key, new_character_profile)
 
         #refresh data
         new_character_profile = CharacterProfileModel.objects(id=new_character_profile.id).first()
@@ -316,14 +311,7 @@ class CharacterProfileService:
 
         # Save the new base as the only version
         new_base.save()
-
-        # Update the character_order for the remaining character text
-        # This is not strictly needed for the rebasing process itself but ensures that
-        # the character_order is correct after the operation.
-        if character_key:
-            characters_to_update = CharacterProfileModel.objects(character_key=character_key)
-            for index, character in enumerate(characters_to_update.order_by('created_at')):
-                character.update(character_order=index + 1)
+        CharacterProfileService.heads.reset(new_base.character_key, new_base)
 
         #trigger events
         CharacterProfileService.events.notify(Event('character_profile_rebased', {'character_profile': new_base}))
@@ -362,8 +350,27 @@ class CharacterProfileService:
 
         return True
 
+    @staticmethod
+    def get_character_order(character_profile):
+        """
+        Get the current position of a character within its project.
+
+        :param character_profile: Any version of the character profile.
+        :return: The 1-based position of the character.
+        """
+        # Until it gets an order key, the order of a character from before order keys is the one it was saved with
+        return CharacterProfileService.heads.position(character_profile.project_id.id, character_profile.character_key) or character_profile.character_order
+
     @staticmethod
     def reorder_character(text_id, new_character_order):
+        """
+        Move a character to a new position. Only the order key of the moved character changes,
+        the positions of the other characters follow from their order keys.
+
+        :param text_id: The ID of any version of the character profile.
+        :param new_character_order: The new 1-based position, limited to the number of characters.
+        :return: The moved CharacterProfileModel object, or None if it was already in place.
+        """
         if new_character_order <= 0:
             raise ValueError("new_character_order must be a positive integer.")
 
@@ -371,32 +378,11 @@ class CharacterProfileService:
         if not character_profile:
             raise ValueError("Character profile not found.")
 
-        max_order = CharacterProfileModel.objects(project_id=character_profile.project_id).count()
-        new_character_order = min(new_character_order, max_order)  # Adjusted to ensure within valid range
-
-        if character_profile.character_order == new_character_order:
+        if CharacterProfileService.get_character_order(character_profile) == new_character_order:
             return  # No change needed
 
-        original_order = character_profile.character_order
-
-        # Moving forward or backward
-        if new_character_order > original_order:
-            # Moving forward
-            CharacterProfileModel.objects(
-                project_id=character_profile.project_id,
-                character_order__gt=original_order,
-                character_order__lte=new_character_order
-            ).update(dec__character_order=1)
-        else:
-            # Moving backward
-            CharacterProfileModel.objects(
-                project_id=character_profile.project_id,
-                character_order__lt=original_order,
-                character_order__gte=new_character_order
-            ).update(inc__character_order=1)
-
-        # Update the character_order of the moved character
-        character_profile.update(set__character_order=new_character_order)
+        new_character_order = CharacterProfileService.heads.move(character_profile.project_id.id, character_profile.character_key, new_character_order)
+        character_profile.character_order = new_character_order
 
         # Trigger events
         CharacterProfileService.events.notify(Event('character_reordered', {'character_key': character_profile.character_key, 'project_id': str(character_profile.project_id.id), 'new_order': new_character_order}))
@@ -435,7 +421,7 @@ class CharacterProfileService:
         return new_character_profile
 
     @staticmethod
-    def generate_from_seed(project_id, text_id, text_seed=None, user_id=None):
+    def generate_from_seed(project_id, text_id, text_seed=None, user_id=None, reuse_cached_results=False):
         # Load the character text object
         character_profile = CharacterProfileModel.objects(id=text_id).first()
         if not character_profile:
@@ -463,13 +449,14 @@ class CharacterProfileService:
 
         # Create the agent task
         agent_task = AgentTaskService.new_agent_task_with_prompt(
-            project_id, 'CharacterProfile', character_profile.id, prompt_data, task_metadata
+            project_id, 'CharacterProfile', character_profile.id, prompt_data, task_metadata,
+            reuse_cached_results=reuse_cached_results
         )
 
         return agent_task.id
 
     @staticmethod
-    def generate_with_notes(project_id, text_id, text_notes=None, user_id=None, select_text_start=None, select_text_end=None):
+    def generate_with_notes(project_id, text_id, text_notes=None, user_id=None, select_text_start=None, select_text_end=None, reuse_cached_results=False):
         # Load the character text object
         character_profile = CharacterProfileModel.objects(id=text_id).first()
         if not character_profile:
@@ -503,7 +490,8 @@ class CharacterProfileService:
 
         # Create the agent task
         agent_task = AgentTaskService.new_agent_task_with_prompt(
-            project_id, 'CharacterProfile', character_profile.id, prompt_data, task_metadata
+            project_id, 'CharacterProfile', character_profile.id, prompt_data, task_metadata,
+            reuse_cached_results=reuse_cached_results
         )
 
         return agent_task.id
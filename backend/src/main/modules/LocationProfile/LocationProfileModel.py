@@ -1,4 +1,4 @@
-from main.libraries.EncryptedDocument import EncryptedDocument
+from main.libraries.DeltaVersionedDocument import DeltaVersionedDocument
 from mongoengine import Document, StringField, ReferenceField, IntField, DictField, DateTimeField, UUIDField
 from datetime import datetime
 from main.modules.Project.ProjectModel import ProjectModel
@@ -7,7 +7,7 @@ from mongoengine.errors import DoesNotExist
 import uuid
 from main.libraries.functions import log_message
 
-class LocationProfileModel(EncryptedDocument):
+class LocationProfileModel(DeltaVersionedDocument):
     """
     LocationProfileModel represents a location text document in MongoDB.
 
@@ -40,6 +40,7 @@ class LocationProfileModel(EncryptedDocument):
         ],
         'ordering': ['location_order', '-created_at'], # Ordered by 'location_order' and 'created_at' in descending order by default.
         'encrypted_fields': ['name', 'text_seed', 'text_notes', 'text_content', 'version_label'],
+        'delta_fields': ['text_seed', 'text_notes', 'text_content'],
     }
 
     project_id = ReferenceField(ProjectModel, required=True)
@@ -12,6 +12,7 @@ from mongoengine import NotUniqueError
 from main.modules.UserPreference.UserPreferenceService import UserPreferenceService
 from main.libraries.Event import Event
 from main.libraries.Observable import Observable
+from main.libraries.DocumentHeads import DocumentHeads
 from main.libraries.Cache import Cache
 from main.libraries.functions import log_message
 
@@ -20,6 +21,9 @@ class LocationProfileService:
     # Create an observable instance for the service
     events = Observable()
 
+    # Current version, version counter and order key of every location profile
+    heads = DocumentHeads(LocationProfileModel, 'location_key', 'project_id', 'location_order')
+
     @staticmethod
     def create_location_profile(project_id, user, name, text_seed=None, location_order_after=None):
         """
@@ -44,31 +48,12 @@ class LocationProfileService:
             created_at=datetime.utcnow()
         )
 
-        if location_order_after is not None:
-            # Place the new location after the specified location order
-            preceding_location = LocationProfileModel.objects(
-                project_id=ObjectId(project_id),
-                location_order__lte=location_order_after
-            ).order_by('-location_order').first()
-            if preceding_location:
-                location_order = preceding_location.location_order + 1
-            else:
-                location_order = location_order_after
-            location_profile.location_order = location_order
-
-            # Increment location_order for subsequent locations
-            subsequent_locations = LocationProfileModel.objects(
-                project_id=ObjectId(project_id),
-                location_order__gte=location_order
-            ).update(inc__location_order=1)
-        else:
-            # Place the new location at the end
-            highest_order_location = LocationProfileModel.objects(
-                project_id=ObjectId(project_id)
-            ).order_by('-location_order').first()
-            location_profile.location_order = (highest_order_location.location_order + 1) if highest_order_location else 1
+        # Place the new location after the specified location order, or at the end
+        with LocationProfileService.heads.ordering(project_id):
+            order_key, location_profile.location_order = LocationProfileService.heads.new_order_key(project_id, location_order_after)
 
-        location_profile.save()
+            location_profile.save()
+            LocationProfileService.heads.reset(location_profile.location_key, location_profile, project_id, order_key)
 
         #refresh data
         location_profile = LocationProfileModel.objects(id=location_profile.id).first()
@@ -127,8 +112,13 @@ class LocationProfileService:
                     'location_count': location.location_count
                 })
 
+        # The position of a location is kept with its head, not on its versions
+        location_positions = LocationProfileService.heads.positions(project_id)
+        for location in unique_locations.values():
+            location['location_order'] = location_positions.get(location['location_key'], location['location_order'])
+
         #Sort locations by their location_order
-        sorted_locations = sorted(unique_locations.values(), key=lambda x: x['location_order'])
+        sorted_locations = sorted(unique_locations.values(), key=lambda x: x['location_order'] or 0)
         return sorted_locations
 
     @staticmethod
@@ -149,6 +139,7 @@ class LocationProfileService:
 
                 # Delete all location text versions that match the location_key
                 LocationProfileModel.objects(location_key=location_key).delete()
+                LocationProfileService.heads.forget([location_key])
 
                 #trigger events -- since the location is deleted the only data we can pass really is the location_key
                 LocationProfileService.events.notify(Event('location_deleted', {'location_key': location_key, 'project_id': project_id}))
@@ -196,7 +187,7 @@ class LocationProfileService:
                 if version_number is not None:
                     return LocationProfileModel.objects(location_key=location_key, version_number=version_number).first()
                 else:
-                    return LocationProfileModel.objects(location_key=location_key).order_by('-version_number').first()
+                    return LocationProfileService.heads.get(location_key)
             else:
                 raise ValueError("Either text_id or location_key must be provided.")
         except (ValueError) as e:
@@ -215,7 +206,10 @@ class LocationProfileService:
                 location_key = uuid.UUID(location_key)
             versions = LocationProfileModel.objects(location_key=location_key).order_by('version_number')
             version_list = []
+            location_order = None
             for version in versions:
+                if location_order is None:
+                    location_order = LocationProfileService.get_location_order(version)
                 try:
                     created_by_id = str(version.created_by.id) if version.created_by else None
                 except Exception:
@@ -230,7 +224,7 @@ class LocationProfileService:
                     'version_label': version.version_label,
                     'location_count': version.location_count,
                     'location_key': version.location_key,
-                    'location_order': version.location_order,
+                    'location_order': location_order,
                     'name': version.name,
                     'text_seed': version.text_seed,
                     'llm_model': version.llm_model,
@@ -254,9 +248,8 @@ class LocationProfileService:
         :param text_content: Optional content text for the new version.
         :return: The newly created LocationProfileModel object.
         """
-        # Determine the latest version number for the location and increment it
-        latest_version = LocationProfileModel.objects(location_key=source_text.location_key).order_by('-version_number').first()
-        next_version_number = latest_version.version_number + 1 if latest_version else 1
+        # Allocate the version number atomically, so concurrent new versions never share one
+        next_version_number = LocationProfileService.heads.next_version_number(source_text.location_key)
 
         # Create the new version
         new_location_profile = LocationProfileModel(
@@ -274,7 +267,9 @@ class LocationProfileService:
             llm_model=llm_model if llm_model is not None else source_text.llm_model,
             created_by=user
         )
+        new_location_profile.set_delta_base(source_text.id)
         new_location_profile.save()
+        LocationProfileService.heads.advance(new_location_profile.location_key, new_location_profile)
 
         #refresh data
         new_location_profile = LocationProfileModel.objects(id=new_location_profile.id).first()
@@ -316,14 +311,7 @@ class LocationProfileService:
 
         # Save the new base as the only version
         new_base.save()
-
-        # Update the location_order for the remaining location text
-        # This is not strictly needed for the rebasing process itself but ensures that
-        # the location_order is correct after the operation.
-        if location_key:
-            locations_to_update = LocationProfileModel.objects(location_key=location_key)
-            for index, location in enumerate(locations_to_update.order_by('created_at')):
-                location.update(location_order=index + 1)
+        LocationProfileService.heads.reset(new_base.location_key, new_base)
 
         #trigger events
         LocationProfileService.events.notify(Event('location_profile_rebased', {'location_profile': new_base}))
@@ -362,8 +350,27 @@ class LocationProfileService:
 
         return True
 
+    @staticmethod
+    def get_location_order(location_profile):
+        """
+        Get the current position of a location within its project.
+
+        :param location_profile: Any version of the location profile.
+        :return: The 1-based position of the location.
+        """
+        # Until it gets an order key, the order of a location from before order keys is the one it was saved with
+        return LocationProfileService.heads.position(location_profile.project_id.id, location_profile.location_key) or location_profile.location_order
+
     @staticmethod
     def reorder_location(text_id, new_location_order):
+        """
+        Move a location to a new position. Only the order key of the moved location changes,
+        the positions of the other locations follow from their order keys.
+
+        :param text_id: The ID of any version of the location profile.
+        :param new_location_order: The new 1-based position, limited to the number of locations.
+        :return: The moved LocationProfileModel object, or None if it was already in place.
+        """
         if new_location_order <= 0:
             raise ValueError("new_location_order must be a positive integer.")
 
@@ -371,32 +378,11 @@ class LocationProfileService:
         if not location_profile:
             raise ValueError("Location profile not found.")
 
-        max_order = LocationProfileModel.objects(project_id=location_profile.project_id).count()
-        new_location_order = min(new_location_order, max_order)  # Adjusted to ensure within valid range
-
-        if location_profile.location_order == new_location_order:
+        if LocationProfileService.get_location_order(location_profile) == new_location_order:
             return  # No change needed
 
-        original_order = location_profile.location_order
-
-        # Determine if moving forward or backward
-        if new_location_order > original_order:
-            # Moving forward
-            LocationProfileModel.objects(
-                project_id=location_profile.project_id,
-                location_order__gt=original_order,
-                location_order__lte=new_location_order
-            ).update(dec__location_order=1)
-        else:
-            # Moving backward
-            LocationProfileModel.objects(
-                project_id=location_profile.project_id,
-                location_order__lt=original_order,
-                location_order__gte=new_location_order
-            ).update(inc__location_order=1)
-
-        # Update the location_order of the moved location
-        location_profile.update(set__location_order=new_location_order)
+        new_location_order = LocationProfileService.heads.move(location_profile.project_id.id, location_profile.location_key, new_location_order)
+        location_profile.location_order = new_location_order
 
         # Trigger events and clear cache
         LocationProfileService.events.notify(Event('location_reordered', {
@@ -438,7 +424,7 @@ class LocationProfileService:
         return new_location_profile
 
     @staticmethod
-    def generate_from_seed(project_id, text_id, text_seed=None, user_id=None):
+    def generate_from_seed(project_id, text_id, text_seed=None, user_id=None, reuse_cached_results=False):
         # Load the location text object
         location_profile = LocationProfileModel.objects(id=text_id).first()
         if not location_profile:
@@ -466,13 +452,14 @@ class LocationProfileService:
 
         # Create the agent task
         agent_task = AgentTaskService.new_agent_task_with_prompt(
-            project_id, 'LocationProfile', location_profile.id, prompt_data, task_metadata
+            project_id, 'LocationProfile', location_profile.id, prompt_data, task_metadata,
+            reuse_cached_results=reuse_cached_results
         )
 
         return agent_task.id
 
     @staticmethod
-    def generate_with_notes(project_id, text_id, text_notes=None, user_id=None, select_text_start=None, select_text_end=None):
+    def generate_with_notes(project_id, text_id, text_notes=None, user_id=None, select_text_start=None, select_text_end=None, reuse_cached_results=False):
         # Load the location text object
         location_profile = LocationProfileModel.objects(id=text_id).first()
         if not location_profile:
@@ -506,7 +493,8 @@ class LocationProfileService:
 
         # Create the agent task
         agent_task = AgentTaskService.new_agent_task_with_prompt(
-            project_id, 'LocationProfile', location_profile.id, prompt_data, task_metadata
+            project_id, 'LocationProfile', location_profile.id, prompt_data, task_metadata,
+            reuse_cached_results=reuse_cached_results
         )
 
         return agent_task.id
@@ -114,15 +114,17 @@ class GenerateMagicNotes(Mutation):
         document_type = String(required=True)
         document_id = ID(required=True)
         critic_ids = List(ID)  # This is an optional list of critic IDs
+        reuse_cached_results = Boolean()
 
     agent_task_id = String()
 
     @project_role(roles="owner")
-    def mutate(self, info, project_id, document_type, document_id, critic_ids=None):
+    def mutate(self, info, project_id, document_type, document_id, critic_ids=None, reuse_cached_results=False):
         try:
             user = info.context.get('user')
             agent_task_id = MagicNoteService.generate_magic_notes(
-                project_id, document_type, document_id, critic_ids, str(user.id)
+                project_id, document_type, document_id, critic_ids, str(user.id),
+                reuse_cached_results=reuse_cached_results
             )
             return GenerateMagicNotes(agent_task_id=str(agent_task_id))
         except Exception as e:
@@ -133,15 +135,17 @@ class GenerateExpansiveNotes(Mutation):
         project_id = ID(required=True)
         document_type = String(required=True)
         document_id = ID(required=True)
+        reuse_cached_results = Boolean()
 
     agent_task_id = String()
 
     @project_role(roles="owner")
-    def mutate(self, info, project_id, document_type, document_id):
+    def mutate(self, info, project_id, document_type, document_id, reuse_cached_results=False):
         try:
             user = info.context.get('user')
             agent_task_id = MagicNoteService.generate_expansive_notes(
-                project_id, document_type, document_id, str(user.id)
+                project_id, document_type, document_id, str(user.id),
+                reuse_cached_results=reuse_cached_results
             )
             return GenerateExpansiveNotes(agent_task_id=str(agent_task_id))
         except Exception as e:
@@ -255,7 +255,7 @@ class MagicNoteService:
         return [{'id': str(critic.id), 'name': critic.name} for critic in critics]
 
     @staticmethod
-    def generate_magic_notes(project_id, document_type, document_id, critic_ids=None, user_id=None):
+    def generate_magic_notes(project_id, document_type, document_id, critic_ids=None, user_id=None, reuse_cached_results=False):
         # Mapping document types to their respective model classes
         document_model_mapping = {
             'StoryText': StoryTextModel,
@@ -303,14 +303,15 @@ class MagicNoteService:
         }
 
         agent_task = AgentTaskService.new_agent_task_with_prompt(
-            project_id, document_type, document_id, prompt_data, task_metadata
+            project_id, document_type, document_id, prompt_data, task_metadata,
+            reuse_cached_results=reuse_cached_results
         )
 
         return agent_task.id
 
 
     @staticmethod
-    def generate_expansive_notes(project_id, document_type, document_id, user_id=None):
+    def generate_expansive_notes(project_id, document_type, document_id, user_id=None, reuse_cached_results=False):
         # Mapping document types to their respective model classes
         document_model_mapping = {
             'StoryText': StoryTextModel,
@@ -349,7 +350,8 @@ class MagicNoteService:
         }
 
         agent_task = AgentTaskService.new_agent_task_with_prompt(
-            project_id, document_type, document_id, prompt_data, task_metadata
+            project_id, document_type, document_id, prompt_data, task_metadata,
+            reuse_cached_results=reuse_cached_results
         )
 
         return agent_task.id
@@ -13,6 +13,7 @@ from main.libraries.decorators import project_role, cache_response
 from main.modules.Project.ProjectModel import ProjectModel
 from main.modules.StoryText.StoryTextModel import StoryTextModel
 from main.modules.SceneText.SceneTextModel import SceneTextModel
+from main.modules.SceneText.SceneTextService import SceneTextService
 from main.modules.ScriptText.ScriptTextModel import ScriptTextModel
 
 class ProjectMetadataInput(InputObjectType):
@@ -85,6 +86,7 @@ class CollateProject(ObjectType):
 
         scene_texts = SceneTextModel.objects(project_id=project_id,
                                              ).order_by("-version_number").all()
+        scene_positions = SceneTextService.heads.positions(project_id)
         processed_scenes = set()
         for scene_text in scene_texts:
 
@@ -96,7 +98,7 @@ class CollateProject(ObjectType):
 
             if include_scene_title and scene_text and scene_text.title:
                 if include_scene_number:
-                    collate_output.append(f"{scene_text.scene_order}. {scene_text.title}")
+                    collate_output.append(f"{scene_positions.get(str(scene_text.scene_key))}. {scene_text.title}")
                 else:
                     collate_output.append(scene_text.title)
 
@@ -36,6 +36,28 @@ class SceneTextListener:
         SceneTextListener.broadcast(event.data['scene_text'], event.type)
         return
 
+    @staticmethod
+    def scenes_created_listener(event):
+        # One notification for a whole batch, clients reload the scene list
+        websocket_data = {
+            'type': 'scene_text',
+            'document_id': None,
+            'scene_keys': [str(scene_text.scene_key) for scene_text in event.data['scene_texts']],
+            'deleted_scene_keys': [str(scene_key) for scene_key in event.data['deleted_scene_keys']],
+            'event_type': event.type
+        }
+
+        # The channel to broadcast on
+        channel_name = f"project-{event.data['project_id']}"
+
+        # Initialize the WebSocket utility class
+        websocket_util = Websocket()
+
+        # Broadcast the message
+        websocket_util.broadcast_message(channel_name, websocket_data)
+
+        return
+
     @staticmethod
     def scene_deleted_listener(event):
         # Format the details for the WebSocket notification
@@ -99,6 +121,7 @@ class SceneTextListener:
         #SceneText
         scene_text_service = SceneTextService.events
         scene_text_service.register('scene_created', self.scene_created_listener)
+        scene_text_service.register('scenes_created', self.scenes_created_listener)
         scene_text_service.register('scene_deleted', self.scene_deleted_listener)
         scene_text_service.register('scene_reordered', self.scene_reordered_listener)
 
@@ -1,4 +1,4 @@
-from main.libraries.EncryptedDocument import EncryptedDocument
+from main.libraries.DeltaVersionedDocument import DeltaVersionedDocument
 from mongoengine import Document, StringField, ReferenceField, IntField, DictField, DateTimeField, UUIDField
 from datetime import datetime
 from main.modules.Project.ProjectModel import ProjectModel
@@ -7,7 +7,7 @@ from mongoengine.errors import DoesNotExist
 import uuid
 from main.libraries.functions import log_message
 
-class SceneTextModel(EncryptedDocument):
+class SceneTextModel(DeltaVersionedDocument):
     """
     SceneTextModel represents a scene text document in MongoDB.
 
@@ -33,6 +33,7 @@ class SceneTextModel(EncryptedDocument):
         'collection': 'scene_texts',
         'indexes': [
             'project_id',
+            ('project_id', 'scene_key', '-version_number'),
             'scene_key',
             'version_number',
             'scene_order',
@@ -40,6 +41,7 @@ class SceneTextModel(EncryptedDocument):
         ],
         'ordering': ['scene_order', '-created_at'], # Ordered by 'scene_order' and 'created_at' in descending order by default.
         'encrypted_fields': ['title', 'text_seed', 'text_notes', 'text_content', 'version_label'],
+        'delta_fields': ['text_seed', 'text_notes', 'text_content'],
     }
 
     project_id = ReferenceField(ProjectModel, required=True)
@@ -115,7 +117,45 @@ class SceneTextModel(EncryptedDocument):
     def getProject(self):
         return self.project_id
 
-    def _to_dict(self):
+    def _reference_id(self, field_name):
+        """
+        Return the ID of a referenced document as a string without dereferencing it.
+        """
+        value = self._data.get(field_name)
+        if value is None:
+            return None
+        return str(getattr(value, 'id', value))
+
+    def _to_dict(self, related=None):
+        """
+        :param related: Precomputed 'latest_beat_sheet_id', 'latest_script_text_id' and
+                        'source_version_number' values, as batched by
+                        SceneTextService.list_project_scenes. When omitted they are looked
+                        up (and missing beat sheets or script texts created) for this
+                        document alone.
+        """
+        if related is not None:
+            return {
+                'id': str(self.id),
+                'project_id': self._reference_id('project_id'),
+                'scene_key': str(self.scene_key),
+                'title': self.title,
+                'scene_order': self.scene_order,
+                'version_type': self.version_type,
+                'source_version_number': related.get('source_version_number'),
+                'version_number': self.version_number,
+                'version_label': self.version_label,
+                'text_seed': self.text_seed,
+                'text_notes': self.text_notes,
+                'text_content': self.text_content,
+                'character_count': self.character_count,
+                'llm_model': self.llm_model,
+                'created_at': self.created_at,
+                'created_by': self._reference_id('created_by'),
+                'latest_beat_sheet_id': related.get('latest_beat_sheet_id'),
+                'latest_script_text_id': related.get('latest_script_text_id')
+            }
+
         try:
             created_by_id = str(self.created_by.id) if self.created_by else None
         except Exception as e:
@@ -26,7 +26,8 @@ class SceneTextPrompter:
         # Retrieve all scenes for the project and sort them by their order
         all_scenes = SceneTextService.list_project_scenes(project.id)
         # Retrieve the preceding scenes by their order
-        preceding_scenes = [s for s in all_scenes if s['scene_order'] < scene_text.scene_order]
+        scene_order = next((s['scene_order'] for s in all_scenes if s['scene_key'] == str(scene_text.scene_key)), scene_text.scene_order)
+        preceding_scenes = [s for s in all_scenes if s['scene_order'] < scene_order]
 
         # Retrieve the immediately preceding scene
         immediately_preceding_scene = len(preceding_scenes) and SceneTextService.get_scene_text(preceding_scenes[-1]['id'])
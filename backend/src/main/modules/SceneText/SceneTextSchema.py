@@ -28,7 +28,7 @@ class SceneText(ObjectType):
 
     @classmethod
     @project_role(roles=None)
-    @cache_response('project_scenes_', 'project_id')
+    @cache_response('project_scenes_', 'project_id', soft_ttl=300, hard_ttl=86400)
     def resolve_list_project_scenes(cls, info, project_id):
         try:
             scenes = SceneTextService.list_project_scenes(project_id)
@@ -53,7 +53,9 @@ class SceneText(ObjectType):
                 raise GraphQLError('Scene text not found')
 
             # Convert the scene_text to a dictionary using the method from the ObjectType
-            return scene_text._to_dict()
+            scene_dict = scene_text._to_dict()
+            scene_dict['scene_order'] = SceneTextService.get_scene_order(scene_text)
+            return scene_dict
         except Exception as e:
             raise GraphQLError(f'Error retrieving scene text: {str(e)}')
 
@@ -183,16 +185,18 @@ class GenerateSceneFromSeed(Mutation):
         project_id = ID(required=True)
         text_id = ID(required=True)
         text_seed = String()
+        reuse_cached_results = Boolean()
 
     agent_task_id = ID()
 
     @project_role(roles="owner")
-    def mutate(self, info, project_id, text_id, text_seed=None):
+    def mutate(self, info, project_id, text_id, text_seed=None, reuse_cached_results=False):
         user = info.context.get('user')
         try:
             # Call the generate_from_seed method and pass the user ID
             agent_task_id = SceneTextService.generate_from_seed(
-                project_id, text_id, text_seed, user.id
+                project_id, text_id, text_seed, user.id,
+                reuse_cached_results=reuse_cached_results
             )
             return GenerateSceneFromSeed(agent_task_id=agent_task_id)
         except Exception as e:
@@ -206,16 +210,18 @@ class GenerateSceneWithNotes(Mutation):
         text_notes = String()
         select_text_start = Int()
         select_text_end = Int()
+        reuse_cached_results = Boolean()
 
     agent_task_id = ID()
 
     @project_role(roles="owner")
-    def mutate(self, info, project_id, text_id, text_notes=None, select_text_start=None, select_text_end=None):
+    def mutate(self, info, project_id, text_id, text_notes=None, select_text_start=None, select_text_end=None, reuse_cached_results=False):
         user = info.context.get('user')
         try:
             # Call the generate_from_seed method and pass the user ID
             agent_task_id = SceneTextService.generate_with_notes(
-                project_id, text_id, text_notes, user.id, select_text_start, select_text_end
+                project_id, text_id, text_notes, user.id, select_text_start, select_text_end,
+                reuse_cached_results=reuse_cached_results
             )
 
             return GenerateSceneWithNotes(agent_task_id=agent_task_id)
@@ -228,16 +234,18 @@ class GenerateMakeScenes(Mutation):
         project_id = ID(required=True)
         story_text_id = ID(required=True)
         scene_count = Int()
+        reuse_cached_results = Boolean()
 
     agent_task_id = ID()
 
     @project_role(roles="owner")
-    def mutate(self, info, project_id, story_text_id, scene_count=24):
+    def mutate(self, info, project_id, story_text_id, scene_count=24, reuse_cached_results=False):
         user = info.context.get('user')
         try:
             # Call the generate_make_scenes method and pass the user ID
             agent_task_id = SceneTextService.generate_make_scenes(
-                project_id, story_text_id, scene_count, user.id
+                project_id, story_text_id, scene_count, user.id,
+                reuse_cached_results=reuse_cached_results
             )
 
             return GenerateMakeScenes(agent_task_id=agent_task_id)
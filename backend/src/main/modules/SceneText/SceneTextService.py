@@ -16,6 +16,7 @@ from main.modules.ScriptText.ScriptTextModel import ScriptTextModel
 from main.modules.UserPreference.UserPreferenceService import UserPreferenceService
 from main.libraries.Event import Event
 from main.libraries.Observable import Observable
+from main.libraries.DocumentHeads import DocumentHeads
 from main.libraries.Cache import Cache
 from main.libraries.functions import decrypt_text, log_message
 
@@ -24,6 +25,9 @@ class SceneTextService:
     # Create an observable instance for the service
     events = Observable()
 
+    # Current version, version counter and order key of every scene text
+    heads = DocumentHeads(SceneTextModel, 'scene_key', 'project_id', 'scene_order')
+
     @staticmethod
     def create_scene_text(project_id, user, title, text_seed=None, scene_order_after=None):
         """
@@ -48,31 +52,12 @@ class SceneTextService:
             created_at=datetime.utcnow()
         )
 
-        if scene_order_after is not None:
-            # Place the new scene after the specified scene order
-            preceding_scene = SceneTextModel.objects(
-                project_id=ObjectId(project_id),
-                scene_order__lte=scene_order_after
-            ).order_by('-scene_order').first()
-            if preceding_scene:
-                scene_order = preceding_scene.scene_order + 1
-            else:
-                scene_order = scene_order_after
-            scene_text.scene_order = scene_order
-
-            # Increment scene_order for subsequent scenes
-            subsequent_scenes = SceneTextModel.objects(
-                project_id=ObjectId(project_id),
-                scene_order__gte=scene_order
-            ).update(inc__scene_order=1)
-        else:
-            # Place the new scene at the end
-            highest_order_scene = SceneTextModel.objects(
-                project_id=ObjectId(project_id)
-            ).order_by('-scene_order').first()
-            scene_text.scene_order = (highest_order_scene.scene_order + 1) if highest_order_scene else 1
+        # Place the new scene after the specified scene order, or at the end
+        with SceneTextService.heads.ordering(project_id):
+            order_key, scene_text.scene_order = SceneTextService.heads.new_order_key(project_id, scene_order_after)
 
-        scene_text.save()
+            scene_text.save()
+            SceneTextService.heads.reset(scene_text.scene_key, scene_text, project_id, order_key)
 
         # Now initiate a new BeatSheet and script text for the created scene
         beat_sheet_id = BeatSheetService.init_beat_sheet(str(scene_text.scene_key), user, str(scene_text.id))
@@ -91,29 +76,50 @@ class SceneTextService:
     def list_project_scenes(project_id):
         """
         Return a dictionary of the latest versions of scenes related to the project.
+        Related ids are loaded in batches, so the number of queries does not grow
+        with the number of scenes or versions, and nothing is written.
 
         :param project_id: The ID of the project.
         :return: A list of dictionaries containing scene details.
         """
-        scenes = SceneTextModel.objects(project_id=ObjectId(project_id)).order_by('scene_order')
-        unique_scenes = {}
-
+        # Find the latest version of every scene in a single aggregation
+        latest_versions = SceneTextModel.objects(project_id=ObjectId(project_id)).aggregate([
+            {'$sort': {'scene_key': 1, 'version_number': -1}},
+            {'$group': {'_id': '$scene_key', 'latest_id': {'$first': '$_id'}}},
+        ])
+        latest_ids = [version['latest_id'] for version in latest_versions]
+        if not latest_ids:
+            return []
+
+        # References are read as raw ids instead of being dereferenced one document at a time
+        scenes = list(SceneTextModel.objects(id__in=latest_ids).no_dereference())
+
+        scene_keys = [scene.scene_key for scene in scenes]
+        latest_beat_sheet_ids = BeatSheetService.get_latest_beat_sheet_ids(scene_keys)
+        latest_script_text_ids = ScriptTextService.get_latest_script_text_ids(scene_keys)
+
+        source_version_ids = {scene.source_version.id for scene in scenes if scene.source_version}
+        source_version_numbers = {
+            source['_id']: source.get('version_number')
+            for source in SceneTextModel.objects(id__in=list(source_version_ids)).only('version_number').as_pymongo()
+        } if source_version_ids else {}
+
+        scene_dicts = []
         for scene in scenes:
             key = str(scene.scene_key)
-            try:
-                created_by_id = str(scene.created_by.id) if scene.created_by else None
-            except Exception:
-                # Log the issue and proceed with created_by as None
-                #log_message('error', f"Error resolving created_by field for scene_key {key}")
-                created_by_id = None
-
-            if key not in unique_scenes:
-                unique_scenes[key] = scene._to_dict()
-            elif scene.version_number > unique_scenes[key]['version_number']:
-                unique_scenes[key].update(scene._to_dict())
+            scene_dicts.append(scene._to_dict(related={
+                'latest_beat_sheet_id': latest_beat_sheet_ids.get(key),
+                'latest_script_text_id': latest_script_text_ids.get(key),
+                'source_version_number': source_version_numbers.get(scene.source_version.id) if scene.source_version else None,
+            }))
+
+        # The position of a scene is kept with its head, not on its versions
+        scene_positions = SceneTextService.heads.positions(project_id)
+        for scene in scene_dicts:
+            scene['scene_order'] = scene_positions.get(str(scene['scene_key']), scene['scene_order'])
 
         #Sort scenes by their scene_order
-        sorted_scenes = sorted(unique_scenes.values(), key=lambda x: x['scene_order'])
+        sorted_scenes = sorted(scene_dicts, key=lambda x: x['scene_order'] or 0)
         return sorted_scenes
 
     @staticmethod
@@ -141,6 +147,10 @@ class SceneTextService:
                 # Delete all scene text versions that match the scene_key
                 SceneTextModel.objects(scene_key=scene_key).delete()
 
+                # Drop the head pointers of the deleted documents
+                for service in (SceneTextService, BeatSheetService, ScriptTextService):
+                    service.heads.forget([scene_key])
+
                 #trigger events -- since the scene is deleted the only data we can pass really is the scene_key
                 SceneTextService.events.notify(Event('scene_deleted', {'scene_key': scene_key, 'project_id': project_id}))
                 SceneTextService.clear_scene_text_cache(project_id)
@@ -152,21 +162,115 @@ class SceneTextService:
     def delete_all_scenes(project_id):
         """
         Delete all scenes associated with a project.
-        Also delete any associated beat sheets by looping through each scene.
+        Also delete any associated beat sheets and script texts, in bulk.
 
         :param project_id: The ID of the project whose scenes are to be deleted.
         """
         try:
             project_id_obj = ObjectId(project_id)
-            # Find all unique scene keys within the project
-            unique_scene_keys = SceneTextModel.objects(project_id=project_id_obj).distinct('scene_key')
+        except (InvalidId, TypeError) as e:
+            raise ValueError(f"Invalid project_id: {e}")
 
-            # Loop through each unique scene key and delete the corresponding scenes
-            for scene_key in unique_scene_keys:
-                SceneTextService.delete_scene(scene_key)
+        scene_keys = SceneTextService._delete_project_scenes(project_id_obj)
 
-        except (InvalidId) as e:
-            raise ValueError(f"Invalid project_id: {e}")
+        #trigger events
+        for scene_key in scene_keys:
+            SceneTextService.events.notify(Event('scene_deleted', {'scene_key': scene_key, 'project_id': str(project_id_obj)}))
+        if scene_keys:
+            SceneTextService.clear_scene_text_cache(str(project_id_obj))
+
+    @staticmethod
+    def _delete_project_scenes(project_id):
+        """
+        Delete every version of every scene, beat sheet and script text of a project,
+        without triggering events.
+
+        :param project_id: The ObjectId of the project.
+        :return: The keys of the deleted scenes.
+        """
+        # Find all unique scene keys within the project
+        scene_keys = SceneTextModel.objects(project_id=project_id).distinct('scene_key')
+        if not scene_keys:
+            return []
+
+        BeatSheetModel.objects(scene_key__in=scene_keys).delete()
+        ScriptTextModel.objects(scene_key__in=scene_keys).delete()
+        SceneTextModel.objects(scene_key__in=scene_keys).delete()
+
+        # Drop the head pointers of the deleted documents
+        for service in (SceneTextService, BeatSheetService, ScriptTextService):
+            service.heads.forget(scene_keys)
+
+        return scene_keys
+
+    @staticmethod
+    def bulk_create_scenes(project_id, user, scenes, replace_existing=False):
+        """
+        Create many scenes, with their beat sheets and script texts, using one bulk
+        insert per collection instead of create_scene_text() for every scene.
+        Triggers a single 'scenes_created' event and cache invalidation.
+
+        :param project_id: The ID of the project.
+        :param user: The user creating the scenes.
+        :param scenes: A list of (title, text_seed) tuples, in scene order.
+        :param replace_existing: Delete the existing scenes of the project first (optional).
+        :return: The newly created SceneTextModel objects, in scene order.
+        """
+        project_id = ObjectId(project_id)
+        deleted_scene_keys = SceneTextService._delete_project_scenes(project_id) if replace_existing else []
+
+        if scenes:
+            with SceneTextService.heads.ordering(project_id):
+                # Orders are assigned in memory, after the existing scenes
+                order_keys, first_order = SceneTextService.heads.new_order_keys(project_id, len(scenes))
+                created_at = datetime.utcnow()
+                scene_texts = [
+                    SceneTextModel(
+                        project_id=project_id,
+                        created_by=user,
+                        title=title,
+                        text_seed=text_seed,
+                        version_type='base',
+                        version_number=1,
+                        scene_key=uuid.uuid4(),
+                        scene_order=first_order + index,
+                        created_at=created_at
+                    ) for index, (title, text_seed) in enumerate(scenes)
+                ]
+                for scene_text in scene_texts:
+                    scene_text.validate()
+                SceneTextModel.objects.insert(scene_texts, load_bulk=False)
+                SceneTextService.heads.reset_many(scene_texts, project_id, order_keys)
+
+            # Every scene starts with an empty beat sheet and script text
+            for service, model in ((BeatSheetService, BeatSheetModel), (ScriptTextService, ScriptTextModel)):
+                documents = [
+                    model(
+                        scene_key=scene_text.scene_key,
+                        version_type='base',
+                        version_number=1,
+                        scene_text_id=scene_text.id,
+                        created_by=user,
+                    ) for scene_text in scene_texts
+                ]
+                model.objects.insert(documents, load_bulk=False)
+                service.heads.reset_many(documents)
+
+            #refresh data
+            created_scenes = SceneTextModel.objects.in_bulk([scene_text.id for scene_text in scene_texts])
+            scene_texts = [created_scenes[scene_text.id] for scene_text in scene_texts]
+        else:
+            scene_texts = []
+
+        #trigger events
+        SceneTextService.events.notify(Event('scenes_created', {
+            'project_id': str(project_id),
+            'scene_texts': scene_texts,
+            'deleted_scene_keys': deleted_scene_keys
+        }))
+        SceneTextService.clear_scene_text_cache(str(project_id))
+
+        return scene_texts
 
     @staticmethod
     def get_scene_text(text_id=None, scene_key=None, version_number=None):
@@ -188,7 +292,7 @@ class SceneTextService:
                 if version_number is not None:
                     return SceneTextModel.objects(scene_key=scene_key, version_number=version_number).first()
                 else:
-                    return SceneTextModel.objects(scene_key=scene_key).order_by('-version_number').first()
+                    return SceneTextService.heads.get(scene_key)
             else:
                 raise ValueError("Either text_id or scene_key must be provided.")
         except (ValueError) as e:
@@ -207,7 +311,10 @@ class SceneTextService:
                 scene_key = uuid.UUID(scene_key)
             versions = SceneTextModel.objects(scene_key=scene_key).order_by('version_number')
             version_list = []
+            scene_order = None
             for version in versions:
+                if scene_order is None:
+                    scene_order = SceneTextService.get_scene_order(version)
                 try:
                     created_by_id = str(version.created_by.id) if version.created_by else None
                 except Exception:
@@ -222,7 +329,7 @@ class SceneTextService:
                     'version_label': version.version_label,
                     'character_count': version.character_count,
                     'scene_key': version.scene_key,
-                    'scene_order': version.scene_order,
+                    'scene_order': scene_order,
                     'title': version.title,
                     'text_seed': version.text_seed,
                     'llm_model': version.llm_model,
@@ -246,9 +353,8 @@ class SceneTextService:
         :param text_content: Optional content text for the new version.
         :return: The newly created SceneTextModel object.
         """
-        # Determine the latest version number for the scene and increment it
-        latest_version = SceneTextModel.objects(scene_key=source_text.scene_key).order_by('-version_number').first()
-        next_version_number = latest_version.version_number + 1 if latest_version else 1
+        # Allocate the version number atomically, so concurrent new versions never share one
+        next_version_number = SceneTextService.heads.next_version_number(source_text.scene_key)
 
         # Create the new version
         new_scene_text = SceneTextModel(
@@ -266,7 +372,9 @@ class SceneTextService:
             llm_model=llm_model if llm_model is not None else source_text.llm_model,
             created_by=user
         )
+        new_scene_text.set_delta_base(source_text.id)
         new_scene_text.save()
+        SceneTextService.heads.advance(new_scene_text.scene_key, new_scene_text)
 
         #refresh data
         new_scene_text = SceneTextModel.objects(id=new_scene_text.id).first()
@@ -308,14 +416,7 @@ class SceneTextService:
 
         # Save the new base as the only version
         new_base.save()
-
-        # Update the scene_order for the remaining scene text
-        # This is not strictly needed for the rebasing process itself but ensures that
-        # the scene_order is correct after the operation.
-        if scene_key:
-            scenes_to_update = SceneTextModel.objects(scene_key=scene_key)
-            for index, scene in enumerate(scenes_to_update.order_by('created_at')):
-                scene.update(scene_order=index + 1)
+        SceneTextService.heads.reset(new_base.scene_key, new_base)
 
         #trigger events
         SceneTextService.events.notify(Event('scene_text_rebased', {'scene_text': new_base}))
@@ -354,8 +455,27 @@ class SceneTextService:
 
         return True
 
+    @staticmethod
+    def get_scene_order(scene_text):
+        """
+        Get the current position of a scene within its project.
+
+        :param scene_text: Any version of the scene.
+        :return: The 1-based position of the scene.
+        """
+        # Until it gets an order key, the order of a scene from before order keys is the one it was saved with
+        return SceneTextService.heads.position(scene_text.project_id.id, scene_text.scene_key) or scene_text.scene_order
+
     @staticmethod
     def reorder_scene(text_id, new_scene_order):
+        """
+        Move a scene to a new position. Only the order key of the moved scene changes,
+        the positions of the other scenes follow from their order keys.
+
+        :param text_id: The ID of any version of the scene.
+        :param new_scene_order: The new 1-based position, limited to the number of scenes.
+        :return: The moved SceneTextModel object, or None if it was already in place.
+        """
         if new_scene_order <= 0:
             raise ValueError("new_scene_order must be a positive integer.")
 
@@ -363,32 +483,11 @@ class SceneTextService:
         if not scene_text:
             raise ValueError("Scene text not found.")
 
-        max_order = SceneTextModel.objects(project_id=scene_text.project_id).count()
-        new_scene_order = min(new_scene_order, max_order)  # Adjusted to ensure within valid range
-
-        if scene_text.scene_order == new_scene_order:
+        if SceneTextService.get_scene_order(scene_text) == new_scene_order:
             return  # No change needed
 
-        original_order = scene_text.scene_order
-
-        # Cases: Moving forward or backward
-        if new_scene_order > original_order:
-            # Moving forward
-            SceneTextModel.objects(
-                project_id=scene_text.project_id,
-                scene_order__gt=original_order,
-                scene_order__lte=new_scene_order
-            ).update(dec__scene_order=1)
-        else:
-            # Moving backward
-            SceneTextModel.objects(
-                project_id=scene_text.project_id,
-                scene_order__lt=original_order,
-                scene_order__gte=new_scene_order
-            ).update(inc__scene_order=1)
-
-        # Update the scene_order of the moved scene
-        scene_text.update(set__scene_order=new_scene_order)
+        new_scene_order = SceneTextService.heads.move(scene_text.project_id.id, scene_text.scene_key, new_scene_order)
+        scene_text.scene_order = new_scene_order
 
         #trigger events
         SceneTextService.events.notify(Event('scene_reordered', {'scene_key': scene_text.scene_key, 'project_id': str(scene_text.project_id.id), 'new_order': new_scene_order}))
@@ -427,7 +526,7 @@ class SceneTextService:
         return new_scene_text
 
     @staticmethod
-    def generate_from_seed(project_id, text_id, text_seed=None, user_id=None):
+    def generate_from_seed(project_id, text_id, text_seed=None, user_id=None, reuse_cached_results=False):
         # Load the scene text object
         scene_text = SceneTextModel.objects(id=text_id).first()
         if not scene_text:
@@ -455,13 +554,14 @@ class SceneTextService:
 
         # Create the agent task
         agent_task = AgentTaskService.new_agent_task_with_prompt(
-            project_id, 'SceneText', scene_text.id, prompt_data, task_metadata
+            project_id, 'SceneText', scene_text.id, prompt_data, task_metadata,
+            reuse_cached_results=reuse_cached_results
         )
 
         return agent_task.id
 
     @staticmethod
-    def generate_with_notes(project_id, text_id, text_notes=None, user_id=None, select_text_start=None, select_text_end=None):
+    def generate_with_notes(project_id, text_id, text_notes=None, user_id=None, select_text_start=None, select_text_end=None, reuse_cached_results=False):
         # Load the scene text object
         scene_text = SceneTextModel.objects(id=text_id).first()
         if not scene_text:
@@ -495,13 +595,14 @@ class SceneTextService:
 
         # Create the agent task
         agent_task = AgentTaskService.new_agent_task_with_prompt(
-            project_id, 'SceneText', scene_text.id, prompt_data, task_metadata
+            project_id, 'SceneText', scene_text.id, prompt_data, task_metadata,
+            reuse_cached_results=reuse_cached_results
         )
 
         return agent_task.id
 
     @staticmethod
-    def generate_make_scenes(project_id, story_text_id, scene_count=24, user_id=None):
+    def generate_make_scenes(project_id, story_text_id, scene_count=24, user_id=None, reuse_cached_results=False):
         # Load the story text object
         story_text = StoryTextModel.objects(id=story_text_id).first()
         if not story_text:
@@ -524,7 +625,8 @@ class SceneTextService:
 
         # Create the agent task
         agent_task = AgentTaskService.new_agent_task_with_prompt(
-            project_id, 'MakeScenes', project_id, prompt_data, task_metadata
+            project_id, 'MakeScenes', project_id, prompt_data, task_metadata,
+            reuse_cached_results=reuse_cached_results
         )
 
         return agent_task.id
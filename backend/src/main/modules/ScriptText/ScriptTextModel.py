@@ -1,4 +1,4 @@
-from main.libraries.EncryptedDocument import EncryptedDocument
+from main.libraries.DeltaVersionedDocument import DeltaVersionedDocument
 from mongoengine import Document, StringField, ReferenceField, IntField, DateTimeField, UUIDField
 from datetime import datetime
 from main.modules.SceneText.SceneTextModel import SceneTextModel
@@ -7,7 +7,7 @@ from main.libraries.RichText import (cleanup_script_array,
                                      assemble_formatted_from_script_array_rtf)
 import uuid
 
-class ScriptTextModel(EncryptedDocument):
+class ScriptTextModel(DeltaVersionedDocument):
     """
     ScriptTextModel represents a script text document in MongoDB.
 
@@ -30,11 +30,13 @@ class ScriptTextModel(EncryptedDocument):
         'collection': 'script_texts',
         'indexes': [
             'scene_key',
+            ('scene_key', '-version_number'),
             'version_number',
             'created_at',
         ],
         'ordering': ['-created_at'],  # Documents will be ordered by 'created_at' in descending order by default.
         'encrypted_fields': ['text_notes', 'text_content', 'version_label'],
+        'delta_fields': ['text_notes', 'text_content'],
     }
 
     scene_key = UUIDField(binary=False, default=uuid.uuid4, unique=False)
@@ -124,15 +124,17 @@ class GenerateScriptTextFromScene(Mutation):
         style_guideline_id = ID()
         script_dialog_flavor_id = ID()
         screenplay_format = Boolean()
+        reuse_cached_results = Boolean()
 
     agent_task_id = ID()
 
     @project_role(roles="owner")
-    def mutate(self, info, scene_key, text_id, scene_text_id, project_id, include_beat_sheet=True, author_style_id=None, style_guideline_id=None, script_dialog_flavor_id=None, screenplay_format=False):
+    def mutate(self, info, scene_key, text_id, scene_text_id, project_id, include_beat_sheet=True, author_style_id=None, style_guideline_id=None, script_dialog_flavor_id=None, screenplay_format=False, reuse_cached_results=False):
         user = info.context.get('user')
         try:
             agent_task_id = ScriptTextService.generate_from_scene(
-                scene_key, text_id, scene_text_id, user.id, include_beat_sheet, author_style_id, style_guideline_id, script_dialog_flavor_id, screenplay_format
+                scene_key, text_id, scene_text_id, user.id, include_beat_sheet, author_style_id, style_guideline_id, script_dialog_flavor_id, screenplay_format,
+                reuse_cached_results=reuse_cached_results
             )
             return GenerateScriptTextFromScene(agent_task_id=agent_task_id)
         except Exception as e:
@@ -152,15 +154,17 @@ class GenerateScriptTextWithNotes(Mutation):
         screenplay_format = Boolean()
         select_text_start = Int()
         select_text_end = Int()
+        reuse_cached_results = Boolean()
 
     agent_task_id = ID()
 
     @project_role(roles="owner")
-    def mutate(self, info, scene_key, text_id, text_notes, project_id, include_beat_sheet=True, author_style_id=None, style_guideline_id=None, script_dialog_flavor_id=None, screenplay_format=False, select_text_start=None, select_text_end=None):
+    def mutate(self, info, scene_key, text_id, text_notes, project_id, include_beat_sheet=True, author_style_id=None, style_guideline_id=None, script_dialog_flavor_id=None, screenplay_format=False, select_text_start=None, select_text_end=None, reuse_cached_results=False):
         user = info.context.get('user')
         try:
             agent_task_id = ScriptTextService.generate_with_notes(
-                scene_key, text_id, text_notes, user.id, include_beat_sheet, author_style_id, style_guideline_id, script_dialog_flavor_id, screenplay_format, select_text_start, select_text_end
+                scene_key, text_id, text_notes, user.id, include_beat_sheet, author_style_id, style_guideline_id, script_dialog_flavor_id, screenplay_format, select_text_start, select_text_end,
+                reuse_cached_results=reuse_cached_results
             )
             return GenerateScriptTextWithNotes(agent_task_id=agent_task_id)
         except Exception as e:
@@ -176,15 +180,17 @@ class GenerateScriptAndBeatSheet(Mutation):
         style_guideline_id = ID()
         script_dialog_flavor_id = ID()
         screenplay_format = Boolean()
+        reuse_cached_results = Boolean()
 
     agent_task_id = ID()
 
     @project_role(roles="owner")
-    def mutate(self, info, scene_key, scene_text_id, project_id, author_style_id=None, style_guideline_id=None, script_dialog_flavor_id=None, screenplay_format=False):
+    def mutate(self, info, scene_key, scene_text_id, project_id, author_style_id=None, style_guideline_id=None, script_dialog_flavor_id=None, screenplay_format=False, reuse_cached_results=False):
         user = info.context.get('user')
         try:
             agent_task_id = ScriptTextService.generate_script_and_beat_sheet(
-                scene_key, scene_text_id, user.id, author_style_id, style_guideline_id, script_dialog_flavor_id, screenplay_format
+                scene_key, scene_text_id, user.id, author_style_id, style_guideline_id, script_dialog_flavor_id, screenplay_format,
+                reuse_cached_results=reuse_cached_results
             )
             return GenerateScriptAndBeatSheet(agent_task_id=agent_task_id)
         except Exception as e:
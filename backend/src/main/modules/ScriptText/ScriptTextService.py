@@ -14,6 +14,7 @@ from uuid import UUID
 from main.modules.UserPreference.UserPreferenceService import UserPreferenceService
 from main.libraries.Event import Event
 from main.libraries.Observable import Observable
+from main.libraries.DocumentHeads import DocumentHeads
 from main.libraries.Cache import Cache
 
 class ScriptTextService:
@@ -21,6 +22,9 @@ class ScriptTextService:
     # Create an observable instance for the service
     events = Observable()
 
+    # Current version and version counter of every script text
+    heads = DocumentHeads(ScriptTextModel, 'scene_key')
+
     @staticmethod
     def init_script_text(scene_key, user, scene_text_id):
         """
@@ -38,7 +42,7 @@ class ScriptTextService:
         except InvalidId as e:
             raise ValueError(f"Invalid ObjectId: {e}")
 
-        latest_script_text = ScriptTextModel.objects(scene_key=scene_key_oid).order_by('-version_number').first()
+        latest_script_text = ScriptTextService.heads.get(scene_key_oid)
 
         if latest_script_text:
             return str(latest_script_text.id)
@@ -52,6 +56,7 @@ class ScriptTextService:
             )
 
             new_script_text.save()
+            ScriptTextService.heads.reset(new_script_text.scene_key, new_script_text)
 
             #refresh data
             new_script_text = ScriptTextModel.objects(id=new_script_text.id).first()
@@ -82,12 +87,30 @@ class ScriptTextService:
                 if version_number:
                     return ScriptTextModel.objects(scene_key=oid, version_number=version_number).first()
                 else:
-                    return ScriptTextModel.objects(scene_key=oid).order_by('-version_number').first()
+                    return ScriptTextService.heads.get(oid)
             else:
                 raise ValueError("Either text_id or scene_key must be provided.")
         except InvalidId as e:
             raise ValueError(f"Invalid ObjectId: {e}")
 
+    @staticmethod
+    def get_latest_script_text_ids(scene_keys):
+        """
+        Look up the latest script text version of several scenes with a single query.
+        Unlike init_script_text, this never creates missing script texts.
+
+        :param scene_keys: The keys of the scenes.
+        :return: A dictionary mapping each scene key (as a string) to the ID of its latest script text.
+        """
+        if not scene_keys:
+            return {}
+
+        latest_versions = ScriptTextModel.objects(scene_key__in=scene_keys).aggregate([
+            {'$sort': {'scene_key': 1, 'version_number': -1}},
+            {'$group': {'_id': '$scene_key', 'latest_id': {'$first': '$_id'}}},
+        ])
+        return {str(version['_id']): str(version['latest_id']) for version in latest_versions}
+
     @staticmethod
     def list_script_text_versions(scene_key):
         """
@@ -128,9 +151,8 @@ class ScriptTextService:
         :param llm_model: Optional LLM model used for the new version.
         :return: The newly created ScriptTextModel object.
         """
-        # Determine the latest version number for the scene and increment it
-        latest_version = ScriptTextModel.objects(scene_key=source_text.scene_key).order_by('-version_number').first()
-        next_version_number = latest_version.version_number + 1 if latest_version else 1
+        # Allocate the version number atomically, so concurrent new versions never share one
+        next_version_number = ScriptTextService.heads.next_version_number(source_text.scene_key)
 
         # Create the new version
         new_script_text = ScriptTextModel(
@@ -145,7 +167,9 @@ class ScriptTextService:
             llm_model=llm_model if llm_model is not None else source_text.llm_model,
             created_by=user
         )
+        new_script_text.set_delta_base(source_text.id)
         new_script_text.save()
+        ScriptTextService.heads.advance(new_script_text.scene_key, new_script_text)
 
         #refresh data
         new_script_text = ScriptTextModel.objects(id=new_script_text.id).first()
@@ -187,6 +211,7 @@ class ScriptTextService:
 
         # Save the new base as the only version
         new_base.save()
+        ScriptTextService.heads.reset(new_base.scene_key, new_base)
 
         #trigger events
         ScriptTextService.events.notify(Event('script_text_rebased', {'script_text': new_base}))
@@ -259,7 +284,8 @@ class ScriptTextService:
         author_style_id=None,
         style_guideline_id=None,
         script_dialog_flavor_id=None,
-        screenplay_format=False
+        screenplay_format=False,
+        reuse_cached_results=False
         ):
 
         # Load the script text object
@@ -330,7 +356,8 @@ class ScriptTextService:
 
         # Create the agent task
         agent_task = AgentTaskService.new_agent_task_with_prompt(
-            project_id, 'ScriptText', script_text.id, prompt_data, task_metadata
+            project_id, 'ScriptText', script_text.id, prompt_data, task_metadata,
+            reuse_cached_results=reuse_cached_results
         )
 
         return agent_task.id
@@ -344,6 +371,7 @@ class ScriptTextService:
                             screenplay_format=False,
                             select_text_start=None,
                             select_text_end=None,
+                            reuse_cached_results=False
                            ):
 
         # Load the script text object
@@ -423,7 +451,8 @@ class ScriptTextService:
 
         # Create the agent task
         agent_task = AgentTaskService.new_agent_task_with_prompt(
-            project_id, 'ScriptText', script_text.id, prompt_data, task_metadata
+            project_id, 'ScriptText', script_text.id, prompt_data, task_metadata,
+            reuse_cached_results=reuse_cached_results
         )
 
         return agent_task.id
@@ -432,7 +461,8 @@ class ScriptTextService:
         author_style_id=None,
         style_guideline_id=None,
         script_dialog_flavor_id=None,
-        screenplay_format=False
+        screenplay_format=False,
+        reuse_cached_results=False
     ):
         # Load the scene text object based on the script_text's scene_text_id
         scene_text = SceneTextModel.objects(id=scene_text_id, scene_key=UUID(scene_key)).first()
@@ -451,7 +481,8 @@ class ScriptTextService:
             style_guideline_id=style_guideline_id,
             script_dialog_flavor_id=script_dialog_flavor_id,
             screenplay_format=screenplay_format,
-            make_script_text=True
+            make_script_text=True,
+            reuse_cached_results=reuse_cached_results
         )
 
         return make_beat_sheet_task
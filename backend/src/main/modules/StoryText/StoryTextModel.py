@@ -1,10 +1,10 @@
-from main.libraries.EncryptedDocument import EncryptedDocument
+from main.libraries.DeltaVersionedDocument import DeltaVersionedDocument
 from mongoengine import Document, StringField, ReferenceField, IntField, DictField, DateTimeField
 from datetime import datetime
 from main.modules.Project.ProjectModel import ProjectModel
 from main.modules.User.UserModel import UserModel
 
-class StoryTextModel(EncryptedDocument):
+class StoryTextModel(DeltaVersionedDocument):
     """
     StoryTextModel represents a story text document in MongoDB.
 
@@ -32,6 +32,7 @@ class StoryTextModel(EncryptedDocument):
         ],
         'ordering': ['-created_at'],  # Documents will be ordered by 'created_at' in descending order by default.
         'encrypted_fields': ['text_seed', 'text_notes', 'text_content', 'version_label'], 
+        'delta_fields': ['text_seed', 'text_notes', 'text_content'],
     }
 
     project_id = ReferenceField(ProjectModel, required=True)
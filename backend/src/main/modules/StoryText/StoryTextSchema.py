@@ -111,16 +111,18 @@ class GenerateStoryFromSeed(Mutation):
         project_id = ID(required=True)
         text_id = ID(required=True)
         text_seed = String()
+        reuse_cached_results = Boolean()
 
     agent_task_id = ID()
 
     @project_role(roles="owner")
-    def mutate(self, info, project_id, text_id, text_seed=None):
+    def mutate(self, info, project_id, text_id, text_seed=None, reuse_cached_results=False):
         user = info.context.get('user')
         try:
             # Call the generate_from_seed method and pass the user ID
             agent_task_id = StoryTextService.generate_from_seed(
-                project_id, text_id, text_seed, user.id
+                project_id, text_id, text_seed, user.id,
+                reuse_cached_results=reuse_cached_results
             )
             return GenerateStoryFromSeed(agent_task_id=agent_task_id)
         except Exception as e:
@@ -134,16 +136,18 @@ class GenerateStoryWithNotes(Mutation):
         text_notes = String()
         select_text_start = Int()
         select_text_end = Int()
+        reuse_cached_results = Boolean()
 
     agent_task_id = ID()
 
     @project_role(roles="owner")
-    def mutate(self, info, project_id, text_id, text_notes=None, select_text_start=None, select_text_end=None):
+    def mutate(self, info, project_id, text_id, text_notes=None, select_text_start=None, select_text_end=None, reuse_cached_results=False):
         user = info.context.get('user')
         try:
             # Call the generate_from_seed method and pass the user ID
             agent_task_id = StoryTextService.generate_with_notes(
-                project_id, text_id, text_notes, user.id, select_text_start, select_text_end
+                project_id, text_id, text_notes, user.id, select_text_start, select_text_end,
+                reuse_cached_results=reuse_cached_results
             )
 
             return GenerateStoryWithNotes(agent_task_id=agent_task_id)
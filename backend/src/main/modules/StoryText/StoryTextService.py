@@ -7,6 +7,7 @@ from main.modules.AgentTask.AgentTaskService import AgentTaskService
 from main.modules.UserPreference.UserPreferenceService import UserPreferenceService
 from main.libraries.Event import Event
 from main.libraries.Observable import Observable
+from main.libraries.DocumentHeads import DocumentHeads
 from main.libraries.Cache import Cache
 
 class StoryTextService:
@@ -14,6 +15,9 @@ class StoryTextService:
     # Create an observable instance for the service
     events = Observable()
 
+    # Current version and version counter of every story text
+    heads = DocumentHeads(StoryTextModel, 'project_id')
+
     @staticmethod
     def init_story_text(project_id, user, text_seed=None):
         """
@@ -24,7 +28,7 @@ class StoryTextService:
         :param text_seed: Optional seed text for the story.
         :return: The ID of the existing or newly created story text version.
         """
-        latest_story_text = StoryTextModel.objects(project_id=project_id).order_by('-version_number').first()
+        latest_story_text = StoryTextService.heads.get(project_id)
 
         if latest_story_text:
             return str(latest_story_text.id)
@@ -38,6 +42,7 @@ class StoryTextService:
             )
 
             new_story_text.save()
+            StoryTextService.heads.reset(new_story_text.project_id, new_story_text)
 
             #refresh data
             new_story_text = StoryTextModel.objects(id=new_story_text.id).first()
@@ -67,7 +72,7 @@ class StoryTextService:
                 if version_number:
                     return StoryTextModel.objects(project_id=oid, version_number=version_number).first()
                 else:
-                    return StoryTextModel.objects(project_id=oid).order_by('-version_number').first()
+                    return StoryTextService.heads.get(oid)
             else:
                 raise ValueError("Either text_id or project_id must be provided.")
         except InvalidId as e:
@@ -109,9 +114,8 @@ class StoryTextService:
         :param text_content: Optional content text for the new version.
         :return: The newly created StoryTextModel object.
         """
-        # Determine the latest version number for the project and increment it
-        latest_version = StoryTextModel.objects(project_id=source_text.project_id).order_by('-version_number').first()
-        next_version_number = latest_version.version_number + 1 if latest_version else 1
+        # Allocate the version number atomically, so concurrent new versions never share one
+        next_version_number = StoryTextService.heads.next_version_number(source_text.project_id)
 
         # Create the new version
         new_story_text = StoryTextModel(
@@ -126,7 +130,9 @@ class StoryTextService:
             llm_model=llm_model if llm_model is not None else source_text.llm_model,
             created_by=user
         )
+        new_story_text.set_delta_base(source_text.id)
         new_story_text.save()
+        StoryTextService.heads.advance(new_story_text.project_id, new_story_text)
 
         #refresh data
         new_story_text = StoryTextModel.objects(id=new_story_text.id).first()
@@ -170,6 +176,7 @@ class StoryTextService:
 
         # Save the new base as the only version
         new_base.save()
+        StoryTextService.heads.reset(new_base.project_id, new_base)
 
         #trigger events
         StoryTextService.events.notify(Event('story_text_rebased', {'story_text': new_base}))
@@ -237,7 +244,7 @@ class StoryTextService:
         return new_story_text
 
     @staticmethod
-    def generate_from_seed(project_id, text_id, text_seed=None, user_id=None):
+    def generate_from_seed(project_id, text_id, text_seed=None, user_id=None, reuse_cached_results=False):
         # Load the story text object
         story_text = StoryTextModel.objects(id=text_id).first()
         if not story_text:
@@ -265,13 +272,14 @@ class StoryTextService:
 
         # Create the agent task
         agent_task = AgentTaskService.new_agent_task_with_prompt(
-            project_id, 'StoryText', story_text.id, prompt_data, task_metadata
+            project_id, 'StoryText', story_text.id, prompt_data, task_metadata,
+            reuse_cached_results=reuse_cached_results
         )
 
         return agent_task.id
 
     @staticmethod
-    def generate_with_notes(project_id, text_id, text_notes=None, user_id=None, select_text_start=None, select_text_end=None):
+    def generate_with_notes(project_id, text_id, text_notes=None, user_id=None, select_text_start=None, select_text_end=None, reuse_cached_results=False):
         # Load the story text object
         story_text = StoryTextModel.objects(id=text_id).first()
         if not story_text:
@@ -306,7 +314,8 @@ class StoryTextService:
 
         # Create the agent task
         agent_task = AgentTaskService.new_agent_task_with_prompt(
-            project_id, 'StoryText', story_text.id, prompt_data, task_metadata
+            project_id, 'StoryText', story_text.id, prompt_data, task_metadata,
+            reuse_cached_results=reuse_cached_results
         )
 
         return agent_task.id
@@ -93,13 +93,14 @@ class GenerateSuggestion(Mutation):
     class Arguments:
         project_id = ID(required=True)
         story_text_id = ID()
+        reuse_cached_results = Boolean()
 
     agent_task_id = ID()
 
     @project_role(roles="owner")
-    def mutate(self, info, project_id, story_text_id=None):
+    def mutate(self, info, project_id, story_text_id=None, reuse_cached_results=False):
         user = info.context.get('user')
-        agent_task_id = SuggestedStoryTitleService.generate_suggestion(project_id, user, story_text_id)
+        agent_task_id = SuggestedStoryTitleService.generate_suggestion(project_id, user, story_text_id, reuse_cached_results=reuse_cached_results)
         return GenerateSuggestion(agent_task_id=agent_task_id)
 
 
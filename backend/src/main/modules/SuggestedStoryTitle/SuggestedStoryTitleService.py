@@ -159,13 +159,14 @@ class SuggestedStoryTitleService:
         return True
 
     @staticmethod
-    def generate_suggestion(project_id, user, story_text_id=None):
+    def generate_suggestion(project_id, user, story_text_id=None, reuse_cached_results=False):
         """
         Generates a new title suggestion for a project based on the provided story text.
 
         :param project_id: The ID of the project for which to generate the suggestion.
         :param user: The user object initiating the suggestion generation.
         :param text_id: Optional ID of the story text to use for generating the suggestion.
+        :param reuse_cached_results: Whether a cached result of the same request may be reused.
         :return: The ID of the created agent task.
         """
         # If text_id is provided, find the story text model by text_id
@@ -203,7 +204,8 @@ class SuggestedStoryTitleService:
             document_type='SuggestedStoryTitle',
             document_id=project_id,
             prompt_data=prompt_data,
-            metadata=task_metadata
+            metadata=task_metadata,
+            reuse_cached_results=reuse_cached_results
         )
 
         # Return the ID of the created agent task
@@ -7,6 +7,9 @@ from main.libraries.Event import Event
 from main.libraries.Observable import Observable
 from main.modules.Auth.AuthService import AuthService
 import copy
+import os
+import time
+import threading
 from ..UserPreference.UserPreferenceService import UserPreferenceService
 from main.config.settings import settings
 from main.libraries.Cache import Cache
@@ -20,6 +23,10 @@ class UserService:
     # Initialize Observable object for user events
     user_events = Observable()
 
+    # Users loaded by JWTMiddleware in this worker, with the time they expire from this cache
+    cached_users = {}
+    cached_users_lock = threading.Lock()
+
     @staticmethod
     def register_user(email: str, first_name=None, last_name=None, password=None, user_context=None, oauth_provider=None, oauth_token=None):
         """
@@ -204,8 +211,35 @@ class UserService:
 
         return user  # return the updated user object
 
+    @staticmethod
+    def get_cached_user(user_id):
+        """
+        Load a user by ID, keeping it for AUTH_USER_CACHE_TTL seconds in this worker.
+        Every caller gets its own copy, so changes to it stay within the request.
+        clear_user_cache() drops the user from the cache of the worker calling it,
+        other workers load the user again once it expires.
+        """
+        ttl = float(os.getenv('AUTH_USER_CACHE_TTL', 30))
+        now = time.monotonic()
+        if ttl > 0:
+            with UserService.cached_users_lock:
+                cached = UserService.cached_users.get(str(user_id))
+            if cached and cached[1] > now:
+                return copy.deepcopy(cached[0])
+
+        user = UserModel.objects(id=user_id).first()
+        if user and ttl > 0:
+            with UserService.cached_users_lock:
+                if len(UserService.cached_users) >= 10000:
+                    UserService.cached_users.clear()
+                UserService.cached_users[str(user_id)] = (copy.deepcopy(user), now + ttl)
+        return user
+
     @staticmethod
     def clear_user_cache(user_id, user_email=None):
+        with UserService.cached_users_lock:
+            UserService.cached_users.pop(str(user_id), None)
+
         # Construct tags for invalidation
         tags_to_clear = []
         tags_to_clear.append(f'me_{user_id}')
@@ -3,6 +3,7 @@ import unittest
 from tests import BaseTestCase
 from main.modules.Project.ProjectModel import ProjectModel
 from main.modules.Admin.AdminService import AdminService
+from main.libraries.RedisConnection import RedisConnection
 
 class TestAdmin(BaseTestCase):
 
@@ -143,3 +144,29 @@ class TestAdmin(BaseTestCase):
 
         # Validate that we have received more than 0 settings
         self.assertGreater(len(settings_list), 0, "No platform settings returned.")
+
+    def test_cache_statistics_query(self):
+        # Creating the pool does not open any connection, so this works without a Redis server
+        RedisConnection.get_pool()
+
+        query = '''
+        query CacheStatistics {
+            cacheStatistics {
+                redisPools
+                tiers
+            }
+        }
+        '''
+
+        # Execute the query as an admin
+        response = self.query_admin(query)
+        self.assertNotIn('errors', response, f"GraphQL Error: {response.get('errors')}")
+
+        pool_stats = response['data']['cacheStatistics']['redisPools']['default']
+        self.assertEqual(pool_stats['in_use_connections'], 0)
+        self.assertGreater(pool_stats['max_connections'], 0)
+        self.assertIn('redis', response['data']['cacheStatistics']['tiers'])
+
+        # Regular users should not be able to read cache statistics
+        response = self.query_user_1(query)
+        self.assertIn('errors', response)
@@ -6,10 +6,17 @@ from main.modules.StoryText.StoryTextModel import StoryTextModel
 from main.modules.AgentTask.AgentTaskModel import AgentTaskModel
 from main.modules.StoryText.StoryTextService import StoryTextService
 from main.modules.AgentTask.AgentTaskService import AgentTaskService
+from main.modules.AgentTask.AgentTaskHandlers import AgentTaskHandlers
+from main.modules.AgentTask.AgentTaskOutbox import AgentTaskOutbox
+from main.libraries.QueueHelper import QueueHelper
+from main.modules.SceneText.SceneTextModel import SceneTextModel
+from main.modules.LocationProfile.LocationProfileModel import LocationProfileModel
+from main.modules.LocationProfile.LocationProfileService import LocationProfileService
 from main.modules.PromptTemplate.PromptTemplateModel import PromptTemplateModel
 from main.modules.PromptTemplate.PromptTemplateService import PromptTemplateService
 from main.modules.Admin.AdminService import AdminService
 import random
+from datetime import datetime, timedelta
 from unittest.mock import patch, MagicMock
 
 class TestAgentTask(BaseTestCase):
@@ -217,6 +224,7 @@ class TestAgentTask(BaseTestCase):
         agent_id = "agent_001"
         status = "completed"
         status_message = "Task processed successfully"
+        AgentTaskService.claim_agent_task(self.agent_task_id, agent_id)
 
         mutation = f"""
         mutation {{
@@ -280,6 +288,307 @@ class TestAgentTask(BaseTestCase):
         self.assertIsNone(reset_task.errors)
         self.assertIsNone(reset_task.processing_at)
 
+    @patch('main.modules.AgentTask.AgentTaskService.QueueHelper')
+    @patch('main.modules.AgentTask.AgentTaskService.AgentResponseCache.set')
+    @patch('main.modules.AgentTask.AgentTaskService.AgentResponseCache.get')
+    def test_response_cache(self, mock_cache_get, mock_cache_set, mock_queue_helper):
+        with patch.dict('os.environ', {'CACHE_DISABLED': '0', 'AGENT_RESPONSE_CACHE_MODELS': 'gpt-4o'}):
+            story_text = StoryTextModel.objects(project_id=self.project_id).first()
+            task_arguments = dict(
+                project_id=self.project_id, document_type='StoryText', document_id=str(story_text.id),
+                llm_model='gpt-4o', max_input_tokens=1000, max_output_tokens=1000, temperature=0,
+                prompt_text='Write a story', system_role='You are a writer'
+            )
+
+            # Nothing cached yet, the task is queued and its result is cached on completion
+            mock_cache_get.return_value = None
+            task = AgentTaskService.new_agent_task(**task_arguments)
+            self.assertIsNotNone(task.request_hash)
+            mock_queue_helper.publish_task.assert_called_once()
+
+            AgentTaskService.update_agent_task(task.id, status='completed', output_tokens_used=3, agent_results='Once upon a time')
+            mock_cache_set.assert_called_once_with(task.request_hash, task.id, 'Once upon a time', 3)
+
+            # The same request, with different outer whitespace, completes from the cache without queueing
+            mock_cache_get.return_value = {'agent_results': 'Once upon a time', 'output_tokens_used': 3, 'task_id': str(task.id)}
+            cached_task = AgentTaskService.new_agent_task(**dict(task_arguments, prompt_text='Write a story\n'))
+            mock_cache_get.assert_called_with(task.request_hash)
+            mock_queue_helper.publish_task.assert_called_once()
+            self.assertEqual(cached_task.status, 'completed')
+            self.assertTrue(cached_task.cache_hit)
+            self.assertEqual(cached_task.output_tokens_used, 0)
+            self.assertEqual(cached_task.agent_results, 'Once upon a time')
+            mock_cache_set.assert_called_once()
+
+            # Requests with a temperature above 0 are only answered from the cache when asked to
+            mock_cache_get.reset_mock()
+            AgentTaskService.new_agent_task(**dict(task_arguments, temperature=0.7))
+            mock_cache_get.assert_not_called()
+            cached_task = AgentTaskService.new_agent_task(**dict(task_arguments, temperature=0.7), reuse_cached_results=True)
+            self.assertTrue(cached_task.cache_hit)
+
+            # A cache hit is never in the outbox, not even before it is completed
+            stored = []
+            complete_from_cache = AgentTaskService.complete_from_cache
+            def check_outbox(task, cached):
+                stored.append(AgentTaskModel.objects.get(id=task.id).enqueued)
+                return complete_from_cache(task, cached)
+            with patch.object(AgentTaskService, 'complete_from_cache', side_effect=check_outbox):
+                with patch.dict('os.environ', {'AGENT_TASK_OUTBOX': '1'}):
+                    cached_task = AgentTaskService.new_agent_task(**task_arguments)
+            self.assertEqual(stored, [True])
+            self.assertTrue(AgentTaskModel.objects.get(id=cached_task.id).enqueued)
+
+            # The generation mutations let a request reuse a cached result
+            story_text.reload()
+            mutation = f'''
+                mutation {{
+                    generateStoryFromSeed(projectId: "{self.project_id}", textId: "{story_text.id}", reuseCachedResults: true) {{
+                        agentTaskId
+                    }}
+                }}
+            '''
+            agent_task_id = self.query_admin(mutation)['data']['generateStoryFromSeed']['agentTaskId']
+            self.assertTrue(AgentTaskModel.objects.get(id=agent_task_id).metadata.get('reuse_cached_results'))
+
+    @patch('main.modules.AgentTask.AgentTaskService.QueueHelper')
+    def test_agent_results_from_queue(self, mock_queue_helper):
+        task = AgentTaskModel.objects.get(id=self.agent_task_id)
+
+        with patch.dict('os.environ', {'AGENT_TASK_PAYLOAD_IN_MESSAGE': '1'}):
+            AgentTaskService.publish_task(task)
+        task_id, queue_name, payload = mock_queue_helper.publish_task.call_args[0]
+        self.assertEqual(payload['id'], self.agent_task_id)
+        self.assertEqual(payload['promptText'], task.prompt_text)
+        self.assertEqual(payload['projectId'], self.project_id)
+
+        AgentTaskService.apply_agent_result({'task_id': self.agent_task_id, 'status': 'completed', 'agent_results': 'Generated content', 'output_tokens_used': 2})
+        # A processing update handled after the results does not reopen the task
+        self.assertIsNone(AgentTaskService.apply_agent_result({'task_id': self.agent_task_id, 'status': 'processing'}))
+
+        task = AgentTaskModel.objects.get(id=self.agent_task_id)
+        self.assertEqual(task.status, 'completed')
+        self.assertEqual(task.agent_results, 'Generated content')
+        self.assertEqual(task.output_tokens_used, 2)
+
+    @patch('main.modules.AgentTask.AgentTaskOutbox.QueueHelper')
+    @patch('main.modules.AgentTask.AgentTaskService.QueueHelper')
+    def test_outbox(self, mock_queue_helper, mock_outbox_queue_helper):
+        story_text = StoryTextModel.objects(project_id=self.project_id).first()
+        task_arguments = dict(
+            project_id=self.project_id, document_type='StoryText', document_id=str(story_text.id),
+            llm_model='gpt-4o', max_input_tokens=1000, max_output_tokens=1000, temperature=0.7,
+            prompt_text='Write a story', system_role='You are a writer'
+        )
+
+        # A failed publish leaves the task in the outbox instead of failing the request
+        mock_queue_helper.publish_task.side_effect = Exception('Connection refused')
+        failed_task = AgentTaskService.new_agent_task(**task_arguments)
+        self.assertFalse(AgentTaskModel.objects.get(id=failed_task.id).enqueued)
+
+        # With AGENT_TASK_OUTBOX=1 the request does not publish at all
+        with patch.dict('os.environ', {'AGENT_TASK_OUTBOX': '1'}):
+            outbox_task = AgentTaskService.new_agent_task(**task_arguments)
+        mock_queue_helper.publish_task.assert_called_once()
+
+        # Tasks the relay fails to publish stay in the outbox
+        mock_outbox_queue_helper.publish_many.side_effect = Exception('Connection refused')
+        with patch.dict('os.environ', {'AGENT_TASK_OUTBOX': '1'}):
+            with self.assertRaises(Exception):
+                AgentTaskOutbox.relay()
+        mock_outbox_queue_helper.publish_many.side_effect = None
+        self.assertFalse(AgentTaskModel.objects.get(id=failed_task.id).enqueued)
+
+        # Without AGENT_TASK_OUTBOX=1 the relay leaves new tasks to their request for a while
+        self.assertEqual(AgentTaskOutbox.relay(), 0)
+        AgentTaskModel.objects(id=failed_task.id).update(set__updated_at=datetime.utcnow() - timedelta(minutes=5))
+        self.assertEqual(AgentTaskOutbox.relay(), 1)
+        published = mock_outbox_queue_helper.publish_many.call_args[0][0]
+        self.assertEqual([task_id for task_id, queue_name, payload in published], [failed_task.id])
+
+        with patch.dict('os.environ', {'AGENT_TASK_OUTBOX': '1'}):
+            self.assertEqual(AgentTaskOutbox.relay(), 1)
+            published = mock_outbox_queue_helper.publish_many.call_args[0][0]
+            self.assertEqual([task_id for task_id, queue_name, payload in published], [outbox_task.id])
+            self.assertTrue(AgentTaskModel.objects.get(id=outbox_task.id).enqueued)
+            self.assertEqual(AgentTaskOutbox.relay(), 0)
+
+        # Tasks stuck pending or processing go back in the outbox
+        AgentTaskModel.objects(id=failed_task.id).update(set__enqueued_at=datetime.utcnow() - timedelta(hours=1))
+        AgentTaskService.update_agent_task(outbox_task.id, status='processing')
+        AgentTaskModel.objects(id=outbox_task.id).update(set__processing_at=datetime.utcnow() - timedelta(hours=1))
+        with patch.dict('os.environ', {'AGENT_TASK_OUTBOX': '1'}):
+            self.assertEqual(AgentTaskOutbox.sweep(), 2)
+        for task_id in (failed_task.id, outbox_task.id):
+            task = AgentTaskModel.objects.get(id=task_id)
+            self.assertEqual((task.status, task.enqueued, task.requeue_count), ('pending', False, 1))
+
+        # Until they were re-queued too often
+        AgentTaskModel.objects(id=outbox_task.id).update(
+            set__status='processing', set__processing_at=datetime.utcnow() - timedelta(hours=1), set__requeue_count=3
+        )
+        AgentTaskModel.objects(id=failed_task.id).update(
+            set__enqueued=True, set__enqueued_at=datetime.utcnow() - timedelta(hours=1), set__requeue_count=3
+        )
+        self.assertEqual(AgentTaskOutbox.sweep(), 0)
+        self.assertEqual(AgentTaskModel.objects.get(id=outbox_task.id).status, 'error')
+        self.assertEqual(AgentTaskModel.objects.get(id=failed_task.id).status, 'error')
+
+    def test_claim_agent_task(self):
+        # The first agent to pick up a task gets it, a second message of it is dropped
+        task = AgentTaskService.claim_agent_task(self.agent_task_id, 'agent-1')
+        self.assertEqual((task.status, task.agent_id), ('processing', 'agent-1'))
+        self.assertIsNotNone(task.processing_at)
+        self.assertIsNone(AgentTaskService.claim_agent_task(self.agent_task_id, 'agent-2'))
+        self.assertIsNone(AgentTaskService.apply_agent_result({'task_id': self.agent_task_id, 'status': 'processing', 'agent_id': 'agent-2'}))
+        self.assertEqual(AgentTaskModel.objects.get(id=self.agent_task_id).agent_id, 'agent-1')
+
+        mutation = f'''
+            mutation {{
+                claimAgentTask(id: "{self.agent_task_id}", agentId: "agent-2") {{
+                    agentTask {{
+                        id
+                    }}
+                }}
+            }}
+        '''
+        with patch.dict('os.environ', {'AGENT_SECRET_KEY': 'agent-key'}):
+            response = self.client.post('/graphql', json={'query': mutation}, headers={'X-API-Key': 'agent-key'}).get_json()
+        self.assertIsNone(response['data']['claimAgentTask']['agentTask'])
+
+        # Until the task is pending again
+        AgentTaskService.reset_agent_task(self.agent_task_id)
+        with patch.dict('os.environ', {'AGENT_SECRET_KEY': 'agent-key'}):
+            response = self.client.post('/graphql', json={'query': mutation}, headers={'X-API-Key': 'agent-key'}).get_json()
+        self.assertEqual(response['data']['claimAgentTask']['agentTask']['id'], self.agent_task_id)
+
+    def test_completion_of_a_task_taken_away(self):
+        AgentTaskService.claim_agent_task(self.agent_task_id, 'agent-1')
+        # Stuck processing, reset and claimed by another agent
+        AgentTaskService.reset_agent_task(self.agent_task_id)
+        self.assertIsNone(AgentTaskService.update_agent_task(self.agent_task_id, status='completed', agent_results='Late', agent_id='agent-1'))
+        AgentTaskService.claim_agent_task(self.agent_task_id, 'agent-2')
+
+        self.assertIsNone(AgentTaskService.apply_agent_result({'task_id': self.agent_task_id, 'status': 'completed', 'agent_results': 'Late', 'agent_id': 'agent-1'}))
+        self.assertIsNone(AgentTaskService.update_agent_task(self.agent_task_id, status='error', errors='Timed out', agent_id='agent-1'))
+        self.assertEqual(AgentTaskModel.objects.get(id=self.agent_task_id).status, 'processing')
+
+        task = AgentTaskService.update_agent_task(self.agent_task_id, status='completed', agent_results='Generated', agent_id='agent-2')
+        self.assertEqual((task.status, task.agent_results), ('completed', 'Generated'))
+
+    def test_enqueue_in_batch(self):
+        story_text = StoryTextModel.objects(project_id=self.project_id).first()
+
+        # Inside a batch a task is only marked enqueued once the batch is published
+        with QueueHelper.batch():
+            task = AgentTaskService.new_agent_task(
+                project_id=self.project_id, document_type='StoryText', document_id=str(story_text.id),
+                llm_model='gpt-4o', max_input_tokens=1000, max_output_tokens=1000, temperature=0.7,
+                prompt_text='Write a story', system_role='You are a writer'
+            )
+            self.assertFalse(AgentTaskModel.objects.get(id=task.id).enqueued)
+        self.assertTrue(AgentTaskModel.objects.get(id=task.id).enqueued)
+
+    def test_queue_routing(self):
+        task = AgentTaskModel.objects.get(id=self.agent_task_id)
+        self.assertEqual(AgentTaskService.queue_name(task), 'agent_task_queue')
+
+        with patch.dict('os.environ', {'AGENT_TASK_ROUTING': '1'}):
+            task.llm_model = 'claude-3-haiku-20240307'
+            self.assertEqual(AgentTaskService.queue_name(task), 'agent_task_queue.anthropic.interactive')
+
+            task.document_type = 'MakeScenes'
+            self.assertEqual(AgentTaskService.queue_name(task), 'agent_task_queue.anthropic.batch')
+
+            task.metadata['lane'] = 'interactive'
+            with patch.dict('os.environ', {'AGENT_TASK_ROUTE_BY': 'model'}):
+                self.assertEqual(AgentTaskService.queue_name(task), 'agent_task_queue.claude-3-haiku-20240307.interactive')
+
+    def test_completion_handler(self):
+        runs = AgentTaskHandlers.get_statistics().get('StoryText', {}).get('runs', 0)
+        AgentTaskService.update_agent_task(self.agent_task_id, status='completed', agent_results='Generated story')
+
+        task = AgentTaskModel.objects.get(id=self.agent_task_id)
+        new_story_text = StoryTextModel.objects.get(id=task.metadata['generated_document'])
+        self.assertEqual(new_story_text.text_content, 'Generated story')
+        self.assertEqual(AgentTaskHandlers.get_statistics()['StoryText']['runs'], runs + 1)
+
+    def completed_task(self, document_type, document_id, agent_results, **metadata):
+        task = AgentTaskModel(
+            project_id=self.project_id, status='completed', document_type=document_type, document_id=str(document_id),
+            llm_model='gpt-4o', agent_results=agent_results, metadata=dict(metadata, created_by=str(self.admin.id))
+        )
+        task.save()
+        # Loaded like the listener does, with the results decrypted
+        return AgentTaskModel.objects.get(id=task.id)
+
+    def test_selective_completion_handler(self):
+        story_text = StoryTextModel.objects(project_id=self.project_id).first()
+        story_text.text_seed = 'A detective in Paris'
+        story_text.text_notes = 'Make the ending darker and shorter'
+        story_text.save()
+
+        # Only the selected part of the notes is replaced, the seed comes from the task
+        task = self.completed_task(
+            'StoryText', story_text.id, 'happier', update_field='text_notes', selective=True,
+            select_text_start=16, select_text_end=22, text_seed='A detective in Rome'
+        )
+        AgentTaskHandlers.handle(task)
+        new_story_text = StoryTextModel.objects.get(id=task.reload().metadata['generated_document'])
+        self.assertEqual(new_story_text.text_notes, 'Make the ending happier and shorter')
+        self.assertEqual(new_story_text.text_seed, 'A detective in Rome')
+        self.assertEqual(new_story_text.text_content, story_text.text_content)
+
+        # Without a selection the whole seed is replaced
+        task = self.completed_task('StoryText', new_story_text.id, 'A chef in Lyon', update_field='text_seed', selective=True)
+        AgentTaskHandlers.handle(task)
+        newest_story_text = StoryTextModel.objects.get(id=task.reload().metadata['generated_document'])
+        self.assertEqual(newest_story_text.text_seed, 'A chef in Lyon')
+        self.assertEqual(newest_story_text.text_notes, new_story_text.text_notes)
+
+    def test_make_scenes_completion_handler(self):
+        # Scenes not in the (title, text_seed) format are skipped
+        task = self.completed_task('MakeScenes', self.project_id, '[["Opening", "The detective arrives"], ["Twist"], ["Ending", "The case is closed"]]')
+        AgentTaskHandlers.handle(task)
+
+        created_scenes = task.reload().metadata['created_scenes']
+        scenes = SceneTextModel.objects(id__in=created_scenes)
+        self.assertEqual(sorted(scene.title for scene in scenes), ['Ending', 'Opening'])
+        self.assertEqual({scene.text_seed for scene in scenes}, {'The detective arrives', 'The case is closed'})
+
+        # Results which are not a list of scenes leave the scenes alone
+        task = self.completed_task('MakeScenes', self.project_id, '{"title": "Opening"}')
+        AgentTaskHandlers.handle(task)
+        self.assertNotIn('created_scenes', task.reload().metadata)
+        self.assertEqual(SceneTextModel.objects(project_id=self.project_id).count(), 2)
+
+    def test_completion_handler_applies_results_once(self):
+        story_text = StoryTextModel.objects(project_id=self.project_id).first()
+        task = self.completed_task('StoryText', story_text.id, 'Generated story')
+        AgentTaskHandlers.handle(task)
+        generated_document = task.reload().metadata['generated_document']
+
+        # A retried or replayed run does not create another version
+        AgentTaskHandlers.handle(AgentTaskModel.objects.get(id=task.id))
+        self.assertEqual(StoryTextModel.objects(project_id=self.project_id).count(), 2)
+        self.assertEqual(task.reload().metadata['generated_document'], generated_document)
+
+        # Resetting the task lets its next run apply new results
+        AgentTaskService.reset_agent_task(str(task.id))
+        self.assertNotIn('generated_document', task.reload().metadata)
+
+    def test_location_profile_completion_handler(self):
+        location_profile = LocationProfileService.create_location_profile(self.project_id, self.admin, 'Harbour', 'A foggy harbour')
+
+        task = self.completed_task('LocationProfile', location_profile.id, 'Ships creak in the fog.')
+        AgentTaskHandlers.handle(task)
+
+        new_location_profile = LocationProfileModel.objects.get(id=task.reload().metadata['generated_document'])
+        self.assertEqual(new_location_profile.text_content, 'Ships creak in the fog.')
+        self.assertEqual(new_location_profile.name, 'Harbour')
+        self.assertEqual(new_location_profile.text_seed, 'A foggy harbour')
+        self.assertEqual(new_location_profile.location_key, location_profile.location_key)
+
     def test_delete_and_generate_new_agent_task(self):
         # Set up the mutation for deleting an agent task
         agent_task_id = self.agent_task_id
@@ -316,4 +625,6 @@ class TestAgentTask(BaseTestCase):
         ProjectModel.objects.delete()
         StoryTextModel.objects.delete()
         AgentTaskModel.objects.delete()
+        SceneTextModel.objects.delete()
+        LocationProfileModel.objects.delete()
         PromptTemplateModel.objects.delete()
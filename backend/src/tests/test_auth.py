@@ -1,7 +1,11 @@
 import unittest
 from main.modules.User.UserModel import UserModel
 from main.modules.Auth.PasswordResetRequestModel import PasswordResetRequestModel
+from main.modules.Auth.RevokedTokenModel import RevokedTokenModel
 from tests import BaseTestCase
+from unittest.mock import patch, MagicMock
+from main.modules.Auth.TokenRevocation import TokenRevocation
+from main.modules.User.UserService import UserService
 
 class TestAuth(BaseTestCase):
 
@@ -110,5 +114,71 @@ class TestAuth(BaseTestCase):
         else:
             self.fail("Logout mutation did not return a successful response.")
 
+    def test_revoked_token_is_rejected(self):
+        me = '{ me { id } }'
+        self.assertEqual(self.query_user_1(me)['data']['me']['id'], str(self.user_1.id))
+
+        self.query_user_1('mutation { logout { success } }')
+        response = self.query_user_1(me)
+        self.assertIsNone(response['data']['me'])
+        self.assertEqual(response['errors'][0]['message'], 'Not authorized')
+
+    def test_revocations_from_redis(self):
+        redis_client = MagicMock()
+        redis_client.hget.return_value = b'2'
+        redis_client.hgetall.return_value = {b'_version': b'2', b'revoked_hash': b'2000000000', b'expired_hash': b'1000'}
+        pipe = redis_client.pipeline.return_value
+        pipe.__enter__.return_value = pipe
+        pipe.exists.return_value = 1
+
+        with patch.dict('os.environ', {'CACHE_DISABLED': '0', 'AUTH_REVOCATION_REFRESH': '60'}), \
+                patch('main.modules.Auth.TokenRevocation.RedisConnection.get_client', return_value=redis_client), \
+                patch.object(TokenRevocation, 'checked_at', 0), patch.object(TokenRevocation, 'version', None), \
+                patch.object(TokenRevocation, 'revoked', set()):
+            self.assertTrue(TokenRevocation.is_revoked('revoked_hash'))
+            self.assertFalse(TokenRevocation.is_revoked('other_hash'))
+            self.assertFalse(TokenRevocation.is_revoked('expired_hash'))
+            redis_client.hdel.assert_called_once_with(TokenRevocation.key(), b'expired_hash')
+            # The version is only checked once per refresh interval
+            redis_client.hget.assert_called_once()
+
+            TokenRevocation.revoke('other_hash', 2000000000)
+            self.assertTrue(TokenRevocation.is_revoked('other_hash'))
+            pipe.hset.assert_called_once_with(TokenRevocation.key(), 'other_hash', 2000000000)
+            pipe.hincrby.assert_called_once_with(TokenRevocation.key(), '_version', 1)
+
+    def test_revoke_before_revocations_are_loaded(self):
+        RevokedTokenModel(user=self.user_1, token_hash='old_revoked_in_db').save()
+        redis_client = MagicMock()
+        pipe = redis_client.pipeline.return_value
+        pipe.__enter__.return_value = pipe
+        # Redis is empty, after a flush or an eviction, until the revocations are loaded
+        pipe.exists.side_effect = [0, 1]
+        calls = MagicMock()
+        calls.attach_mock(pipe.hset, 'hset')
+        calls.attach_mock(pipe.hincrby, 'hincrby')
+
+        with patch.dict('os.environ', {'CACHE_DISABLED': '0'}), \
+                patch('main.modules.Auth.TokenRevocation.RedisConnection.get_client', return_value=redis_client):
+            TokenRevocation.revoke('new', 2000000000)
+
+        # The revocations of the database are added before the version is bumped
+        self.assertEqual([call[0] for call in calls.mock_calls], ['hset', 'hset', 'hincrby'])
+        self.assertIn('old_revoked_in_db', calls.mock_calls[0].kwargs['mapping'])
+        pipe.hsetnx.assert_called_once_with(TokenRevocation.key(), '_version', 1)
+        self.assertEqual(calls.mock_calls[1].args, (TokenRevocation.key(), 'new', 2000000000))
+        RevokedTokenModel.objects(token_hash='old_revoked_in_db').delete()
+
+    def test_cached_user(self):
+        user = UserService.get_cached_user(self.user_1.id)
+        user.first_name = 'Changed in a request'
+        with patch('main.modules.User.UserService.UserModel.objects') as mock_objects:
+            cached_user = UserService.get_cached_user(self.user_1.id)
+            mock_objects.assert_not_called()
+        self.assertEqual(cached_user.first_name, self.user_1.first_name)
+
+        UserService.clear_user_cache(self.user_1.id)
+        self.assertNotIn(str(self.user_1.id), UserService.cached_users)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,272 @@
+import unittest
+import uuid
+import time
+import dill
+from datetime import datetime
+from unittest.mock import patch, MagicMock
+from bson import ObjectId
+from main.libraries.LocalCache import LocalCache
+from main.libraries.CacheCodec import CacheCodec
+from main.libraries.decorators import _single_flight, _stale_while_revalidate, cache_response
+from main.modules.AgentTask.AgentTaskSchema import AgentTasksList
+
+
+class TestLocalCache(unittest.TestCase):
+
+    def setUp(self):
+        self.local_cache = LocalCache(max_bytes=100, max_entry_bytes=60, ttl=30)
+
+    def test_get_and_set(self):
+        self.assertEqual(self.local_cache.get('missing'), (False, None))
+
+        self.local_cache.set('key', {'title': 'Scene'}, size=10)
+        self.assertEqual(self.local_cache.get('key'), (True, {'title': 'Scene'}))
+
+        stats = self.local_cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['bytes'], 10)
+
+    def test_entry_size_limit(self):
+        self.assertFalse(self.local_cache.set('big', 'value', size=61))
+        self.assertEqual(self.local_cache.get('big'), (False, None))
+
+    def test_lru_eviction(self):
+        self.local_cache.set('a', 1, size=40)
+        self.local_cache.set('b', 2, size=40)
+        # Touch 'a' so that 'b' becomes the least recently used entry
+        self.local_cache.get('a')
+        self.local_cache.set('c', 3, size=40)
+
+        self.assertTrue(self.local_cache.get('a')[0])
+        self.assertFalse(self.local_cache.get('b')[0])
+        self.assertTrue(self.local_cache.get('c')[0])
+        self.assertEqual(self.local_cache.stats()['evictions'], 1)
+        self.assertLessEqual(self.local_cache.stats()['bytes'], 100)
+
+    def test_ttl_expiry(self):
+        with patch('main.libraries.LocalCache.time.monotonic', return_value=1000):
+            self.local_cache.set('short', 1, size=1, timeout=5)
+            self.local_cache.set('default', 2, size=1)
+        with patch('main.libraries.LocalCache.time.monotonic', return_value=1010):
+            self.assertFalse(self.local_cache.get('short')[0])
+            self.assertTrue(self.local_cache.get('default')[0])
+        with patch('main.libraries.LocalCache.time.monotonic', return_value=1031):
+            self.assertFalse(self.local_cache.get('default')[0])
+
+    def test_forget_by_tags(self):
+        self.local_cache.set('scenes', 1, size=1, tags=['project_scenes_project_id:1'])
+        self.local_cache.set('scene', 2, size=1, tags=['scene_text_project_id:1'])
+
+        self.local_cache.forget_by_tags(['project_scenes_project_id:1'])
+
+        self.assertFalse(self.local_cache.get('scenes')[0])
+        self.assertTrue(self.local_cache.get('scene')[0])
+        self.assertNotIn('project_scenes_project_id:1', self.local_cache.tag_index)
+
+    def test_stale_fill_is_rejected(self):
+        # A value read before an invalidation must not be stored after it
+        epoch = self.local_cache.epoch
+        self.local_cache.forget_by_tags(['any'])
+        self.assertFalse(self.local_cache.set('key', 1, size=1, epoch=epoch))
+        self.assertFalse(self.local_cache.get('key')[0])
+
+
+class TestCacheCodec(unittest.TestCase):
+
+    def setUp(self):
+        self.codec = CacheCodec(codec='msgpack', compress_threshold=1024)
+        self.value = {
+            'id': ObjectId(),
+            'scene_key': uuid.uuid4(),
+            'created_at': datetime(2024, 5, 1, 12, 30, 15, 120000),
+            'scene_order': 3,
+            'title': 'Opening Scene',
+            'versions': [{'version_number': 1, 'version_label': None}],
+        }
+
+    def test_round_trip(self):
+        encoded = self.codec.encode(self.value)
+        self.assertEqual(encoded[0], CacheCodec.VERSION_MSGPACK)
+        self.assertEqual(self.codec.decode(encoded), self.value)
+
+    def test_compression_above_threshold(self):
+        value = {'text_content': 'It was a dark and stormy night. ' * 200}
+        encoded = self.codec.encode(value)
+        self.assertEqual(encoded[0], CacheCodec.VERSION_MSGPACK_ZSTD)
+        self.assertLess(len(encoded), 1024)
+        self.assertEqual(self.codec.decode(encoded), value)
+
+    def test_graphql_object_type_round_trip(self):
+        value = AgentTasksList(agent_tasks=[{'id': '1', 'status': 'pending'}], pages=2, statistics={'total': 1})
+        decoded = self.codec.decode(self.codec.encode(value))
+        self.assertIsInstance(decoded, AgentTasksList)
+        self.assertEqual(decoded.agent_tasks, [{'id': '1', 'status': 'pending'}])
+        self.assertEqual(decoded.pages, 2)
+
+    def test_unsupported_type_is_rejected(self):
+        with self.assertRaises(TypeError):
+            self.codec.encode({'value': object()})
+
+    def test_legacy_entries(self):
+        legacy = dill.dumps(self.value)
+        legacy_codec = CacheCodec(codec='msgpack', legacy_read=True)
+        self.assertEqual(legacy_codec.decode(legacy), self.value)
+
+        # Pickles are refused unless legacy reads are switched on
+        with self.assertRaises(ValueError):
+            self.codec.decode(legacy)
+        with self.assertRaises(ValueError):
+            self.codec.decode(CacheCodec(codec='dill').encode(self.value))
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_lock_holder_computes(self):
+        cache = MagicMock()
+        cache.acquire_lock.return_value = 'token'
+        compute = MagicMock(return_value=['scene'])
+
+        self.assertEqual(_single_flight(cache, 'key', compute, lambda: None), ['scene'])
+        compute.assert_called_once()
+        cache.release_lock.assert_called_once_with('key', 'token')
+
+    def test_waiter_gets_result_of_lock_holder(self):
+        cache = MagicMock()
+        cache.acquire_lock.return_value = None
+        compute = MagicMock()
+        lookups = iter([None, None, ['scene']])
+
+        with patch('main.libraries.decorators.time.sleep'):
+            response = _single_flight(cache, 'key', compute, lambda: next(lookups))
+
+        self.assertEqual(response, ['scene'])
+        compute.assert_not_called()
+
+    def test_waiter_falls_back_to_stale_response(self):
+        cache = MagicMock()
+        cache.acquire_lock.return_value = None
+        compute = MagicMock()
+
+        with patch.dict('os.environ', {'CACHE_LOCK_WAIT': '0'}):
+            response = _single_flight(cache, 'key', compute, lambda: None, lambda: ['stale scene'])
+
+        self.assertEqual(response, ['stale scene'])
+        compute.assert_not_called()
+
+
+class MemoryCache:
+    """Stands in for Cache in the decorator tests, recording what is set and locked."""
+
+    def __init__(self, lock_available=True):
+        self.entries = {}
+        self.lock_available = lock_available
+        self.locked_keys = []
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, value, timeout=None, tags=[]):
+        self.entries[key] = value
+        return True
+
+    def acquire_lock(self, key, timeout):
+        self.locked_keys.append(key)
+        return 'token' if self.lock_available else None
+
+    def release_lock(self, key, token):
+        return True
+
+
+class TestCacheResponse(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = MemoryCache()
+        patcher = patch('main.libraries.decorators.Cache', return_value=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        environment = patch.dict('os.environ', {'CACHE_DISABLED': '0'})
+        environment.start()
+        self.addCleanup(environment.stop)
+
+    def resolver(self, *identifier_keys, **ttls):
+        calls = []
+
+        @cache_response('project_scenes_', *identifier_keys, **ttls)
+        def resolve(cls, info, **kwargs):
+            calls.append(info.context['user'].id)
+            return ['scene']
+        return resolve, calls
+
+    def info(self, user_id):
+        return MagicMock(context={'user': MagicMock(id=user_id)})
+
+    def test_project_members_share_entry_and_lock(self):
+        resolve, calls = self.resolver('project_id')
+
+        self.assertEqual(resolve(None, self.info('user-1'), project_id='p1'), ['scene'])
+        self.assertEqual(resolve(None, self.info('user-2'), project_id='p1'), ['scene'])
+
+        self.assertEqual(calls, ['user-1'])
+        self.assertEqual(self.cache.locked_keys, ['project_scenes_project_id:p1'])
+
+    def test_other_responses_are_cached_per_user(self):
+        resolve, calls = self.resolver('id')
+
+        resolve(None, self.info('user-1'), id='1')
+        resolve(None, self.info('user-2'), id='1')
+
+        self.assertEqual(calls, ['user-1', 'user-2'])
+
+    def test_stale_while_revalidate_entry(self):
+        resolve, calls = self.resolver('project_id', soft_ttl=60, hard_ttl=3600)
+
+        self.assertEqual(resolve(None, self.info('user-1'), project_id='p1'), ['scene'])
+        self.assertEqual(self.cache.entries['project_scenes_project_id:p1']['response'], ['scene'])
+        self.assertEqual(self.cache.entries['project_scenes_project_id:p1:stale']['response'], ['scene'])
+
+
+class TestStaleWhileRevalidate(unittest.TestCase):
+
+    def entry(self, response, fresh_for):
+        return {'response': response, 'fresh_until': time.time() + fresh_for}
+
+    def test_fresh_entry_is_served(self):
+        cache = MemoryCache()
+        cache.entries['key'] = self.entry(['cached scene'], 60)
+        compute = MagicMock()
+
+        self.assertEqual(_stale_while_revalidate(cache, 'key', [], compute, 60, 3600), ['cached scene'])
+        compute.assert_not_called()
+
+    def test_soft_expired_entry_is_refreshed_by_lock_holder(self):
+        cache = MemoryCache()
+        cache.entries['key'] = self.entry(['old scene'], -1)
+        compute = MagicMock(return_value=['new scene'])
+
+        self.assertEqual(_stale_while_revalidate(cache, 'key', [], compute, 60, 3600), ['new scene'])
+        self.assertEqual(cache.entries['key']['response'], ['new scene'])
+        self.assertGreater(cache.entries['key']['fresh_until'], time.time())
+
+    def test_soft_expired_entry_is_served_while_refreshed_elsewhere(self):
+        cache = MemoryCache(lock_available=False)
+        cache.entries['key'] = self.entry(['old scene'], -1)
+        compute = MagicMock()
+
+        self.assertEqual(_stale_while_revalidate(cache, 'key', [], compute, 60, 3600), ['old scene'])
+        compute.assert_not_called()
+
+    def test_invalidated_entry_falls_back_to_stale_copy(self):
+        cache = MemoryCache(lock_available=False)
+        cache.entries['key:stale'] = self.entry(['old scene'], -1)
+        compute = MagicMock()
+
+        with patch.dict('os.environ', {'CACHE_LOCK_WAIT': '0'}):
+            response = _stale_while_revalidate(cache, 'key', [], compute, 60, 3600)
+
+        self.assertEqual(response, ['old scene'])
+        compute.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
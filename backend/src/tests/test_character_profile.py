@@ -185,7 +185,7 @@ class TestCharacterProfile(BaseTestCase):
 
         # Additional Verification - Confirm that the new order is reflected in the database
         reordered_character = CharacterProfileModel.objects(id=character_to_move.id).first()
-        self.assertEqual(reordered_character.character_order, new_order)
+        self.assertEqual(CharacterProfileService.get_character_order(reordered_character), new_order)
 
     def test_list_character_versions(self):
         # Setup - create initial version and additional versions
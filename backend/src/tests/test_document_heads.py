@@ -0,0 +1,128 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from bson import ObjectId
+from tests import BaseTestCase
+from main.libraries.DocumentHeads import DocumentHeadModel, DocumentLockModel
+from main.modules.SceneText.SceneTextService import SceneTextService
+from main.modules.StoryText.StoryTextModel import StoryTextModel
+from main.modules.StoryText.StoryTextService import StoryTextService
+
+
+class TestDocumentHeads(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.heads = SceneTextService.heads
+        self.parent = str(ObjectId())
+        self.versions = StoryTextService.heads
+        self.project_id = ObjectId()
+
+    def story_text(self, version_number):
+        # Saved without touching the heads, like versions written before they existed
+        story_text = StoryTextModel(project_id=self.project_id, version_type='base', version_number=version_number, created_by=self.admin)
+        story_text.save()
+        return story_text
+
+    def test_next_version_number(self):
+        first = self.story_text(1)
+        self.versions.reset(self.project_id, first)
+
+        # Numbers are handed out from the head, never twice
+        self.assertEqual([self.versions.next_version_number(self.project_id) for _ in range(3)], [2, 3, 4])
+
+        # The head only moves forward
+        third = self.story_text(3)
+        self.versions.advance(self.project_id, third)
+        self.versions.advance(self.project_id, self.story_text(2))
+        self.assertEqual(self.versions.get(self.project_id).id, third.id)
+        self.assertEqual(self.versions.next_version_number(self.project_id), 5)
+
+    def test_without_head(self):
+        # A key with no versions starts at 1
+        self.assertEqual(self.versions.next_version_number(ObjectId()), 1)
+
+        # Versions written before heads existed: the latest is found by its number and becomes the head
+        latest = [self.story_text(version_number) for version_number in (1, 3, 2)][1]
+        self.assertEqual(self.versions.get(self.project_id).id, latest.id)
+        head = DocumentHeadModel.objects.get(document_type='story_texts', key=str(self.project_id))
+        self.assertEqual((head.head_id, head.head_version, head.version_counter), (latest.id, 3, 3))
+        self.assertEqual(self.versions.next_version_number(self.project_id), 4)
+
+    def test_seeding_race(self):
+        self.story_text(1)
+        self.story_text(2)
+        latest_version = self.versions._latest_version
+
+        def seeded_by_another_request(key):
+            # Another request seeds the counter, and takes number 3, in between
+            DocumentHeadModel(document_type='story_texts', key=str(self.project_id), head_version=2, version_counter=3).save()
+            return latest_version(key)
+
+        with patch.object(self.versions, '_latest_version', side_effect=seeded_by_another_request):
+            self.assertEqual(self.versions.next_version_number(self.project_id), 4)
+
+    def test_reset_and_forget(self):
+        for version_number in (1, 2, 3):
+            self.versions.advance(self.project_id, self.story_text(version_number))
+
+        # A rebase leaves one version, the counter restarts from it
+        StoryTextModel.objects(project_id=self.project_id).delete()
+        base = self.story_text(1)
+        self.versions.reset(self.project_id, base)
+        self.assertEqual(self.versions.get(self.project_id).id, base.id)
+        self.assertEqual(self.versions.next_version_number(self.project_id), 2)
+
+        # A head pointing at a deleted version falls back to the latest version
+        base.delete()
+        second = self.story_text(2)
+        self.assertEqual(self.versions.get(self.project_id).id, second.id)
+
+        # Forgotten with its document, the counter is seeded from the versions again
+        self.versions.forget([self.project_id])
+        self.assertFalse(DocumentHeadModel.objects(document_type='story_texts', key=str(self.project_id)))
+        self.assertEqual(self.versions.next_version_number(self.project_id), 3)
+
+    @patch.dict('os.environ', {'ORDER_KEY_LOCK_WAIT': '0.1'})
+    def test_ordering_lock_in_database(self):
+        # With the cache disabled, the lock is held in MongoDB
+        with self.heads.ordering(self.parent):
+            self.assertEqual(DocumentLockModel.objects.count(), 1)
+            with self.assertRaises(ValueError):
+                with self.heads.ordering(self.parent):
+                    self.fail('Ran without the order lock')
+            # Other parents have their own lock
+            with self.heads.ordering(str(ObjectId())):
+                pass
+        self.assertEqual(DocumentLockModel.objects.count(), 0)
+
+        # The lock of a holder which died is taken over once it expired
+        DocumentLockModel(key=f"order_keys:scene_texts:{self.parent}", token='dead', expires_at=datetime.utcnow() - timedelta(seconds=1)).save()
+        with self.heads.ordering(self.parent):
+            self.assertNotEqual(DocumentLockModel.objects.get().token, 'dead')
+
+    @patch.dict('os.environ', {'CACHE_DISABLED': '0'})
+    def test_ordering_fails_without_redis(self):
+        with patch('main.libraries.DocumentHeads.Cache') as mock_cache:
+            mock_cache.return_value.acquire_lock.side_effect = ConnectionError('Connection refused')
+            with self.assertRaises(ValueError):
+                with self.heads.ordering(self.parent):
+                    self.fail('Ran without the order lock')
+            mock_cache.return_value.acquire_lock.assert_called_once_with(f"order_keys:scene_texts:{self.parent}", 30, strict=True)
+
+            # Taken and released in Redis when it can be reached
+            mock_cache.return_value.acquire_lock.side_effect = None
+            mock_cache.return_value.acquire_lock.return_value = 'token'
+            with self.heads.ordering(self.parent):
+                pass
+            mock_cache.return_value.release_lock.assert_called_once_with(f"order_keys:scene_texts:{self.parent}", 'token')
+        self.assertEqual(DocumentLockModel.objects.count(), 0)
+
+    def tearDown(self):
+        super().tearDown()
+        DocumentLockModel.objects.delete()
+        DocumentHeadModel.objects.delete()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -186,7 +186,7 @@ class TestLocationProfile(BaseTestCase):
 
         # Additional Verification - Confirm that the new order is reflected in the database
         reordered_location = LocationProfileModel.objects(id=location_to_move.id).first()
-        self.assertEqual(reordered_location.location_order, new_order)
+        self.assertEqual(LocationProfileService.get_location_order(reordered_location), new_order)
 
     def test_list_location_versions(self):
         # Setup - create initial version and additional versions
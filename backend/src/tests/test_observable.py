@@ -0,0 +1,87 @@
+import unittest
+from unittest.mock import patch, MagicMock
+from main.libraries.Event import Event
+from main.libraries.Observable import Observable
+
+
+@patch.dict('os.environ', {'EVENTS_ASYNC': '1', 'EVENTS_RETRY_DELAY': '0', 'EVENTS_MAX_ATTEMPTS': '3'})
+class TestObservable(unittest.TestCase):
+
+    def setUp(self):
+        self.redis_client = MagicMock()
+        self.redis_client.set.return_value = True
+        patcher = patch('main.libraries.Observable.RedisConnection.get_client', return_value=self.redis_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_async_listeners_run_on_the_worker_pool(self):
+        observable = Observable()
+        sync_listener = MagicMock(__qualname__='sync_listener')
+        async_listener = MagicMock(__qualname__='async_listener')
+        observable.register('updated', sync_listener)
+        observable.register('updated', async_listener, run_async=True, idempotency_key=lambda event: event.data['id'])
+
+        executor = MagicMock()
+        with patch.object(Observable, 'get_executor', return_value=executor):
+            event = Event('updated', {'id': 'task'})
+            observable.notify(event)
+
+        sync_listener.assert_called_once_with(event)
+        async_listener.assert_not_called()
+        executor.submit.assert_called_once_with(
+            observable.run_async, async_listener, event, Observable.idempotency_key('updated', async_listener, 'task'), None
+        )
+
+        # Without EVENTS_ASYNC every listener runs right away
+        with patch.dict('os.environ', {'EVENTS_ASYNC': '0'}):
+            observable.notify(event)
+        async_listener.assert_called_once_with(event)
+
+    def test_retries_and_idempotency(self):
+        observable = Observable()
+        listener = MagicMock(__qualname__='listener', side_effect=[Exception('busy'), None])
+
+        observable.run_async(listener, Event('updated', {}), 'key')
+        self.assertEqual(listener.call_count, 2)
+
+        # The key is claimed before the listener runs, and marked done after
+        claim, done = self.redis_client.set.call_args_list
+        self.assertEqual(claim[0][:2], ('key', 'running'))
+        self.assertTrue(claim[1]['nx'])
+        self.assertEqual(done[0][:2], ('key', 'done'))
+
+        # Done already or running in another worker, the listener does not run again
+        self.redis_client.set.return_value = None
+        observable.run_async(listener, Event('updated', {}), 'key')
+        self.assertEqual(listener.call_count, 2)
+
+    def test_max_attempts(self):
+        observable = Observable()
+        listener = MagicMock(__qualname__='listener', side_effect=Exception('busy'))
+        observable.register('updated', listener, run_async=True, max_attempts=1)
+
+        executor = MagicMock()
+        with patch.object(Observable, 'get_executor', return_value=executor):
+            observable.notify(Event('updated', {}))
+        observable.run_async(*executor.submit.call_args[0][1:])
+        listener.assert_called_once()
+
+    def test_dead_letter(self):
+        observable = Observable()
+        listener = MagicMock(__qualname__='listener', side_effect=Exception('broken'))
+
+        observable.run_async(listener, Event('updated', {'task': MagicMock(id='task_id')}), 'key')
+        self.assertEqual(listener.call_count, 3)
+        # Only claimed, and released so the event may run again
+        self.redis_client.set.assert_called_once()
+        self.redis_client.delete.assert_called_once_with('key')
+
+        pipe = self.redis_client.pipeline.return_value
+        dead_letter_key, entry = pipe.lpush.call_args[0]
+        self.assertEqual(dead_letter_key, Observable.dead_letter_key())
+        self.assertIn('"task": "task_id"', entry)
+        self.assertIn('broken', entry)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import random
+import unittest
+from main.libraries.OrderKeys import key_between, spread_keys
+
+
+class TestOrderKeys(unittest.TestCase):
+
+    def test_key_between(self):
+        first = key_between()
+        self.assertLess(key_between(None, first), first)
+        self.assertGreater(key_between(first, None), first)
+
+        after = key_between(first, None)
+        middle = key_between(first, after)
+        self.assertTrue(first < middle < after)
+
+        with self.assertRaises(ValueError):
+            key_between(after, first)
+        with self.assertRaises(ValueError):
+            key_between('V0', None)
+
+    def test_random_inserts_stay_sorted(self):
+        generator = random.Random(9)
+        keys = [key_between()]
+        for _ in range(2000):
+            index = generator.randint(0, len(keys))
+            keys.insert(index, key_between(
+                keys[index - 1] if index > 0 else None,
+                keys[index] if index < len(keys) else None
+            ))
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(len(set(keys)), len(keys))
+        self.assertLess(max(len(key) for key in keys), 10)
+
+    def test_spread_keys(self):
+        for count in (0, 1, 61, 62, 5000):
+            keys = spread_keys(count)
+            self.assertEqual(len(set(keys)), count)
+            self.assertEqual(keys, sorted(keys))
+        self.assertEqual(max(len(key) for key in spread_keys(5000)), 3)
+        # Spread keys leave room for inserts anywhere
+        keys = spread_keys(3)
+        self.assertTrue(keys[0] < key_between(keys[0], keys[1]) < keys[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
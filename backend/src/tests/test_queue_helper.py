@@ -0,0 +1,81 @@
+import json
+import unittest
+import pika
+from unittest.mock import patch, MagicMock
+from main.libraries.QueueHelper import QueueHelper
+
+
+@patch.dict('os.environ', {'MOCK_QUEUE': '0', 'QUEUE_PUBLISH_CONFIRM': '1'})
+class TestQueueHelper(unittest.TestCase):
+
+    def setUp(self):
+        QueueHelper._disconnect()
+        patcher = patch('main.libraries.QueueHelper.pika')
+        self.mock_pika = patcher.start()
+        self.mock_pika.exceptions = pika.exceptions
+        self.addCleanup(patcher.stop)
+        self.addCleanup(QueueHelper._disconnect)
+
+    def test_publish_many_over_one_connection(self):
+        channel = self.mock_pika.BlockingConnection.return_value.channel.return_value
+
+        QueueHelper.publish_task('task_1', 'agent_task_queue')
+        QueueHelper.publish_many([('task_2', 'agent_task_queue', None), ('task_3', 'agent_task_queue', {'id': 'task_3'})])
+
+        self.mock_pika.BlockingConnection.assert_called_once()
+        channel.confirm_delivery.assert_called_once()
+        channel.tx_select.assert_not_called()
+        channel.queue_declare.assert_called_once_with(queue='agent_task_queue', durable=True)
+        self.assertEqual(channel.basic_publish.call_count, 3)
+        # Confirmed publishes raise for messages no queue took
+        self.assertTrue(channel.basic_publish.call_args.kwargs['mandatory'])
+        self.assertEqual(json.loads(channel.basic_publish.call_args.kwargs['body']), {'task_id': 'task_3', 'task': {'id': 'task_3'}})
+
+    def test_reconnects_after_a_dropped_connection(self):
+        dropped_channel, channel = MagicMock(), MagicMock()
+        dropped_channel.basic_publish.side_effect = pika.exceptions.StreamLostError('Connection lost')
+        self.mock_pika.BlockingConnection.return_value.channel.side_effect = [dropped_channel, channel]
+
+        QueueHelper.publish_task('task_1', 'agent_task_queue')
+
+        self.assertEqual(self.mock_pika.BlockingConnection.call_count, 2)
+        channel.confirm_delivery.assert_called_once()
+        channel.basic_publish.assert_called_once()
+
+    def test_batch(self):
+        channel = self.mock_pika.BlockingConnection.return_value.channel.return_value
+
+        with QueueHelper.batch():
+            QueueHelper.publish_task('task_1', 'agent_task_queue')
+            with QueueHelper.batch():
+                QueueHelper.publish_task('task_2', 'agent_task_queue')
+            channel.basic_publish.assert_not_called()
+
+        self.assertEqual(channel.basic_publish.call_count, 2)
+
+    def test_batch_callbacks_run_once_published(self):
+        channel = self.mock_pika.BlockingConnection.return_value.channel.return_value
+        published = []
+
+        with QueueHelper.batch():
+            QueueHelper.publish_task('task_1', 'agent_task_queue', on_published=lambda: published.append('task_1'))
+            self.assertEqual(published, [])
+        self.assertEqual(published, ['task_1'])
+
+        # A batch which fails to publish does not run them, and raises the publish error
+        channel.basic_publish.side_effect = pika.exceptions.NackError([])
+        with self.assertRaises(pika.exceptions.NackError):
+            with QueueHelper.batch():
+                QueueHelper.publish_task('task_2', 'agent_task_queue', on_published=lambda: published.append('task_2'))
+        self.assertEqual(published, ['task_1'])
+
+        # Unless the block itself failed, its error is the one raised
+        with self.assertRaises(ValueError):
+            with QueueHelper.batch():
+                QueueHelper.publish_task('task_3', 'agent_task_queue', on_published=lambda: published.append('task_3'))
+                raise ValueError('Task not found')
+        self.assertEqual(published, ['task_1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
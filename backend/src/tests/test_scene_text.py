@@ -2,6 +2,8 @@ import unittest
 from tests import BaseTestCase
 from main.modules.Project.ProjectModel import ProjectModel
 from main.modules.SceneText.SceneTextModel import SceneTextModel
+from main.libraries.DeltaVersionedDocument import reconstructed_versions
+from main.libraries.DocumentHeads import DocumentHeadModel
 from main.modules.User.UserModel import UserModel
 from main.modules.Project.ProjectService import ProjectService
 from main.modules.SceneText.SceneTextService import SceneTextService
@@ -9,6 +11,8 @@ from main.modules.PromptTemplate.PromptTemplateModel import PromptTemplateModel
 from main.modules.PromptTemplate.PromptTemplateService import PromptTemplateService
 from bson import ObjectId
 from unittest.mock import patch, MagicMock
+from contextlib import contextmanager
+from mongomock.collection import Collection
 from main.modules.Admin.AdminService import AdminService
 
 
@@ -186,7 +190,11 @@ class TestSceneText(BaseTestCase):
 
         # Additional Verification - Confirm that the new order is reflected in the database
         reordered_scene = SceneTextModel.objects(id=scene_to_move.id).first()
-        self.assertEqual(reordered_scene.scene_order, new_order)
+        self.assertEqual(SceneTextService.get_scene_order(reordered_scene), new_order)
+
+        # The other scenes were not rewritten
+        for scene_text in scene_texts[1:]:
+            self.assertEqual(SceneTextModel.objects(id=scene_text.id).first().scene_order, scene_text.scene_order)
 
     def test_list_scene_versions(self):
         # Setup - create initial version and additional versions
@@ -349,6 +357,66 @@ class TestSceneText(BaseTestCase):
         self.assertEqual(latest_version.text_content, update_fields['text_content'], "Text content was not updated.")
         self.assertEqual(latest_version.created_by.id, self.user_1.id, "Created by user is incorrect.")
 
+    @patch.dict('os.environ', {'VERSION_DELTA_STORAGE': '1'})
+    def test_delta_stored_versions(self):
+        scene_text = SceneTextService.create_scene_text(
+            project_id=str(self.project_id),
+            user=self.user_1,
+            title="Delta Scene"
+        )
+        text_content = "\n".join(f"Line {index} of a long scene." for index in range(100))
+        first_version = SceneTextService.update_scene_text(str(scene_text.id), self.user_1, text_content=text_content)
+        edited_content = text_content.replace("Line 50 ", "Line fifty ")
+        second_version = SceneTextService.update_scene_text(str(first_version.id), self.user_1, text_content=edited_content)
+
+        # The edit is stored as a delta of the version it was made from
+        stored = SceneTextModel._get_collection().find_one({'_id': second_version.id})
+        self.assertIsNone(stored.get('text_content'))
+        self.assertEqual(stored['delta_base'], first_version.id)
+
+        # Reads see the full text
+        query = f'''
+        query {{
+            getSceneText(projectId: "{str(self.project_id)}", sceneKey: "{str(scene_text.scene_key)}") {{
+                versionNumber
+                textContent
+            }}
+        }}
+        '''
+        response = self.query_user_1(query)
+        scene_text_data = response['data']['getSceneText']
+        self.assertEqual(scene_text_data['versionNumber'], second_version.version_number)
+        self.assertEqual(scene_text_data['textContent'], edited_content)
+
+    @patch.dict('os.environ', {'VERSION_DELTA_STORAGE': '1'})
+    def test_saving_delta_base(self):
+        scene_text = SceneTextService.create_scene_text(
+            project_id=str(self.project_id),
+            user=self.user_1,
+            title="Delta Base Scene"
+        )
+        text_content = "\n".join(f"Line {index} of a long scene." for index in range(100))
+        first_version = SceneTextService.update_scene_text(str(scene_text.id), self.user_1, text_content=text_content)
+        edited_content = text_content.replace("Line 50 ", "Line fifty ")
+        second_version = SceneTextService.update_scene_text(str(first_version.id), self.user_1, text_content=edited_content)
+
+        # Saving a loaded version without text changes leaves the versions based on it alone
+        base = SceneTextModel.objects(id=first_version.id).first()
+        base.title = "Renamed"
+        reconstructed_versions.forget([SceneTextModel._cache_key(base.id)])
+        with patch.object(SceneTextModel, 'objects', wraps=SceneTextModel.objects) as objects:
+            base.save()
+        objects.assert_not_called()
+        self.assertIsNotNone(SceneTextModel._get_collection().find_one({'_id': second_version.id}).get('text_delta'))
+
+        # Changing its text stores them in full first
+        base = SceneTextModel.objects(id=first_version.id).first()
+        base.text_content = "Rewritten"
+        base.save()
+        stored = SceneTextModel._get_collection().find_one({'_id': second_version.id})
+        self.assertIsNone(stored.get('text_delta'))
+        self.assertEqual(SceneTextModel.objects(id=second_version.id).first().text_content, edited_content)
+
     @patch('main.libraries.QueueHelper.pika')
     def test_generate_scene_from_seed(self, mock_pika):
         # Mock the components of pika used in QueueHelper.publish_task
@@ -544,10 +612,134 @@ class TestSceneText(BaseTestCase):
         assert response['data']['reorderScene']['success'] is True, "Reordering scene failed according to GraphQL response."
 
         # Additional Verification - Confirm that scene orders are sequential and ch
-        reordered_scenes = SceneTextModel.objects(project_id=project_id).order_by('scene_order')
+        reordered_scenes = SceneTextService.list_project_scenes(project_id)
         for index, scene in enumerate(reordered_scenes):
             expected_order = index + 1
-            assert scene.scene_order == expected_order, f"Scene order is incorrect. Expected {expected_order}, got {scene.scene_order}"
+            assert scene['scene_order'] == expected_order, f"Scene order is incorrect. Expected {expected_order}, got {scene['scene_order']}"
+        self.assertEqual(
+            [scene['title'] for scene in reordered_scenes],
+            ['Scene 2', 'Scene 3', 'Scene 1', 'Scene 4', 'Scene 5', 'Scene 6']
+        )
+
+    def test_scene_order_of_legacy_scenes(self):
+        # Scenes stored before order keys existed keep their integer order
+        project = ProjectModel.objects(id=self.project_id).first()
+        for order in (2, 3, 1):
+            SceneTextModel(project_id=project, created_by=self.user_1, title=f"Scene {order}", scene_order=order, version_type="base", version_number=1).save()
+
+        scenes = SceneTextService.list_project_scenes(str(self.project_id))
+        self.assertEqual([scene['title'] for scene in scenes], ['Scene 1', 'Scene 2', 'Scene 3'])
+
+        # Inserting after the first scene and moving a scene only write order keys
+        new_scene = SceneTextService.create_scene_text(str(self.project_id), self.user_1, "Scene 1b", scene_order_after=1)
+        self.assertEqual(new_scene.scene_order, 2)
+        SceneTextService.reorder_scene(str(scenes[2]['id']), 1)
+
+        scenes = SceneTextService.list_project_scenes(str(self.project_id))
+        self.assertEqual([scene['title'] for scene in scenes], ['Scene 3', 'Scene 1', 'Scene 1b', 'Scene 2'])
+        self.assertEqual([scene['scene_order'] for scene in scenes], [1, 2, 3, 4])
+        self.assertEqual(SceneTextModel.objects(id=scenes[0]['id']).first().scene_order, 3)
+
+    def test_scene_order_reads_do_not_write(self):
+        project = ProjectModel.objects(id=self.project_id).first()
+        for order in (2, 1):
+            SceneTextModel(project_id=project, created_by=self.user_1, title=f"Scene {order}", scene_order=order, version_type="base", version_number=1).save()
+
+        scenes = SceneTextService.list_project_scenes(str(self.project_id))
+        self.assertEqual([scene['scene_order'] for scene in scenes], [1, 2])
+        self.assertEqual(SceneTextService.get_scene_order(SceneTextModel.objects(id=scenes[1]['id']).first()), 2)
+        self.assertEqual(DocumentHeadModel.objects(document_type='scene_texts', parent_key=str(self.project_id)).count(), 0)
+
+    @contextmanager
+    def counted_operations(self):
+        # Counts the reads and writes of all collections
+        counts = {'reads': 0, 'writes': 0}
+        operations = {
+            'reads': ('find', 'aggregate', 'count_documents'),
+            'writes': ('insert_one', 'insert_many', 'update_one', 'update_many', 'replace_one', 'find_one_and_update', 'delete_one', 'delete_many', 'bulk_write'),
+        }
+        patchers = []
+        for kind, names in operations.items():
+            for name in names:
+                def counted(collection, *args, _original=getattr(Collection, name), _kind=kind, **kwargs):
+                    counts[_kind] += 1
+                    return _original(collection, *args, **kwargs)
+                patchers.append(patch.object(Collection, name, counted))
+        for patcher in patchers:
+            patcher.start()
+        try:
+            yield counts
+        finally:
+            for patcher in patchers:
+                patcher.stop()
+
+    def test_list_project_scenes_queries(self):
+        def add_scenes(count):
+            scenes = SceneTextService.bulk_create_scenes(str(self.project_id), self.user_1, [(f"Scene {i}", f"Seed {i}.") for i in range(count)])
+            # Edited scenes have a source version to look up
+            for scene in scenes[:2]:
+                SceneTextService.create_new_version(scene, self.user_1, 'edit', text_content='Edited')
+
+        add_scenes(3)
+        with self.counted_operations() as few:
+            self.assertEqual(len(SceneTextService.list_project_scenes(str(self.project_id))), 3)
+
+        add_scenes(30)
+        with patch.object(SceneTextModel, 'save') as save, self.counted_operations() as many:
+            self.assertEqual(len(SceneTextService.list_project_scenes(str(self.project_id))), 33)
+
+        # As many queries for 33 scenes as for 3, and nothing written
+        self.assertEqual(many['reads'], few['reads'])
+        self.assertEqual((few['writes'], many['writes']), (0, 0))
+        save.assert_not_called()
+
+    def test_scene_positions_after_rebalance(self):
+        scenes = [SceneTextService.create_scene_text(str(self.project_id), self.user_1, f"Scene {index}") for index in range(1, 5)]
+        # Versions deleted without their head leave a stale head, dropped by the next write
+        SceneTextModel.objects(scene_key=scenes[1].scene_key).delete()
+
+        SceneTextService.heads.rebalance(str(self.project_id))
+
+        ordered = SceneTextService.heads.ordered_keys(str(self.project_id))
+        self.assertEqual([key for key, _ in ordered], [str(scene.scene_key) for scene in scenes if scene is not scenes[1]])
+        self.assertEqual(len({order_key for _, order_key in ordered}), 3)
+        for position, scene in enumerate((scenes[0], scenes[2], scenes[3]), start=1):
+            self.assertEqual(SceneTextService.get_scene_order(scene), position)
+
+    def test_bulk_create_scenes(self):
+        # Setup - an existing scene that the bulk creation replaces
+        old_scene = SceneTextService.create_scene_text(str(self.project_id), self.user_1, "Old Scene")
+
+        with patch.object(SceneTextService.events, 'notify') as notify:
+            scene_texts = SceneTextService.bulk_create_scenes(
+                str(self.project_id),
+                self.user_1,
+                [(f"Scene {i}", f"Content for scene {i}.") for i in range(1, 41)],
+                replace_existing=True
+            )
+
+        # One aggregated event for the whole batch
+        notify.assert_called_once()
+        self.assertEqual(notify.call_args[0][0].type, 'scenes_created')
+        self.assertEqual(notify.call_args[0][0].data['deleted_scene_keys'], [str(old_scene.scene_key)])
+
+        self.assertEqual(len(scene_texts), 40)
+        self.assertIsNone(SceneTextModel.objects(scene_key=old_scene.scene_key).first())
+
+        scenes = SceneTextService.list_project_scenes(str(self.project_id))
+        self.assertEqual([scene['title'] for scene in scenes], [f"Scene {i}" for i in range(1, 41)])
+        self.assertEqual([scene['scene_order'] for scene in scenes], list(range(1, 41)))
+        self.assertEqual(scenes[0]['text_seed'], "Content for scene 1.")
+        self.assertIsNotNone(scenes[0]['latest_beat_sheet_id'])
+        self.assertIsNotNone(scenes[0]['latest_script_text_id'])
+
+        # Bulk inserted documents are encrypted like saved ones
+        stored = SceneTextModel._get_collection().find_one({'_id': scene_texts[0].id})
+        self.assertNotEqual(stored['title'], "Scene 1")
+
+        # New scenes go after the bulk created ones
+        new_scene = SceneTextService.create_scene_text(str(self.project_id), self.user_1, "Scene 41")
+        self.assertEqual(SceneTextService.get_scene_order(new_scene), 41)
 
     def tearDown(self):
         super().tearDown()
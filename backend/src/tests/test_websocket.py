@@ -0,0 +1,124 @@
+import json
+import unittest
+from unittest.mock import patch, MagicMock
+from main.libraries.Websocket import Websocket, BroadcastCoalescer
+from main.libraries.WebsocketRelay import WebsocketRelay
+
+
+@patch.dict('os.environ', {'MOCK_WEBSOCKETS': '0', 'WEBSOCKET_COALESCE_MS': '50'})
+class TestWebsocket(unittest.TestCase):
+
+    def setUp(self):
+        self.redis_client = MagicMock()
+        patcher = patch('main.libraries.Websocket.RedisConnection.get_client', return_value=self.redis_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(BroadcastCoalescer.buffers.clear)
+
+    def published(self):
+        published = []
+        for call in self.redis_client.publish.call_args_list:
+            self.assertEqual(call.args[0], 'notifications')
+            notification = json.loads(call.args[1])
+            self.assertIsInstance(notification.pop('sent_at'), float)
+            published.append(notification)
+        return published
+
+    def test_coalesced_broadcast(self):
+        with patch('main.libraries.Websocket.threading.Timer') as mock_timer:
+            websocket_util = Websocket()
+            for status in ('pending', 'processing', 'completed'):
+                websocket_util.broadcast_message('project-1', {'type': 'agent_task', 'agent_task_id': 'task', 'status': status, 'document_type': 'SceneText', 'document_id': 'scene'})
+            websocket_util.broadcast_message('project-1', {'type': 'scene_text', 'document_id': 'scene', 'event_type': 'scene_text_new_version'})
+            websocket_util.broadcast_message('project-1', {'type': 'scene_text', 'document_id': 'scene', 'event_type': 'scene_text_new_version'})
+            websocket_util.broadcast_message('project-2', {'type': 'scene_text', 'document_id': 'other'})
+
+        # One window for each channel, nothing sent before it ends
+        self.assertEqual(mock_timer.call_count, 2)
+        self.redis_client.publish.assert_not_called()
+
+        BroadcastCoalescer.flush_all()
+        batch, single = self.published()
+        self.assertEqual(single, {'channel': 'project-2', 'notification': {'type': 'scene_text', 'document_id': 'other'}})
+        self.assertEqual(batch['channel'], 'project-1')
+        self.assertEqual(batch['notification']['type'], 'batch')
+        self.assertEqual([notification.get('status') for notification in batch['notification']['notifications']], ['completed', None])
+        self.assertEqual(batch['notification']['changed'], [
+            {'type': 'agent_task', 'document_type': 'SceneText', 'document_id': 'scene'},
+            {'type': 'scene_text', 'document_type': None, 'document_id': 'scene'},
+        ])
+
+    def test_merge_flattens_batches(self):
+        first = BroadcastCoalescer.merge([
+            {'type': 'agent_task', 'agent_task_id': 'task', 'status': 'processing'},
+            {'type': 'scene_text', 'document_id': 'a'},
+        ])
+        second = BroadcastCoalescer.merge([
+            {'type': 'agent_task', 'agent_task_id': 'task', 'status': 'completed'},
+            {'type': 'scene_text', 'document_id': 'a'},
+            {'type': 'scene_text', 'document_id': 'b'},
+        ])
+
+        # Batches merged again, as the relay does with those of the broadcasting processes, are not nested
+        merged = BroadcastCoalescer.merge([first, second])
+        self.assertEqual(merged['type'], 'batch')
+        self.assertEqual(merged['notifications'], [
+            {'type': 'scene_text', 'document_id': 'a'},
+            {'type': 'agent_task', 'agent_task_id': 'task', 'status': 'completed'},
+            {'type': 'scene_text', 'document_id': 'b'},
+        ])
+        self.assertEqual([document['document_id'] for document in merged['changed']], ['a', None, 'b'])
+
+    def test_flush_when_full(self):
+        with patch.dict('os.environ', {'WEBSOCKET_COALESCE_MAX': '2'}):
+            websocket_util = Websocket()
+            websocket_util.broadcast_message('project-1', {'type': 'scene_text', 'document_id': 'a'})
+            websocket_util.broadcast_message('project-1', {'type': 'scene_text', 'document_id': 'b'})
+
+        notification = self.published()[0]['notification']
+        self.assertEqual([document['document_id'] for document in notification['changed']], ['a', 'b'])
+
+    def test_without_coalescing(self):
+        with patch.dict('os.environ', {'WEBSOCKET_COALESCE_MS': '0'}):
+            Websocket().broadcast_message('project-1', {'type': 'scene_text'})
+        self.assertEqual(self.published(), [{'channel': 'project-1', 'notification': {'type': 'scene_text'}}])
+
+
+    def test_sharded_channels(self):
+        with patch.dict('os.environ', {'WEBSOCKET_COALESCE_MS': '0', 'WEBSOCKET_RELAY_SHARDS': '4'}):
+            Websocket().broadcast_message('project-1', {'type': 'scene_text'})
+            shard = Websocket.shard_of('project-1')
+            self.assertEqual(self.redis_client.publish.call_args.args[0], f'notifications.{shard}')
+            self.assertEqual(Websocket.notifications_channel(shard), f'notifications.{shard}')
+
+    def test_relay_drains_without_waiting(self):
+        notifications = [
+            {'channel': 'project-1', 'notification': {'type': 'scene_text', 'document_id': 'a'}, 'sent_at': 1.0},
+            {'channel': 'project-2', 'notification': {'type': 'scene_text', 'document_id': 'b'}},
+            {'channel': 'project-1', 'notification': {'type': 'scene_text', 'document_id': 'c'}},
+        ]
+        pubsub = MagicMock()
+        pubsub.get_message.side_effect = [{'type': 'message', 'data': json.dumps(notification).encode('utf-8')} for notification in notifications] + [None]
+        emit, sleep = MagicMock(), MagicMock()
+
+        with patch.dict('os.environ', {'WEBSOCKET_COALESCE_MS': '0'}):
+            relay = WebsocketRelay(emit=emit, sleep=sleep)
+            self.assertEqual(relay.drain(pubsub), 3)
+        # Only the first read waits for notifications
+        self.assertEqual([call.kwargs['timeout'] for call in pubsub.get_message.call_args_list], [1.0, 0, 0, 0])
+        self.assertEqual([call.kwargs['room'] for call in emit.call_args_list], ['project-1', 'project-1', 'project-2'])
+        sleep.assert_called_once_with(0)
+
+        # Coalesced, a room gets one emit for its notifications of a batch
+        emit.reset_mock()
+        pubsub.get_message.side_effect = [{'type': 'message', 'data': json.dumps(notification)} for notification in notifications] + [None]
+        relay.drain(pubsub)
+        self.assertEqual(emit.call_count, 2)
+        self.assertEqual(emit.call_args_list[0].args[1]['type'], 'batch')
+
+        statistics = relay.statistics()
+        self.assertEqual((statistics['notifications'], statistics['emits'], statistics['batches']), (6, 5, 2))
+        self.assertGreater(statistics['max_latency_ms'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,9 +4,9 @@ from dotenv import load_dotenv
 from flask import Flask
 from flask_cors import CORS
 from flask_socketio import SocketIO, join_room
-import redis
 import json
 from main.libraries.functions import setup_opentelemetry
+from main.libraries.WebsocketRelay import WebsocketRelay
 
 # Load environment variables from .env file
 load_dotenv()
@@ -23,10 +23,11 @@ async_mode = 'threading'
 if os.getenv("FLASK_ENV") == "production":
     async_mode = 'gevent'
 
-socketio = SocketIO(app, cors_allowed_origins='*', async_mode=async_mode)
+# Relay processes sharding the channels (WEBSOCKET_RELAY_SHARDS) share their emits through a message queue,
+# e.g. redis://localhost:6379/0, so every client receives them whichever process it is connected to
+socketio = SocketIO(app, cors_allowed_origins='*', async_mode=async_mode,
+                    message_queue=os.getenv('WEBSOCKET_MESSAGE_QUEUE') or None)
 
-# Initialize Redis client
-redis_client = redis.Redis(host=os.getenv("REDIS_HOST"), port=os.getenv("REDIS_PORT"), db=0)
 
 # Simple log message function
 def log_message(message):
@@ -50,33 +51,15 @@ def on_join(data):
     join_room(room)
     log_message(f'Client joined room: {room}')
 
-def message_received_handler(message):
-    # Log received message for debugging
-    log_message(f"Received message: {message}")
+# Relay the notifications published on Redis to the rooms, see WebsocketRelay
+relay = WebsocketRelay(
+    emit=socketio.emit,
+    sleep=socketio.sleep,
+    log=log_message if os.getenv('WEBSOCKET_RELAY_DEBUG') == '1' else None
+)
 
-    # Decode the message data
-    data = json.loads(message['data'].decode('utf-8'))
-
-    # Log the decoded data
-    log_message(f"Received data: {data}")
-
-    # Emit to the channel specified in the message
-    # Assuming the message data contains 'channel' and 'notification' keys
-    socketio.emit('message', data['notification'], room=data['channel'])
-
-pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
-pubsub.subscribe(**{'notifications': message_received_handler})
-
-# Start a thread that listens for incoming messages on the Redis channel
-def redis_listener():
-   for message in pubsub.listen():
-       # Check that the received message is of type 'message'
-       if message['type'] == 'message':
-           message_received_handler(message)
-       socketio.sleep(0.1)  # Non-blocking sleep
-
-# Start the Redis listener in a background thread
-socketio.start_background_task(redis_listener)
+# Start the relay in a background thread
+socketio.start_background_task(relay.run)
 
 if __name__ == '__main__':
     if os.getenv("FLASK_ENV") == "production":